@@ -49,23 +49,16 @@ G_DEFINE_TYPE_WITH_CODE (Account, account, XDP_DBUS_TYPE_ACCOUNT_SKELETON,
 G_DEFINE_AUTOPTR_CLEANUP_FUNC (Account, g_object_unref)
 
 static void
-send_response_in_thread_func (GTask        *task,
-                              gpointer      source_object,
-                              gpointer      task_data,
-                              GCancellable *cancellable)
+send_response (XdpRequest *request,
+               guint       response,
+               const char *image_uri)
 {
-  XdpRequest *request = task_data;
-  guint response;
   GVariant *results;
   g_auto(GVariantBuilder) new_results =
     G_VARIANT_BUILDER_INIT (G_VARIANT_TYPE_VARDICT);
   g_autoptr(GVariant) idv = NULL;
   g_autoptr(GVariant) namev = NULL;
-  const char *image;
 
-  REQUEST_AUTOLOCK (request);
-
-  response = GPOINTER_TO_INT (g_object_get_data (G_OBJECT (request), "response"));
   results = (GVariant *)g_object_get_data (G_OBJECT (request), "results");
 
   if (response != 0)
@@ -77,26 +70,8 @@ send_response_in_thread_func (GTask        *task,
   g_variant_builder_add (&new_results, "{sv}", "id", idv);
   g_variant_builder_add (&new_results, "{sv}", "name", namev);
 
-  if (g_variant_lookup (results, "image", "&s", &image))
-    {
-      g_autofree char *ruri = NULL;
-      g_autoptr(GError) error = NULL;
-
-      if (xdp_app_info_is_host (request->app_info))
-        ruri = g_strdup (image);
-      else
-        ruri = xdp_register_document (image, xdp_app_info_get_id (request->app_info), XDP_DOCUMENT_FLAG_NONE, &error);
-
-      if (ruri == NULL)
-        {
-          g_warning ("Failed to register %s: %s", image, error->message);
-        }
-      else
-        {
-          g_debug ("convert uri '%s' -> '%s'\n", image, ruri);
-          g_variant_builder_add (&new_results, "{sv}", "image", g_variant_new_string (ruri));
-        }
-    }
+  if (image_uri)
+    g_variant_builder_add (&new_results, "{sv}", "image", g_variant_new_string (image_uri));
 
 out:
   if (request->exported)
@@ -108,6 +83,59 @@ out:
     }
 }
 
+static void
+register_image_done (GObject      *source,
+                     GAsyncResult *result,
+                     gpointer      data)
+{
+  g_autoptr(XdpRequest) request = data;
+  g_autoptr(GError) error = NULL;
+  g_autofree char *ruri = NULL;
+
+  REQUEST_AUTOLOCK (request);
+
+  ruri = xdp_register_document_finish (result, &error);
+  if (ruri == NULL)
+    g_warning ("Failed to register image: %s", error->message);
+  else
+    g_debug ("Registered image as '%s'", ruri);
+
+  send_response (request, 0, ruri);
+}
+
+static void
+send_response_in_thread_func (GTask        *task,
+                              gpointer      source_object,
+                              gpointer      task_data,
+                              GCancellable *cancellable)
+{
+  XdpRequest *request = task_data;
+  guint response;
+  GVariant *results;
+  const char *image = NULL;
+
+  REQUEST_AUTOLOCK (request);
+
+  response = GPOINTER_TO_INT (g_object_get_data (G_OBJECT (request), "response"));
+  results = (GVariant *)g_object_get_data (G_OBJECT (request), "results");
+
+  if (response == 0 &&
+      g_variant_lookup (results, "image", "&s", &image) &&
+      !xdp_app_info_is_host (request->app_info))
+    {
+      /* Respond once registered, without waiting in this thread */
+      xdp_register_document_async (image,
+                                   xdp_app_info_get_id (request->app_info),
+                                   XDP_DOCUMENT_FLAG_NONE,
+                                   NULL,
+                                   register_image_done,
+                                   g_object_ref (request));
+      return;
+    }
+
+  send_response (request, response, image);
+}
+
 static void
 get_user_information_done (GObject *source,
                            GAsyncResult *result,
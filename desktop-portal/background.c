@@ -70,6 +70,8 @@ struct _Background
   GCancellable *cancellable;
 
   GHashTable *applications; /* instance ID -> InstanceData */
+  GHashTable *pending_permissions; /* app ID -> XdpPermission */
+  guint flush_permissions_id;
   GMutex applications_lock;
 };
 
@@ -177,6 +179,23 @@ get_permission (const char *app_id)
   return XDP_PERMISSION_UNSET;
 }
 
+static const char *
+permission_to_string (XdpPermission permission)
+{
+  switch (permission)
+    {
+    case XDP_PERMISSION_ASK:
+      return "ask";
+    case XDP_PERMISSION_YES:
+      return "yes";
+    case XDP_PERMISSION_NO:
+      return "no";
+    case XDP_PERMISSION_UNSET:
+    default:
+      return NULL;
+    }
+}
+
 static void
 set_permission (const char *app_id,
                 XdpPermission permission)
@@ -184,13 +203,8 @@ set_permission (const char *app_id,
   g_autoptr(GError) error = NULL;
   const char *permissions[2];
 
-  if (permission == XDP_PERMISSION_ASK)
-    permissions[0] = "ask";
-  else if (permission == XDP_PERMISSION_YES)
-    permissions[0] = "yes";
-  else if (permission == XDP_PERMISSION_NO)
-    permissions[0] = "no";
-  else
+  permissions[0] = permission_to_string (permission);
+  if (permissions[0] == NULL)
     {
       g_warning ("Wrong permission format, ignoring");
       return;
@@ -211,6 +225,106 @@ set_permission (const char *app_id,
     }
 }
 
+static void
+set_permissions_done (GObject      *source,
+                      GAsyncResult *result,
+                      gpointer      data)
+{
+  g_autoptr(GError) error = NULL;
+
+  if (!xdp_dbus_impl_permission_store_call_set_permissions_finish (XDP_DBUS_IMPL_PERMISSION_STORE (source),
+                                                                   result,
+                                                                   &error))
+    {
+      g_dbus_error_strip_remote_error (error);
+      g_warning ("Error updating permission store: %s", error->message);
+    }
+}
+
+/* Permission changes from notification responses are queued and written
+ * to the permission store in a single SetPermissions call, instead of one
+ * synchronous round-trip per app.
+ */
+static gboolean
+flush_permissions (gpointer data)
+{
+  Background *background = data;
+  XdpDbusImplPermissionStore *store = xdp_get_permission_store ();
+  g_autoptr(GHashTable) pending = NULL;
+  GVariantBuilder builder;
+  GHashTableIter iter;
+  gpointer key, value;
+
+  g_mutex_lock (&background->applications_lock);
+
+  background->flush_permissions_id = 0;
+
+  /* Permission stores predating SetPermissions get one call per app */
+  if (xdp_dbus_impl_permission_store_get_version (store) < 3)
+    {
+      pending = g_steal_pointer (&background->pending_permissions);
+      background->pending_permissions =
+        g_hash_table_new_full (g_str_hash, g_str_equal, g_free, NULL);
+      g_mutex_unlock (&background->applications_lock);
+
+      g_hash_table_iter_init (&iter, pending);
+      while (g_hash_table_iter_next (&iter, &key, &value))
+        set_permission (key, GPOINTER_TO_INT (value));
+
+      return G_SOURCE_REMOVE;
+    }
+
+  g_variant_builder_init (&builder, G_VARIANT_TYPE ("a{sas}"));
+  g_hash_table_iter_init (&iter, background->pending_permissions);
+  while (g_hash_table_iter_next (&iter, &key, &value))
+    {
+      const char *permissions[2] = {
+        permission_to_string (GPOINTER_TO_INT (value)),
+        NULL,
+      };
+
+      g_variant_builder_add (&builder, "{s^as}", key, permissions);
+    }
+  g_hash_table_remove_all (background->pending_permissions);
+
+  /* Queue the call with the lock held, so that a concurrent lookup from
+   * the monitor thread either sees the pending permissions or is sent
+   * after them.
+   */
+  xdp_dbus_impl_permission_store_call_set_permissions (store,
+                                                       BACKGROUND_PERMISSION_TABLE,
+                                                       TRUE,
+                                                       BACKGROUND_PERMISSION_ID,
+                                                       g_variant_builder_end (&builder),
+                                                       NULL,
+                                                       set_permissions_done,
+                                                       NULL);
+
+  g_mutex_unlock (&background->applications_lock);
+
+  return G_SOURCE_REMOVE;
+}
+
+/* Must be called with applications_lock held */
+static void
+queue_permission (Background    *background,
+                  const char    *app_id,
+                  XdpPermission  permission)
+{
+  g_hash_table_insert (background->pending_permissions,
+                       g_strdup (app_id),
+                       GINT_TO_POINTER (permission));
+
+  if (background->flush_permissions_id == 0)
+    {
+      background->flush_permissions_id =
+        g_idle_add_full (G_PRIORITY_DEFAULT_IDLE,
+                         flush_permissions,
+                         g_object_ref (background),
+                         g_object_unref);
+    }
+}
+
 /* background monitor */
 
 /* The background monitor is running in a dedicated thread.
@@ -480,10 +594,10 @@ notify_background_done (GObject *source,
   else
     g_debug ("Unexpected response from NotifyBackground: %u", result);
 
+  g_mutex_lock (&background->applications_lock);
   if (nd->perm != XDP_PERMISSION_UNSET)
-    set_permission (nd->app_id, nd->perm);
+    queue_permission (background, nd->app_id, nd->perm);
 
-  g_mutex_lock (&background->applications_lock);
   idata = g_hash_table_lookup (background->applications, nd->id);
   if (idata)
     {
@@ -571,6 +685,7 @@ check_background_apps (Background *background)
       InstanceData *idata;
       const char *state_names[] = { "background", "running", "active" };
       gboolean is_new = FALSE;
+      gpointer pending;
 
       if (!flatpak_instance_is_running (instance))
         continue;
@@ -599,6 +714,11 @@ check_background_apps (Background *background)
 
       idata->permission = get_one_permission (app_id, perms);
 
+      /* Permissions not yet written to the permission store take precedence */
+      if (g_hash_table_lookup_extended (background->pending_permissions,
+                                        app_id, NULL, &pending))
+        idata->permission = GPOINTER_TO_INT (pending);
+
       /* If the app is not in the list yet, add it,
        * but don't notify yet - this gives apps some
        * leeway to get their window up. If it is still
@@ -1354,6 +1474,7 @@ background_dispose (GObject *object)
   if (background->applications)
     {
       g_clear_pointer (&background->applications, g_hash_table_unref);
+      g_clear_pointer (&background->pending_permissions, g_hash_table_unref);
       g_mutex_clear (&background->applications_lock);
     }
 
@@ -1396,6 +1517,9 @@ background_new (XdpDbusImplBackground *background_impl,
   g_mutex_init (&background->applications_lock);
   background->applications = g_hash_table_new_full (g_str_hash, g_str_equal,
                                                     g_free, instance_data_free);
+  background->pending_permissions = g_hash_table_new_full (g_str_hash,
+                                                           g_str_equal,
+                                                           g_free, NULL);
 
   g_signal_connect_object (background->impl, "running-applications-changed",
                            G_CALLBACK (on_running_apps_changed),
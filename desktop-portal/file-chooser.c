@@ -50,6 +50,70 @@ G_DEFINE_TYPE_WITH_CODE (FileChooser, file_chooser,
 
 G_DEFINE_AUTOPTR_CLEANUP_FUNC (FileChooser, g_object_unref)
 
+static void
+send_response (XdpRequest *request,
+               guint       response,
+               GPtrArray  *ruris)
+{
+  g_auto(GVariantBuilder) results =
+    G_VARIANT_BUILDER_INIT (G_VARIANT_TYPE_VARDICT);
+  g_auto(GVariantBuilder) uris =
+    G_VARIANT_BUILDER_INIT (G_VARIANT_TYPE_STRING_ARRAY);
+  GVariant *options;
+  g_autoptr(GVariant) choices = NULL;
+  g_autoptr(GVariant) current_filter = NULL;
+
+  options = (GVariant *)g_object_get_data (G_OBJECT (request), "options");
+
+  if (response != 0)
+    goto out;
+
+  choices = g_variant_lookup_value (options, "choices", G_VARIANT_TYPE ("a(ss)"));
+  if (choices)
+    g_variant_builder_add (&results, "{sv}", "choices", choices);
+
+  current_filter = g_variant_lookup_value (options, "current_filter", G_VARIANT_TYPE ("(sa(us))"));
+  if (current_filter)
+    g_variant_builder_add (&results, "{sv}", "current_filter", current_filter);
+
+  for (size_t i = 0; ruris && i < ruris->len; i++)
+    {
+      const char *ruri = g_ptr_array_index (ruris, i);
+
+      if (ruri != NULL)
+        g_variant_builder_add (&uris, "s", ruri);
+    }
+
+out:
+  g_variant_builder_add (&results, "{sv}", "uris", g_variant_builder_end (&uris));
+
+  if (request->exported)
+    {
+      xdp_dbus_request_emit_response (XDP_DBUS_REQUEST (request),
+                                      response,
+                                      g_variant_builder_end (&results));
+      xdp_request_unexport (request);
+    }
+}
+
+static void
+register_documents_done (GObject      *source,
+                         GAsyncResult *result,
+                         gpointer      data)
+{
+  g_autoptr(XdpRequest) request = data;
+  g_autoptr(GPtrArray) ruris = NULL;
+  g_autoptr(GError) error = NULL;
+
+  REQUEST_AUTOLOCK (request);
+
+  ruris = xdp_register_documents_finish (result, &error);
+  if (ruris == NULL)
+    g_warning ("Failed to register documents: %s", error->message);
+
+  send_response (request, 0, ruris);
+}
+
 static void
 send_response_in_thread_func (GTask        *task,
                               gpointer      source_object,
@@ -57,17 +121,12 @@ send_response_in_thread_func (GTask        *task,
                               GCancellable *cancellable)
 {
   XdpRequest *request = task_data;
-  g_auto(GVariantBuilder) results =
-    G_VARIANT_BUILDER_INIT (G_VARIANT_TYPE_VARDICT);
-  g_auto(GVariantBuilder) ruris =
-    G_VARIANT_BUILDER_INIT (G_VARIANT_TYPE_STRING_ARRAY);
   guint response;
   GVariant *options;
   XdpDocumentFlags flags = XDP_DOCUMENT_FLAG_WRITABLE | XDP_DOCUMENT_FLAG_DIRECTORY;
   g_autofree char **uris = NULL;
-  g_autoptr(GVariant) choices = NULL;
-  g_autoptr(GVariant) current_filter = NULL;
   g_autoptr(GVariant) writable = NULL;
+  g_autoptr(GPtrArray) ruris = NULL;
 
   REQUEST_AUTOLOCK (request);
 
@@ -85,56 +144,45 @@ send_response_in_thread_func (GTask        *task,
   if (writable && !g_variant_get_boolean (writable))
     flags &= ~XDP_DOCUMENT_FLAG_WRITABLE;
 
-  choices = g_variant_lookup_value (options, "choices", G_VARIANT_TYPE ("a(ss)"));
-  if (choices)
-    g_variant_builder_add (&results, "{sv}", "choices", choices);
-
-  current_filter = g_variant_lookup_value (options, "current_filter", G_VARIANT_TYPE ("(sa(us))"));
-  if (current_filter)
-    g_variant_builder_add (&results, "{sv}", "current_filter", current_filter);
-
   if (g_variant_lookup (options, "uris", "^a&s", &uris))
     {
+      g_autoptr(GPtrArray) file_uris = g_ptr_array_new ();
       int i;
 
       for (i = 0; uris && uris[i]; i++)
         {
-          g_autofree char *ruri = NULL;
-          g_autoptr(GError) error = NULL;
-
-          g_assert (uris[i] != NULL);
-
           if (!g_str_has_prefix (uris[i], "file://"))
             {
               g_warning ("Only URIs with the \"file://\" scheme are allowed");
               continue;
             }
 
-          if (xdp_app_info_is_host (request->app_info))
-            ruri = g_strdup (uris[i]);
-          else
-            ruri = xdp_register_document (uris[i], xdp_app_info_get_id (request->app_info), flags, &error);
+          g_ptr_array_add (file_uris, (char *) uris[i]);
+        }
+      g_ptr_array_add (file_uris, NULL);
 
-          if (ruri == NULL)
-            {
-              g_warning ("Failed to register %s: %s", uris[i], error->message);
-              continue;
-            }
-          g_debug ("convert uri %s -> %s\n", uris[i], ruri);
-          g_variant_builder_add (&ruris, "s", ruri);
+      if (!xdp_app_info_is_host (request->app_info))
+        {
+          /* Respond once all files are registered, in as few calls as
+           * possible and without waiting in this thread */
+          xdp_register_documents_async ((const char * const *) file_uris->pdata,
+                                        xdp_app_info_get_id (request->app_info),
+                                        flags,
+                                        NULL,
+                                        register_documents_done,
+                                        g_object_ref (request));
+          g_task_return_boolean (task, TRUE);
+          return;
         }
+
+      ruris = g_ptr_array_new_from_null_terminated_array (file_uris->pdata,
+                                                          (GCopyFunc) g_strdup,
+                                                          NULL,
+                                                          g_free);
     }
 
 out:
-  g_variant_builder_add (&results, "{sv}", "uris", g_variant_builder_end (&ruris));
-
-  if (request->exported)
-    {
-      xdp_dbus_request_emit_response (XDP_DBUS_REQUEST (request),
-                                      response,
-                                      g_variant_builder_end (&results));
-      xdp_request_unexport (request);
-    }
+  send_response (request, response, ruris);
 
   g_task_return_boolean (task, TRUE);
 }
@@ -6,6 +6,10 @@
 
 #include "flatpak-instance.h"
 
+#include <errno.h>
+#include <sys/inotify.h>
+#include <unistd.h>
+
 #include <gio/gio.h>
 #include <json-glib/json-glib.h>
 
@@ -431,35 +435,137 @@ flatpak_instance_new (const char *dir)
   return self;
 }
 
-static FlatpakInstance *
-flatpak_instance_new_for_id (const char *id)
+/* The instances are kept in a table that is updated from inotify events on
+ * $XDG_RUNTIME_DIR/.flatpak and on each instance directory, so that only
+ * instances that changed are read again. */
+#define INSTANCE_DIR_EVENTS (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | \
+                             IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+#define INSTANCE_FILE_EVENTS (INSTANCE_DIR_EVENTS | IN_CLOSE_WRITE)
+
+typedef struct
 {
-  g_autofree char *dir = NULL;
+  gboolean initialized;
+  int inotify_fd;
+  int base_wd;
+  GHashTable *instances; /* id -> FlatpakInstance */
+  GHashTable *watches; /* wd -> id */
+  GHashTable *dirty; /* set of ids to read again */
+  gboolean rescan;
+} InstanceCache;
+
+static InstanceCache instance_cache = { 0, };
+G_LOCK_DEFINE_STATIC (instance_cache);
 
-  dir = g_build_filename (g_get_user_runtime_dir (), ".flatpak", id, NULL);
-  return flatpak_instance_new (dir);
+static void
+instance_cache_init (InstanceCache *cache)
+{
+  cache->initialized = TRUE;
+  cache->base_wd = -1;
+  cache->instances = g_hash_table_new_full (g_str_hash, g_str_equal,
+                                            g_free, g_object_unref);
+  cache->watches = g_hash_table_new_full (NULL, NULL, NULL, g_free);
+  cache->dirty = g_hash_table_new_full (g_str_hash, g_str_equal, g_free, NULL);
+  cache->rescan = TRUE;
+
+  cache->inotify_fd = inotify_init1 (IN_NONBLOCK | IN_CLOEXEC);
+  if (cache->inotify_fd < 0)
+    g_warning ("Failed to watch flatpak instances: %s", g_strerror (errno));
 }
 
-/**
- * flatpak_instance_get_all:
- *
- * Gets FlatpakInstance objects for all running sandboxes in the current session.
- *
- * Returns: (transfer full) (element-type FlatpakInstance): a #GPtrArray of
- *   #FlatpakInstance objects
- *
- * Since: 1.1
- */
-GPtrArray *
-flatpak_instance_get_all (void)
+static void
+instance_cache_handle_event (InstanceCache              *cache,
+                             const struct inotify_event *event)
+{
+  const char *id;
+
+  if (event->mask & IN_Q_OVERFLOW)
+    {
+      cache->rescan = TRUE;
+      return;
+    }
+
+  if (event->wd == cache->base_wd)
+    {
+      if (event->mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF))
+        {
+          cache->base_wd = -1;
+          cache->rescan = TRUE;
+        }
+      else if (event->len > 0)
+        {
+          g_hash_table_add (cache->dirty, g_strdup (event->name));
+        }
+
+      return;
+    }
+
+  id = g_hash_table_lookup (cache->watches, GINT_TO_POINTER (event->wd));
+  if (id == NULL)
+    return;
+
+  g_hash_table_add (cache->dirty, g_strdup (id));
+
+  if (event->mask & IN_IGNORED)
+    g_hash_table_remove (cache->watches, GINT_TO_POINTER (event->wd));
+}
+
+static void
+instance_cache_read_events (InstanceCache *cache)
+{
+  char buf[4096] __attribute__ ((aligned (__alignof__ (struct inotify_event))));
+  ssize_t len;
+
+  if (cache->inotify_fd < 0)
+    {
+      cache->rescan = TRUE;
+      return;
+    }
+
+  while ((len = read (cache->inotify_fd, buf, sizeof (buf))) > 0)
+    {
+      const struct inotify_event *event;
+
+      for (char *ptr = buf; ptr < buf + len; ptr += sizeof (*event) + event->len)
+        {
+          event = (const struct inotify_event *) ptr;
+          instance_cache_handle_event (cache, event);
+        }
+    }
+
+  if (len < 0 && errno != EAGAIN && errno != EINTR)
+    {
+      g_warning ("Failed to read flatpak instance events: %s", g_strerror (errno));
+      cache->rescan = TRUE;
+    }
+}
+
+static void
+instance_cache_rescan (InstanceCache *cache,
+                       const char    *base_dir)
 {
-  g_autoptr(GPtrArray) instances = NULL;
-  g_autofree char *base_dir = NULL;
   g_autoptr(GFile) file = NULL;
   g_autoptr(GFileEnumerator) iter = NULL;
+  GHashTableIter hash_iter;
+  const char *id;
+
+  cache->rescan = FALSE;
+
+  /* Watch before enumerating, so that nothing is missed in between */
+  if (cache->inotify_fd >= 0 && cache->base_wd < 0)
+    {
+      cache->base_wd = inotify_add_watch (cache->inotify_fd, base_dir,
+                                          INSTANCE_DIR_EVENTS);
+
+      /* The directory doesn't exist before the first instance is started */
+      if (cache->base_wd < 0)
+        cache->rescan = TRUE;
+    }
+
+  /* Instances that are gone are removed when refreshing them */
+  g_hash_table_iter_init (&hash_iter, cache->instances);
+  while (g_hash_table_iter_next (&hash_iter, (gpointer *) &id, NULL))
+    g_hash_table_add (cache->dirty, g_strdup (id));
 
-  instances = g_ptr_array_new_with_free_func ((GDestroyNotify) g_object_unref);
-  base_dir = g_build_filename (g_get_user_runtime_dir (), ".flatpak", NULL);
   file = g_file_new_for_path (base_dir);
   iter = g_file_enumerate_children (file,
                                     G_FILE_ATTRIBUTE_STANDARD_NAME ","
@@ -468,7 +574,7 @@ flatpak_instance_get_all (void)
                                     NULL,
                                     NULL);
   if (!iter)
-    return g_steal_pointer (&instances);
+    return;
 
   while (TRUE)
     {
@@ -481,8 +587,95 @@ flatpak_instance_get_all (void)
         break;
 
       if (g_file_info_get_file_type (info) == G_FILE_TYPE_DIRECTORY)
-        g_ptr_array_add (instances, flatpak_instance_new_for_id (g_file_info_get_name (info)));
+        g_hash_table_add (cache->dirty, g_strdup (g_file_info_get_name (info)));
     }
+}
+
+static gboolean
+remove_watch_for_id (gpointer key,
+                     gpointer value,
+                     gpointer user_data)
+{
+  return g_str_equal (value, user_data);
+}
+
+static void
+instance_cache_refresh (InstanceCache *cache,
+                        const char    *base_dir,
+                        const char    *id)
+{
+  g_autofree char *dir = NULL;
+  int wd;
+
+  g_hash_table_remove (cache->instances, id);
+
+  dir = g_build_filename (base_dir, id, NULL);
+  if (!g_file_test (dir, G_FILE_TEST_IS_DIR))
+    return;
+
+  /* Watch before reading, so that later changes mark it dirty again */
+  if (cache->inotify_fd >= 0)
+    {
+      wd = inotify_add_watch (cache->inotify_fd, dir, INSTANCE_FILE_EVENTS);
+      if (wd >= 0)
+        {
+          g_hash_table_foreach_remove (cache->watches, remove_watch_for_id, (gpointer) id);
+          g_hash_table_insert (cache->watches, GINT_TO_POINTER (wd), g_strdup (id));
+        }
+    }
+
+  g_hash_table_insert (cache->instances, g_strdup (id), flatpak_instance_new (dir));
+}
+
+/**
+ * flatpak_instance_get_all:
+ *
+ * Gets FlatpakInstance objects for all running sandboxes in the current session.
+ *
+ * Returns: (transfer full) (element-type FlatpakInstance): a #GPtrArray of
+ *   #FlatpakInstance objects
+ *
+ * Since: 1.1
+ */
+GPtrArray *
+flatpak_instance_get_all (void)
+{
+  InstanceCache *cache = &instance_cache;
+  g_autoptr(GPtrArray) instances = NULL;
+  g_autofree char *base_dir = NULL;
+  GHashTableIter iter;
+  FlatpakInstance *instance;
+  const char *id;
+  guint n_refreshed;
+
+  instances = g_ptr_array_new_with_free_func ((GDestroyNotify) g_object_unref);
+  base_dir = g_build_filename (g_get_user_runtime_dir (), ".flatpak", NULL);
+
+  G_LOCK (instance_cache);
+
+  if (!cache->initialized)
+    instance_cache_init (cache);
+
+  instance_cache_read_events (cache);
+
+  if (cache->rescan)
+    instance_cache_rescan (cache, base_dir);
+
+  n_refreshed = g_hash_table_size (cache->dirty);
+
+  g_hash_table_iter_init (&iter, cache->dirty);
+  while (g_hash_table_iter_next (&iter, (gpointer *) &id, NULL))
+    instance_cache_refresh (cache, base_dir, id);
+  g_hash_table_remove_all (cache->dirty);
+
+  g_hash_table_iter_init (&iter, cache->instances);
+  while (g_hash_table_iter_next (&iter, NULL, (gpointer *) &instance))
+    g_ptr_array_add (instances, g_object_ref (instance));
+
+  G_UNLOCK (instance_cache);
+
+  if (n_refreshed > 0)
+    g_debug ("Read %u of %u flatpak instances", n_refreshed, instances->len);
 
   return g_steal_pointer (&instances);
 }
@@ -298,7 +298,7 @@ handle_call_thread (GTask        *task,
           return;
         }
 
-      if (pidns_id != 0 && !xdp_map_pids (pidns_id, pids, n_pids, &error))
+      if (pidns_id != 0 && !xdp_app_info_map_pids (call->app_info, pids, n_pids, &error))
         {
           g_prefix_error (&error, "Could not map pids: ");
           g_warning ("GameMode error: %s", error->message);
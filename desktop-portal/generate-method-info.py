@@ -3,7 +3,9 @@
 # SPDX-FileCopyrightText: Copyright © the xdg-desktop-portal contributors
 
 import argparse
+import sys
 import xml.etree.ElementTree as ElementTree
+from typing import NamedTuple
 
 
 def quote(s: str):
@@ -14,7 +16,18 @@ def cbool(b: bool):
     return "TRUE" if b else "FALSE"
 
 
-def handle_interface(interface: ElementTree.Element):
+class MethodInfo(NamedTuple):
+    interface: str
+    method: str
+    uses_request: bool
+    option_arg: int
+
+    def sort_key(self):
+        # Same order as strcmp(), which is used to bisect the table
+        return (self.interface.encode(), self.method.encode())
+
+
+def handle_interface(interface: ElementTree.Element, methods: list[MethodInfo]):
     intf_name = interface.attrib["name"]
     for method in interface.iter("method"):
         method_name = method.attrib["name"]
@@ -35,19 +48,15 @@ def handle_interface(interface: ElementTree.Element):
             if arg_name == "options" and arg_type == "a{sv}" and arg_direction == "in":
                 option_arg = pos
 
-        method_name = quote(method_name)
-        iname = quote(intf_name)
-        print(
-            f"  {{ .interface = {iname:40s}, .method = {method_name:32s}, .uses_request = {cbool(uses_requests)}, .option_arg = {option_arg:2d}, }},"
-        )
+        methods.append(MethodInfo(intf_name, method_name, uses_requests, option_arg))
 
 
-def parse_portal_xml(filename: str):
+def parse_portal_xml(filename: str, methods: list[MethodInfo]):
     tree = ElementTree.parse(filename)
     root = tree.getroot()
 
     for interface in root.iter("interface"):
-        handle_interface(interface)
+        handle_interface(interface, methods)
 
 
 if __name__ == "__main__":
@@ -56,15 +65,50 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    methods: list[MethodInfo] = []
+    for file in args.file:
+        parse_portal_xml(file, methods)
+
+    # Sort by interface and method, so xdp_method_info_find() can bisect the
+    # interfaces, and then the methods of the interface
+    methods.sort(key=MethodInfo.sort_key)
+
+    interfaces: list[tuple[str, int, int]] = []
+    for i, mi in enumerate(methods):
+        if i > 0 and mi.sort_key() == methods[i - 1].sort_key():
+            sys.exit(f"Duplicate method {mi.interface}.{mi.method}")
+
+        if interfaces and interfaces[-1][0] == mi.interface:
+            intf_name, first, count = interfaces[-1]
+            interfaces[-1] = (intf_name, first, count + 1)
+        else:
+            interfaces.append((mi.interface, i, 1))
+
+    interface_ids = {intf[0]: i for i, intf in enumerate(interfaces)}
+
     print('#include "glib.h"')
     print('#include "xdp-method-info.h"')
     print("")
     print("static const XdpMethodInfo method_info[] = {")
 
-    for file in args.file:
-        parse_portal_xml(file)
+    for mi in methods:
+        method_name = quote(mi.method)
+        iname = quote(mi.interface)
+        print(
+            f"  {{ .interface = {iname:40s}, .method = {method_name:32s}, .uses_request = {cbool(mi.uses_request)}, .option_arg = {mi.option_arg:2d}, .interface_id = {interface_ids[mi.interface]:2d}, }},"
+        )
 
     print("  { .interface = NULL },")
+    print("};")
+    print("")
+    print("static const XdpMethodInfoInterface method_info_interfaces[] = {")
+
+    for intf_name, first, count in interfaces:
+        iname = quote(intf_name)
+        print(
+            f"  {{ .interface = {iname:40s}, .first_method = {first:3d}, .n_methods = {count:2d}, }},"
+        )
+
     print("};")
     print("")
     print(
@@ -74,3 +118,11 @@ if __name__ == "__main__":
     print(
         "unsigned int xdp_method_info_get_count (void) { return G_N_ELEMENTS(method_info) - 1; };"
     )
+    print("")
+    print(
+        "const XdpMethodInfoInterface *xdp_method_info_get_interfaces (void) { return method_info_interfaces; };"
+    )
+    print("")
+    print(
+        "unsigned int xdp_method_info_get_interface_count (void) { return G_N_ELEMENTS(method_info_interfaces); };"
+    )
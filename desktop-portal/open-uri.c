@@ -215,60 +215,132 @@ is_file_uri (const char *uri)
   return FALSE;
 }
 
-static gboolean
-launch_application_with_uri (const char *choice_id,
-                             const char *uri,
-                             const char *parent_window,
-                             gboolean    writable,
-                             const char *activation_token,
-                             GError    **error)
+typedef struct
 {
-  g_autofree char *desktop_id = g_strconcat (choice_id, ".desktop", NULL);
-  g_autoptr(GDesktopAppInfo) info = g_desktop_app_info_new (desktop_id);
+  char *choice_id;
+  char *uri;
+  char *parent_window;
+  char *activation_token;
+  GDesktopAppInfo *info;
+} LaunchData;
+
+static void
+launch_data_free (gpointer user_data)
+{
+  LaunchData *data = user_data;
+
+  g_free (data->choice_id);
+  g_free (data->uri);
+  g_free (data->parent_window);
+  g_free (data->activation_token);
+  g_clear_object (&data->info);
+  g_free (data);
+}
+
+static void
+launch_with_uri (GTask      *task,
+                 const char *ruri)
+{
+  LaunchData *data = g_task_get_task_data (task);
   g_autoptr(XdpAppLaunchContext) xdp_context = xdp_app_launch_context_new ();
   GAppLaunchContext *context = G_APP_LAUNCH_CONTEXT (xdp_context);
+  g_autoptr(GError) error = NULL;
+  GList uris;
+
+  g_app_launch_context_setenv (context, "PARENT_WINDOW_ID", data->parent_window);
+
+  xdp_app_launch_context_set_activation_token (xdp_context, data->activation_token);
+
+  uris.data = (gpointer)ruri;
+  uris.next = NULL;
+
+  if (!g_app_info_launch_uris (G_APP_INFO (data->info), &uris, context, &error))
+    g_warning ("Failed to launch %s: %s", data->choice_id, error->message);
+
+  g_task_return_boolean (task, TRUE);
+}
+
+static void
+register_document_done (GObject      *source,
+                        GAsyncResult *result,
+                        gpointer      user_data)
+{
+  g_autoptr(GTask) task = user_data;
+  LaunchData *data = g_task_get_task_data (task);
+  g_autoptr(GError) error = NULL;
   g_autofree char *ruri = NULL;
+
+  ruri = xdp_register_document_finish (result, &error);
+  if (ruri == NULL)
+    {
+      g_warning ("Error registering %s for %s: %s", data->uri, data->choice_id, error->message);
+      g_task_return_error (task, g_steal_pointer (&error));
+      return;
+    }
+
+  launch_with_uri (task, ruri);
+}
+
+static void
+launch_application_with_uri (const char          *choice_id,
+                             const char          *uri,
+                             const char          *parent_window,
+                             gboolean             writable,
+                             const char          *activation_token,
+                             GAsyncReadyCallback  callback,
+                             gpointer             user_data)
+{
+  g_autofree char *desktop_id = g_strconcat (choice_id, ".desktop", NULL);
+  g_autoptr(GDesktopAppInfo) info = g_desktop_app_info_new (desktop_id);
+  g_autoptr(GTask) task = NULL;
   XdpDocumentFlags flags = XDP_DOCUMENT_FLAG_NONE;
-  GList uris;
+  LaunchData *data;
+
+  task = g_task_new (NULL, NULL, callback, user_data);
+  g_task_set_source_tag (task, launch_application_with_uri);
 
   if (info == NULL)
     {
       g_debug ("Cannot launch %s because desktop file does not exist", desktop_id);
-      g_set_error (error, XDG_DESKTOP_PORTAL_ERROR, XDG_DESKTOP_PORTAL_ERROR_NOT_FOUND, "Desktop file %s does not exist", desktop_id);
-      return FALSE;
+      g_task_return_new_error (task, XDG_DESKTOP_PORTAL_ERROR, XDG_DESKTOP_PORTAL_ERROR_NOT_FOUND,
+                               "Desktop file %s does not exist", desktop_id);
+      return;
     }
 
+  data = g_new0 (LaunchData, 1);
+  data->choice_id = g_strdup (choice_id);
+  data->uri = g_strdup (uri);
+  data->parent_window = g_strdup (parent_window);
+  data->activation_token = g_strdup (activation_token);
+  data->info = g_steal_pointer (&info);
+  g_task_set_task_data (task, data, launch_data_free);
+
   g_debug ("Launching %s %s", choice_id, uri);
 
-  if (is_sandboxed (info) && is_file_uri (uri))
+  if (is_sandboxed (data->info) && is_file_uri (uri))
     {
-      g_autoptr(GError) local_error = NULL;
-
       g_debug ("Registering %s for %s", uri, choice_id);
       if (writable)
         flags |= XDP_DOCUMENT_FLAG_WRITABLE;
 
-      ruri = xdp_register_document (uri, choice_id, flags, &local_error);
-      if (ruri == NULL)
-        {
-          g_warning ("Error registering %s for %s: %s", uri, choice_id, local_error->message);
-          g_propagate_error (error, g_steal_pointer (&local_error));
-          return FALSE;
-        }
+      /* Don't hold up the calling thread on the document portal */
+      xdp_register_document_async (uri, choice_id, flags, NULL,
+                                   register_document_done,
+                                   g_steal_pointer (&task));
+      return;
     }
-  else
-    ruri = g_strdup (uri);
-
-  g_app_launch_context_setenv (context, "PARENT_WINDOW_ID", parent_window);
-
-  xdp_app_launch_context_set_activation_token (xdp_context, activation_token);
 
-  uris.data = (gpointer)ruri;
-  uris.next = NULL;
+  launch_with_uri (task, uri);
+}
 
-  g_app_info_launch_uris (G_APP_INFO (info), &uris, context, error);
+static gboolean
+launch_application_with_uri_finish (GAsyncResult  *result,
+                                    GError       **error)
+{
+  g_return_val_if_fail (g_task_is_valid (result, NULL), FALSE);
+  g_return_val_if_fail (g_async_result_is_tagged (result, launch_application_with_uri), FALSE);
 
-  return TRUE;
+  return g_task_propagate_boolean (G_TASK (result), error);
 }
 
 static void
@@ -327,6 +399,67 @@ update_permissions_store (const char *app_id,
     }
 }
 
+static void
+send_response (XdpRequest *request,
+               guint       response)
+{
+  if (request->exported)
+    {
+      g_auto(GVariantBuilder) opt_builder =
+        G_VARIANT_BUILDER_INIT (G_VARIANT_TYPE_VARDICT);
+
+      xdp_dbus_request_emit_response (XDP_DBUS_REQUEST (request),
+                                      response,
+                                      g_variant_builder_end (&opt_builder));
+      xdp_request_unexport (request);
+    }
+}
+
+static void
+update_permissions_in_thread_func (GTask        *task,
+                                   gpointer      source_object,
+                                   gpointer      task_data,
+                                   GCancellable *cancellable)
+{
+  XdpRequest *request = XDP_REQUEST (task_data);
+  GVariant *options;
+  const char *choice;
+  const char *content_type;
+
+  REQUEST_AUTOLOCK (request);
+
+  options = (GVariant *)g_object_get_data (G_OBJECT (request), "options");
+  content_type = (const char *)g_object_get_data (G_OBJECT (request), "content-type");
+
+  if (g_variant_lookup (options, "choice", "&s", &choice))
+    update_permissions_store (xdp_app_info_get_id (request->app_info), content_type, choice);
+
+  send_response (request, 0);
+}
+
+static void
+launch_chosen_app_done (GObject      *source,
+                        GAsyncResult *result,
+                        gpointer      data)
+{
+  g_autoptr(XdpRequest) request = data;
+  g_autoptr(GTask) task = NULL;
+
+  if (!launch_application_with_uri_finish (result, NULL))
+    {
+      REQUEST_AUTOLOCK (request);
+
+      send_response (request, 0);
+      return;
+    }
+
+  /* The permission store is updated synchronously, keep it off the main thread */
+  task = g_task_new (NULL, NULL, NULL, NULL);
+  g_task_set_source_tag (task, launch_chosen_app_done);
+  g_task_set_task_data (task, g_object_ref (request), g_object_unref);
+  g_task_run_in_thread (task, update_permissions_in_thread_func);
+}
+
 static void
 send_response_in_thread_func (GTask *task,
                               gpointer source_object,
@@ -351,7 +484,6 @@ send_response_in_thread_func (GTask *task,
       const char *uri;
       const char *parent_window;
       gboolean writable;
-      const char *content_type;
       const char *activation_token = NULL;
 
       g_debug ("Received choice %s", choice);
@@ -359,25 +491,17 @@ send_response_in_thread_func (GTask *task,
       uri = (const char *)g_object_get_data (G_OBJECT (request), "uri");
       parent_window = (const char *)g_object_get_data (G_OBJECT (request), "parent-window");
       writable = GPOINTER_TO_INT (g_object_get_data (G_OBJECT (request), "writable"));
-      content_type = (const char *)g_object_get_data (G_OBJECT (request), "content-type");
 
       g_variant_lookup (options, "activation_token", "&s", &activation_token);
 
-      if (launch_application_with_uri (choice, uri, parent_window, writable, activation_token, NULL))
-        update_permissions_store (xdp_app_info_get_id (request->app_info), content_type, choice);
+      /* Responds once the app is launched */
+      launch_application_with_uri (choice, uri, parent_window, writable, activation_token,
+                                   launch_chosen_app_done, g_object_ref (request));
+      return;
     }
 
 out:
-  if (request->exported)
-    {
-      g_auto(GVariantBuilder) opt_builder =
-        G_VARIANT_BUILDER_INIT (G_VARIANT_TYPE_VARDICT);
-
-      xdp_dbus_request_emit_response (XDP_DBUS_REQUEST (request),
-                                      response,
-                                      g_variant_builder_end (&opt_builder));
-      xdp_request_unexport (request);
-    }
+  send_response (request, response);
 }
 
 static void
@@ -571,6 +695,25 @@ app_exists (const char *app_id)
   return (info != NULL);
 }
 
+static void
+launch_app_done (GObject      *source,
+                 GAsyncResult *result,
+                 gpointer      data)
+{
+  g_autoptr(XdpRequest) request = data;
+  g_autoptr(GError) error = NULL;
+  gboolean launched;
+
+  REQUEST_AUTOLOCK (request);
+
+  launched = launch_application_with_uri_finish (result, &error);
+  if (!launched)
+    g_debug ("Open request failed: %s", error->message);
+
+  send_response (request,
+                 launched ? XDG_DESKTOP_PORTAL_RESPONSE_SUCCESS : XDG_DESKTOP_PORTAL_RESPONSE_OTHER);
+}
+
 static void
 handle_open_in_thread_func (GTask *task,
                             gpointer source_object,
@@ -846,22 +989,11 @@ handle_open_in_thread_func (GTask *task,
 
       if (app)
         {
-          /* Launch the app directly */
-          g_autoptr(GError) error = NULL;
-
+          /* Launch the app directly, responds once it is launched */
           g_debug ("Skipping app chooser");
 
-          gboolean result = launch_application_with_uri (app, uri, parent_window, writable, activation_token, &error);
-          if (request->exported)
-            {
-              if (!result)
-                g_debug ("Open request for '%s' failed: %s", uri, error->message);
-              xdp_dbus_request_emit_response (XDP_DBUS_REQUEST (request),
-                                              result ? XDG_DESKTOP_PORTAL_RESPONSE_SUCCESS : XDG_DESKTOP_PORTAL_RESPONSE_OTHER,
-                                              g_variant_builder_end (&opts_builder));
-              xdp_request_unexport (request);
-            }
-
+          launch_application_with_uri (app, uri, parent_window, writable, activation_token,
+                                       launch_app_done, g_object_ref (request));
           return;
         }
     }
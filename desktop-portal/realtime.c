@@ -61,14 +61,24 @@ map_pid (XdpAppInfo *app_info, pid_t *pid, pid_t *tid, GError **error)
       return FALSE;
     }
 
-  if (pidns_id != 0 && !xdp_map_pids (pidns_id, pid, 1, error))
+  if (pidns_id == 0)
+    return TRUE;
+
+  if (!xdp_app_info_map_pids (app_info, pid, 1, error))
     {
       g_prefix_error (error, "Could not map pid %d: ", unmapped_pid);
       g_warning ("Realtime error: %s", (*error)->message);
       return FALSE;
     }
 
-  if (pidns_id != 0 && !xdp_map_tids (pidns_id, *pid, tid, 1, error))
+  /* The main thread has the tid of the process */
+  if (*tid == unmapped_pid)
+    {
+      *tid = *pid;
+      return TRUE;
+    }
+
+  if (!xdp_map_tids (pidns_id, *pid, tid, 1, error))
     {
       g_prefix_error (error, "Could not map tid %d of pid %d: ", *tid, unmapped_pid);
       g_warning ("Realtime error: %s", (*error)->message);
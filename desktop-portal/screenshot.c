@@ -79,6 +79,28 @@ send_response (XdpRequest *request,
     }
 }
 
+static void
+register_screenshot_done (GObject      *source,
+                          GAsyncResult *result,
+                          gpointer      data)
+{
+  g_autoptr(XdpRequest) request = data;
+  g_auto(GVariantBuilder) results =
+    G_VARIANT_BUILDER_INIT (G_VARIANT_TYPE_VARDICT);
+  g_autoptr(GError) error = NULL;
+  g_autofree char *ruri = NULL;
+
+  REQUEST_AUTOLOCK (request);
+
+  ruri = xdp_register_document_finish (result, &error);
+  if (ruri == NULL)
+    g_warning ("Failed to register screenshot: %s", error->message);
+  else
+    g_variant_builder_add (&results, "{&sv}", "uri", g_variant_new_string (ruri));
+
+  send_response (request, 0, g_variant_builder_end (&results));
+}
+
 static void
 send_response_in_thread_func (GTask *task,
                               gpointer source_object,
@@ -90,7 +112,6 @@ send_response_in_thread_func (GTask *task,
     G_VARIANT_BUILDER_INIT (G_VARIANT_TYPE_VARDICT);
   guint response;
   GVariant *options;
-  g_autoptr(GError) error = NULL;
   const char *retval;
 
   REQUEST_AUTOLOCK (request);
@@ -113,15 +134,20 @@ send_response_in_thread_func (GTask *task,
           goto out;
         }
 
-      if (xdp_app_info_is_host (request->app_info))
-        ruri = g_strdup (uri);
-      else
-        ruri = xdp_register_document (uri, xdp_app_info_get_id (request->app_info), XDP_DOCUMENT_FLAG_DELETABLE, &error);
+      if (!xdp_app_info_is_host (request->app_info))
+        {
+          /* Respond once registered, without waiting in this thread */
+          xdp_register_document_async (uri,
+                                       xdp_app_info_get_id (request->app_info),
+                                       XDP_DOCUMENT_FLAG_DELETABLE,
+                                       NULL,
+                                       register_screenshot_done,
+                                       g_object_ref (request));
+          return;
+        }
 
-      if (ruri == NULL)
-        g_warning ("Failed to register %s: %s", uri, error->message);
-      else
-        g_variant_builder_add (&results, "{&sv}", "uri", g_variant_new_string (ruri));
+      ruri = g_strdup (uri);
+      g_variant_builder_add (&results, "{&sv}", "uri", g_variant_new_string (ruri));
     }
   else if (g_strcmp0 (retval, "color") == 0)
     {
@@ -21,12 +21,30 @@
 typedef struct _Settings Settings;
 typedef struct _SettingsClass SettingsClass;
 
+/* The settings of one implementation, filled lazily from its replies and
+ * kept up to date from its SettingChanged signals. */
+typedef struct
+{
+  /* FALSE for implementations that don't reliably emit SettingChanged,
+   * all calls are passed through to those */
+  gboolean enabled;
+  /* Bumped on every change, so replies that raced with one are dropped */
+  guint64 generation;
+  /* Whether namespaces has every namespace of the implementation */
+  gboolean complete;
+  /* namespace -> a{sv}, or NULL if the implementation doesn't have it */
+  GHashTable *namespaces;
+} SettingsImplCache;
+
 struct _Settings
 {
   XdpDbusSettingsSkeleton parent_instance;
 
   XdpDbusImplSettings **impls;
+  SettingsImplCache *impl_caches;
   size_t n_impls;
+
+  GMutex cache_lock;
 };
 
 struct _SettingsClass
@@ -43,6 +61,8 @@ G_DEFINE_TYPE_WITH_CODE (Settings, settings, XDP_DBUS_TYPE_SETTINGS_SKELETON,
 
 G_DEFINE_AUTOPTR_CLEANUP_FUNC (Settings, g_object_unref)
 
+#define SETTINGS_IMPL_TIMEOUT_MS 5000
+
 static void
 merge_impl_settings (GHashTable *merged,
                      GVariant   *settings)
@@ -108,11 +128,268 @@ merged_to_variant (GHashTable *merged)
 }
 
 static gboolean
-settings_handle_read_all (XdpDbusSettings       *object,
-                          GDBusMethodInvocation *invocation,
-                          const char    * const *arg_namespaces)
+namespace_is_glob (const char *namespace)
 {
-  Settings *self = (Settings*)object;
+  return strlen (namespace) >= 3 && g_str_has_suffix (namespace, ".*");
+}
+
+static gboolean
+namespaces_match_all (const char * const *namespaces)
+{
+  return namespaces[0] == NULL || g_strv_contains (namespaces, "");
+}
+
+static gboolean
+namespaces_match (const char * const *namespaces,
+                  const char          *namespace)
+{
+  for (size_t i = 0; namespaces[i]; i++)
+    {
+      const char *pattern = namespaces[i];
+
+      if (namespace_is_glob (pattern))
+        {
+          /* "org.example.*" matches everything starting with "org.example." */
+          if (strncmp (namespace, pattern, strlen (pattern) - 1) == 0)
+            return TRUE;
+        }
+      else if (g_str_equal (namespace, pattern))
+        {
+          return TRUE;
+        }
+    }
+
+  return FALSE;
+}
+
+static void
+maybe_variant_unref (gpointer data)
+{
+  if (data)
+    g_variant_unref (data);
+}
+
+/* Returns what the implementation would reply to ReadAll(@namespaces), or
+ * NULL if that isn't known. Must be called with cache_lock held. */
+static GVariant *
+settings_cache_lookup_all (SettingsImplCache   *cache,
+                           const char * const  *namespaces)
+{
+  g_auto(GVariantBuilder) builder =
+    G_VARIANT_BUILDER_INIT (G_VARIANT_TYPE ("a{sa{sv}}"));
+  gboolean match_all = namespaces_match_all (namespaces);
+  const char *namespace;
+  GVariant *nsvalue;
+  GHashTableIter iter;
+
+  if (!cache->enabled)
+    return NULL;
+
+  /* Globs can only be answered from the full set of namespaces */
+  if (!cache->complete)
+    {
+      if (match_all)
+        return NULL;
+
+      for (size_t i = 0; namespaces[i]; i++)
+        {
+          if (namespace_is_glob (namespaces[i]) ||
+              !g_hash_table_contains (cache->namespaces, namespaces[i]))
+            return NULL;
+        }
+    }
+
+  g_hash_table_iter_init (&iter, cache->namespaces);
+  while (g_hash_table_iter_next (&iter,
+                                 (gpointer *)&namespace,
+                                 (gpointer *)&nsvalue))
+    {
+      if (nsvalue == NULL)
+        continue;
+
+      if (match_all || namespaces_match (namespaces, namespace))
+        g_variant_builder_add (&builder, "{s@a{sv}}", namespace, nsvalue);
+    }
+
+  return g_variant_ref_sink (g_variant_builder_end (&builder));
+}
+
+/* Returns TRUE if it is known whether the implementation has the key, and
+ * sets @out_value to its value, or NULL if it doesn't have it. Must be
+ * called with cache_lock held. */
+static gboolean
+settings_cache_lookup (SettingsImplCache  *cache,
+                       const char         *namespace,
+                       const char         *key,
+                       GVariant          **out_value)
+{
+  GVariant *nsvalue = NULL;
+
+  if (!cache->enabled)
+    return FALSE;
+
+  if (!g_hash_table_lookup_extended (cache->namespaces, namespace,
+                                     NULL, (gpointer *)&nsvalue) &&
+      !cache->complete)
+    return FALSE;
+
+  *out_value = nsvalue ? g_variant_lookup_value (nsvalue, key, NULL) : NULL;
+  return TRUE;
+}
+
+/* Stores the reply of ReadAll(@namespaces), unless a change was signalled
+ * since @generation. Must be called with cache_lock held. */
+static void
+settings_cache_store (SettingsImplCache  *cache,
+                      guint64             generation,
+                      const char * const *namespaces,
+                      GVariant           *impl_value)
+{
+  GVariantIter iter;
+  const char *namespace;
+  GVariant *nsvalue;
+
+  if (!cache->enabled || cache->generation != generation)
+    return;
+
+  if (namespaces_match_all (namespaces))
+    {
+      g_hash_table_remove_all (cache->namespaces);
+      cache->complete = TRUE;
+    }
+  else
+    {
+      /* Remember the namespaces the implementation doesn't have */
+      for (size_t i = 0; namespaces[i]; i++)
+        {
+          if (!namespace_is_glob (namespaces[i]))
+            g_hash_table_insert (cache->namespaces, g_strdup (namespaces[i]), NULL);
+        }
+    }
+
+  g_variant_iter_init (&iter, impl_value);
+  while (g_variant_iter_next (&iter, "{s@a{sv}}", &namespace, &nsvalue))
+    g_hash_table_insert (cache->namespaces, (char *) namespace, nsvalue);
+}
+
+/* Must be called with cache_lock held */
+static void
+settings_cache_update (SettingsImplCache *cache,
+                       const char        *namespace,
+                       const char        *key,
+                       GVariant          *value)
+{
+  g_autoptr(GVariantDict) dict = NULL;
+  g_autoptr(GVariant) unboxed = NULL;
+  GVariant *nsvalue = NULL;
+
+  cache->generation++;
+
+  if (!g_hash_table_lookup_extended (cache->namespaces, namespace,
+                                     NULL, (gpointer *)&nsvalue) &&
+      !cache->complete)
+    return;
+
+  /* The signal boxes the value, the a{sv} of the cache doesn't */
+  unboxed = g_variant_get_variant (value);
+  dict = g_variant_dict_new (nsvalue);
+  g_variant_dict_insert_value (dict, key, unboxed);
+  g_hash_table_insert (cache->namespaces,
+                       g_strdup (namespace),
+                       g_variant_ref_sink (g_variant_dict_end (dict)));
+}
+
+/* Must be called with cache_lock held */
+static void
+settings_cache_invalidate (SettingsImplCache *cache)
+{
+  cache->generation++;
+  cache->complete = FALSE;
+  g_hash_table_remove_all (cache->namespaces);
+}
+
+/* A Read(), ReadOne() or ReadAll() call, answered from the caches where
+ * possible and forwarded to the other implementations concurrently. The
+ * replies are used in priority order: the first implementation has the
+ * highest priority. */
+typedef struct
+{
+  Settings *settings;
+  GDBusMethodInvocation *invocation;
+  char **namespaces; /* ReadAll() */
+  char *namespace;
+  char *key;
+  gboolean read_one;
+  gboolean returned;
+  size_t n_pending;
+  gboolean *impl_done;
+  GVariant **impl_values; /* NULL if the implementation failed */
+  guint64 *impl_generations;
+} SettingsRead;
+
+static SettingsRead *
+settings_read_new (Settings              *settings,
+                   GDBusMethodInvocation *invocation)
+{
+  SettingsRead *read = g_new0 (SettingsRead, 1);
+
+  read->settings = g_object_ref (settings);
+  read->invocation = g_object_ref (invocation);
+  read->n_pending = settings->n_impls;
+  read->impl_done = g_new0 (gboolean, settings->n_impls);
+  read->impl_values = g_new0 (GVariant *, settings->n_impls);
+  read->impl_generations = g_new0 (guint64, settings->n_impls);
+
+  return read;
+}
+
+static void
+settings_read_free (SettingsRead *read)
+{
+  for (size_t i = 0; i < read->settings->n_impls; i++)
+    g_clear_pointer (&read->impl_values[i], g_variant_unref);
+
+  g_clear_pointer (&read->impl_generations, g_free);
+  g_clear_pointer (&read->impl_values, g_free);
+  g_clear_pointer (&read->impl_done, g_free);
+  g_clear_pointer (&read->namespaces, g_strfreev);
+  g_clear_pointer (&read->namespace, g_free);
+  g_clear_pointer (&read->key, g_free);
+  g_clear_object (&read->invocation);
+  g_clear_object (&read->settings);
+  g_free (read);
+}
+
+static size_t
+settings_get_impl_index (Settings *self,
+                         GObject  *impl)
+{
+  size_t i;
+
+  for (i = 0; i < self->n_impls; i++)
+    {
+      if ((GObject *) self->impls[i] == impl)
+        break;
+    }
+  g_assert (i < self->n_impls);
+
+  return i;
+}
+
+static void
+settings_read_complete (SettingsRead *read,
+                        size_t        impl_index,
+                        GVariant     *impl_value)
+{
+  read->impl_done[impl_index] = TRUE;
+  read->impl_values[impl_index] = impl_value;
+  read->n_pending--;
+}
+
+static void
+settings_read_all_return (SettingsRead *read)
+{
+  Settings *self = read->settings;
   g_autoptr(GHashTable) merged = NULL;
   g_autoptr(GVariant) settings = NULL;
 
@@ -120,62 +397,314 @@ settings_handle_read_all (XdpDbusSettings       *object,
                                   g_free,
                                   (GDestroyNotify) g_variant_dict_unref);
 
+  /* Lowest priority first, so higher priorities override it */
   for (size_t i = 0; i < self->n_impls; i++)
     {
-      g_autoptr(GError) error = NULL;
-      g_autoptr(GVariant) impl_value = NULL;
       size_t j = self->n_impls - i - 1;
 
-      if (!xdp_dbus_impl_settings_call_read_all_sync (self->impls[j],
-                                                      arg_namespaces,
-                                                      &impl_value,
-                                                      NULL, &error))
-        g_warning ("Failed to ReadAll() from Settings implementation: %s", error->message);
-      else
-        merge_impl_settings (merged, impl_value);
+      if (read->impl_values[j])
+        merge_impl_settings (merged, read->impl_values[j]);
     }
 
   settings = merged_to_variant (merged);
-  g_dbus_method_invocation_return_value (invocation, settings);
+  g_dbus_method_invocation_return_value (read->invocation, settings);
 
-  return G_DBUS_METHOD_INVOCATION_HANDLED;
+  settings_read_free (read);
+}
+
+static void
+read_all_done (GObject      *source_object,
+               GAsyncResult *result,
+               gpointer      user_data)
+{
+  SettingsRead *read = user_data;
+  Settings *self = read->settings;
+  g_autoptr(GError) error = NULL;
+  GVariant *impl_value = NULL;
+  size_t i;
+
+  i = settings_get_impl_index (self, source_object);
+
+  if (!xdp_dbus_impl_settings_call_read_all_finish (XDP_DBUS_IMPL_SETTINGS (source_object),
+                                                    &impl_value,
+                                                    result,
+                                                    &error))
+    {
+      g_warning ("Failed to ReadAll() from Settings implementation: %s", error->message);
+    }
+  else
+    {
+      g_autoptr(GMutexLocker) locker = g_mutex_locker_new (&self->cache_lock);
+
+      settings_cache_store (&self->impl_caches[i],
+                            read->impl_generations[i],
+                            (const char * const *) read->namespaces,
+                            impl_value);
+    }
+
+  settings_read_complete (read, i, impl_value);
+  if (read->n_pending == 0)
+    settings_read_all_return (read);
 }
 
 static gboolean
-settings_handle_read (XdpDbusSettings       *object,
-                      GDBusMethodInvocation *invocation,
-                      const char            *arg_namespace,
-                      const char            *arg_key)
+settings_handle_read_all (XdpDbusSettings       *object,
+                          GDBusMethodInvocation *invocation,
+                          const char    * const *arg_namespaces)
 {
   Settings *self = (Settings*)object;
+  g_autofree size_t *misses = g_new0 (size_t, self->n_impls);
+  size_t n_misses = 0;
+  SettingsRead *read;
+
+  read = settings_read_new (self, invocation);
+  read->namespaces = g_strdupv ((char **) arg_namespaces);
+
+  {
+    g_autoptr(GMutexLocker) locker = g_mutex_locker_new (&self->cache_lock);
+
+    for (size_t i = 0; i < self->n_impls; i++)
+      {
+        SettingsImplCache *cache = &self->impl_caches[i];
+        GVariant *impl_value;
+
+        impl_value = settings_cache_lookup_all (cache, arg_namespaces);
+        if (impl_value)
+          {
+            settings_read_complete (read, i, impl_value);
+          }
+        else
+          {
+            read->impl_generations[i] = cache->generation;
+            misses[n_misses++] = i;
+          }
+      }
+  }
+
+  if (n_misses == 0)
+    {
+      settings_read_all_return (read);
+      return G_DBUS_METHOD_INVOCATION_HANDLED;
+    }
 
-  g_debug ("Read %s %s", arg_namespace, arg_key);
+  /* The last reply frees read, don't touch it after the last call */
+  for (size_t k = 0; k < n_misses; k++)
+    {
+      xdp_dbus_impl_settings_call_read_all (self->impls[misses[k]],
+                                            (const char * const *) read->namespaces,
+                                            NULL,
+                                            read_all_done,
+                                            read);
+    }
+
+  return G_DBUS_METHOD_INVOCATION_HANDLED;
+}
+
+/* Returns the value of the highest priority implementation that has the
+ * key, as soon as all higher priority implementations are known not to
+ * have it. */
+static void
+settings_read_maybe_return (SettingsRead *read)
+{
+  Settings *self = read->settings;
+
+  if (read->returned)
+    return;
 
   for (size_t i = 0; i < self->n_impls; i++)
     {
-      g_autoptr(GError) error = NULL;
-      g_autoptr(GVariant) impl_value = NULL;
+      GVariant *impl_value = read->impl_values[i];
 
-      if (!xdp_dbus_impl_settings_call_read_sync (self->impls[i],
-                                                  arg_namespace,
-                                                  arg_key,
-                                                  &impl_value,
-                                                  NULL, &error))
+      if (!read->impl_done[i])
+        return;
+
+      if (impl_value == NULL)
+        continue;
+
+      /* The deprecated Read() boxes the value twice */
+      if (read->read_one)
+        g_dbus_method_invocation_return_value (read->invocation,
+                                               g_variant_new ("(v)", impl_value));
+      else
+        g_dbus_method_invocation_return_value (read->invocation,
+                                               g_variant_new ("(v)",
+                                                              g_variant_new_variant (impl_value)));
+      read->returned = TRUE;
+      return;
+    }
+
+  g_debug ("Attempted to read unknown namespace/key pair: %s %s", read->namespace, read->key);
+  g_dbus_method_invocation_return_error_literal (read->invocation, XDG_DESKTOP_PORTAL_ERROR,
+                                                 XDG_DESKTOP_PORTAL_ERROR_NOT_FOUND,
+                                                 _("Requested setting not found"));
+  read->returned = TRUE;
+}
+
+static void
+read_done (GObject      *source_object,
+           GAsyncResult *result,
+           gpointer      user_data)
+{
+  SettingsRead *read = user_data;
+  g_autoptr(GError) error = NULL;
+  GVariant *impl_value = NULL;
+  size_t i;
+
+  i = settings_get_impl_index (read->settings, source_object);
+
+  if (!xdp_dbus_impl_settings_call_read_finish (XDP_DBUS_IMPL_SETTINGS (source_object),
+                                                &impl_value,
+                                                result,
+                                                &error))
+    {
+      /* A key not being found is expected, continue to our implementation */
+      g_debug ("Failed to Read() from Settings implementation: %s", error->message);
+    }
+  else
+    {
+      g_autoptr(GVariant) boxed = g_steal_pointer (&impl_value);
+
+      /* Same representation as the values of the cache */
+      impl_value = g_variant_get_variant (boxed);
+    }
+
+  settings_read_complete (read, i, impl_value);
+  settings_read_maybe_return (read);
+
+  if (read->n_pending == 0)
+    settings_read_free (read);
+}
+
+/* Like read_done(), but for a ReadAll() of the namespace, which fills the
+ * cache */
+static void
+read_fill_done (GObject      *source_object,
+                GAsyncResult *result,
+                gpointer      user_data)
+{
+  SettingsRead *read = user_data;
+  Settings *self = read->settings;
+  g_autoptr(GVariant) settings = NULL;
+  g_autoptr(GVariant) nsvalue = NULL;
+  g_autoptr(GError) error = NULL;
+  GVariant *impl_value = NULL;
+  size_t i;
+
+  i = settings_get_impl_index (self, source_object);
+
+  if (!xdp_dbus_impl_settings_call_read_all_finish (XDP_DBUS_IMPL_SETTINGS (source_object),
+                                                    &settings,
+                                                    result,
+                                                    &error))
+    {
+      g_warning ("Failed to ReadAll() from Settings implementation: %s", error->message);
+    }
+  else
+    {
+      g_autoptr(GMutexLocker) locker = g_mutex_locker_new (&self->cache_lock);
+      const char *namespaces[] = { read->namespace, NULL };
+
+      settings_cache_store (&self->impl_caches[i],
+                            read->impl_generations[i],
+                            namespaces,
+                            settings);
+
+      nsvalue = g_variant_lookup_value (settings, read->namespace,
+                                        G_VARIANT_TYPE_VARDICT);
+      if (nsvalue)
+        impl_value = g_variant_lookup_value (nsvalue, read->key, NULL);
+    }
+
+  settings_read_complete (read, i, impl_value);
+  settings_read_maybe_return (read);
+
+  if (read->n_pending == 0)
+    settings_read_free (read);
+}
+
+static void
+settings_read_start (Settings              *self,
+                     GDBusMethodInvocation *invocation,
+                     const char            *arg_namespace,
+                     const char            *arg_key,
+                     gboolean               read_one)
+{
+  g_autofree size_t *misses = g_new0 (size_t, self->n_impls);
+  size_t n_misses = 0;
+  SettingsRead *read;
+
+  read = settings_read_new (self, invocation);
+  read->namespace = g_strdup (arg_namespace);
+  read->key = g_strdup (arg_key);
+  read->read_one = read_one;
+
+  {
+    g_autoptr(GMutexLocker) locker = g_mutex_locker_new (&self->cache_lock);
+
+    for (size_t i = 0; i < self->n_impls; i++)
+      {
+        SettingsImplCache *cache = &self->impl_caches[i];
+        GVariant *impl_value = NULL;
+
+        if (settings_cache_lookup (cache, arg_namespace, arg_key, &impl_value))
+          {
+            settings_read_complete (read, i, impl_value);
+          }
+        else
+          {
+            read->impl_generations[i] = cache->generation;
+            misses[n_misses++] = i;
+          }
+      }
+  }
+
+  /* Lower priority implementations don't matter if a higher priority one
+   * has the key cached */
+  settings_read_maybe_return (read);
+  if (read->returned)
+    {
+      settings_read_free (read);
+      return;
+    }
+
+  /* The last reply frees read, don't touch it after the last call */
+  for (size_t k = 0; k < n_misses; k++)
+    {
+      size_t i = misses[k];
+
+      if (self->impl_caches[i].enabled)
         {
-          /* A key not being found is expected, continue to our implementation */
-          g_debug ("Failed to Read() from Settings implementation: %s", error->message);
+          const char *namespaces[] = { read->namespace, NULL };
+
+          xdp_dbus_impl_settings_call_read_all (self->impls[i],
+                                                namespaces,
+                                                NULL,
+                                                read_fill_done,
+                                                read);
         }
       else
         {
-          g_dbus_method_invocation_return_value (invocation, g_variant_new ("(v)", impl_value));
-          return G_DBUS_METHOD_INVOCATION_HANDLED;
+          xdp_dbus_impl_settings_call_read (self->impls[i],
+                                            read->namespace,
+                                            read->key,
+                                            NULL,
+                                            read_done,
+                                            read);
         }
     }
+}
 
-  g_debug ("Attempted to read unknown namespace/key pair: %s %s", arg_namespace, arg_key);
-  g_dbus_method_invocation_return_error_literal (invocation, XDG_DESKTOP_PORTAL_ERROR,
-                                                 XDG_DESKTOP_PORTAL_ERROR_NOT_FOUND,
-                                                 _("Requested setting not found"));
+static gboolean
+settings_handle_read (XdpDbusSettings       *object,
+                      GDBusMethodInvocation *invocation,
+                      const char            *arg_namespace,
+                      const char            *arg_key)
+{
+  Settings *self = (Settings*)object;
+
+  g_debug ("Read %s %s", arg_namespace, arg_key);
+
+  settings_read_start (self, invocation, arg_namespace, arg_key, FALSE);
 
   return G_DBUS_METHOD_INVOCATION_HANDLED;
 }
@@ -190,31 +719,7 @@ settings_handle_read_one (XdpDbusSettings       *object,
 
   g_debug ("ReadOne %s %s", arg_namespace, arg_key);
 
-  for (size_t i = 0; i < self->n_impls; i++)
-    {
-      g_autoptr(GError) error = NULL;
-      g_autoptr(GVariant) impl_value = NULL;
-
-      if (!xdp_dbus_impl_settings_call_read_sync (self->impls[i],
-                                                  arg_namespace,
-                                                  arg_key,
-                                                  &impl_value,
-                                                  NULL, &error))
-        {
-          /* A key not being found is expected, continue to our implementation */
-          g_debug ("Failed to Read() from Settings implementation: %s", error->message);
-        }
-      else
-        {
-          g_dbus_method_invocation_return_value (invocation, g_variant_new_tuple (&impl_value, 1));
-          return G_DBUS_METHOD_INVOCATION_HANDLED;
-        }
-    }
-
-  g_debug ("Attempted to read unknown namespace/key pair: %s %s", arg_namespace, arg_key);
-  g_dbus_method_invocation_return_error_literal (invocation, XDG_DESKTOP_PORTAL_ERROR,
-                                                 XDG_DESKTOP_PORTAL_ERROR_NOT_FOUND,
-                                                 _("Requested setting not found"));
+  settings_read_start (self, invocation, arg_namespace, arg_key, TRUE);
 
   return G_DBUS_METHOD_INVOCATION_HANDLED;
 }
@@ -224,13 +729,33 @@ on_impl_settings_changed (XdpDbusImplSettings *impl,
                           const char          *arg_namespace,
                           const char          *arg_key,
                           GVariant            *arg_value,
-                          XdpDbusSettings     *settings)
+                          Settings            *self)
 {
+  size_t i = settings_get_impl_index (self, G_OBJECT (impl));
+
+  {
+    g_autoptr(GMutexLocker) locker = g_mutex_locker_new (&self->cache_lock);
+
+    settings_cache_update (&self->impl_caches[i], arg_namespace, arg_key, arg_value);
+  }
+
   g_debug ("Emitting changed for %s %s", arg_namespace, arg_key);
-  xdp_dbus_settings_emit_setting_changed (settings, arg_namespace,
+  xdp_dbus_settings_emit_setting_changed (XDP_DBUS_SETTINGS (self), arg_namespace,
                                           arg_key, arg_value);
 }
 
+static void
+on_impl_name_owner_changed (XdpDbusImplSettings *impl,
+                            GParamSpec          *pspec,
+                            Settings            *self)
+{
+  size_t i = settings_get_impl_index (self, G_OBJECT (impl));
+  g_autoptr(GMutexLocker) locker = g_mutex_locker_new (&self->cache_lock);
+
+  /* A restarted implementation may have different settings */
+  settings_cache_invalidate (&self->impl_caches[i]);
+}
+
 static void
 settings_iface_init (XdpDbusSettingsIface *iface)
 {
@@ -242,6 +767,7 @@ settings_iface_init (XdpDbusSettingsIface *iface)
 static void
 settings_init (Settings *settings)
 {
+  g_mutex_init (&settings->cache_lock);
 }
 
 static void
@@ -253,9 +779,12 @@ settings_finalize (GObject *object)
     {
       g_signal_handlers_disconnect_by_data (self->impls[i], self);
       g_clear_object (&self->impls[i]);
+      g_clear_pointer (&self->impl_caches[i].namespaces, g_hash_table_unref);
     }
 
   g_clear_pointer(&self->impls, g_free);
+  g_clear_pointer (&self->impl_caches, g_free);
+  g_mutex_clear (&self->cache_lock);
 
   G_OBJECT_CLASS (settings_parent_class)->finalize (object);
 }
@@ -269,22 +798,37 @@ settings_class_init (SettingsClass *klass)
 }
 
 static Settings *
-settings_new (GPtrArray *impls)
+settings_new (GPtrArray *impls,
+              GArray    *impls_cached)
 {
   Settings *settings;
 
   settings = g_object_new (settings_get_type (), NULL);
   settings->n_impls = impls->len;
   settings->impls = (XdpDbusImplSettings **) g_ptr_array_steal (impls, NULL);
+  settings->impl_caches = g_new0 (SettingsImplCache, settings->n_impls);
 
   xdp_dbus_settings_set_version (XDP_DBUS_SETTINGS (settings), 2);
 
   for (size_t i = 0; i < settings->n_impls; i++)
     {
+      /* Don't let a hung backend delay replies for the default 25s */
+      g_dbus_proxy_set_default_timeout (G_DBUS_PROXY (settings->impls[i]),
+                                        SETTINGS_IMPL_TIMEOUT_MS);
+
+      settings->impl_caches[i].enabled = g_array_index (impls_cached, gboolean, i);
+      settings->impl_caches[i].namespaces =
+        g_hash_table_new_full (g_str_hash, g_str_equal,
+                               g_free, maybe_variant_unref);
+
       g_signal_connect_object (settings->impls[i], "setting-changed",
                                G_CALLBACK (on_impl_settings_changed),
                                settings,
                                G_CONNECT_DEFAULT);
+      g_signal_connect_object (settings->impls[i], "notify::g-name-owner",
+                               G_CALLBACK (on_impl_name_owner_changed),
+                               settings,
+                               G_CONNECT_DEFAULT);
     }
 
   return settings;
@@ -298,12 +842,14 @@ init_settings (XdpContext *context)
   XdpPortalConfig *config = xdp_context_get_config (context);
   g_autoptr(GPtrArray) impl_configs = NULL;
   g_autoptr(GPtrArray) impl_proxies = NULL;
+  g_autoptr(GArray) impls_cached = NULL;
 
   impl_configs = xdp_portal_config_find_all (config, SETTINGS_DBUS_IMPL_IFACE);
   if (impl_configs->len == 0)
     return;
 
   impl_proxies = g_ptr_array_new_with_free_func (g_object_unref);
+  impls_cached = g_array_new (FALSE, FALSE, sizeof (gboolean));
 
   for (size_t i = 0; i < impl_configs->len; i++)
     {
@@ -320,9 +866,13 @@ init_settings (XdpContext *context)
                                                NULL,
                                                &error);
       if (impl_proxy == NULL)
-        g_warning ("Failed to create settings proxy: %s", error->message);
-      else
-        g_ptr_array_add (impl_proxies, g_steal_pointer (&impl_proxy));
+        {
+          g_warning ("Failed to create settings proxy: %s", error->message);
+          continue;
+        }
+
+      g_ptr_array_add (impl_proxies, g_steal_pointer (&impl_proxy));
+      g_array_append_val (impls_cached, impl_config->settings_cache);
     }
 
   if (impl_proxies->len == 0)
@@ -331,7 +881,7 @@ init_settings (XdpContext *context)
       return;
     }
 
-  settings = settings_new (impl_proxies);
+  settings = settings_new (impl_proxies, impls_cached);
 
   xdp_context_take_and_export_portal (context,
                                       G_DBUS_INTERFACE_SKELETON (g_steal_pointer (&settings)),
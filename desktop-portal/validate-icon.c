@@ -11,6 +11,8 @@
 
 #include <errno.h>
 #include <fcntl.h>
+#include <string.h>
+#include <sys/socket.h>
 #include <unistd.h>
 
 #include <gdk-pixbuf/gdk-pixbuf.h>
@@ -50,6 +52,7 @@ static const XdpValidatorRuleset *ruleset = NULL;
 static gboolean opt_sandbox;
 static char *opt_path = NULL;
 static int opt_fd = -1;
+static int opt_socket = -1;
 
 static gboolean
 option_validator_cb (const gchar  *option_name,
@@ -77,10 +80,11 @@ static GOptionEntry entries[] = {
   { "path", 0, 0, G_OPTION_ARG_FILENAME, &opt_path, "Read icon data from given file path. Required to be from a trusted source.", "PATH" },
   { "fd", 0, 0, G_OPTION_ARG_INT, &opt_fd, "Read icon data from given file descriptor. Required to be from a trusted source or to be sealed", "FD" },
   { "ruleset", 0, 0, G_OPTION_ARG_CALLBACK, &option_validator_cb, "The icon validator ruleset to apply. Accepted values: desktop, notification", "RULESET" },
+  { "socket", 0, 0, G_OPTION_ARG_INT, &opt_socket, "Keep validating icons received over the given socket, with the ruleset name as payload", "FD" },
   { NULL }
 };
 
-static int
+static char *
 validate_icon (int input_fd)
 {
   const char *allowed_formats[] = { "png", "jpeg", "svg", NULL };
@@ -104,7 +108,7 @@ validate_icon (int input_fd)
   if (!mapped)
     {
       g_printerr ("Failed to create mapped file for image: %s\n", error->message);
-      return 1;
+      return NULL;
     }
 
   bytes = g_mapped_file_get_bytes (mapped);
@@ -112,13 +116,13 @@ validate_icon (int input_fd)
   if (g_bytes_get_size (bytes) == 0)
     {
       g_printerr ("Image is 0 bytes\n");
-      return 1;
+      return NULL;
     }
 
   if (g_bytes_get_size (bytes) > ruleset->max_file_size)
     {
       g_printerr ("Image is bigger then the allowed size\n");
-      return 1;
+      return NULL;
     }
 
   loader = gdk_pixbuf_loader_new ();
@@ -127,34 +131,34 @@ validate_icon (int input_fd)
     {
       g_printerr ("Failed to load image: %s\n", error->message);
       gdk_pixbuf_loader_close (loader, NULL);
-      return 1;
+      return NULL;
     }
 
   if (!gdk_pixbuf_loader_close (loader, &error))
     {
       g_printerr ("Failed to load image: %s\n", error->message);
-      return 1;
+      return NULL;
     }
 
   pixbuf = gdk_pixbuf_loader_get_pixbuf (loader);
   if (!pixbuf)
     {
       g_printerr ("Failed to load image: %s\n", error->message);
-      return 1;
+      return NULL;
     }
 
   format = gdk_pixbuf_loader_get_format (loader);
   if (!format)
     {
       g_printerr ("Image format not recognized\n");
-      return 1;
+      return NULL;
     }
 
   name = gdk_pixbuf_format_get_name (format);
   if (!g_strv_contains (allowed_formats, name))
     {
       g_printerr ("Image format %s not accepted\n", name);
-      return 1;
+      return NULL;
     }
 
   width = gdk_pixbuf_get_width (pixbuf);
@@ -163,7 +167,7 @@ validate_icon (int input_fd)
   if (width != height)
     {
       g_printerr ("Expected a square image but got: %dx%d\n", width, height);
-      return 1;
+      return NULL;
     }
 
   /* Sanity check for vector files */
@@ -173,7 +177,7 @@ validate_icon (int input_fd)
   if (width > max_size)
     {
       g_printerr ("Image too large (%dx%d). Max. size %dx%d\n", width, height, max_size, max_size);
-      return 1;
+      return NULL;
     }
 
   /* Print the format and size for consumption by (at least) the dynamic
@@ -184,11 +188,104 @@ validate_icon (int input_fd)
   g_key_file_set_string (key_file, ICON_VALIDATOR_GROUP, "format", name);
   g_key_file_set_integer (key_file, ICON_VALIDATOR_GROUP, "width", width);
   key_file_data = g_key_file_to_data (key_file, NULL, NULL);
-  g_print ("%s", key_file_data);
 
-  return 0;
+  return g_steal_pointer (&key_file_data);
 }
 
+/* Each request is a single packet carrying the ruleset name and the icon fd.
+ * The reply is a status byte ('0' for valid) followed by the key file. */
+static int
+serve_socket (int socket_fd)
+{
+  while (TRUE)
+    {
+      char name[64] = { 0, };
+      union {
+        struct cmsghdr hdr;
+        char buf[CMSG_SPACE (sizeof (int))];
+      } control;
+      struct iovec iov = { name, sizeof (name) - 1 };
+      struct msghdr msg = {
+        .msg_iov = &iov,
+        .msg_iovlen = 1,
+        .msg_control = &control,
+        .msg_controllen = sizeof (control),
+      };
+      struct cmsghdr *cmsg;
+      g_autofd int input_fd = -1;
+      g_autofree char *key_file_data = NULL;
+      g_autoptr(GString) reply = NULL;
+      gboolean malformed;
+      ssize_t res;
+
+      res = recvmsg (socket_fd, &msg, MSG_CMSG_CLOEXEC);
+      if (res < 0 && errno == EINTR)
+        continue;
+      if (res < 0)
+        {
+          g_printerr ("Error: Failed to receive request: %s\n", g_strerror (errno));
+          return 1;
+        }
+      /* The portal closed its end, we are done */
+      if (res == 0)
+        return 0;
+
+      /* Requests carry exactly one fd, close any extra ones */
+      malformed = (msg.msg_flags & MSG_CTRUNC) != 0;
+      for (cmsg = CMSG_FIRSTHDR (&msg); cmsg != NULL; cmsg = CMSG_NXTHDR (&msg, cmsg))
+        {
+          size_t n_fds;
+
+          if (cmsg->cmsg_level != SOL_SOCKET || cmsg->cmsg_type != SCM_RIGHTS)
+            continue;
+
+          n_fds = (cmsg->cmsg_len - CMSG_LEN (0)) / sizeof (int);
+          for (size_t i = 0; i < n_fds; i++)
+            {
+              int fd;
+
+              memcpy (&fd, CMSG_DATA (cmsg) + i * sizeof (int), sizeof (int));
+              if (input_fd == -1)
+                {
+                  input_fd = fd;
+                }
+              else
+                {
+                  close (fd);
+                  malformed = TRUE;
+                }
+            }
+        }
+
+      ruleset = NULL;
+      for (size_t i = 0; i < G_N_ELEMENTS (rulesets); i++)
+        {
+          if (g_str_equal (name, rulesets[i].name))
+            ruleset = &rulesets[i];
+        }
+
+      if (malformed)
+        g_printerr ("Error: Malformed request, expected a single fd\n");
+      else if (input_fd == -1)
+        g_printerr ("Error: No icon fd received\n");
+      else if (ruleset == NULL)
+        g_printerr ("Error: Invalid ruleset '%s'\n", name);
+      else
+        key_file_data = validate_icon (input_fd);
+
+      reply = g_string_new (key_file_data != NULL ? "0" : "1");
+      if (key_file_data != NULL)
+        g_string_append (reply, key_file_data);
+
+      if (send (socket_fd, reply->str, reply->len, MSG_NOSIGNAL) < 0)
+        {
+          g_printerr ("Error: Failed to send reply: %s\n", g_strerror (errno));
+          return 1;
+        }
+    }
+}
+
+
 #ifdef HELPER
 
 G_GNUC_NULL_TERMINATED
@@ -235,7 +332,8 @@ flatpak_get_bwrap (void)
 }
 
 static int
-rerun_in_sandbox (int input_fd)
+rerun_in_sandbox (const char *fd_option,
+                  int         input_fd)
 {
   const char * const usrmerged_dirs[] = { "bin", "lib32", "lib64", "lib", "sbin" };
   g_autoptr(GPtrArray) args = g_ptr_array_new_with_free_func (g_free);
@@ -243,8 +341,6 @@ rerun_in_sandbox (int input_fd)
   char validate_icon[PATH_MAX + 1];
   ssize_t symlink_size;
 
-  g_assert (ruleset != NULL);
-
   symlink_size = readlink ("/proc/self/exe", validate_icon, sizeof (validate_icon) - 1);
   if (symlink_size < 0 || (size_t) symlink_size >= sizeof (validate_icon))
     {
@@ -304,11 +400,9 @@ rerun_in_sandbox (int input_fd)
     add_args (args, "--setenv", "G_MESSAGES_PREFIXED", g_getenv ("G_MESSAGES_PREFIXED"), NULL);
 
   arg_input_fd = g_strdup_printf ("%d", input_fd);
-  add_args (args,
-            validate_icon,
-            "--fd", arg_input_fd,
-            "--ruleset", ruleset->name,
-            NULL);
+  add_args (args, validate_icon, fd_option, arg_input_fd, NULL);
+  if (ruleset != NULL)
+    add_args (args, "--ruleset", ruleset->name, NULL);
   g_ptr_array_add (args, NULL);
 
   execvpe (flatpak_get_bwrap (), (char **) args->pdata, NULL);
@@ -335,6 +429,22 @@ main (int argc, char *argv[])
       return 1;
     }
 
+  if (opt_socket != -1)
+    {
+      if (opt_path != NULL || opt_fd != -1)
+        {
+          g_printerr ("Error: --socket can't be combined with --path or --fd\n");
+          return 1;
+        }
+
+#ifdef HELPER
+      if (opt_sandbox)
+        return rerun_in_sandbox ("--socket", opt_socket);
+      else
+#endif
+        return serve_socket (opt_socket);
+    }
+
   if (ruleset == NULL)
     {
       g_printerr ("Error: A ruleset must be given with --ruleset\n");
@@ -367,8 +477,16 @@ main (int argc, char *argv[])
 
 #ifdef HELPER
   if (opt_sandbox)
-    return rerun_in_sandbox (opt_fd);
+    return rerun_in_sandbox ("--fd", opt_fd);
   else
 #endif
-    return validate_icon (opt_fd);
+    {
+      g_autofree char *key_file_data = validate_icon (opt_fd);
+
+      if (key_file_data == NULL)
+        return 1;
+
+      g_print ("%s", key_file_data);
+      return 0;
+    }
 }
@@ -7,6 +7,8 @@
 
 #include <errno.h>
 #include <fcntl.h>
+#include <string.h>
+#include <sys/socket.h>
 #include <unistd.h>
 
 #include <glib/gstdio.h>
@@ -23,7 +25,7 @@
 
 #define SOUND_VALIDATOR_GROUP "Sound Validator"
 
-static int
+static char *
 validate_sound (int input_fd)
 {
   g_autoptr(GKeyFile) key_file = NULL;
@@ -45,7 +47,7 @@ validate_sound (int input_fd)
   if (!discoverer)
     {
       g_printerr ("validate-sound: Failed to create gstreamer discoverer: %s\n", error->message);
-      return 1;
+      return NULL;
     }
 
   uri = g_strdup_printf ("file:///proc/self/fd/%d", input_fd);
@@ -56,16 +58,16 @@ validate_sound (int input_fd)
     {
       case GST_DISCOVERER_URI_INVALID:
         g_assert_not_reached ();
-        return 1;
+        return NULL;
       case GST_DISCOVERER_ERROR:
         g_printerr ("validate-sound: Couldn't discover media type: %s\n", error->message);
-        return 1;
+        return NULL;
       case GST_DISCOVERER_TIMEOUT:
         g_printerr ("validate-sound: Couldn't discover media type: Timeout\n");
-        return 1;
+        return NULL;
       case GST_DISCOVERER_BUSY:
         g_printerr ("validate-sound: Couldn't discover media type: Busy\n");
-        return 1;
+        return NULL;
       case GST_DISCOVERER_MISSING_PLUGINS:
         {
           g_autofree char *str = NULL;
@@ -74,7 +76,7 @@ validate_sound (int input_fd)
                             (char **) gst_discoverer_info_get_missing_elements_installer_details (info));
 
           g_printerr ("validate-sound: Couldn't discover media type: Missing plugins: %s\n", str);
-          return 1;
+          return NULL;
         }
       case GST_DISCOVERER_OK:
         break;
@@ -84,14 +86,14 @@ validate_sound (int input_fd)
   if (!stream_info)
     {
       g_printerr ("validate-sound: Contains a invalid stream\n");
-      return 1;
+      return NULL;
     }
 
   stream_next = gst_discoverer_stream_info_get_next (stream_info);
   if (stream_next)
     {
       g_printerr ("validate-sound: Only a single stream is allowed\n");
-      return 1;
+      return NULL;
     }
 
   if (GST_IS_DISCOVERER_CONTAINER_INFO (stream_info))
@@ -106,13 +108,13 @@ validate_sound (int input_fd)
       if (!gst_caps_is_fixed (container_caps) || gst_caps_get_size (container_caps) != 1)
         {
           g_printerr ("validate-sound: The media format is to complex\n");
-          return 1;
+          return NULL;
         }
 
       if (!gst_structure_has_name (structure, "audio/ogg"))
         {
           g_printerr ("validate-sound: Unsupported container format\n");
-          return 1;
+          return NULL;
         }
 
       streams = gst_discoverer_container_info_get_streams (GST_DISCOVERER_CONTAINER_INFO (stream_info));
@@ -120,7 +122,7 @@ validate_sound (int input_fd)
       if (streams->next)
         {
           g_printerr ("validate-sound: Only a single stream is allowed\n");
-          return 1;
+          return NULL;
         }
 
       audio_info = gst_discoverer_stream_info_ref (streams->data);
@@ -141,7 +143,7 @@ validate_sound (int input_fd)
       if (!gst_caps_is_fixed (caps) || gst_caps_get_size (caps) != 1)
         {
           g_printerr ("validate-sound: Media format is to complex\n");
-          return 1;
+          return NULL;
         }
 
       if (gst_structure_has_name (structure, "audio/x-wav"))
@@ -161,17 +163,98 @@ validate_sound (int input_fd)
   if (format == NULL)
     {
       g_printerr ("validate-sound: Unsupported sound format\n");
-      return 1;
+      return NULL;
     }
 
   key_file = g_key_file_new ();
   g_key_file_set_string (key_file, SOUND_VALIDATOR_GROUP, "format", format);
   key_file_data = g_key_file_to_data (key_file, NULL, NULL);
-  g_print ("%s", key_file_data);
 
-  close (input_fd);
+  return g_steal_pointer (&key_file_data);
+}
+
+/* Each request is a single packet carrying the sound fd, the reply is a
+ * status byte ('0' for valid) followed by the key file. */
+static int
+serve_socket (int socket_fd)
+{
+  while (TRUE)
+    {
+      char payload[16];
+      union {
+        struct cmsghdr hdr;
+        char buf[CMSG_SPACE (sizeof (int))];
+      } control;
+      struct iovec iov = { payload, sizeof (payload) };
+      struct msghdr msg = {
+        .msg_iov = &iov,
+        .msg_iovlen = 1,
+        .msg_control = &control,
+        .msg_controllen = sizeof (control),
+      };
+      struct cmsghdr *cmsg;
+      g_autofd int input_fd = -1;
+      g_autofree char *key_file_data = NULL;
+      g_autoptr(GString) reply = NULL;
+      gboolean malformed;
+      ssize_t res;
+
+      res = recvmsg (socket_fd, &msg, MSG_CMSG_CLOEXEC);
+      if (res < 0 && errno == EINTR)
+        continue;
+      if (res < 0)
+        {
+          g_printerr ("validate-sound: Failed to receive request: %s\n", g_strerror (errno));
+          return 1;
+        }
+      /* The portal closed its end, we are done */
+      if (res == 0)
+        return 0;
+
+      /* Requests carry exactly one fd, close any extra ones */
+      malformed = (msg.msg_flags & MSG_CTRUNC) != 0;
+      for (cmsg = CMSG_FIRSTHDR (&msg); cmsg != NULL; cmsg = CMSG_NXTHDR (&msg, cmsg))
+        {
+          size_t n_fds;
+
+          if (cmsg->cmsg_level != SOL_SOCKET || cmsg->cmsg_type != SCM_RIGHTS)
+            continue;
+
+          n_fds = (cmsg->cmsg_len - CMSG_LEN (0)) / sizeof (int);
+          for (size_t i = 0; i < n_fds; i++)
+            {
+              int fd;
+
+              memcpy (&fd, CMSG_DATA (cmsg) + i * sizeof (int), sizeof (int));
+              if (input_fd == -1)
+                {
+                  input_fd = fd;
+                }
+              else
+                {
+                  close (fd);
+                  malformed = TRUE;
+                }
+            }
+        }
+
+      if (malformed)
+        g_printerr ("validate-sound: Malformed request, expected a single fd\n");
+      else if (input_fd == -1)
+        g_printerr ("validate-sound: No sound fd received\n");
+      else
+        key_file_data = validate_sound (input_fd);
+
+      reply = g_string_new (key_file_data != NULL ? "0" : "1");
+      if (key_file_data != NULL)
+        g_string_append (reply, key_file_data);
 
-  return 0;
+      if (send (socket_fd, reply->str, reply->len, MSG_NOSIGNAL) < 0)
+        {
+          g_printerr ("validate-sound: Failed to send reply: %s\n", g_strerror (errno));
+          return 1;
+        }
+    }
 }
 
 #ifdef HELPER
@@ -220,7 +303,8 @@ flatpak_get_bwrap (void)
 }
 
 static int
-rerun_in_sandbox (int input_fd)
+rerun_in_sandbox (const char *fd_option,
+                  int         input_fd)
 {
   const char * const usrmerged_dirs[] = { "bin", "lib32", "lib64", "lib", "sbin" };
   int i;
@@ -289,7 +373,7 @@ rerun_in_sandbox (int input_fd)
 
 
   arg_input_fd = g_strdup_printf ("%d", input_fd);
-  add_args (args, validate_sound, "--fd", arg_input_fd, NULL);
+  add_args (args, validate_sound, fd_option, arg_input_fd, NULL);
   g_ptr_array_add (args, NULL);
 
   execvpe (flatpak_get_bwrap (), (char **) args->pdata, NULL);
@@ -302,11 +386,13 @@ rerun_in_sandbox (int input_fd)
 static gboolean  opt_sandbox;
 static gchar    *opt_path = NULL;
 static gint      opt_fd = -1;
+static gint      opt_socket = -1;
 
 static GOptionEntry entries[] = {
   { "sandbox", 0, 0, G_OPTION_ARG_NONE, &opt_sandbox, "Run in a sandbox", NULL },
   { "path", 0, 0, G_OPTION_ARG_FILENAME, &opt_path, "Read sound data from given file path", "PATH" },
   { "fd", 0, 0, G_OPTION_ARG_INT, &opt_fd, "Read sound data from given file descriptor", "FD" },
+  { "socket", 0, 0, G_OPTION_ARG_INT, &opt_socket, "Keep validating sounds received over the given socket", "FD" },
   { NULL }
 };
 
@@ -326,6 +412,22 @@ main (int argc, char *argv[])
       return 1;
     }
 
+  if (opt_socket != -1)
+    {
+      if (opt_path != NULL || opt_fd != -1)
+        {
+          g_printerr ("Error: --socket can't be combined with --path or --fd\n");
+          return 1;
+        }
+
+#ifdef HELPER
+      if (opt_sandbox)
+        return rerun_in_sandbox ("--socket", opt_socket);
+      else
+#endif
+        return serve_socket (opt_socket);
+    }
+
   if (opt_path != NULL && opt_fd != -1)
     {
       g_printerr ("Error: Only --path or --fd can be given\n");
@@ -352,8 +454,17 @@ main (int argc, char *argv[])
 
 #ifdef HELPER
   if (opt_sandbox)
-    return rerun_in_sandbox (opt_fd);
+    return rerun_in_sandbox ("--fd", opt_fd);
   else
 #endif
-    return validate_sound (opt_fd);
+    {
+      g_autofree char *key_file_data = validate_sound (opt_fd);
+
+      if (key_file_data == NULL)
+        return 1;
+
+      g_print ("%s", key_file_data);
+      close (opt_fd);
+      return 0;
+    }
 }
@@ -17,6 +17,7 @@
 #include "document-enums.h"
 #include "xdp-app-info.h"
 #include "xdp-dbus.h"
+#include "xdp-permissions.h"
 #include "xdp-utils.h"
 
 #define DOCUMENT_PORTAL_DBUS_NAME "org.freedesktop.portal.Documents"
@@ -25,6 +26,85 @@
 static XdpDbusDocuments *documents = NULL;
 static char *documents_mountpoint = NULL;
 
+/* Resolving document portal paths back to host paths happens for every
+ * request involving files, so remember the host path of the documents
+ * we've seen. The permission store announces deleted or changed documents,
+ * and everything is forgotten when the document portal goes away. */
+#define HOST_PATH_CACHE_MAX_SIZE 256
+
+G_LOCK_DEFINE_STATIC (host_path_cache);
+static GHashTable *host_path_cache = NULL; /* doc id -> host path */
+static guint64 host_path_cache_generation = 0;
+
+static char *
+host_path_cache_lookup (const char *doc_id,
+                        guint64    *generation)
+{
+  char *host_path;
+
+  G_LOCK (host_path_cache);
+
+  host_path = g_strdup (g_hash_table_lookup (host_path_cache, doc_id));
+  *generation = host_path_cache_generation;
+
+  G_UNLOCK (host_path_cache);
+
+  return host_path;
+}
+
+static void
+host_path_cache_store (const char *doc_id,
+                       const char *host_path,
+                       guint64     generation)
+{
+  G_LOCK (host_path_cache);
+
+  /* Don't store anything if the document changed while we were
+   * asking the document portal about it */
+  if (generation == host_path_cache_generation)
+    {
+      if (g_hash_table_size (host_path_cache) >= HOST_PATH_CACHE_MAX_SIZE)
+        g_hash_table_remove_all (host_path_cache);
+
+      g_hash_table_insert (host_path_cache, g_strdup (doc_id), g_strdup (host_path));
+    }
+
+  G_UNLOCK (host_path_cache);
+}
+
+static void
+on_documents_changed (XdpDbusImplPermissionStore *store,
+                      const char                 *table,
+                      const char                 *id,
+                      gboolean                    deleted,
+                      GVariant                   *data,
+                      GVariant                   *permissions,
+                      gpointer                    user_data)
+{
+  if (g_strcmp0 (table, "documents") != 0)
+    return;
+
+  G_LOCK (host_path_cache);
+
+  host_path_cache_generation++;
+  g_hash_table_remove (host_path_cache, id);
+
+  G_UNLOCK (host_path_cache);
+}
+
+static void
+on_documents_owner_changed (GObject    *object,
+                            GParamSpec *pspec,
+                            gpointer    user_data)
+{
+  G_LOCK (host_path_cache);
+
+  host_path_cache_generation++;
+  g_hash_table_remove_all (host_path_cache);
+
+  G_UNLOCK (host_path_cache);
+}
+
 gboolean
 xdp_init_document_proxy (GDBusConnection  *connection,
                          GError          **error)
@@ -38,6 +118,13 @@ xdp_init_document_proxy (GDBusConnection  *connection,
   if (!documents)
     return FALSE;
 
+  host_path_cache = g_hash_table_new_full (g_str_hash, g_str_equal, g_free, g_free);
+
+  g_signal_connect (xdp_get_permission_store (), "changed",
+                    G_CALLBACK (on_documents_changed), NULL);
+  g_signal_connect (documents, "notify::g-name-owner",
+                    G_CALLBACK (on_documents_owner_changed), NULL);
+
   if (!xdp_dbus_documents_call_get_mount_point_sync (documents,
                                                      &documents_mountpoint,
                                                      NULL, &local_error))
@@ -51,29 +138,72 @@ xdp_init_document_proxy (GDBusConnection  *connection,
   return TRUE;
 }
 
-char *
-xdp_register_document (const char        *uri,
-                       const char        *app_id,
-                       XdpDocumentFlags   flags,
-                       GError           **error)
+/* Linux passes at most SCM_MAX_FD (253) fds in a single message */
+#define DOCUMENTS_MAX_FDS_PER_CALL 250
+
+/* Requests waiting for the document portal don't hold a thread, but a slow
+ * document portal still shouldn't get an unbounded number of calls */
+#define DOCUMENTS_MAX_CALLS_IN_FLIGHT 16
+
+static void
+get_document_permissions (XdpDocumentFlags  flags,
+                          const char       *permissions[5])
+{
+  int i = 0;
+
+  permissions[i++] = "read";
+  if ((flags & XDP_DOCUMENT_FLAG_WRITABLE) || (flags & XDP_DOCUMENT_FLAG_FOR_SAVE))
+    permissions[i++] = "write";
+  permissions[i++] = "grant-permissions";
+  if (flags & XDP_DOCUMENT_FLAG_DELETABLE)
+    permissions[i++] = "delete";
+  permissions[i++] = NULL;
+}
+
+static DocumentAddFullFlags
+get_add_full_flags (XdpDocumentFlags flags)
+{
+  DocumentAddFullFlags full_flags;
+
+  full_flags = DOCUMENT_ADD_FLAGS_REUSE_EXISTING | DOCUMENT_ADD_FLAGS_PERSISTENT | DOCUMENT_ADD_FLAGS_AS_NEEDED_BY_APP;
+  if (flags & XDP_DOCUMENT_FLAG_DIRECTORY)
+    full_flags |= DOCUMENT_ADD_FLAGS_DIRECTORY;
+
+  return full_flags;
+}
+
+static char *
+get_document_uri (const char  *path,
+                  const char  *doc_id,
+                  GError     **error)
 {
-  g_autofree char *doc_id = NULL;
-  g_auto(GStrv) doc_ids = NULL;
-  g_autofree char *path = NULL;
   g_autofree char *basename = NULL;
-  g_autofree char *dirname = NULL;
-  g_autoptr(GUnixFDList) fd_list = NULL;
-  int fd, fd_in;
-  g_autoptr(GFile) file = NULL;
-  gboolean ret = FALSE;
-  const char *permissions[5];
   g_autofree char *doc_path = NULL;
-  int i;
-  int version;
-  gboolean handled_permissions = FALSE;
-  DocumentAddFullFlags full_flags;
 
-  g_return_val_if_fail (app_id != NULL && *app_id != '\0', NULL);
+  /* The app can already access the file */
+  if (g_strcmp0 (doc_id, "") == 0)
+    {
+      doc_path = g_build_filename (path, NULL);
+      return g_filename_to_uri (doc_path, NULL, error);
+    }
+
+  basename = g_path_get_basename (path);
+  doc_path = g_build_filename (documents_mountpoint, doc_id, basename, NULL);
+  return g_filename_to_uri (doc_path, NULL, error);
+}
+
+static gboolean
+open_document (const char        *uri,
+               XdpDocumentFlags   flags,
+               GUnixFDList       *fd_list,
+               char             **path_out,
+               int               *fd_in_out,
+               GError           **error)
+{
+  g_autoptr(GFile) file = NULL;
+  g_autofree char *path = NULL;
+  g_autofree char *dirname = NULL;
+  int fd, fd_in;
 
   file = g_file_new_for_uri (uri);
   path = g_file_get_path (file);
@@ -81,9 +211,8 @@ xdp_register_document (const char        *uri,
     {
       g_set_error (error, G_IO_ERROR, G_IO_ERROR_NOT_SUPPORTED,
                    "URI %s not supported by the document portal", uri);
-      return NULL;
+      return FALSE;
     }
-  basename = g_path_get_basename (path);
   dirname = g_path_get_dirname (path);
 
   if (flags & XDP_DOCUMENT_FLAG_FOR_SAVE)
@@ -95,28 +224,48 @@ xdp_register_document (const char        *uri,
     {
       g_set_error (error, G_IO_ERROR, g_io_error_from_errno (errno),
                    "Failed to open %s", uri);
-      return NULL;
+      return FALSE;
     }
-  fd_list = g_unix_fd_list_new ();
+
   fd_in = g_unix_fd_list_append (fd_list, fd, error);
   close (fd);
 
   if (fd_in == -1)
+    return FALSE;
+
+  *path_out = g_steal_pointer (&path);
+  *fd_in_out = fd_in;
+  return TRUE;
+}
+
+static char *
+register_document_sync (const char        *uri,
+                        const char        *app_id,
+                        XdpDocumentFlags   flags,
+                        GError           **error)
+{
+  g_autofree char *doc_id = NULL;
+  g_auto(GStrv) doc_ids = NULL;
+  g_autofree char *path = NULL;
+  g_autofree char *basename = NULL;
+  g_autoptr(GUnixFDList) fd_list = NULL;
+  int fd_in;
+  gboolean ret = FALSE;
+  const char *permissions[5];
+  int version;
+  gboolean handled_permissions = FALSE;
+  DocumentAddFullFlags full_flags;
+
+  fd_list = g_unix_fd_list_new ();
+  if (!open_document (uri, flags, fd_list, &path, &fd_in, error))
     return NULL;
 
-  i = 0;
-  permissions[i++] = "read";
-  if ((flags & XDP_DOCUMENT_FLAG_WRITABLE) || (flags & XDP_DOCUMENT_FLAG_FOR_SAVE))
-    permissions[i++] = "write";
-  permissions[i++] = "grant-permissions";
-  if (flags & XDP_DOCUMENT_FLAG_DELETABLE)
-    permissions[i++] = "delete";
-  permissions[i++] = NULL;
+  basename = g_path_get_basename (path);
+
+  get_document_permissions (flags, permissions);
 
   version = xdp_dbus_documents_get_version (documents);
-  full_flags = DOCUMENT_ADD_FLAGS_REUSE_EXISTING | DOCUMENT_ADD_FLAGS_PERSISTENT | DOCUMENT_ADD_FLAGS_AS_NEEDED_BY_APP;
-  if (flags & XDP_DOCUMENT_FLAG_DIRECTORY)
-    full_flags |= DOCUMENT_ADD_FLAGS_DIRECTORY;
+  full_flags = get_add_full_flags (flags);
 
   if (flags & XDP_DOCUMENT_FLAG_FOR_SAVE)
     {
@@ -195,31 +344,591 @@ xdp_register_document (const char        *uri,
         return NULL;
     }
 
-  if (g_strcmp0 (doc_id, "") == 0)
+  return get_document_uri (path, doc_id, error);
+}
+
+/* Calls in flight */
+
+typedef void (* DocumentsCallFunc) (gpointer user_data);
+
+typedef struct
+{
+  DocumentsCallFunc func;
+  gpointer user_data;
+} DocumentsCall;
+
+G_LOCK_DEFINE_STATIC (documents_calls);
+static unsigned int documents_calls_in_flight = 0;
+static GQueue documents_calls_pending = G_QUEUE_INIT;
+
+static gboolean
+documents_call_run (gpointer user_data)
+{
+  DocumentsCall *call = user_data;
+
+  call->func (call->user_data);
+  g_free (call);
+
+  return G_SOURCE_REMOVE;
+}
+
+/* Runs func on the main context as soon as fewer than
+ * DOCUMENTS_MAX_CALLS_IN_FLIGHT calls are in flight. Every call must be
+ * followed by documents_call_done() once the document portal replied.
+ *
+ * The calls may be queued and finished from any thread, but their replies
+ * are handled on the main context, so that's where they are started too. */
+static void
+documents_call_queue (DocumentsCallFunc func,
+                      gpointer          user_data)
+{
+  DocumentsCall *call;
+  gboolean run;
+
+  call = g_new0 (DocumentsCall, 1);
+  call->func = func;
+  call->user_data = user_data;
+
+  G_LOCK (documents_calls);
+  run = documents_calls_in_flight < DOCUMENTS_MAX_CALLS_IN_FLIGHT;
+  if (run)
+    documents_calls_in_flight++;
+  else
+    g_queue_push_tail (&documents_calls_pending, call);
+  G_UNLOCK (documents_calls);
+
+  if (run)
+    g_main_context_invoke (NULL, documents_call_run, call);
+}
+
+static void
+documents_call_done (void)
+{
+  DocumentsCall *call;
+
+  G_LOCK (documents_calls);
+  call = g_queue_pop_head (&documents_calls_pending);
+  if (call == NULL)
+    documents_calls_in_flight--;
+  G_UNLOCK (documents_calls);
+
+  /* Not called inline, this may be a worker thread */
+  if (call)
+    g_main_context_invoke (NULL, documents_call_run, call);
+}
+
+/* Registering a single document */
+
+typedef struct
+{
+  char *uri;
+  char *app_id;
+  XdpDocumentFlags flags;
+  char *path;
+} RegisterDocumentData;
+
+static void
+register_document_data_free (gpointer user_data)
+{
+  RegisterDocumentData *data = user_data;
+
+  g_free (data->uri);
+  g_free (data->app_id);
+  g_free (data->path);
+  g_free (data);
+}
+
+static void
+register_document_in_thread_func (GTask        *task,
+                                  gpointer      source_object,
+                                  gpointer      task_data,
+                                  GCancellable *cancellable)
+{
+  RegisterDocumentData *data = task_data;
+  g_autoptr(GError) error = NULL;
+  char *ruri;
+
+  ruri = register_document_sync (data->uri, data->app_id, data->flags, &error);
+
+  documents_call_done ();
+
+  if (ruri == NULL)
+    g_task_return_error (task, g_steal_pointer (&error));
+  else
+    g_task_return_pointer (task, ruri, g_free);
+}
+
+static void
+register_document_added (GTask       *task,
+                         const char  *doc_id,
+                         GError      *error)
+{
+  RegisterDocumentData *data = g_task_get_task_data (task);
+  g_autoptr(GError) local_error = NULL;
+  char *ruri;
+
+  documents_call_done ();
+
+  if (error)
     {
-      doc_path = g_build_filename (path, NULL);
-      return g_filename_to_uri (doc_path, NULL, error);
+      g_dbus_error_strip_remote_error (error);
+      g_task_return_error (task, g_error_copy (error));
+      return;
     }
 
-  doc_path = g_build_filename (documents_mountpoint, doc_id, basename, NULL);
-  return g_filename_to_uri (doc_path, NULL, error);
+  ruri = get_document_uri (data->path, doc_id, &local_error);
+  if (ruri == NULL)
+    g_task_return_error (task, g_steal_pointer (&local_error));
+  else
+    g_task_return_pointer (task, ruri, g_free);
+}
+
+static void
+add_named_full_done (GObject      *source,
+                     GAsyncResult *result,
+                     gpointer      user_data)
+{
+  g_autoptr(GTask) task = user_data;
+  g_autofree char *doc_id = NULL;
+  g_autoptr(GError) error = NULL;
+
+  xdp_dbus_documents_call_add_named_full_finish (XDP_DBUS_DOCUMENTS (source),
+                                                 &doc_id,
+                                                 NULL,
+                                                 NULL,
+                                                 result,
+                                                 &error);
+  register_document_added (task, doc_id, error);
+}
+
+static void
+add_full_done (GObject      *source,
+               GAsyncResult *result,
+               gpointer      user_data)
+{
+  g_autoptr(GTask) task = user_data;
+  g_auto(GStrv) doc_ids = NULL;
+  g_autoptr(GError) error = NULL;
+
+  if (xdp_dbus_documents_call_add_full_finish (XDP_DBUS_DOCUMENTS (source),
+                                               &doc_ids,
+                                               NULL,
+                                               NULL,
+                                               result,
+                                               &error) &&
+      (doc_ids == NULL || doc_ids[0] == NULL))
+    {
+      g_set_error_literal (&error, G_IO_ERROR, G_IO_ERROR_FAILED,
+                           "No document ID returned");
+    }
+
+  register_document_added (task, doc_ids ? doc_ids[0] : NULL, error);
+}
+
+static void
+register_document_start (gpointer user_data)
+{
+  g_autoptr(GTask) task = user_data;
+  RegisterDocumentData *data = g_task_get_task_data (task);
+  g_autoptr(GUnixFDList) fd_list = NULL;
+  g_autoptr(GError) error = NULL;
+  g_autofree char *basename = NULL;
+  const char *permissions[5];
+  int version;
+  int fd_in;
+
+  version = xdp_dbus_documents_get_version (documents);
+
+  /* Document portals without the *Full methods need more than one call */
+  if (version < 2 || ((data->flags & XDP_DOCUMENT_FLAG_FOR_SAVE) && version < 3))
+    {
+      g_task_run_in_thread (task, register_document_in_thread_func);
+      return;
+    }
+
+  fd_list = g_unix_fd_list_new ();
+  if (!open_document (data->uri, data->flags, fd_list, &data->path, &fd_in, &error))
+    {
+      documents_call_done ();
+      g_task_return_error (task, g_steal_pointer (&error));
+      return;
+    }
+
+  get_document_permissions (data->flags, permissions);
+
+  if (data->flags & XDP_DOCUMENT_FLAG_FOR_SAVE)
+    {
+      basename = g_path_get_basename (data->path);
+      xdp_dbus_documents_call_add_named_full (documents,
+                                              g_variant_new_handle (fd_in),
+                                              basename,
+                                              get_add_full_flags (data->flags),
+                                              data->app_id,
+                                              permissions,
+                                              fd_list,
+                                              g_task_get_cancellable (task),
+                                              add_named_full_done,
+                                              g_object_ref (task));
+    }
+  else
+    {
+      xdp_dbus_documents_call_add_full (documents,
+                                        g_variant_new_fixed_array (G_VARIANT_TYPE_HANDLE, &fd_in, 1, sizeof (gint32)),
+                                        get_add_full_flags (data->flags),
+                                        data->app_id,
+                                        permissions,
+                                        fd_list,
+                                        g_task_get_cancellable (task),
+                                        add_full_done,
+                                        g_object_ref (task));
+    }
+}
+
+void
+xdp_register_document_async (const char          *uri,
+                             const char          *app_id,
+                             XdpDocumentFlags     flags,
+                             GCancellable        *cancellable,
+                             GAsyncReadyCallback  callback,
+                             gpointer             user_data)
+{
+  g_autoptr(GTask) task = NULL;
+  RegisterDocumentData *data;
+
+  g_return_if_fail (app_id != NULL && *app_id != '\0');
+
+  data = g_new0 (RegisterDocumentData, 1);
+  data->uri = g_strdup (uri);
+  data->app_id = g_strdup (app_id);
+  data->flags = flags;
+
+  task = g_task_new (NULL, cancellable, callback, user_data);
+  g_task_set_source_tag (task, xdp_register_document_async);
+  g_task_set_task_data (task, data, register_document_data_free);
+
+  documents_call_queue (register_document_start, g_steal_pointer (&task));
+}
+
+char *
+xdp_register_document_finish (GAsyncResult  *result,
+                              GError       **error)
+{
+  g_return_val_if_fail (g_task_is_valid (result, NULL), NULL);
+  g_return_val_if_fail (g_async_result_is_tagged (result, xdp_register_document_async), NULL);
+
+  return g_task_propagate_pointer (G_TASK (result), error);
+}
+
+/* Registering documents in batches */
+
+typedef struct
+{
+  GStrv uris;
+  char *app_id;
+  XdpDocumentFlags flags;
+  GPtrArray *ruris; /* same length as uris, NULL for failed files */
+  unsigned int n_pending;
+} RegisterDocumentsData;
+
+static void
+register_documents_data_free (gpointer user_data)
+{
+  RegisterDocumentsData *data = user_data;
+
+  g_strfreev (data->uris);
+  g_free (data->app_id);
+  g_ptr_array_unref (data->ruris);
+  g_free (data);
+}
+
+typedef struct
+{
+  GTask *task;
+  size_t index;
+} RegisterOneData;
+
+typedef struct
+{
+  GTask *task;
+  size_t first;
+  size_t n_uris;
+  GArray *indices; /* indices of the files that could be opened */
+  GPtrArray *paths;
+} RegisterBatchData;
+
+static void
+register_batch_data_free (RegisterBatchData *batch)
+{
+  g_clear_object (&batch->task);
+  g_clear_pointer (&batch->indices, g_array_unref);
+  g_clear_pointer (&batch->paths, g_ptr_array_unref);
+  g_free (batch);
+}
+
+static void
+register_documents_maybe_return (GTask *task)
+{
+  RegisterDocumentsData *data = g_task_get_task_data (task);
+
+  if (data->n_pending > 0)
+    return;
+
+  g_task_return_pointer (task,
+                         g_ptr_array_ref (data->ruris),
+                         (GDestroyNotify) g_ptr_array_unref);
+}
+
+static void
+register_one_done (GObject      *source,
+                   GAsyncResult *result,
+                   gpointer      user_data)
+{
+  RegisterOneData *one = user_data;
+  g_autoptr(GTask) task = one->task;
+  RegisterDocumentsData *data = g_task_get_task_data (task);
+  g_autoptr(GError) error = NULL;
+  char *ruri;
+
+  ruri = xdp_register_document_finish (result, &error);
+  if (ruri == NULL)
+    g_warning ("Failed to register %s: %s", data->uris[one->index], error->message);
+
+  g_ptr_array_index (data->ruris, one->index) = ruri;
+  g_free (one);
+
+  data->n_pending--;
+  register_documents_maybe_return (task);
+}
+
+static void
+register_one (GTask  *task,
+              size_t  index)
+{
+  RegisterDocumentsData *data = g_task_get_task_data (task);
+  RegisterOneData *one;
+
+  one = g_new0 (RegisterOneData, 1);
+  one->task = g_object_ref (task);
+  one->index = index;
+
+  data->n_pending++;
+  xdp_register_document_async (data->uris[index],
+                               data->app_id,
+                               data->flags,
+                               g_task_get_cancellable (task),
+                               register_one_done,
+                               one);
+}
+
+G_DEFINE_AUTOPTR_CLEANUP_FUNC (RegisterBatchData, register_batch_data_free)
+
+static void
+add_full_batch_done (GObject      *source,
+                     GAsyncResult *result,
+                     gpointer      user_data)
+{
+  g_autoptr(RegisterBatchData) batch = user_data;
+  GTask *task = batch->task;
+  RegisterDocumentsData *data = g_task_get_task_data (task);
+  g_auto(GStrv) doc_ids = NULL;
+  g_autoptr(GError) error = NULL;
+
+  documents_call_done ();
+
+  if (!xdp_dbus_documents_call_add_full_finish (XDP_DBUS_DOCUMENTS (source),
+                                                &doc_ids,
+                                                NULL,
+                                                NULL,
+                                                result,
+                                                &error))
+    {
+      /* A single bad file fails the whole call, find out which one */
+      g_dbus_error_strip_remote_error (error);
+      g_debug ("Failed to register %u documents at once, retrying one by one: %s",
+               batch->indices->len, error->message);
+
+      for (guint j = 0; j < batch->indices->len; j++)
+        register_one (task, g_array_index (batch->indices, size_t, j));
+    }
+  else
+    {
+      for (guint j = 0; j < batch->indices->len && doc_ids[j] != NULL; j++)
+        {
+          size_t i = g_array_index (batch->indices, size_t, j);
+          g_autoptr(GError) local_error = NULL;
+          char *ruri;
+
+          ruri = get_document_uri (g_ptr_array_index (batch->paths, j), doc_ids[j], &local_error);
+          if (ruri == NULL)
+            g_warning ("Failed to register %s: %s", data->uris[i], local_error->message);
+
+          g_ptr_array_index (data->ruris, i) = ruri;
+        }
+    }
+
+  data->n_pending--;
+  register_documents_maybe_return (task);
+}
+
+static void
+register_batch_start (gpointer user_data)
+{
+  g_autoptr(RegisterBatchData) batch = user_data;
+  RegisterDocumentsData *data = g_task_get_task_data (batch->task);
+  g_autoptr(GUnixFDList) fd_list = g_unix_fd_list_new ();
+  g_autoptr(GArray) handles = g_array_new (FALSE, FALSE, sizeof (gint32));
+  const char *permissions[5];
+
+  for (size_t i = batch->first; i < batch->first + batch->n_uris; i++)
+    {
+      g_autoptr(GError) error = NULL;
+      char *path = NULL;
+      int fd_in;
+
+      if (!open_document (data->uris[i], data->flags, fd_list, &path, &fd_in, &error))
+        {
+          g_warning ("Failed to register %s: %s", data->uris[i], error->message);
+          continue;
+        }
+
+      g_array_append_val (handles, fd_in);
+      g_array_append_val (batch->indices, i);
+      g_ptr_array_add (batch->paths, path);
+    }
+
+  if (handles->len == 0)
+    {
+      documents_call_done ();
+      data->n_pending--;
+      register_documents_maybe_return (batch->task);
+      return;
+    }
+
+  get_document_permissions (data->flags, permissions);
+
+  xdp_dbus_documents_call_add_full (documents,
+                                    g_variant_new_fixed_array (G_VARIANT_TYPE_HANDLE,
+                                                               handles->data,
+                                                               handles->len,
+                                                               sizeof (gint32)),
+                                    get_add_full_flags (data->flags),
+                                    data->app_id,
+                                    permissions,
+                                    fd_list,
+                                    g_task_get_cancellable (batch->task),
+                                    add_full_batch_done,
+                                    g_steal_pointer (&batch));
+}
+
+static gboolean
+register_documents_start (gpointer user_data)
+{
+  g_autoptr(GTask) task = user_data;
+  RegisterDocumentsData *data = g_task_get_task_data (task);
+  size_t n_uris = data->ruris->len;
+
+  /* Hold off returning until everything is queued */
+  data->n_pending++;
+
+  /* Saving needs the name of each file, which AddFull doesn't take */
+  if ((data->flags & XDP_DOCUMENT_FLAG_FOR_SAVE) ||
+      xdp_dbus_documents_get_version (documents) < 2)
+    {
+      for (size_t i = 0; i < n_uris; i++)
+        register_one (task, i);
+    }
+  else
+    {
+      for (size_t i = 0; i < n_uris; i += DOCUMENTS_MAX_FDS_PER_CALL)
+        {
+          RegisterBatchData *batch;
+
+          batch = g_new0 (RegisterBatchData, 1);
+          batch->task = g_object_ref (task);
+          batch->first = i;
+          batch->n_uris = MIN (n_uris - i, DOCUMENTS_MAX_FDS_PER_CALL);
+          batch->indices = g_array_new (FALSE, FALSE, sizeof (size_t));
+          batch->paths = g_ptr_array_new_with_free_func (g_free);
+
+          data->n_pending++;
+          documents_call_queue (register_batch_start, batch);
+        }
+    }
+
+  data->n_pending--;
+  register_documents_maybe_return (task);
+
+  return G_SOURCE_REMOVE;
+}
+
+/*
+ * xdp_register_documents_async:
+ *
+ * Registers all @uris with the document portal, with as few calls as
+ * possible. The result is an array of the same length as @uris, with the
+ * document URI of each file, or %NULL for files that failed to register.
+ */
+void
+xdp_register_documents_async (const char * const  *uris,
+                              const char           *app_id,
+                              XdpDocumentFlags      flags,
+                              GCancellable         *cancellable,
+                              GAsyncReadyCallback   callback,
+                              gpointer              user_data)
+{
+  g_autoptr(GTask) task = NULL;
+  RegisterDocumentsData *data;
+  size_t n_uris;
+
+  g_return_if_fail (app_id != NULL && *app_id != '\0');
+
+  n_uris = g_strv_length ((char **) uris);
+
+  data = g_new0 (RegisterDocumentsData, 1);
+  data->uris = g_strdupv ((char **) uris);
+  data->app_id = g_strdup (app_id);
+  data->flags = flags;
+  data->ruris = g_ptr_array_new_with_free_func (g_free);
+  g_ptr_array_set_size (data->ruris, n_uris);
+
+  task = g_task_new (NULL, cancellable, callback, user_data);
+  g_task_set_source_tag (task, xdp_register_documents_async);
+  g_task_set_task_data (task, data, register_documents_data_free);
+
+  /* The batch state is only touched on the main context */
+  g_main_context_invoke (NULL, register_documents_start, g_steal_pointer (&task));
+}
+
+GPtrArray *
+xdp_register_documents_finish (GAsyncResult  *result,
+                               GError       **error)
+{
+  g_return_val_if_fail (g_task_is_valid (result, NULL), NULL);
+  g_return_val_if_fail (g_async_result_is_tagged (result, xdp_register_documents_async), NULL);
+
+  return g_task_propagate_pointer (G_TASK (result), error);
 }
 
 char *
 xdp_get_real_path_for_doc_id (const char *doc_id)
 {
-  gboolean ret = FALSE;
-  char *real_path = NULL;
+  g_autofree char *real_path = NULL;
   g_autoptr (GError) error = NULL;
+  guint64 generation;
 
-  ret = xdp_dbus_documents_call_info_sync (documents, doc_id, &real_path, NULL, NULL, &error);
-  if (!ret)
+  real_path = host_path_cache_lookup (doc_id, &generation);
+  if (real_path)
+    return g_steal_pointer (&real_path);
+
+  if (!xdp_dbus_documents_call_info_sync (documents, doc_id, &real_path, NULL, NULL, &error))
     {
       g_debug ("document portal error for doc id '%s': %s", doc_id, error->message);
       return NULL;
     }
 
-  return real_path;
+  host_path_cache_store (doc_id, real_path, generation);
+
+  return g_steal_pointer (&real_path);
 }
 
 /* Get the document id from the path, if there's any.
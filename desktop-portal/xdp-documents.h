@@ -19,10 +19,25 @@ typedef enum {
 gboolean xdp_init_document_proxy (GDBusConnection  *connection,
                                   GError          **error);
 
-char *xdp_register_document (const char        *uri,
-                             const char        *app_id,
-                             XdpDocumentFlags   flags,
-                             GError           **error);
+void xdp_register_document_async (const char          *uri,
+                                  const char          *app_id,
+                                  XdpDocumentFlags     flags,
+                                  GCancellable        *cancellable,
+                                  GAsyncReadyCallback  callback,
+                                  gpointer             user_data);
+
+char *xdp_register_document_finish (GAsyncResult  *result,
+                                    GError       **error);
+
+void xdp_register_documents_async (const char * const  *uris,
+                                   const char           *app_id,
+                                   XdpDocumentFlags      flags,
+                                   GCancellable         *cancellable,
+                                   GAsyncReadyCallback   callback,
+                                   gpointer              user_data);
+
+GPtrArray *xdp_register_documents_finish (GAsyncResult  *result,
+                                          GError       **error);
 
 char *xdp_get_real_path_for_doc_id (const char *doc_id);
 
@@ -6,28 +6,49 @@
 
 #include "xdp-method-info.h"
 
+#include <stdlib.h>
+#include <string.h>
+
 #include <glib.h>
 
+static int
+compare_interface (const void *key,
+                   const void *element)
+{
+  const XdpMethodInfoInterface *intf = element;
+
+  return strcmp (key, intf->interface);
+}
+
+static int
+compare_method (const void *key,
+                const void *element)
+{
+  const XdpMethodInfo *mi = element;
+
+  return strcmp (key, mi->method);
+}
+
 const XdpMethodInfo *
 xdp_method_info_find (const char *interface,
                       const char *method)
 {
-  const XdpMethodInfo *mi = NULL;
-  gboolean interface_found = FALSE;
-
-  mi = xdp_method_info_get_all ();
-  while (mi->interface != NULL)
-    {
-      if (g_strcmp0 (interface, mi->interface) == 0)
-        {
-          interface_found = TRUE;
-          if (g_strcmp0 (method, mi->method) == 0)
-            return mi;
-        }
-      else if (interface_found)
-        break;
-      mi++;
-    }
-
-  return NULL;
+  const XdpMethodInfoInterface *intf;
+
+  if (interface == NULL || method == NULL)
+    return NULL;
+
+  intf = bsearch (interface,
+                  xdp_method_info_get_interfaces (),
+                  xdp_method_info_get_interface_count (),
+                  sizeof (XdpMethodInfoInterface),
+                  compare_interface);
+  if (intf == NULL)
+    return NULL;
+
+  return bsearch (method,
+                  xdp_method_info_get_all () + intf->first_method,
+                  intf->n_methods,
+                  sizeof (XdpMethodInfo),
+                  compare_method);
 }
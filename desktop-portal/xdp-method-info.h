@@ -11,8 +11,17 @@ typedef struct {
   const char *method;
   gboolean uses_request;
   int option_arg;
+  unsigned int interface_id; /* index in xdp_method_info_get_interfaces () */
 } XdpMethodInfo;
 
+/* The methods of an interface are consecutive in the method info table,
+ * which is sorted by interface and method name */
+typedef struct {
+  const char *interface;
+  unsigned int first_method;
+  unsigned int n_methods;
+} XdpMethodInfoInterface;
+
 const XdpMethodInfo *
 xdp_method_info_find (const char *interface,
                       const char *method);
@@ -26,3 +35,13 @@ xdp_method_info_get_all (void);
  * gobject-linter-ignore-next-line: missing_implementation */
 unsigned int
 xdp_method_info_get_count (void);
+
+/* Implementation generated by generate-method-info.py
+ * gobject-linter-ignore-next-line: missing_implementation */
+const XdpMethodInfoInterface *
+xdp_method_info_get_interfaces (void);
+
+/* Implementation generated by generate-method-info.py
+ * gobject-linter-ignore-next-line: missing_implementation */
+unsigned int
+xdp_method_info_get_interface_count (void);
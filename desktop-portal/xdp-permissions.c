@@ -8,33 +8,163 @@
 
 #include <string.h>
 
+#include "xdp-utils.h"
+
 #define PERMISSION_STORE_DBUS_NAME "org.freedesktop.impl.portal.PermissionStore"
 #define PERMISSION_STORE_DBUS_PATH "/org/freedesktop/impl/portal/PermissionStore"
 
 static XdpDbusImplPermissionStore *permission_store = NULL;
 
+/* The app permissions of the resources looked up so far, kept up to date
+ * from the Changed signal of the permission store. Resources that are not
+ * in the permission store are cached as an empty a{sas}.
+ *
+ * The generation is bumped on every change, so that the result of a lookup
+ * racing with a change is not cached.
+ */
+G_LOCK_DEFINE_STATIC (permission_cache);
+static GHashTable *permission_cache = NULL; /* table -> (id -> a{sas}) */
+static guint64 permission_cache_generation = 0;
+
+static GVariant *
+permission_cache_lookup (const char *table,
+                         const char *id,
+                         guint64    *generation)
+{
+  GHashTable *ids;
+  GVariant *perms = NULL;
+
+  G_LOCK (permission_cache);
+
+  *generation = permission_cache_generation;
+
+  ids = g_hash_table_lookup (permission_cache, table);
+  if (ids)
+    perms = g_hash_table_lookup (ids, id);
+  if (perms)
+    g_variant_ref (perms);
+
+  G_UNLOCK (permission_cache);
+
+  return perms;
+}
+
+static void
+permission_cache_store (const char *table,
+                        const char *id,
+                        GVariant   *perms,
+                        guint64     generation)
+{
+  GHashTable *ids;
+
+  G_LOCK (permission_cache);
+
+  if (generation == permission_cache_generation)
+    {
+      ids = g_hash_table_lookup (permission_cache, table);
+      if (!ids)
+        {
+          ids = g_hash_table_new_full (g_str_hash, g_str_equal,
+                                       g_free, (GDestroyNotify) g_variant_unref);
+          g_hash_table_insert (permission_cache, g_strdup (table), ids);
+        }
+
+      g_hash_table_insert (ids, g_strdup (id), g_variant_ref_sink (perms));
+    }
+
+  G_UNLOCK (permission_cache);
+}
+
+static void
+permission_cache_invalidate (const char *table,
+                             const char *id)
+{
+  GHashTable *ids;
+
+  G_LOCK (permission_cache);
+
+  permission_cache_generation++;
+
+  ids = g_hash_table_lookup (permission_cache, table);
+  if (ids)
+    g_hash_table_remove (ids, id);
+
+  G_UNLOCK (permission_cache);
+}
+
+static void
+on_permission_store_changed (XdpDbusImplPermissionStore *store,
+                             const char                 *table,
+                             const char                 *id,
+                             gboolean                    deleted,
+                             GVariant                   *data,
+                             GVariant                   *permissions,
+                             gpointer                    user_data)
+{
+  GHashTable *ids;
+
+  G_LOCK (permission_cache);
+
+  permission_cache_generation++;
+
+  /* Only update resources that are already cached, the signal is emitted
+   * for every resource of every table */
+  ids = g_hash_table_lookup (permission_cache, table);
+  if (ids && g_hash_table_contains (ids, id))
+    g_hash_table_insert (ids, g_strdup (id), g_variant_ref (permissions));
+
+  G_UNLOCK (permission_cache);
+}
+
+static void
+on_permission_store_owner_changed (GObject    *object,
+                                   GParamSpec *pspec,
+                                   gpointer    user_data)
+{
+  G_LOCK (permission_cache);
+
+  permission_cache_generation++;
+  g_hash_table_remove_all (permission_cache);
+
+  G_UNLOCK (permission_cache);
+}
+
 char **
 xdp_get_permissions_sync (XdpAppInfo *app_info,
                           const char *table,
                           const char *id)
 {
-  g_autoptr(GError) error = NULL;
   g_autoptr(GVariant) out_perms = NULL;
-  g_autoptr(GVariant) out_data = NULL;
   g_autofree char **permissions = NULL;
   const char *app_id;
+  guint64 generation;
 
-  if (!xdp_dbus_impl_permission_store_call_lookup_sync (permission_store,
-                                                        table,
-                                                        id,
-                                                        &out_perms,
-                                                        &out_data,
-                                                        NULL,
-                                                        &error))
+  out_perms = permission_cache_lookup (table, id, &generation);
+  if (!out_perms)
     {
-      g_dbus_error_strip_remote_error (error);
-      g_debug ("No '%s' permissions found: %s", table, error->message);
-      return NULL;
+      g_autoptr(GError) error = NULL;
+      g_autoptr(GVariant) out_data = NULL;
+
+      if (!xdp_dbus_impl_permission_store_call_lookup_sync (permission_store,
+                                                            table,
+                                                            id,
+                                                            &out_perms,
+                                                            &out_data,
+                                                            NULL,
+                                                            &error))
+        {
+          g_dbus_error_strip_remote_error (error);
+          g_debug ("No '%s' permissions found: %s", table, error->message);
+
+          if (g_error_matches (error, XDG_DESKTOP_PORTAL_ERROR, XDG_DESKTOP_PORTAL_ERROR_NOT_FOUND))
+            permission_cache_store (table, id,
+                                    g_variant_new_array (G_VARIANT_TYPE ("{sas}"), NULL, 0),
+                                    generation);
+
+          return NULL;
+        }
+
+      permission_cache_store (table, id, out_perms, generation);
     }
 
   app_id = xdp_app_info_get_id (app_info);
@@ -125,6 +255,9 @@ xdp_set_permissions_sync (XdpAppInfo         *app_info,
                  xdp_app_info_get_id (app_info),
                  error->message);
     }
+
+  /* Don't wait for the Changed signal, the next lookup must see the change */
+  permission_cache_invalidate (table, id);
 }
 
 XdpPermission
@@ -163,7 +296,18 @@ xdp_init_permission_store (GDBusConnection  *connection,
                                                    PERMISSION_STORE_DBUS_NAME,
                                                    PERMISSION_STORE_DBUS_PATH,
                                                    NULL, error);
-  return (permission_store != NULL);
+  if (permission_store == NULL)
+    return FALSE;
+
+  permission_cache = g_hash_table_new_full (g_str_hash, g_str_equal,
+                                            g_free, (GDestroyNotify) g_hash_table_unref);
+
+  g_signal_connect (permission_store, "changed",
+                    G_CALLBACK (on_permission_store_changed), NULL);
+  g_signal_connect (permission_store, "notify::g-name-owner",
+                    G_CALLBACK (on_permission_store_owner_changed), NULL);
+
+  return TRUE;
 }
 
 XdpDbusImplPermissionStore *
@@ -222,6 +222,21 @@ register_portal (GHashTable  *portals,
         g_debug ("portal implementation supports %s", impl_config->interfaces[i]);
     }
 
+  impl_config->settings_cache = TRUE;
+  if (g_key_file_has_key (keyfile, "portal", "SettingsCache", NULL))
+    {
+      g_autoptr(GError) local_error = NULL;
+
+      impl_config->settings_cache = g_key_file_get_boolean (keyfile,
+                                                            "portal", "SettingsCache",
+                                                            &local_error);
+      if (local_error)
+        {
+          g_propagate_error (error, g_steal_pointer (&local_error));
+          return FALSE;
+        }
+    }
+
   impl_config->use_in = g_key_file_get_string_list (keyfile,
                                                     "portal", "UseIn",
                                                     NULL, error);
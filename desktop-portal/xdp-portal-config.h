@@ -13,6 +13,7 @@ typedef struct {
   char *dbus_name;
   char **interfaces;
   char **use_in;
+  gboolean settings_cache;
 } XdpImplConfig;
 
 #define XDP_TYPE_PORTAL_CONFIG (xdp_portal_config_get_type())
@@ -13,6 +13,7 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/inotify.h>
 #include <sys/resource.h>
 #include <sys/time.h>
 #include <sys/types.h>
@@ -109,6 +110,14 @@
  * To work around this we regularly emit entry invalidation calls
  * to the kernel, which will make it forget the inodes that are
  * only pinned by the dcache.
+ *
+ * Optionally (see xdp_fuse_set_cache_timeout()) we do let the kernel
+ * cache attributes and entries of real files. For this we put an
+ * inotify watch on the backing inodes we hand out with a non-zero
+ * timeout, and invalidate the kernel caches when a change is
+ * reported. Changes done through a file descriptor or path that
+ * was obtained outside of our view can then be seen late only by
+ * the time it takes to process the inotify event.
  */
 
 
@@ -185,12 +194,22 @@ G_LOCK_DEFINE (domain_inodes);
 typedef struct {
   gint ref_count; /* atomic */
   DevIno backing_devino;
-  int fd; /* O_PATH fd */
+
+  /* Below is protected by physical_inodes */
+  int fd; /* O_PATH fd, or -1 if closed to stay within the fd budget */
+  int fd_users; /* Number of pins, the fd is kept open while pinned */
+  struct file_handle *handle; /* To reopen the fd, NULL if not possible */
+  GList lru_link; /* In physical_lru while fd is open */
 } XdpPhysicalInode;
 
+/* A physical inode whose fd is kept open, see xdp_physical_inode_pin() */
+typedef XdpPhysicalInode XdpPhysicalInodePin;
+
 static XdpPhysicalInode *xdp_physical_inode_ref   (XdpPhysicalInode *inode);
 static void              xdp_physical_inode_unref (XdpPhysicalInode *inode);
+static void              xdp_physical_inode_unpin (XdpPhysicalInodePin *inode);
 G_DEFINE_AUTOPTR_CLEANUP_FUNC (XdpPhysicalInode, xdp_physical_inode_unref)
+G_DEFINE_AUTOPTR_CLEANUP_FUNC (XdpPhysicalInodePin, xdp_physical_inode_unpin)
 
 typedef struct {
   gint ref_count; /* atomic */
@@ -221,21 +240,31 @@ struct _XdpInode {
    * forgets it and then looks it up we will not get a new inode and
    * thus a new domain. */
   XdpInode *domain_root_inode;
+
+  /* inotify watch tracking changes to the inode, or -1. Protected by watches */
+  int wd;
 };
 
 typedef struct {
   int fd;
+  int backing_id; /* fuse passthrough id, or 0 */
   GList *link;
 } XdpFile;
 
 
+typedef struct {
+  mode_t mode;
+  char *name;
+} XdpDirEntry;
+
 typedef struct {
   DIR *dir;
   struct dirent *entry;
   off_t offset;
 
-  char *dirbuf;
-  gsize dirbuf_size;
+  /* Buffered dirs. Both readdir and readdirplus use indexes into
+   * entries as offsets, as the kernel can mix them on the same handle */
+  GArray *entries; /* XdpDirEntry */
 } XdpDir;
 
 XdpInode *root_inode;
@@ -248,9 +277,26 @@ typedef struct {
 
 typedef struct {
   gboolean use_splice;
+  gboolean use_passthrough;
+  gboolean clone_fd;
+  guint max_idle_threads;
+  guint max_background;
+  guint congestion_threshold;
+  guint max_write;
+  guint max_read;
 } XdpFuseOptions;
 
+/* Cleared if the kernel refuses to register backing files, e.g. because we
+ * lack CAP_SYS_ADMIN */
+static gint use_passthrough = FALSE; /* atomic */
+static gint passthrough_opens = 0; /* atomic */
+static gint copy_file_range_fallbacks = 0; /* atomic */
+
+/* Entries the kernel may cache are only invalidated once they expire,
+ * the others as soon as possible to free their O_PATH fds */
 static GList *invalidate_list;
+static GList *invalidate_cached_list;
+static guint64 invalidate_batches = 0;
 G_LOCK_DEFINE (invalidate_list);
 
 static XdpInode *xdp_inode_ref (XdpInode *inode);
@@ -269,31 +315,161 @@ static int ensure_docdir_inode (XdpInode *parent,
                                 XdpInode **inode_out);
 
 static void queue_invalidate_dentry (XdpInode *parent, const char *name);
+static void queue_invalidate_cached_dentry (XdpInode *parent, const char *name);
+
+/* Cache of the permissions apps have on documents, so that the
+ * per-operation access checks don't have to look into the db entry.
+ * Entries are dropped by xdp_fuse_invalidate_doc_permissions() */
+static GHashTable *doc_perms_cache; /* doc id -> (app id -> cached perms) */
+static guint64 doc_perms_cache_serial;
+G_LOCK_DEFINE (doc_perms_cache);
+
+/* Set in the cached value so that 0 permissions can be cached too */
+#define DOC_PERMS_CACHED (1 << 16)
+
+/* Docs visible to an app ("" for all docs), for listing directories.
+ * Protected by doc_perms_cache and invalidated together with it. */
+static GHashTable *doc_list_cache; /* app id -> GPtrArray of doc ids */
+
+static DocumentPermissionFlags
+get_doc_app_permissions (const char *doc_id,
+                         const char *app_id)
+{
+  g_autoptr(PermissionDbEntry) entry = NULL;
+  DocumentPermissionFlags perms = 0;
+  GHashTable *app_perms;
+  guint64 serial;
+  guint cached = 0;
+
+  G_LOCK (doc_perms_cache);
+  app_perms = g_hash_table_lookup (doc_perms_cache, doc_id);
+  if (app_perms)
+    cached = GPOINTER_TO_UINT (g_hash_table_lookup (app_perms, app_id));
+  serial = doc_perms_cache_serial;
+  G_UNLOCK (doc_perms_cache);
+
+  if (cached != 0)
+    return cached & ~DOC_PERMS_CACHED;
+
+  entry = xdp_lookup_doc (doc_id);
+  if (entry != NULL)
+    perms = document_entry_get_permissions_by_app_id (entry, app_id);
+
+  G_LOCK (doc_perms_cache);
+  /* Don't cache the result if there was an invalidation since we
+   * looked at the db, as it may be outdated */
+  if (serial == doc_perms_cache_serial)
+    {
+      app_perms = g_hash_table_lookup (doc_perms_cache, doc_id);
+      if (app_perms == NULL)
+        {
+          app_perms = g_hash_table_new_full (g_str_hash, g_str_equal, g_free, NULL);
+          g_hash_table_insert (doc_perms_cache, g_strdup (doc_id), app_perms);
+        }
+      g_hash_table_insert (app_perms, g_strdup (app_id),
+                           GUINT_TO_POINTER (perms | DOC_PERMS_CACHED));
+    }
+  G_UNLOCK (doc_perms_cache);
+
+  return perms;
+}
+
+/* Called when the permissions of an app on a document change, and with
+   null opt_app_id when the doc is created/removed */
+void
+xdp_fuse_invalidate_doc_permissions (const char *doc_id,
+                                     const char *opt_app_id)
+{
+  XDP_AUTOLOCK (doc_perms_cache);
+
+  if (doc_perms_cache == NULL)
+    return;
+
+  doc_perms_cache_serial++;
+
+  if (opt_app_id != NULL)
+    {
+      GHashTable *app_perms = g_hash_table_lookup (doc_perms_cache, doc_id);
+
+      if (app_perms)
+        g_hash_table_remove (app_perms, opt_app_id);
+
+      g_hash_table_remove (doc_list_cache, opt_app_id);
+    }
+  else
+    {
+      g_hash_table_remove (doc_perms_cache, doc_id);
+      g_hash_table_remove_all (doc_list_cache);
+    }
+}
 
 static gboolean
-app_can_write_doc (PermissionDbEntry *entry, const char *app_id)
+app_can_write_doc (const char *doc_id, const char *app_id)
 {
+  DocumentPermissionFlags perms;
+
   if (app_id == NULL)
     return TRUE;
 
-  if (document_entry_has_permissions_by_app_id (entry, app_id, DOCUMENT_PERMISSION_FLAGS_WRITE))
+  perms = get_doc_app_permissions (doc_id, app_id);
+  if ((perms & DOCUMENT_PERMISSION_FLAGS_WRITE) != 0)
     return TRUE;
 
   return FALSE;
 }
 
 static gboolean
-app_can_see_doc (PermissionDbEntry *entry, const char *app_id)
+app_can_see_doc (const char *doc_id, const char *app_id)
 {
+  DocumentPermissionFlags perms;
+
   if (app_id == NULL)
     return TRUE;
 
-  if (document_entry_has_permissions_by_app_id (entry, app_id, DOCUMENT_PERMISSION_FLAGS_READ))
+  perms = get_doc_app_permissions (doc_id, app_id);
+  if ((perms & DOCUMENT_PERMISSION_FLAGS_READ) != 0)
     return TRUE;
 
   return FALSE;
 }
 
+/* Returns the ids of the docs the app can see, or of all docs for a
+ * NULL app id */
+static GPtrArray *
+get_visible_docs (const char *for_app_id)
+{
+  g_autoptr(GPtrArray) visible = NULL;
+  g_auto(GStrv) docs = NULL;
+  const char *key = for_app_id ? for_app_id : "";
+  guint64 serial;
+
+  G_LOCK (doc_perms_cache);
+  visible = g_hash_table_lookup (doc_list_cache, key);
+  if (visible)
+    g_ptr_array_ref (visible);
+  serial = doc_perms_cache_serial;
+  G_UNLOCK (doc_perms_cache);
+
+  if (visible)
+    return g_steal_pointer (&visible);
+
+  visible = g_ptr_array_new_with_free_func (g_free);
+
+  docs = xdp_list_docs ();
+  for (size_t i = 0; docs[i] != NULL; i++)
+    {
+      if (app_can_see_doc (docs[i], for_app_id))
+        g_ptr_array_add (visible, g_strdup (docs[i]));
+    }
+
+  G_LOCK (doc_perms_cache);
+  if (serial == doc_perms_cache_serial)
+    g_hash_table_insert (doc_list_cache, g_strdup (key), g_ptr_array_ref (visible));
+  G_UNLOCK (doc_perms_cache);
+
+  return g_steal_pointer (&visible);
+}
+
 static char *
 fd_to_path (int fd)
 {
@@ -453,6 +629,75 @@ devino_equal (gconstpointer  _a,
 static GHashTable *physical_inodes;
 G_LOCK_DEFINE (physical_inodes);
 
+/* fd budget for physical inodes. When we can reopen files by their
+ * handle (which needs CAP_DAC_READ_SEARCH), the least recently used
+ * fds that are not pinned get closed once there are more than
+ * max_physical_fds of them. Protected by physical_inodes. */
+static GQueue physical_lru = G_QUEUE_INIT; /* Least recently used first */
+static guint max_physical_fds = 0; /* 0 means no limit */
+static gboolean can_reopen_by_handle = FALSE;
+static GHashTable *mount_fds; /* guint64 dev -> O_PATH fd on that filesystem */
+
+/* Statistics, protected by physical_inodes */
+static guint live_physical_fds = 0;
+static guint64 physical_fd_reopens = 0;
+static guint64 physical_fd_evictions = 0;
+
+static struct file_handle *
+get_file_handle (int o_path_fd)
+{
+  g_autofree struct file_handle *handle = NULL;
+  int mount_id;
+
+  handle = g_malloc0 (sizeof (struct file_handle) + MAX_HANDLE_SZ);
+  handle->handle_bytes = MAX_HANDLE_SZ;
+
+  if (name_to_handle_at (o_path_fd, "", handle, &mount_id, AT_EMPTY_PATH) != 0)
+    return NULL;
+
+  return g_steal_pointer (&handle);
+}
+
+/* Called with physical_inodes lock held */
+static void
+evict_physical_fds (void)
+{
+  GList *l, *next;
+
+  if (max_physical_fds == 0 || !can_reopen_by_handle)
+    return;
+
+  for (l = physical_lru.head;
+       l != NULL && live_physical_fds > max_physical_fds;
+       l = next)
+    {
+      XdpPhysicalInode *inode = l->data;
+
+      next = l->next;
+
+      if (inode->fd_users > 0 || inode->handle == NULL)
+        continue;
+
+      g_queue_unlink (&physical_lru, l);
+      g_clear_fd (&inode->fd, NULL);
+      live_physical_fds--;
+      physical_fd_evictions++;
+    }
+}
+
+/* Must be called with physical_inodes held. Returns -1 if there is no
+ * fd on that filesystem */
+static int
+mount_fd_lookup (dev_t dev)
+{
+  guint64 key = dev;
+  gpointer fd;
+
+  if (!g_hash_table_lookup_extended (mount_fds, &key, NULL, &fd))
+    return -1;
+
+  return GPOINTER_TO_INT (fd);
+}
 
 /* Takes ownership of the o_path fd if passed in */
 static XdpPhysicalInode *
@@ -467,7 +712,16 @@ ensure_physical_inode (dev_t dev, ino_t ino, int o_path_fd)
   if (inode != NULL)
     {
       inode = xdp_physical_inode_ref (inode);
-      close (o_path_fd);
+
+      /* Might as well use the fd we got if the old one was closed */
+      if (inode->fd == -1)
+        {
+          inode->fd = o_path_fd;
+          live_physical_fds++;
+          g_queue_push_tail_link (&physical_lru, &inode->lru_link);
+        }
+      else
+        close (o_path_fd);
     }
   else
     {
@@ -476,14 +730,103 @@ ensure_physical_inode (dev_t dev, ino_t ino, int o_path_fd)
       inode->ref_count = 1;
       inode->fd = o_path_fd;
       inode->backing_devino = devino;
+      inode->lru_link.data = inode;
       g_hash_table_insert (physical_inodes, &inode->backing_devino, inode);
+
+      /* Reopening needs some fd on the same filesystem, keep the first one around */
+      if (can_reopen_by_handle &&
+          mount_fd_lookup (dev) == -1)
+        {
+          int mount_fd = fcntl (o_path_fd, F_DUPFD_CLOEXEC, 3);
+
+          if (mount_fd != -1)
+            {
+              guint64 *key = g_new (guint64, 1);
+
+              *key = dev;
+              g_hash_table_insert (mount_fds, key, GINT_TO_POINTER (mount_fd));
+            }
+        }
+
+      if (can_reopen_by_handle &&
+          mount_fd_lookup (dev) != -1)
+        inode->handle = get_file_handle (o_path_fd);
+
+      live_physical_fds++;
+      g_queue_push_tail_link (&physical_lru, &inode->lru_link);
     }
 
+  evict_physical_fds ();
+
   G_UNLOCK (physical_inodes);
 
   return inode;
 }
 
+/* Keeps the O_PATH fd of the inode open until unpinned, reopening it
+ * if needed. Returns NULL with a negative errno in fd_out on failure */
+static XdpPhysicalInodePin *
+xdp_physical_inode_pin (XdpPhysicalInode *inode,
+                        int              *fd_out)
+{
+  XDP_AUTOLOCK (physical_inodes);
+
+  if (inode->fd == -1)
+    {
+      int mount_fd = mount_fd_lookup (inode->backing_devino.dev);
+
+      inode->fd = open_by_handle_at (mount_fd, inode->handle, O_PATH | O_CLOEXEC);
+      if (inode->fd == -1)
+        {
+          *fd_out = -errno;
+          return NULL;
+        }
+
+      live_physical_fds++;
+      physical_fd_reopens++;
+    }
+  else
+    g_queue_unlink (&physical_lru, &inode->lru_link);
+
+  g_queue_push_tail_link (&physical_lru, &inode->lru_link);
+  inode->fd_users++;
+
+  evict_physical_fds ();
+
+  *fd_out = inode->fd;
+  return inode;
+}
+
+static void
+xdp_physical_inode_unpin (XdpPhysicalInodePin *inode)
+{
+  XDP_AUTOLOCK (physical_inodes);
+
+  g_assert (inode->fd_users > 0);
+  inode->fd_users--;
+}
+
+/* Probes whether open_by_handle_at() is allowed for us */
+static gboolean
+check_can_reopen_by_handle (void)
+{
+  g_autofree struct file_handle *handle = NULL;
+  g_autofd int dir_fd = -1;
+  g_autofd int fd = -1;
+
+  dir_fd = open (g_get_user_runtime_dir (), O_PATH | O_DIRECTORY | O_CLOEXEC);
+  if (dir_fd == -1)
+    return FALSE;
+
+  handle = get_file_handle (dir_fd);
+  if (handle == NULL)
+    return FALSE;
+
+  fd = open_by_handle_at (dir_fd, handle, O_PATH | O_CLOEXEC);
+
+  return fd != -1;
+}
+
 static XdpPhysicalInode *
 xdp_physical_inode_ref (XdpPhysicalInode *inode)
 {
@@ -522,9 +865,16 @@ retry_atomic_decrement1:
         }
       g_hash_table_remove (physical_inodes, &inode->backing_devino);
 
+      if (inode->fd != -1)
+        {
+          g_queue_unlink (&physical_lru, &inode->lru_link);
+          live_physical_fds--;
+        }
+
       G_UNLOCK (physical_inodes);
 
-      close (inode->fd);
+      g_clear_fd (&inode->fd, NULL);
+      g_free (inode->handle);
       g_free (inode);
     }
 }
@@ -652,33 +1002,142 @@ xdp_domain_new_document (XdpDomain         *parent,
 static gboolean
 xdp_document_domain_can_see (XdpDomain *domain)
 {
-  if (domain->app_id != NULL)
-    {
-      g_autoptr(PermissionDbEntry) entry = xdp_lookup_doc (domain->doc_id);
+  return app_can_see_doc (domain->doc_id, domain->app_id);
+}
 
-      if (entry == NULL ||
-          !app_can_see_doc (entry, domain->app_id))
-        return FALSE;
-    }
+static gboolean
+xdp_document_domain_can_write (XdpDomain *domain)
+{
+  return app_can_write_doc (domain->doc_id, domain->app_id);
+}
 
-  return TRUE;
+/* Positive caching of document inodes, see xdp_fuse_set_cache_timeout() */
+static double cache_timeout = 0.0;
+static int inotify_fd = -1;
+static GHashTable *watches; /* wd -> XdpWatch */
+G_LOCK_DEFINE (watches);
+
+#define WATCH_EVENTS (IN_ATTRIB | IN_MODIFY | IN_CREATE | IN_DELETE | \
+                      IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF)
+
+typedef struct {
+  guint64 ino;
+  char *name; /* Only changes to this child are relevant, or NULL for all */
+} XdpWatchTarget;
+
+typedef struct {
+  int wd;
+  GArray *targets; /* XdpWatchTarget, the inodes the kernel may have cached */
+} XdpWatch;
+
+static void
+xdp_watch_target_clear (XdpWatchTarget *target)
+{
+  g_clear_pointer (&target->name, g_free);
+}
+
+static void
+xdp_watch_free (XdpWatch *watch)
+{
+  g_array_unref (watch->targets);
+  g_free (watch);
 }
 
+/* Returns TRUE if changes to the inode are tracked, so that the kernel
+ * may cache it. For physical inodes that is the inode itself and its
+ * children, for the document dir it is the entry of the document. */
 static gboolean
-xdp_document_domain_can_write (XdpDomain *domain)
+xdp_inode_ensure_watch (XdpInode *inode)
 {
-  if (domain->app_id != NULL)
+  XdpDomain *domain = inode->domain;
+  g_autoptr(XdpPhysicalInodePin) pin = NULL;
+  g_autofree char *path = NULL;
+  XdpWatchTarget target = { 0, };
+  XdpWatch *watch;
+  int wd;
+
+  if (inotify_fd == -1 || domain->type != XDP_DOMAIN_DOCUMENT)
+    return FALSE;
+
+  XDP_AUTOLOCK (watches);
+
+  if (inode->wd != -1)
+    return TRUE;
+
+  if (inode->physical)
     {
-      g_autoptr(PermissionDbEntry) entry = xdp_lookup_doc (domain->doc_id);
+      int fd;
 
-      if (entry == NULL ||
-          !app_can_write_doc (entry, domain->app_id))
+      pin = xdp_physical_inode_pin (inode->physical, &fd);
+      if (pin == NULL)
         return FALSE;
+
+      path = fd_to_path (fd);
+    }
+  else if (xdp_document_domain_is_dir (domain))
+    path = g_path_get_dirname (domain->doc_path);
+  else
+    path = g_strdup (domain->doc_path);
+
+  wd = inotify_add_watch (inotify_fd, path, WATCH_EVENTS);
+  if (wd == -1)
+    {
+      g_debug ("Can't watch %s: %s", path, g_strerror (errno));
+      return FALSE;
     }
 
+  watch = g_hash_table_lookup (watches, GINT_TO_POINTER (wd));
+  if (watch == NULL)
+    {
+      watch = g_new0 (XdpWatch, 1);
+      watch->wd = wd;
+      watch->targets = g_array_new (FALSE, FALSE, sizeof (XdpWatchTarget));
+      g_array_set_clear_func (watch->targets, (GDestroyNotify) xdp_watch_target_clear);
+      g_hash_table_insert (watches, GINT_TO_POINTER (wd), watch);
+    }
+
+  target.ino = inode->ino;
+  if (inode->physical == NULL)
+    target.name = g_strdup (domain->doc_file);
+  g_array_append_val (watch->targets, target);
+
+  inode->wd = wd;
+
   return TRUE;
 }
 
+static void
+xdp_inode_drop_watch (XdpInode *inode)
+{
+  XdpWatch *watch;
+
+  XDP_AUTOLOCK (watches);
+
+  if (inode->wd == -1)
+    return;
+
+  watch = g_hash_table_lookup (watches, GINT_TO_POINTER (inode->wd));
+  inode->wd = -1;
+
+  if (watch == NULL)
+    return;
+
+  for (guint i = 0; i < watch->targets->len; i++)
+    {
+      if (g_array_index (watch->targets, XdpWatchTarget, i).ino == inode->ino)
+        {
+          g_array_remove_index_fast (watch->targets, i);
+          break;
+        }
+    }
+
+  if (watch->targets->len == 0)
+    {
+      inotify_rm_watch (inotify_fd, watch->wd);
+      g_hash_table_remove (watches, GINT_TO_POINTER (watch->wd));
+    }
+}
+
 static char **
 xdp_domain_get_inode_keys_as_string (XdpDomain *domain)
 {
@@ -743,6 +1202,7 @@ _xdp_inode_new (void)
   XdpInode *inode = g_new0 (XdpInode, 1);
   inode->ref_count = 1;
   inode->kernel_ref_count = 0;
+  inode->wd = -1;
 
   return inode;
 }
@@ -902,6 +1362,7 @@ retry_atomic_decrement1:
 
       /* By now we have no refs outstanding and no way to get at the inode, so free it */
 
+      xdp_inode_drop_watch (inode);
       g_clear_pointer (&inode->domain_root_inode, xdp_inode_unref);
       g_clear_pointer (&inode->physical, xdp_physical_inode_unref);
       xdp_domain_unref (inode->domain);
@@ -1010,7 +1471,22 @@ xdp_document_inode_ensure_dirfd (XdpInode *inode,
   *close_fd_out = -1;
 
   if (inode->physical)
-    return inode->physical->fd;
+    {
+      g_autoptr(XdpPhysicalInodePin) pin = NULL;
+      int fd;
+
+      /* Return a copy, as the fd of the physical inode is only valid while pinned */
+      pin = xdp_physical_inode_pin (inode->physical, &fd);
+      if (pin == NULL)
+        return fd;
+
+      close_fd = fcntl (fd, F_DUPFD_CLOEXEC, 3);
+      if (close_fd == -1)
+        return -errno;
+
+      *close_fd_out = close_fd;
+      return close_fd;
+    }
   else
     {
       if (xdp_document_domain_is_dir (inode->domain))
@@ -1194,7 +1670,14 @@ xdp_document_inode_open_child_fd (XdpInode   *inode,
 
   if (inode->physical)
     {
-      fd = openat (inode->physical->fd, name, open_flags, mode);
+      g_autoptr(XdpPhysicalInodePin) pin = NULL;
+      int physical_fd;
+
+      pin = xdp_physical_inode_pin (inode->physical, &physical_fd);
+      if (pin == NULL)
+        return physical_fd;
+
+      fd = openat (physical_fd, name, open_flags, mode);
       if (fd == -1)
         return -errno;
 
@@ -1255,7 +1738,15 @@ xdp_document_inode_open_child_fd (XdpInode   *inode,
 
           if (tempfile)
             {
-              g_autofree char *fd_path = fd_to_path (tempfile->inode->physical->fd);
+              g_autoptr(XdpPhysicalInodePin) pin = NULL;
+              g_autofree char *fd_path = NULL;
+              int physical_fd;
+
+              pin = xdp_physical_inode_pin (tempfile->inode->physical, &physical_fd);
+              if (pin == NULL)
+                return physical_fd;
+
+              fd_path = fd_to_path (physical_fd);
               fd = open (fd_path, open_flags & ~(O_CREAT|O_EXCL|O_NOFOLLOW), mode);
               if (fd == -1)
                 return -errno;
@@ -1273,14 +1764,24 @@ xdp_document_inode_open_child_fd (XdpInode   *inode,
   return -ENOENT;
 }
 
-/* Returns /proc/self/fds/$fd path for O_PATH fd or toplevel path */
+/* Returns /proc/self/fds/$fd path for O_PATH fd or toplevel path.
+ * The fd path is only valid while the returned pin is held. */
 static char *
-xdp_document_inode_get_self_as_path (XdpInode *inode)
+xdp_document_inode_get_self_as_path (XdpInode             *inode,
+                                     XdpPhysicalInodePin **pin_out)
 {
   g_assert (inode->domain->type == XDP_DOMAIN_DOCUMENT);
 
   if (inode->physical)
-    return fd_to_path (inode->physical->fd);
+    {
+      int fd;
+
+      *pin_out = xdp_physical_inode_pin (inode->physical, &fd);
+      if (*pin_out == NULL)
+        return NULL;
+
+      return fd_to_path (fd);
+    }
   else
     {
       if (xdp_document_domain_is_dir (inode->domain))
@@ -1433,12 +1934,8 @@ stat_virtual_inode (XdpInode    *inode,
       buf->st_nlink = 2;
 
       /* Remove perms if not writable */
-      if (inode->domain->app_id != NULL)
-        {
-          g_autoptr(PermissionDbEntry) entry = xdp_lookup_doc (inode->domain->doc_id);
-          if (entry == NULL || !app_can_write_doc (entry, inode->domain->app_id))
-            buf->st_mode &= ~(0222);
-        }
+      if (!app_can_write_doc (inode->domain->doc_id, inode->domain->app_id))
+        buf->st_mode &= ~(0222);
       break;
     }
 }
@@ -1468,7 +1965,14 @@ xdp_fuse_getattr (fuse_req_t             req,
 
   if (inode->physical)
     {
-      res = fstatat (inode->physical->fd, "", &buf, AT_EMPTY_PATH | AT_SYMLINK_NOFOLLOW);
+      g_autoptr(XdpPhysicalInodePin) pin = NULL;
+      int fd;
+
+      pin = xdp_physical_inode_pin (inode->physical, &fd);
+      if (pin == NULL)
+        return xdp_reply_err (op, req, -fd);
+
+      res = fstatat (fd, "", &buf, AT_EMPTY_PATH | AT_SYMLINK_NOFOLLOW);
     }
   else
     {
@@ -1481,6 +1985,9 @@ xdp_fuse_getattr (fuse_req_t             req,
 
   tweak_statbuf_for_document_inode (inode, &buf);
 
+  if (inode->physical && !S_ISLNK (buf.st_mode) && xdp_inode_ensure_watch (inode))
+    attr_valid_time = cache_timeout;
+
   fuse_reply_attr (req, &buf, attr_valid_time);
 }
 
@@ -1492,9 +1999,11 @@ xdp_fuse_setattr (fuse_req_t             req,
                   struct fuse_file_info *fi)
 {
   g_autoptr(XdpInode) inode = xdp_inode_from_ino (ino);
+  g_autoptr(XdpPhysicalInodePin) pin = NULL;
   g_autofree char *to_set_string = setattr_flags_to_string (to_set);
   struct stat buf;
   double attr_valid_time = 0.0;/* Time in secs for attribute validation */
+  int physical_fd;
   int res;
   const char *op = "SETATTR";
 
@@ -1504,6 +2013,10 @@ xdp_fuse_setattr (fuse_req_t             req,
                                   CHECK_CAN_WRITE | CHECK_IS_PHYSICAL))
     return;
 
+  pin = xdp_physical_inode_pin (inode->physical, &physical_fd);
+  if (pin == NULL)
+    return xdp_reply_err (op, req, -physical_fd);
+
   /* Truncate */
   if (to_set & FUSE_SET_ATTR_SIZE)
     {
@@ -1518,7 +2031,7 @@ xdp_fuse_setattr (fuse_req_t             req,
         }
       else if (inode->physical)
         {
-          path = fd_to_path (inode->physical->fd);
+          path = fd_to_path (physical_fd);
           res = truncate (path, attr->st_size);
           if (res == -1)
             res = -errno;
@@ -1549,7 +2062,7 @@ xdp_fuse_setattr (fuse_req_t             req,
 
       if (inode->physical)
         {
-          path = fd_to_path (inode->physical->fd);
+          path = fd_to_path (physical_fd);
           res = utimensat (AT_FDCWD, path, times, 0);
         }
       else
@@ -1573,7 +2086,7 @@ xdp_fuse_setattr (fuse_req_t             req,
 
       if (inode->physical)
         {
-          path = fd_to_path (inode->physical->fd);
+          path = fd_to_path (physical_fd);
           res = chown (path, uid, gid);
           if (res == -1)
             res = -errno;
@@ -1593,7 +2106,7 @@ xdp_fuse_setattr (fuse_req_t             req,
 
       if (inode->physical)
         {
-          path = fd_to_path (inode->physical->fd);
+          path = fd_to_path (physical_fd);
           res = chmod (path, attr->st_mode);
           if (res == -1)
             res = -errno;
@@ -1608,7 +2121,7 @@ xdp_fuse_setattr (fuse_req_t             req,
     }
 
   if (inode->physical)
-    res = fstatat (inode->physical->fd, "", &buf, AT_EMPTY_PATH | AT_SYMLINK_NOFOLLOW);
+    res = fstatat (physical_fd, "", &buf, AT_EMPTY_PATH | AT_SYMLINK_NOFOLLOW);
   else
     res = stat (inode->domain->doc_path, &buf); /* Follow symlinks here */
 
@@ -1648,6 +2161,28 @@ prepare_reply_virtual_entry (XdpInode                *inode,
   e->entry_timeout = 60.0; /* dentry timeout */
 }
 
+/* Let the kernel cache the looked up entry and its attributes if
+ * we get told about changes to them */
+static void
+cache_reply_entry (XdpInode                *parent,
+                   const char              *name,
+                   XdpInode                *inode,
+                   struct fuse_entry_param *e)
+{
+  if (inotify_fd == -1)
+    return;
+
+  if (!S_ISLNK (e->attr.st_mode) && xdp_inode_ensure_watch (inode))
+    e->attr_timeout = cache_timeout;
+
+  /* In the document dir only the document itself is tracked, not tempfiles */
+  if (parent->physical == NULL && g_strcmp0 (name, parent->domain->doc_file) != 0)
+    return;
+
+  if (xdp_inode_ensure_watch (parent))
+    e->entry_timeout = cache_timeout;
+}
+
 static void
 abort_reply_entry (struct fuse_entry_param *e)
 {
@@ -1761,7 +2296,7 @@ ensure_doc_inode (XdpInode   *parent,
 
   if (doc_entry == NULL ||
       (parent_domain->app_id &&
-       !app_can_see_doc (doc_entry, parent_domain->app_id)))
+       !app_can_see_doc (doc_id, parent_domain->app_id)))
     return NULL;
 
   G_LOCK (domain_inodes);
@@ -1783,13 +2318,26 @@ ensure_doc_inode (XdpInode   *parent,
 static void
 invalidate_dentry_cb (gpointer user_data)
 {
+  GList **list = user_data;
   GList *to_invalidate = NULL;
   {
     XDP_AUTOLOCK (invalidate_list);
-    to_invalidate = g_steal_pointer (&invalidate_list);
+    to_invalidate = g_steal_pointer (list);
+    invalidate_batches++;
   }
   to_invalidate = g_list_reverse (to_invalidate);
 
+  {
+    XDP_AUTOLOCK (physical_inodes);
+    g_debug ("%u O_PATH fds open (budget %u), %" G_GUINT64_FORMAT " reopened, "
+             "%" G_GUINT64_FORMAT " closed, %" G_GUINT64_FORMAT " invalidation batches",
+             live_physical_fds, max_physical_fds, physical_fd_reopens,
+             physical_fd_evictions, invalidate_batches);
+  }
+  g_debug ("%d passthrough opens, %d copy_file_range fallbacks",
+           g_atomic_int_get (&passthrough_opens),
+           g_atomic_int_get (&copy_file_range_fallbacks));
+
   XDP_AUTOLOCK (session);
   for (GList *l = to_invalidate; l != NULL; l = l->next)
     {
@@ -1803,16 +2351,15 @@ invalidate_dentry_cb (gpointer user_data)
   g_list_free (to_invalidate);
 }
 
-/* Queue an inval_dentry, thereby freeing unused inodes in the dcache
- * which will free up a bunch of O_PATH fds in the fuse implementation.
- */
 static void
-queue_invalidate_dentry (XdpInode   *parent,
-                         const char *name)
+queue_invalidate_dentry_in (GList      **list,
+                            guint        delay_ms,
+                            XdpInode    *parent,
+                            const char  *name)
 {
   XDP_AUTOLOCK (invalidate_list);
 
-  for (GList *l = invalidate_list; l != NULL; l = l->next)
+  for (GList *l = *list; l != NULL; l = l->next)
     {
       XdpInvalidateData *data = l->data;
       if (data->parent_ino == parent->ino && g_strcmp0 (name, data->name) == 0)
@@ -1824,34 +2371,44 @@ queue_invalidate_dentry (XdpInode   *parent,
   data->parent_ino = parent->ino;
   memcpy (data->name, name, name_buf_size);
 
-  if (invalidate_list == NULL)
-    g_timeout_add_once (10, invalidate_dentry_cb, NULL);
+  if (*list == NULL)
+    g_timeout_add_once (delay_ms, invalidate_dentry_cb, list);
 
-  invalidate_list = g_list_append (invalidate_list, data);
+  *list = g_list_append (*list, data);
 }
 
+/* Queue an inval_dentry, thereby freeing unused inodes in the dcache
+ * which will free up a bunch of O_PATH fds in the fuse implementation.
+ */
 static void
-xdp_fuse_lookup (fuse_req_t  req,
-                 fuse_ino_t  parent_ino,
-                 const char *name)
+queue_invalidate_dentry (XdpInode   *parent,
+                         const char *name)
+{
+  queue_invalidate_dentry_in (&invalidate_list, 10, parent, name);
+}
+
+/* Like queue_invalidate_dentry(), for entries replied with the cache
+ * timeout. Don't throw them away before they expire. */
+static void
+queue_invalidate_cached_dentry (XdpInode   *parent,
+                                const char *name)
+{
+  queue_invalidate_dentry_in (&invalidate_cached_list,
+                              inotify_fd != -1 ? cache_timeout * 1000 : 10,
+                              parent, name);
+}
+
+/* Fills in e and gives a ref to the kernel on success, which must be
+ * returned with abort_reply_entry() if the entry is not sent */
+static int
+xdp_lookup_entry (XdpInode                *parent,
+                  const char              *name,
+                  struct fuse_entry_param *e)
 {
-  g_autoptr(XdpInode) parent = xdp_inode_from_ino (parent_ino);
   XdpDomain *parent_domain = parent->domain;
   g_autoptr(XdpInode) inode = NULL;
-  struct fuse_entry_param e;
   int res, fd;
   int open_flags = O_PATH|O_NOFOLLOW;
-  const char *op = "LOOKUP";
-
-  g_debug ("LOOKUP %" G_GINT64_MODIFIER "x:%s", parent_ino, name);
-
-  if (g_strcmp0 (name, ".") == 0 || g_strcmp0 (name, "..") == 0)
-    {
-      /* We don't set FUSE_CAP_EXPORT_SUPPORT, so should not get
-       * here. But lets make sure we never ever resolve them as that
-       * could be a security issue by escaping the root. */
-      return xdp_reply_err (op, req, ESTALE);
-    }
 
   if (xdp_domain_is_virtual_type (parent_domain))
     {
@@ -1874,9 +2431,9 @@ xdp_fuse_lookup (fuse_req_t  req,
         }
 
       if (inode == NULL)
-        return xdp_reply_err (op, req, ENOENT);
+        return -ENOENT;
 
-      prepare_reply_virtual_entry (inode, &e);
+      prepare_reply_virtual_entry (inode, e);
     }
   else
     {
@@ -1884,15 +2441,47 @@ xdp_fuse_lookup (fuse_req_t  req,
 
       fd = xdp_document_inode_open_child_fd (parent, name, open_flags, 0);
       if (fd < 0)
-        return xdp_reply_err (op, req, -fd);
+        return fd;
 
-      res = ensure_docdir_inode (parent, fd, &e, NULL); /* Takes ownership of fd */
+      res = ensure_docdir_inode (parent, fd, e, &inode); /* Takes ownership of fd */
       if (res != 0)
-        return xdp_reply_err (op, req, -res);
+        return res;
+
+      cache_reply_entry (parent, name, inode, e);
 
-      queue_invalidate_dentry (parent, name);
+      if (e->entry_timeout > 0)
+        queue_invalidate_cached_dentry (parent, name);
+      else
+        queue_invalidate_dentry (parent, name);
     }
 
+  return 0;
+}
+
+static void
+xdp_fuse_lookup (fuse_req_t  req,
+                 fuse_ino_t  parent_ino,
+                 const char *name)
+{
+  g_autoptr(XdpInode) parent = xdp_inode_from_ino (parent_ino);
+  struct fuse_entry_param e;
+  int res;
+  const char *op = "LOOKUP";
+
+  g_debug ("LOOKUP %" G_GINT64_MODIFIER "x:%s", parent_ino, name);
+
+  if (g_strcmp0 (name, ".") == 0 || g_strcmp0 (name, "..") == 0)
+    {
+      /* We don't set FUSE_CAP_EXPORT_SUPPORT, so should not get
+       * here. But lets make sure we never ever resolve them as that
+       * could be a security issue by escaping the root. */
+      return xdp_reply_err (op, req, ESTALE);
+    }
+
+  res = xdp_lookup_entry (parent, name, &e);
+  if (res != 0)
+    return xdp_reply_err (op, req, -res);
+
   g_debug ("LOOKUP %" G_GINT64_MODIFIER "x:%s => %" G_GINT64_MODIFIER "x", parent_ino, name, e.ino);
 
   if (fuse_reply_entry (req, &e) == -ENOENT)
@@ -1924,14 +2513,60 @@ xdp_file_free (XdpFile *file)
   g_free (file);
 }
 
+/* Let the kernel do reads and writes directly on the backing file, if
+ * possible. Permissions were checked when opening file->fd. */
+static void
+xdp_file_setup_passthrough (fuse_req_t             req,
+                            XdpFile               *file,
+                            struct fuse_file_info *fi)
+{
+#if HAVE_FUSE_PASSTHROUGH
+  int backing_id;
+
+  if (!g_atomic_int_get (&use_passthrough))
+    return;
+
+  backing_id = fuse_passthrough_open (req, file->fd);
+  if (backing_id <= 0)
+    {
+      /* EPERM means we are not allowed at all, other errors (such as a too
+       * deep filesystem stack) are specific to this file */
+      if (errno == EPERM)
+        {
+          g_debug ("Disabling fuse passthrough: %s", g_strerror (errno));
+          g_atomic_int_set (&use_passthrough, FALSE);
+        }
+      return;
+    }
+
+  file->backing_id = backing_id;
+  fi->backing_id = backing_id;
+  g_atomic_int_inc (&passthrough_opens);
+#endif
+}
+
+static void
+xdp_file_release (fuse_req_t  req,
+                  XdpFile    *file)
+{
+#if HAVE_FUSE_PASSTHROUGH
+  if (file->backing_id > 0)
+    fuse_passthrough_close (req, file->backing_id);
+#endif
+
+  xdp_file_free (file);
+}
+
 static void
 xdp_fuse_open (fuse_req_t             req,
                fuse_ino_t             ino,
                struct fuse_file_info *fi)
 {
   g_autoptr(XdpInode) inode = xdp_inode_from_ino (ino);
+  g_autoptr(XdpPhysicalInodePin) pin = NULL;
   int open_flags = fi->flags;
   g_autofree char *open_flags_string = open_flags_to_string (open_flags);
+  int physical_fd;
   int fd;
   g_autofree char *path = NULL;
   /* gobject-linter-ignore-next-line: use_auto_cleanup */
@@ -1949,7 +2584,11 @@ xdp_fuse_open (fuse_req_t             req,
   if (!xdp_document_inode_checks (op, req, inode, checks))
     return;
 
-  path = fd_to_path (inode->physical->fd);
+  pin = xdp_physical_inode_pin (inode->physical, &physical_fd);
+  if (pin == NULL)
+    return xdp_reply_err (op, req, -physical_fd);
+
+  path = fd_to_path (physical_fd);
 
   /*
    * `path` is a path to the fd entry in `/proc`, which is a symlink
@@ -1977,12 +2616,13 @@ xdp_fuse_open (fuse_req_t             req,
     return xdp_reply_err (op, req, errno);
 
   file = xdp_file_new (fd);
+  xdp_file_setup_passthrough (req, file, fi);
 
   fi->fh = (gsize)file;
   if (fuse_reply_open (req, fi) == -ENOENT)
     {
       /* The open syscall was interrupted, so it must be cancelled */
-      xdp_file_free (file);
+      xdp_file_release (req, file);
     }
 }
 
@@ -2026,12 +2666,13 @@ xdp_fuse_create (fuse_req_t             req,
     return xdp_reply_err (op, req, -res);
 
   file = xdp_file_new (g_steal_fd (&fd)); /* Takes ownership of fd */
+  xdp_file_setup_passthrough (req, file, fi);
 
   fi->fh = (gsize)file;
   if (fuse_reply_create (req, &e, fi) == -ENOENT)
     {
       /* The open syscall was interrupted, so it must be cancelled */
-      xdp_file_free (file);
+      xdp_file_release (req, file);
       abort_reply_entry (&e);
     }
 
@@ -2115,6 +2756,93 @@ xdp_fuse_write_buf (fuse_req_t             req,
     xdp_reply_err (op, req, errno);
 }
 
+/* Copies in the server when copy_file_range() can't be used between the
+ * backing files, which still saves passing the data through the fuse
+ * channel twice. Returns the number of bytes copied or -errno. */
+static ssize_t
+copy_range_fallback (int    fd_in,
+                     off_t  off_in,
+                     int    fd_out,
+                     off_t  off_out,
+                     size_t len)
+{
+  g_autofree char *buf = NULL;
+  size_t buf_size = MIN (len, 1024 * 1024);
+  ssize_t copied = 0;
+
+  g_atomic_int_inc (&copy_file_range_fallbacks);
+
+  buf = g_malloc (buf_size);
+
+  while ((size_t)copied < len)
+    {
+      ssize_t n_read, n_written = 0;
+
+      n_read = pread (fd_in, buf, MIN (buf_size, len - copied), off_in + copied);
+      if (n_read < 0)
+        return copied > 0 ? copied : -errno;
+      if (n_read == 0)
+        break;
+
+      while (n_written < n_read)
+        {
+          ssize_t res;
+
+          res = pwrite (fd_out, buf + n_written, n_read - n_written,
+                        off_out + copied + n_written);
+          if (res < 0)
+            {
+              copied += n_written;
+              return copied > 0 ? copied : -errno;
+            }
+
+          n_written += res;
+        }
+
+      copied += n_read;
+    }
+
+  return copied;
+}
+
+static void
+xdp_fuse_copy_file_range (fuse_req_t             req,
+                          fuse_ino_t             ino_in,
+                          off_t                  off_in,
+                          struct fuse_file_info *fi_in,
+                          fuse_ino_t             ino_out,
+                          off_t                  off_out,
+                          struct fuse_file_info *fi_out,
+                          size_t                 len,
+                          int                    flags)
+{
+  XdpFile *file_in = (XdpFile *)fi_in->fh;
+  XdpFile *file_out = (XdpFile *)fi_out->fh;
+  const char *op = "COPY_FILE_RANGE";
+  ssize_t res = -1;
+
+  g_debug ("COPY_FILE_RANGE %" G_GINT64_MODIFIER "x off %" G_GOFFSET_FORMAT " => %" G_GINT64_MODIFIER "x off %" G_GOFFSET_FORMAT " len %" G_GSIZE_FORMAT,
+           ino_in, (goffset)off_in, ino_out, (goffset)off_out, len);
+
+  if (flags != 0)
+    return xdp_reply_err (op, req, EINVAL);
+
+#if HAVE_COPY_FILE_RANGE
+  res = copy_file_range (file_in->fd, &off_in, file_out->fd, &off_out, len, 0);
+  if (res < 0 && errno != EXDEV && errno != ENOSYS && errno != EOPNOTSUPP)
+    return xdp_reply_err (op, req, errno);
+#endif
+
+  if (res < 0)
+    {
+      res = copy_range_fallback (file_in->fd, off_in, file_out->fd, off_out, len);
+      if (res < 0)
+        return xdp_reply_err (op, req, -res);
+    }
+
+  fuse_reply_write (req, res);
+}
+
 static void
 xdp_fuse_fsync (fuse_req_t             req,
                 fuse_ino_t             ino,
@@ -2184,7 +2912,7 @@ xdp_fuse_release (fuse_req_t             req,
 
   g_debug ("RELEASE %" G_GINT64_MODIFIER "x", ino);
 
-  xdp_file_free (file);
+  xdp_file_release (req, file);
 
   xdp_reply_ok (op, req);
 }
@@ -2223,34 +2951,29 @@ xdp_fuse_forget_multi (fuse_req_t               req,
   fuse_reply_none (req);
 }
 
+static void
+xdp_dir_entry_clear (XdpDirEntry *entry)
+{
+  g_clear_pointer (&entry->name, g_free);
+}
+
 static void
 xdp_dir_free (XdpDir *d)
 {
   if (d->dir)
     closedir (d->dir);
-  g_free (d->dirbuf);
+  g_clear_pointer (&d->entries, g_array_unref);
   g_free (d);
 }
 
 static void
 xdp_dir_add (XdpDir     *d,
-             fuse_req_t  req,
              const char *name,
              mode_t      mode)
 {
-  struct stat stbuf;
-
-  size_t oldsize = d->dirbuf_size;
+  XdpDirEntry entry = { mode, g_strdup (name) };
 
-  d->dirbuf_size += fuse_add_direntry (req, NULL, 0, name, NULL, 0);
-  d->dirbuf = (char *) g_realloc (d->dirbuf, d->dirbuf_size);
-  memset (&stbuf, 0, sizeof (stbuf));
-  stbuf.st_ino = FUSE_UNKNOWN_INO;
-  stbuf.st_mode = mode;
-  fuse_add_direntry (req, d->dirbuf + oldsize,
-                     d->dirbuf_size - oldsize,
-                     name, &stbuf,
-                     d->dirbuf_size);
+  g_array_append_val (d->entries, entry);
 }
 
 static XdpDir *
@@ -2264,41 +2987,29 @@ xdp_dir_new_physical (DIR *dir)
 }
 
 static XdpDir *
-xdp_dir_new_buffered (fuse_req_t  req)
+xdp_dir_new_buffered (void)
 {
   XdpDir *d = g_new0 (XdpDir, 1);
-  xdp_dir_add (d, req, ".", S_IFDIR);
-  xdp_dir_add (d, req, "..", S_IFDIR);
+  d->entries = g_array_new (FALSE, FALSE, sizeof (XdpDirEntry));
+  g_array_set_clear_func (d->entries, (GDestroyNotify) xdp_dir_entry_clear);
+  xdp_dir_add (d, ".", S_IFDIR);
+  xdp_dir_add (d, "..", S_IFDIR);
   return d;
 }
 
 static void
 xdp_dir_add_docs (XdpDir     *d,
-                  fuse_req_t  req,
                   const char *for_app_id)
 {
-  g_auto(GStrv) docs = NULL;
-  int i;
+  g_autoptr(GPtrArray) docs = get_visible_docs (for_app_id);
 
-  docs = xdp_list_docs ();
-  for (i = 0; docs[i] != NULL; i++)
-    {
-      if (for_app_id)
-        {
-          g_autoptr(PermissionDbEntry) entry = xdp_lookup_doc (docs[i]);
-          if (entry == NULL ||
-              !app_can_see_doc (entry, for_app_id))
-            continue;
-        }
-
-      xdp_dir_add (d, req, docs[i], S_IFDIR);
-    }
+  for (guint i = 0; i < docs->len; i++)
+    xdp_dir_add (d, g_ptr_array_index (docs, i), S_IFDIR);
 }
 
 static void
 xdp_dir_add_apps (XdpDir     *d,
                   XdpDomain  *domain,
-                  fuse_req_t  req,
                   const char *for_app_id)
 {
   g_auto(GStrv) apps = NULL;
@@ -2308,7 +3019,7 @@ xdp_dir_add_apps (XdpDir     *d,
   /* First all pre-used apps as these can be created on demand */
   names = xdp_domain_get_inode_keys_as_string (domain);
   for (i = 0; names[i] != NULL; i++)
-    xdp_dir_add (d, req, names[i], S_IFDIR);
+    xdp_dir_add (d, names[i], S_IFDIR);
 
   /* Then all in the db (that don't already have inodes) */
   apps = xdp_list_apps ();
@@ -2316,7 +3027,7 @@ xdp_dir_add_apps (XdpDir     *d,
     {
       const char *app = apps[i];
       if (!g_strv_contains ((const gchar * const *)names, app))
-        xdp_dir_add (d, req, app, S_IFDIR);
+        xdp_dir_add (d, app, S_IFDIR);
     }
 }
 
@@ -2335,18 +3046,18 @@ xdp_fuse_opendir (fuse_req_t             req,
 
   if (xdp_domain_is_virtual_type (domain))
     {
-      d = xdp_dir_new_buffered (req);
+      d = xdp_dir_new_buffered ();
       switch (domain->type)
         {
         case XDP_DOMAIN_ROOT:
-          xdp_dir_add (d, req, BY_APP_NAME, S_IFDIR);
-          xdp_dir_add_docs (d, req, NULL);
+          xdp_dir_add (d, BY_APP_NAME, S_IFDIR);
+          xdp_dir_add_docs (d, NULL);
           break;
         case XDP_DOMAIN_APP:
-          xdp_dir_add_docs (d, req, domain->app_id);
+          xdp_dir_add_docs (d, domain->app_id);
           break;
         case XDP_DOMAIN_BY_APP:
-          xdp_dir_add_apps (d, inode->domain, req, NULL);
+          xdp_dir_add_apps (d, inode->domain, NULL);
           break;
         case XDP_DOMAIN_DOCUMENT:
           g_assert_not_reached ();
@@ -2360,10 +3071,15 @@ xdp_fuse_opendir (fuse_req_t             req,
         {
           if (inode->physical)
             {
+              g_autoptr(XdpPhysicalInodePin) pin = NULL;
               DIR *dir;
               int fd;
 
-              fd = openat (inode->physical->fd, ".", O_RDONLY | O_DIRECTORY, 0);
+              pin = xdp_physical_inode_pin (inode->physical, &fd);
+              if (pin == NULL)
+                return xdp_reply_err (op, req, -fd);
+
+              fd = openat (fd, ".", O_RDONLY | O_DIRECTORY, 0);
               if (fd < 0)
                 return xdp_reply_err (op, req, errno);
 
@@ -2381,10 +3097,10 @@ xdp_fuse_opendir (fuse_req_t             req,
             {
               struct stat buf;
 
-              d = xdp_dir_new_buffered (req);
+              d = xdp_dir_new_buffered ();
 
               if (xdp_domain_get_doc_dir (domain, NULL, &buf) == 0)
-                xdp_dir_add (d, req, domain->doc_file, buf.st_mode);
+                xdp_dir_add (d, domain->doc_file, buf.st_mode);
             }
         }
       else
@@ -2394,10 +3110,10 @@ xdp_fuse_opendir (fuse_req_t             req,
           GHashTableIter iter;
           gpointer key, value;
 
-          d = xdp_dir_new_buffered (req);
+          d = xdp_dir_new_buffered ();
 
           if (stat (main_path, &buf) == 0)
-            xdp_dir_add (d, req, domain->doc_file, buf.st_mode);
+            xdp_dir_add (d, domain->doc_file, buf.st_mode);
 
           g_mutex_lock (&domain->tempfile_mutex);
 
@@ -2405,7 +3121,7 @@ xdp_fuse_opendir (fuse_req_t             req,
           while (g_hash_table_iter_next (&iter, &key, &value))
             {
               const char *tempname = key;
-              xdp_dir_add (d, req, tempname, S_IFREG);
+              xdp_dir_add (d, tempname, S_IFREG);
             }
 
           g_mutex_unlock (&domain->tempfile_mutex);
@@ -2500,19 +3216,175 @@ xdp_fuse_readdir (fuse_req_t             req,
     }
   else
     {
-      if (off < d->dirbuf_size)
+      g_autofree char *buf = g_try_malloc (size);
+      size_t rem;
+      char *p;
+
+      if (buf == NULL)
         {
-          gsize reply_size = MIN (d->dirbuf_size - off, size);
-          g_autofree char *buf = g_memdup2 (d->dirbuf + off, reply_size);
-          fuse_reply_buf (req, buf, reply_size);
+          xdp_reply_err (op, req, ENOMEM);
+          return;
         }
-      else
+
+      p = buf;
+      rem = size;
+
+      /* Offsets are entry indexes, like for readdirplus */
+      for (gsize i = off; i < d->entries->len; i++)
         {
-          fuse_reply_buf (req, NULL, 0);
+          XdpDirEntry *entry = &g_array_index (d->entries, XdpDirEntry, i);
+          struct stat st = {
+            .st_ino = FUSE_UNKNOWN_INO,
+            .st_mode = entry->mode,
+          };
+          size_t entsize;
+
+          entsize = fuse_add_direntry (req, p, rem, entry->name, &st, i + 1);
+          if (entsize > rem)
+            break;
+
+          p += entsize;
+          rem -= entsize;
         }
+
+      fuse_reply_buf (req, buf, size - rem);
     }
 }
 
+static gboolean
+is_dot_or_dotdot (const char *name)
+{
+  return g_strcmp0 (name, ".") == 0 || g_strcmp0 (name, "..") == 0;
+}
+
+/* Adds the entry with its attributes to the buffer, looking it up like
+ * LOOKUP would. Returns the size used, or 0 if there was no room */
+static size_t
+xdp_dir_add_entry_plus (fuse_req_t  req,
+                        XdpInode   *parent,
+                        const char *name,
+                        mode_t      mode,
+                        char       *buf,
+                        size_t      rem,
+                        off_t       nextoff)
+{
+  struct fuse_entry_param e = { 0, };
+  size_t entsize;
+
+  if (is_dot_or_dotdot (name))
+    {
+      /* No lookup count is taken for these */
+      e.attr.st_ino = FUSE_UNKNOWN_INO;
+      e.attr.st_mode = mode;
+      entsize = fuse_add_direntry_plus (req, buf, rem, name, &e, nextoff);
+      return entsize > rem ? 0 : entsize;
+    }
+
+  if (xdp_lookup_entry (parent, name, &e) != 0)
+    {
+      /* Went away or not accessible, leave it to a later lookup */
+      memset (&e, 0, sizeof (e));
+      e.attr.st_ino = FUSE_UNKNOWN_INO;
+      e.attr.st_mode = mode;
+      entsize = fuse_add_direntry_plus (req, buf, rem, name, &e, nextoff);
+      return entsize > rem ? 0 : entsize;
+    }
+
+  entsize = fuse_add_direntry_plus (req, buf, rem, name, &e, nextoff);
+  if (entsize > rem)
+    {
+      abort_reply_entry (&e);
+      return 0;
+    }
+
+  return entsize;
+}
+
+static void
+xdp_fuse_readdirplus (fuse_req_t             req,
+                      fuse_ino_t             ino,
+                      size_t                 size,
+                      off_t                  off,
+                      struct fuse_file_info *fi)
+{
+  g_autoptr(XdpInode) inode = xdp_inode_from_ino (ino);
+  XdpDir *d = (XdpDir *)fi->fh;
+  g_autofree char *buf = NULL;
+  const char *op = "READDIRPLUS";
+  size_t rem;
+  char *p;
+
+  g_debug ("READDIRPLUS %" G_GINT64_MODIFIER "x %" G_GSIZE_FORMAT " %" G_GOFFSET_FORMAT, ino, size, (goffset)off);
+
+  buf = g_try_malloc (size);
+  if (buf == NULL)
+    return xdp_reply_err (op, req, ENOMEM);
+
+  p = buf;
+  rem = size;
+
+  if (d->dir)
+    {
+      /* If offset is not same, need to seek it */
+      if (off != d->offset)
+        {
+          seekdir (d->dir, off);
+          d->entry = NULL;
+          d->offset = off;
+        }
+
+      while (TRUE)
+        {
+          size_t entsize;
+          off_t nextoff;
+
+          if (!d->entry)
+            {
+              errno = 0;
+              d->entry = readdir (d->dir);
+              if (!d->entry)
+                {
+                  if (errno && rem == size)
+                    return xdp_reply_err (op, req, errno);
+                  break;
+                }
+            }
+          nextoff = telldir (d->dir);
+
+          entsize = xdp_dir_add_entry_plus (req, inode, d->entry->d_name,
+                                            d->entry->d_type << 12,
+                                            p, rem, nextoff);
+          if (entsize == 0)
+            break;
+
+          p += entsize;
+          rem -= entsize;
+
+          d->entry = NULL;
+          d->offset = nextoff;
+        }
+    }
+  else
+    {
+      /* Offsets are entry indexes, like for readdir */
+      for (gsize i = off; i < d->entries->len; i++)
+        {
+          XdpDirEntry *entry = &g_array_index (d->entries, XdpDirEntry, i);
+          size_t entsize;
+
+          entsize = xdp_dir_add_entry_plus (req, inode, entry->name, entry->mode,
+                                            p, rem, i + 1);
+          if (entsize == 0)
+            break;
+
+          p += entsize;
+          rem -= entsize;
+        }
+    }
+
+  fuse_reply_buf (req, buf, size - rem);
+}
+
 static void
 xdp_fuse_releasedir (fuse_req_t             req,
                      fuse_ino_t             ino,
@@ -2613,7 +3485,14 @@ xdp_fuse_unlink (fuse_req_t  req,
 
   if (parent->physical)
     {
-      res = unlinkat (parent->physical->fd, filename, 0);
+      g_autoptr(XdpPhysicalInodePin) pin = NULL;
+      int physical_fd;
+
+      pin = xdp_physical_inode_pin (parent->physical, &physical_fd);
+      if (pin == NULL)
+        return xdp_reply_err (op, req, -physical_fd);
+
+      res = unlinkat (physical_fd, filename, 0);
       if (res != 0)
         return xdp_reply_err (op, req, errno);
     }
@@ -2859,7 +3738,14 @@ xdp_fuse_access (fuse_req_t req,
 
   if (inode->physical)
     {
-      path = fd_to_path (inode->physical->fd);
+      g_autoptr(XdpPhysicalInodePin) pin = NULL;
+      int physical_fd;
+
+      pin = xdp_physical_inode_pin (inode->physical, &physical_fd);
+      if (pin == NULL)
+        return xdp_reply_err (op, req, -physical_fd);
+
+      path = fd_to_path (physical_fd);
       res = access (path, mask);
     }
   else
@@ -2916,8 +3802,10 @@ xdp_fuse_readlink (fuse_req_t req,
                    fuse_ino_t ino)
 {
   g_autoptr(XdpInode) inode = xdp_inode_from_ino (ino);
+  g_autoptr(XdpPhysicalInodePin) pin = NULL;
   char linkname[PATH_MAX + 1];
   const char *op = "READLINK";
+  int physical_fd;
   ssize_t res;
 
   g_debug ("READLINK %" G_GINT64_MODIFIER "x", ino);
@@ -2930,7 +3818,11 @@ xdp_fuse_readlink (fuse_req_t req,
   if (inode->physical == NULL)
     return xdp_reply_err (op, req, EINVAL);
 
-  res = readlinkat (inode->physical->fd, "", linkname, sizeof(linkname));
+  pin = xdp_physical_inode_pin (inode->physical, &physical_fd);
+  if (pin == NULL)
+    return xdp_reply_err (op, req, -physical_fd);
+
+  res = readlinkat (physical_fd, "", linkname, sizeof(linkname));
   if (res < 0)
     return xdp_reply_err (op, req, errno);
 
@@ -2983,11 +3875,13 @@ xdp_fuse_link (fuse_req_t  req,
 {
   g_autoptr(XdpInode) newparent = xdp_inode_from_ino (newparent_ino);
   g_autoptr(XdpInode) inode = xdp_inode_from_ino (ino);
+  g_autoptr(XdpPhysicalInodePin) pin = NULL;
   g_autofree char *proc_path = NULL;
   g_autofd int close_fd = -1;
   struct fuse_entry_param e;
   const char * op = "LINK";
   int newparent_dirfd;
+  int physical_fd;
   int res;
 
   g_debug ("LINK %" G_GINT64_MODIFIER "x %" G_GINT64_MODIFIER "x %s", ino, newparent_ino, newname);
@@ -3003,7 +3897,11 @@ xdp_fuse_link (fuse_req_t  req,
   if (inode->domain != newparent->domain)
     return xdp_reply_err (op, req, EXDEV);
 
-  proc_path = fd_to_path (inode->physical->fd);
+  pin = xdp_physical_inode_pin (inode->physical, &physical_fd);
+  if (pin == NULL)
+    return xdp_reply_err (op, req, -physical_fd);
+
+  proc_path = fd_to_path (physical_fd);
   newparent_dirfd = xdp_document_inode_ensure_dirfd (newparent, &close_fd);
   if (newparent_dirfd < 0)
     return xdp_reply_err (op, req, -newparent_dirfd);
@@ -3049,7 +3947,16 @@ xdp_fuse_statfs (fuse_req_t req,
     return;
 
   if (inode->physical)
-    res = fstatvfs (inode->physical->fd, &buf);
+    {
+      g_autoptr(XdpPhysicalInodePin) pin = NULL;
+      int physical_fd;
+
+      pin = xdp_physical_inode_pin (inode->physical, &physical_fd);
+      if (pin == NULL)
+        return xdp_reply_err (op, req, -physical_fd);
+
+      res = fstatvfs (physical_fd, &buf);
+    }
   else
     res = statvfs (inode->domain->doc_path, &buf);
 
@@ -3063,11 +3970,19 @@ static gboolean
 xdp_fuse_get_real_path (XdpPhysicalInode  *physical,
                         char             **real_path_out)
 {
-  g_autofree char *fd_path = fd_to_path (physical->fd);
+  g_autoptr(XdpPhysicalInodePin) pin = NULL;
+  g_autofree char *fd_path = NULL;
   char path_buffer[PATH_MAX + 1];
   DevIno file_devino = physical->backing_devino;
   ssize_t symlink_size;
   struct stat buf;
+  int fd;
+
+  pin = xdp_physical_inode_pin (physical, &fd);
+  if (pin == NULL)
+    return FALSE;
+
+  fd_path = fd_to_path (fd);
 
   /* Try to extract a real path to the file
    * (and verify it goes to the same place as the fd) */
@@ -3159,9 +4074,11 @@ xdp_fuse_setxattr (fuse_req_t  req,
                    int         flags)
 {
   g_autoptr(XdpInode) inode = xdp_inode_from_ino (ino);
+  g_autoptr(XdpPhysicalInodePin) pin = NULL;
   ssize_t res;
   g_autofree char *path = NULL;
   const char *op = "SETXATTR";
+  int physical_fd;
 
   g_debug ("SETXATTR %" G_GINT64_MODIFIER "x %s", ino, name);
 
@@ -3177,7 +4094,11 @@ xdp_fuse_setxattr (fuse_req_t  req,
     }
   else
     {
-      path = fd_to_path (inode->physical->fd);
+      pin = xdp_physical_inode_pin (inode->physical, &physical_fd);
+      if (pin == NULL)
+        return xdp_reply_err (op, req, -physical_fd);
+
+      path = fd_to_path (physical_fd);
 #if HAVE_SYS_XATTR_H
       res = setxattr (path, name, value, size, flags);
 #elif HAVE_SYS_EXTATTR_H
@@ -3200,6 +4121,7 @@ xdp_fuse_getxattr (fuse_req_t  req,
                    size_t      size)
 {
   g_autoptr(XdpInode) inode = xdp_inode_from_ino (ino);
+  g_autoptr(XdpPhysicalInodePin) pin = NULL;
   ssize_t res;
   g_autofree char *buf = NULL;
   g_autofree char *path = NULL;
@@ -3213,7 +4135,7 @@ xdp_fuse_getxattr (fuse_req_t  req,
   if (size != 0)
     buf = g_malloc (size);
 
-  path = xdp_document_inode_get_self_as_path (inode);
+  path = xdp_document_inode_get_self_as_path (inode, &pin);
   if (path == NULL)
     return xdp_reply_err (op, req, ENODATA);
 
@@ -3268,6 +4190,7 @@ xdp_fuse_listxattr (fuse_req_t req,
                     size_t     size)
 {
   g_autoptr(XdpInode) inode = xdp_inode_from_ino (ino);
+  g_autoptr(XdpPhysicalInodePin) pin = NULL;
   g_autofree char *path = NULL;
   g_autofree char *buf = NULL;
   const char *op = "LISTXATTR";
@@ -3281,7 +4204,7 @@ xdp_fuse_listxattr (fuse_req_t req,
   if (size != 0)
     buf = g_malloc (size);
 
-  path = xdp_document_inode_get_self_as_path (inode);
+  path = xdp_document_inode_get_self_as_path (inode, &pin);
 
   if (path == NULL)
     {
@@ -3316,9 +4239,11 @@ xdp_fuse_removexattr (fuse_req_t  req,
                       const char *name)
 {
   g_autoptr(XdpInode) inode = xdp_inode_from_ino (ino);
+  g_autoptr(XdpPhysicalInodePin) pin = NULL;
   g_autofree char *path = NULL;
   ssize_t res;
   const char *op = "REMOVEXATTR";
+  int physical_fd;
 
   g_debug ("REMOVEXATTR %" G_GINT64_MODIFIER "x %s", ino, name);
 
@@ -3334,7 +4259,11 @@ xdp_fuse_removexattr (fuse_req_t  req,
     }
   else
     {
-      path = fd_to_path (inode->physical->fd);
+      pin = xdp_physical_inode_pin (inode->physical, &physical_fd);
+      if (pin == NULL)
+        return xdp_reply_err (op, req, -physical_fd);
+
+      path = fd_to_path (physical_fd);
 #if HAVE_SYS_XATTR_H
       res = removexattr (path, name);
 #elif HAVE_SYS_EXTATTR_H
@@ -3422,6 +4351,27 @@ xdp_fuse_init_cb (void                  *userdata,
       /* splice_move: move buffers from writing app to kernel during splice write */
       conn->want |= FUSE_CAP_SPLICE_MOVE;
     }
+
+#if HAVE_FUSE_PASSTHROUGH
+  /* passthrough: let the kernel read and write the backing files directly */
+  if (fuse_opts->use_passthrough && (conn->capable & FUSE_CAP_PASSTHROUGH))
+    {
+      conn->want |= FUSE_CAP_PASSTHROUGH;
+      g_atomic_int_set (&use_passthrough, TRUE);
+    }
+#endif
+
+  /* max_read is handled by the mount option, libfuse refuses to start
+   * if conn->max_read disagrees with it. */
+  if (fuse_opts->max_write > 0)
+    conn->max_write = fuse_opts->max_write;
+  if (fuse_opts->max_background > 0)
+    conn->max_background = fuse_opts->max_background;
+  if (fuse_opts->congestion_threshold > 0)
+    conn->congestion_threshold = fuse_opts->congestion_threshold;
+
+  g_debug ("INIT max_write %u max_background %u congestion_threshold %u",
+           conn->max_write, conn->max_background, conn->congestion_threshold);
 }
 
 extern gboolean on_fuse_unmount (void *);
@@ -3446,10 +4396,12 @@ static struct fuse_lowlevel_ops xdp_fuse_oper = {
  .getattr      = xdp_fuse_getattr,
  .setattr      = xdp_fuse_setattr,
  .readdir      = xdp_fuse_readdir,
+ .readdirplus  = xdp_fuse_readdirplus,
  .open         = xdp_fuse_open,
  .read         = xdp_fuse_read,
  .write        = xdp_fuse_write,
  .write_buf    = xdp_fuse_write_buf,
+ .copy_file_range = xdp_fuse_copy_file_range,
  .fsync        = xdp_fuse_fsync,
  .forget       = xdp_fuse_forget,
  .forget_multi = xdp_fuse_forget_multi,
@@ -3508,17 +4460,79 @@ xdp_fuse_mainloop (struct fuse_session     *se,
 typedef struct fuse_args XdpAutoFuseArgs;
 G_DEFINE_AUTO_CLEANUP_CLEAR_FUNC (XdpAutoFuseArgs, fuse_opt_free_args);
 
+static guint
+get_env_uint (const char *name,
+              guint       default_value,
+              guint       max_value)
+{
+  g_autoptr(GError) error = NULL;
+  const char *value;
+  guint64 result;
+
+  value = g_getenv (name);
+  if (value == NULL || *value == 0)
+    return default_value;
+
+  if (!g_ascii_string_to_unsigned (value, 10, 0, max_value, &result, &error))
+    {
+      g_warning ("Ignoring %s: %s", name, error->message);
+      return default_value;
+    }
+
+  return result;
+}
+
+/* The tuning knobs for the fuse session are read from the environment, as
+ * the document portal is usually started by D-Bus activation:
+ *
+ *  XDG_DOCUMENT_PORTAL_FUSE_SPLICE: 0 to not use splice() for read and write
+ *  XDG_DOCUMENT_PORTAL_FUSE_PASSTHROUGH: 0 to not pass reads and writes
+ *    directly to the backing files, where the kernel supports it
+ *  XDG_DOCUMENT_PORTAL_FUSE_CLONE_FD: 1 to give each worker its own /dev/fuse fd
+ *  XDG_DOCUMENT_PORTAL_FUSE_MAX_IDLE_THREADS: idle workers kept around
+ *  XDG_DOCUMENT_PORTAL_FUSE_MAX_BACKGROUND: pending background requests
+ *  XDG_DOCUMENT_PORTAL_FUSE_CONGESTION_THRESHOLD: background requests before
+ *    the kernel considers the filesystem congested
+ *  XDG_DOCUMENT_PORTAL_FUSE_MAX_WRITE: largest write request, in bytes
+ *  XDG_DOCUMENT_PORTAL_FUSE_MAX_READ: largest read request, in bytes
+ *
+ * A value of 0 (or unset) keeps the libfuse and kernel defaults.
+ */
+static XdpFuseOptions *
+xdp_fuse_options_new (void)
+{
+  XdpFuseOptions *fuse_opts = g_new0 (XdpFuseOptions, 1);
+
+#if HAVE_SPLICE
+  fuse_opts->use_splice =
+    get_env_uint ("XDG_DOCUMENT_PORTAL_FUSE_SPLICE", 1, 1) != 0;
+#endif
+#if HAVE_FUSE_PASSTHROUGH
+  fuse_opts->use_passthrough =
+    get_env_uint ("XDG_DOCUMENT_PORTAL_FUSE_PASSTHROUGH", 1, 1) != 0;
+#endif
+  fuse_opts->clone_fd =
+    get_env_uint ("XDG_DOCUMENT_PORTAL_FUSE_CLONE_FD", 0, 1) != 0;
+  fuse_opts->max_idle_threads =
+    get_env_uint ("XDG_DOCUMENT_PORTAL_FUSE_MAX_IDLE_THREADS", 0, G_MAXINT);
+  /* Both are 16 bit fields in the kernel protocol */
+  fuse_opts->max_background =
+    get_env_uint ("XDG_DOCUMENT_PORTAL_FUSE_MAX_BACKGROUND", 0, G_MAXUINT16);
+  fuse_opts->congestion_threshold =
+    get_env_uint ("XDG_DOCUMENT_PORTAL_FUSE_CONGESTION_THRESHOLD", 0, G_MAXUINT16);
+  fuse_opts->max_write =
+    get_env_uint ("XDG_DOCUMENT_PORTAL_FUSE_MAX_WRITE", 0, G_MAXINT);
+  fuse_opts->max_read =
+    get_env_uint ("XDG_DOCUMENT_PORTAL_FUSE_MAX_READ", 0, G_MAXINT);
+
+  return fuse_opts;
+}
+
 static gpointer
 xdp_fuse_thread (gpointer data)
 {
-  /* Options:
-   *  auto_unmount: Tell fusermount to auto unmount if we die.
-   */
-  static char *fusermount_argv[] = {
-    "xdp-fuse", "-osubtype=portal,fsname=portal,auto_unmount",
-  };
-  g_auto(XdpAutoFuseArgs) args =
-    FUSE_ARGS_INIT (G_N_ELEMENTS (fusermount_argv), fusermount_argv);
+  g_auto(XdpAutoFuseArgs) args = FUSE_ARGS_INIT (0, NULL);
+  g_autoptr(GString) mount_opts = NULL;
   g_autoptr(GMutexLocker) session_locker = NULL;
   g_autoptr(GMutexLocker) locker = NULL;
   struct fuse_cmdline_opts opts = {0};
@@ -3533,19 +4547,26 @@ xdp_fuse_thread (gpointer data)
 
   g_cond_signal (&thread_data->cond);
 
-  if (fuse_parse_cmdline (&args, &opts) != 0)
+  fuse_opts = xdp_fuse_options_new ();
+
+  /* Options:
+   *  auto_unmount: Tell fusermount to auto unmount if we die.
+   */
+  mount_opts = g_string_new ("-osubtype=portal,fsname=portal,auto_unmount");
+  if (fuse_opts->max_read > 0)
+    g_string_append_printf (mount_opts, ",max_read=%u", fuse_opts->max_read);
+
+  if (fuse_opt_add_arg (&args, "xdp-fuse") != 0 ||
+      fuse_opt_add_arg (&args, mount_opts->str) != 0 ||
+      fuse_parse_cmdline (&args, &opts) != 0)
     {
       g_set_error (&thread_data->error, XDG_DESKTOP_PORTAL_ERROR,
                    XDG_DESKTOP_PORTAL_ERROR_INVALID_ARGUMENT,
                    "Impossible to parse command line");
+      g_clear_pointer (&fuse_opts, g_free);
       return NULL;
     }
 
-  fuse_opts = g_new0 (XdpFuseOptions, 1);
-#if HAVE_SPLICE
-  fuse_opts->use_splice = TRUE;
-#endif
-
   se = fuse_session_new (&args, &xdp_fuse_oper,
                          sizeof (xdp_fuse_oper), fuse_opts);
   if (se == NULL)
@@ -3571,9 +4592,14 @@ xdp_fuse_thread (gpointer data)
   thread_data = NULL;
   g_clear_pointer (&locker, g_mutex_locker_free);
 
-  loop_config.clone_fd = opts.clone_fd;
+  loop_config.clone_fd = opts.clone_fd || fuse_opts->clone_fd;
   loop_config.max_idle_threads = opts.max_idle_threads;
-  thread_data = NULL;
+  if (fuse_opts->max_idle_threads > 0)
+    loop_config.max_idle_threads = fuse_opts->max_idle_threads;
+
+  g_debug ("Starting fuse loop: splice %d clone_fd %d max_idle_threads %u",
+           fuse_opts->use_splice, loop_config.clone_fd,
+           loop_config.max_idle_threads);
 
   session_locker = g_mutex_locker_new (&G_LOCK_NAME (session));
   g_clear_pointer (&session_locker, g_mutex_locker_free);
@@ -3613,6 +4639,26 @@ xdp_fuse_init (GError **error)
   physical_inodes =
     g_hash_table_new_full (devino_hash, devino_equal, NULL, NULL);
 
+  G_LOCK (doc_perms_cache);
+  doc_perms_cache =
+    g_hash_table_new_full (g_str_hash, g_str_equal, g_free, (GDestroyNotify) g_hash_table_unref);
+  doc_list_cache =
+    g_hash_table_new_full (g_str_hash, g_str_equal, g_free, (GDestroyNotify) g_ptr_array_unref);
+  G_UNLOCK (doc_perms_cache);
+
+  if (cache_timeout > 0)
+    {
+      inotify_fd = inotify_init1 (IN_NONBLOCK | IN_CLOEXEC);
+      if (inotify_fd == -1)
+        g_warning ("Can't track document changes, not caching: %s", g_strerror (errno));
+      else
+        {
+          watches = g_hash_table_new_full (g_direct_hash, g_direct_equal,
+                                           NULL, (GDestroyNotify) xdp_watch_free);
+          g_unix_fd_add (inotify_fd, G_IO_IN, watch_events_cb, NULL);
+        }
+    }
+
     /* Bump nr of filedescriptor limit to max */
   if (getrlimit (RLIMIT_NOFILE , &rl) == 0 &&
       rl.rlim_cur != rl.rlim_max)
@@ -3621,6 +4667,15 @@ xdp_fuse_init (GError **error)
       setrlimit (RLIMIT_NOFILE, &rl);
     }
 
+  G_LOCK (physical_inodes);
+  mount_fds = g_hash_table_new_full (g_int64_hash, g_int64_equal, g_free, NULL);
+  can_reopen_by_handle = check_can_reopen_by_handle ();
+  if (max_physical_fds == 0 && getrlimit (RLIMIT_NOFILE, &rl) == 0)
+    max_physical_fds = MIN (rl.rlim_cur / 2, G_MAXUINT);
+  if (!can_reopen_by_handle)
+    g_debug ("Can't reopen files by handle, not limiting the number of O_PATH fds");
+  G_UNLOCK (physical_inodes);
+
   path = xdp_fuse_get_mountpoint ();
 
   if ((stat (path, &st) == -1 && errno == ENOTCONN) ||
@@ -3727,7 +4782,39 @@ invalidate_doc_inode (XdpInode   *parent_inode,
   inval.filename = g_strdup (doc_id);
   g_array_append_val (invalidates, inval);
 
-  /* No need to invalidate doc children, we don't cache them */
+  /* Doc children are only cached if we track changes to them */
+  if (inotify_fd != -1)
+    {
+      GHashTableIter iter;
+      gpointer value;
+
+      g_hash_table_iter_init (&iter, doc_inode->domain->inodes);
+      while (g_hash_table_iter_next (&iter, NULL, &value))
+        {
+          inval.ino = xdp_inode_to_ino ((XdpInode *) value);
+          inval.filename = NULL;
+          g_array_append_val (invalidates, inval);
+        }
+    }
+}
+
+/* Called with session lock held */
+static void
+send_invalidates (GArray *invalidates)
+{
+  for (guint i = 0; i < invalidates->len; i++)
+    {
+      Invalidate *invalidate = &g_array_index (invalidates, Invalidate, i);
+
+      if (invalidate->filename)
+        {
+          fuse_lowlevel_notify_inval_entry (session, invalidate->ino,
+                                            invalidate->filename, strlen (invalidate->filename));
+          g_free (invalidate->filename);
+        }
+      else
+        fuse_lowlevel_notify_inval_inode (session, invalidate->ino, 0, 0);
+    }
 }
 
 
@@ -3739,7 +4826,6 @@ xdp_fuse_invalidate_doc_app (const char *doc_id,
 {
   g_autoptr(GArray) invalidates = NULL;
   XDP_AUTOLOCK (session);
-  int i;
 
   /* This can happen if fuse is not initialized yet for the very
      first dbus message that activated the service */
@@ -3748,6 +4834,8 @@ xdp_fuse_invalidate_doc_app (const char *doc_id,
 
   g_debug ("invalidate %s/%s", doc_id, opt_app_id ? opt_app_id : "*");
 
+  xdp_fuse_invalidate_doc_permissions (doc_id, opt_app_id);
+
   invalidates = g_array_new (FALSE, FALSE, sizeof (Invalidate));
 
   G_LOCK (domain_inodes);
@@ -3770,19 +4858,133 @@ xdp_fuse_invalidate_doc_app (const char *doc_id,
 
   G_UNLOCK (domain_inodes);
 
-  for (i = 0; i < invalidates->len; i++)
+  send_invalidates (invalidates);
+}
+
+static void
+add_watch_invalidates (XdpWatch                   *watch,
+                       const struct inotify_event *event,
+                       GArray                     *invalidates)
+{
+  for (guint i = 0; i < watch->targets->len; i++)
     {
-      Invalidate *invalidate = &g_array_index (invalidates, Invalidate, i);
+      XdpWatchTarget *target = &g_array_index (watch->targets, XdpWatchTarget, i);
+      Invalidate inval;
 
-      if (invalidate->filename)
+      if (target->name != NULL)
         {
-          fuse_lowlevel_notify_inval_entry (session, invalidate->ino,
-                                            invalidate->filename, strlen (invalidate->filename));
-          g_free (invalidate->filename);
+          /* Changes to the document in its host dir, or to the dir itself */
+          if (event != NULL && event->len > 0 && g_strcmp0 (event->name, target->name) != 0)
+            continue;
+
+          inval.ino = target->ino;
+          inval.filename = g_strdup (target->name);
+          g_array_append_val (invalidates, inval);
+          continue;
         }
+
+      inval.ino = target->ino;
+      inval.filename = NULL;
+      g_array_append_val (invalidates, inval);
+
+      if (event != NULL && event->len > 0)
+        {
+          inval.filename = g_strdup (event->name);
+          g_array_append_val (invalidates, inval);
+        }
+    }
+}
+
+/* The watch is gone, so the kernel must not cache the targets anymore */
+static void
+forget_watch (XdpWatch *watch)
+{
+  G_LOCK (all_inodes);
+  for (guint i = 0; i < watch->targets->len; i++)
+    {
+      XdpWatchTarget *target = &g_array_index (watch->targets, XdpWatchTarget, i);
+      XdpInode *inode = g_hash_table_lookup (all_inodes, &target->ino);
+
+      if (inode != NULL && inode->wd == watch->wd)
+        inode->wd = -1;
+    }
+  G_UNLOCK (all_inodes);
+
+  g_hash_table_remove (watches, GINT_TO_POINTER (watch->wd));
+}
+
+static gboolean
+watch_events_cb (int          fd,
+                 GIOCondition condition,
+                 gpointer     user_data)
+{
+  g_autoptr(GArray) invalidates = g_array_new (FALSE, FALSE, sizeof (Invalidate));
+  char buf[4096] __attribute__ ((aligned (__alignof__ (struct inotify_event))));
+  ssize_t len;
+
+  while ((len = read (fd, buf, sizeof (buf))) > 0)
+    {
+      XDP_AUTOLOCK (watches);
+
+      for (char *p = buf; p < buf + len; )
+        {
+          const struct inotify_event *event = (const struct inotify_event *) p;
+          XdpWatch *watch;
+
+          p += sizeof (struct inotify_event) + event->len;
+
+          if (event->mask & IN_Q_OVERFLOW)
+            {
+              GHashTableIter iter;
+
+              g_debug ("inotify queue overflow, invalidating all cached inodes");
+
+              g_hash_table_iter_init (&iter, watches);
+              while (g_hash_table_iter_next (&iter, NULL, (gpointer *) &watch))
+                add_watch_invalidates (watch, NULL, invalidates);
+              continue;
+            }
+
+          watch = g_hash_table_lookup (watches, GINT_TO_POINTER (event->wd));
+          if (watch == NULL)
+            continue;
+
+          add_watch_invalidates (watch, event, invalidates);
+
+          if (event->mask & IN_IGNORED)
+            forget_watch (watch);
+        }
+    }
+
+  if (invalidates->len > 0)
+    {
+      XDP_AUTOLOCK (session);
+
+      if (session)
+        send_invalidates (invalidates);
       else
-        fuse_lowlevel_notify_inval_inode (session, invalidate->ino, 0, 0);
+        {
+          for (guint i = 0; i < invalidates->len; i++)
+            g_free (g_array_index (invalidates, Invalidate, i).filename);
+        }
     }
+
+  return G_SOURCE_CONTINUE;
+}
+
+/* Must be called before xdp_fuse_init(). The default of 0 uses half of
+ * the fd limit. */
+void
+xdp_fuse_set_max_fds (guint max_fds)
+{
+  max_physical_fds = max_fds;
+}
+
+/* Must be called before xdp_fuse_init(). A timeout of 0 disables caching */
+void
+xdp_fuse_set_cache_timeout (double timeout)
+{
+  cache_timeout = timeout;
 }
 
 char *
@@ -14,11 +14,15 @@ char **        xdp_list_docs (void);
 PermissionDbEntry *xdp_lookup_doc (const char *doc_id);
 GBytes *       xdp_file_handle_for_fd (int fd);
 
+void        xdp_fuse_set_cache_timeout (double timeout);
+void        xdp_fuse_set_max_fds (guint max_fds);
 gboolean    xdp_fuse_init (GError **error);
 void        xdp_fuse_exit (void);
 const char *xdp_fuse_get_mountpoint (void);
 void        xdp_fuse_invalidate_doc_app (const char *doc_id,
                                          const char *opt_app_id);
+void        xdp_fuse_invalidate_doc_permissions (const char *doc_id,
+                                                 const char *opt_app_id);
 char      *xdp_fuse_lookup_id_for_inode (ino_t    inode,
                                          gboolean directory,
                                          char   **real_path_out);
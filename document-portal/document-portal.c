@@ -35,6 +35,7 @@
 
 static GMainLoop *loop = NULL;
 static PermissionDb *db = NULL;
+static guint db_path_index;
 static XdgPermissionStore *permission_store;
 static int final_exit_status = 0;
 static GError *exit_error = NULL;
@@ -46,25 +47,31 @@ XdpAppInfoRegistry *app_info_registry;
 
 G_LOCK_DEFINE (db);
 
+/* These are called from the fuse threads, so they read from the latest
+ * published snapshot of the db instead of taking the db lock */
+
 char **
 xdp_list_apps (void)
 {
-  XDP_AUTOLOCK (db);
-  return permission_db_list_apps (db);
+  g_autoptr(PermissionDbSnapshot) snapshot = permission_db_get_snapshot (db);
+
+  return permission_db_snapshot_list_apps (snapshot);
 }
 
 char **
 xdp_list_docs (void)
 {
-  XDP_AUTOLOCK (db);
-  return permission_db_list_ids (db);
+  g_autoptr(PermissionDbSnapshot) snapshot = permission_db_get_snapshot (db);
+
+  return permission_db_snapshot_list_ids (snapshot);
 }
 
 PermissionDbEntry *
 xdp_lookup_doc (const char *doc_id)
 {
-  XDP_AUTOLOCK (db);
-  return permission_db_lookup (db, doc_id);
+  g_autoptr(PermissionDbSnapshot) snapshot = permission_db_get_snapshot (db);
+
+  return permission_db_snapshot_lookup (snapshot, doc_id);
 }
 
 static gboolean
@@ -89,6 +96,7 @@ do_set_permissions (PermissionDbEntry    *entry,
 
   new_entry = permission_db_entry_set_app_permissions (entry, app_id, perms_s);
   permission_db_set_entry (db, doc_id, new_entry);
+  xdp_fuse_invalidate_doc_permissions (doc_id, app_id);
 
   if (persist_entry (new_entry))
     {
@@ -266,6 +274,7 @@ portal_delete (GDBusMethodInvocation *invocation,
     g_debug ("delete %s", id);
 
     permission_db_set_entry (db, id, NULL);
+    xdp_fuse_invalidate_doc_permissions (id, NULL);
 
     if (persist_entry (entry))
       xdg_permission_store_call_delete (permission_store, TABLE_NAME,
@@ -348,6 +357,41 @@ find_id_matches (PermissionDbEntry *entry,
   return TRUE;
 }
 
+static char *
+make_path_index_key (const char *path,
+                     uint32_t    flags)
+{
+  /* Transient-ness is ignored by some lookups, so leave it out of the key
+   * and let find_id_matches() check it */
+  flags &= ~DOCUMENT_ENTRY_FLAG_TRANSIENT;
+
+  return g_strdup_printf ("%x:%s", flags, path);
+}
+
+static char *
+path_index_key_func (PermissionDbEntry *entry,
+                     gpointer           user_data)
+{
+  return make_path_index_key (document_entry_get_path (entry),
+                              document_entry_get_flags (entry));
+}
+
+static char *
+find_id_in (char       **ids,
+            FindIdData  *find_data)
+{
+  for (size_t i = 0; ids[i] != NULL; i++)
+    {
+      g_autoptr(PermissionDbEntry) entry = NULL;
+
+      entry = permission_db_lookup (db, ids[i]);
+      if (entry && find_id_matches (entry, find_data))
+        return g_strdup (ids[i]);
+    }
+
+  return NULL;
+}
+
 static char *
 find_id (const char *path,
          dev_t       st_dev,
@@ -357,6 +401,9 @@ find_id (const char *path,
          gboolean    ignore_transient)
 {
   FindIdData find_data;
+  g_autofree char *key = NULL;
+  g_auto(GStrv) ids = NULL;
+  char *id;
 
   find_data = (FindIdData) {
     .path = path,
@@ -367,30 +414,23 @@ find_id (const char *path,
     .ignore_transient = ignore_transient,
   };
 
-  {
-    g_auto(GStrv) ids = NULL;
+  /* Every match has the same path and flags, so only look at the
+   * candidates from the path index instead of scanning the whole db */
+  key = make_path_index_key (path, flags);
+  ids = permission_db_lookup_index (db, db_path_index, key);
 
-    ids = permission_db_filter_ids (db, find_id_matches, &find_data);
-    if (ids[0] != NULL)
-      return g_strdup (ids[0]);
-  }
+  id = find_id_in (ids, &find_data);
+  if (id != NULL)
+    return id;
 
   /* We didn't have a handle, so we already checked by dev+ino */
   if (find_data.handle == NULL)
     return NULL;
 
   /* We didn't find a match via handle, so fall back to checking by dev+ino */
-  {
-    g_auto(GStrv) ids = NULL;
+  find_data.handle = NULL;
 
-    find_data.handle = NULL;
-
-    ids = permission_db_filter_ids (db, find_id_matches, &find_data);
-    if (ids[0] != NULL)
-      return g_strdup (ids[0]);
-  }
-
-  return NULL;
+  return find_id_in (ids, &find_data);
 }
 
 static char *
@@ -446,6 +486,7 @@ do_create_doc (struct stat *parent_st_buf,
     }
 
   permission_db_set_entry (db, id, entry);
+  xdp_fuse_invalidate_doc_permissions (id, NULL);
 
   if (persistent)
     {
@@ -1512,16 +1553,70 @@ portal_list (GDBusMethodInvocation *invocation,
   return TRUE;
 }
 
-const char *
-get_host_path_internal (GDBusMethodInvocation *invocation,
-                        XdpAppInfo            *app_info,
-                        const char            *id,
-                        GError                **error)
+static gboolean
+portal_list_paged (GDBusMethodInvocation *invocation,
+                   GVariant              *parameters,
+                   XdpAppInfo            *app_info)
 {
-  g_autoptr(PermissionDbEntry) entry = NULL;
+  const char *app_id;
+  const char *after;
+  guint32 limit;
+  g_auto(GStrv) ids = NULL;
+  GVariantBuilder builder;
+
+  if (!xdp_app_info_is_host (app_info))
+    {
+      g_dbus_method_invocation_return_error (invocation,
+                                             XDG_DESKTOP_PORTAL_ERROR, XDG_DESKTOP_PORTAL_ERROR_NOT_ALLOWED,
+                                             "Not allowed in sandbox");
+      return TRUE;
+    }
+
+  g_variant_get (parameters, "(&s&su)", &app_id, &after, &limit);
+
+  if (limit == 0)
+    {
+      g_dbus_method_invocation_return_error (invocation,
+                                             XDG_DESKTOP_PORTAL_ERROR, XDG_DESKTOP_PORTAL_ERROR_INVALID_ARGUMENT,
+                                             "Limit must not be 0");
+      return TRUE;
+    }
+
+  if (after[0] == '\0')
+    after = NULL;
 
   XDP_AUTOLOCK (db);
 
+  if (g_strcmp0 (app_id, "") == 0)
+    ids = permission_db_list_ids_range (db, after, limit);
+  else
+    ids = permission_db_list_ids_by_app_range (db, app_id, after, limit);
+
+  g_variant_builder_init (&builder, G_VARIANT_TYPE ("a{say}"));
+  for (size_t i = 0; ids[i]; i++)
+    {
+      g_autoptr(PermissionDbEntry) entry = NULL;
+
+      entry = permission_db_lookup (db, ids[i]);
+
+      g_variant_builder_add (&builder, "{s@ay}", ids[i], get_path (entry));
+    }
+
+  g_dbus_method_invocation_return_value (invocation,
+                                         g_variant_new ("(@a{say})",
+                                                        g_variant_builder_end (&builder)));
+
+  return TRUE;
+}
+
+/* Must be called with the db lock held */
+static char *
+get_host_path_locked (XdpAppInfo  *app_info,
+                      const char  *id,
+                      GError     **error)
+{
+  g_autoptr(PermissionDbEntry) entry = NULL;
+
   entry = permission_db_lookup (db, id);
 
   if (!entry)
@@ -1569,7 +1664,7 @@ get_host_path_internal (GDBusMethodInvocation *invocation,
         }
     }
 
-  return document_entry_get_path (entry);
+  return g_strdup (document_entry_get_path (entry));
 }
 
 static gboolean
@@ -1585,20 +1680,25 @@ portal_get_host_paths (GDBusMethodInvocation *invocation,
   g_variant_builder_init (&builder, G_VARIANT_TYPE ("(a{say})"));
   g_variant_builder_open (&builder, G_VARIANT_TYPE ("a{say}"));
 
-  for (size_t i = 0; id_list[i] != NULL; i++)
-    {
-      g_autoptr(GError) error = NULL;
-      const char *path = NULL;
+  {
+    /* Resolve the whole batch against the same state of the db */
+    XDP_AUTOLOCK (db);
 
-      path = get_host_path_internal (invocation, app_info, id_list[i], &error);
-      if (path == NULL)
-        {
-          g_warning ("Failed to get host path for %s: %s", id_list[i], error->message);
-          continue;
-        }
+    for (size_t i = 0; id_list[i] != NULL; i++)
+      {
+        g_autoptr(GError) error = NULL;
+        g_autofree char *path = NULL;
 
-      g_variant_builder_add (&builder, "{s@ay}", id_list[i], g_variant_new_bytestring (path));
-    }
+        path = get_host_path_locked (app_info, id_list[i], &error);
+        if (path == NULL)
+          {
+            g_warning ("Failed to get host path for %s: %s", id_list[i], error->message);
+            continue;
+          }
+
+        g_variant_builder_add (&builder, "{s@ay}", id_list[i], g_variant_new_bytestring (path));
+      }
+  }
 
   g_variant_builder_close (&builder);
 
@@ -1627,7 +1727,7 @@ on_bus_acquired (GDBusConnection *connection,
 
   app_info_registry = xdp_app_info_registry_new ();
 
-  xdp_dbus_documents_set_version (XDP_DBUS_DOCUMENTS (dbus_api), 5);
+  xdp_dbus_documents_set_version (XDP_DBUS_DOCUMENTS (dbus_api), 6);
 
   g_signal_connect_swapped (dbus_api, "handle-get-mount-point", G_CALLBACK (handle_get_mount_point), NULL);
   g_signal_connect_swapped (dbus_api, "handle-add", G_CALLBACK (handle_method), portal_add);
@@ -1640,6 +1740,7 @@ on_bus_acquired (GDBusConnection *connection,
   g_signal_connect_swapped (dbus_api, "handle-lookup", G_CALLBACK (handle_method), portal_lookup);
   g_signal_connect_swapped (dbus_api, "handle-info", G_CALLBACK (handle_method), portal_info);
   g_signal_connect_swapped (dbus_api, "handle-list", G_CALLBACK (handle_method), portal_list);
+  g_signal_connect_swapped (dbus_api, "handle-list-paged", G_CALLBACK (handle_method), portal_list_paged);
   g_signal_connect_swapped (dbus_api, "handle-get-host-paths", G_CALLBACK (handle_method), portal_get_host_paths);
 
   file_transfer = file_transfer_create ();
@@ -1766,11 +1867,15 @@ session_bus_closed (GDBusConnection *connection,
 static gboolean opt_verbose;
 static gboolean opt_replace;
 static gboolean opt_version;
+static int opt_cache_timeout = 0;
+static int opt_max_fds = 0;
 
 static GOptionEntry entries[] = {
   { "verbose", 'v', 0, G_OPTION_ARG_NONE, &opt_verbose, "Print debug information", NULL },
   { "replace", 'r', 0, G_OPTION_ARG_NONE, &opt_replace, "Replace", NULL },
   { "version", 0, 0, G_OPTION_ARG_NONE, &opt_version, "Print version and exit", NULL },
+  { "cache-timeout", 0, 0, G_OPTION_ARG_INT, &opt_cache_timeout, "Seconds the kernel may cache document attributes, tracking changes with inotify (default: 0, no caching)", "SECONDS" },
+  { "max-fds", 0, 0, G_OPTION_ARG_INT, &opt_max_fds, "Maximum number of file descriptors to keep open for exported files, if they can be reopened (default: 0, half the fd limit)", "N" },
   { NULL }
 };
 
@@ -1855,6 +1960,15 @@ main (int    argc,
   if (opt_verbose)
     g_log_set_handler (G_LOG_DOMAIN, G_LOG_LEVEL_DEBUG, message_handler, NULL);
 
+  if (opt_cache_timeout < 0 || opt_max_fds < 0)
+    {
+      g_printerr ("Cache timeout and fd limit must not be negative\n");
+      return 1;
+    }
+
+  xdp_fuse_set_cache_timeout (opt_cache_timeout);
+  xdp_fuse_set_max_fds (opt_max_fds);
+
   g_set_prgname (argv[0]);
 
   loop = g_main_loop_new (NULL, FALSE);
@@ -1867,6 +1981,9 @@ main (int    argc,
       exit (2);
     }
 
+  db_path_index = permission_db_add_index (db, path_index_key_func, NULL, NULL);
+  permission_db_enable_snapshots (db);
+
   session_bus = g_bus_get_sync (G_BUS_TYPE_SESSION, NULL, &error);
   if (session_bus == NULL)
     {
@@ -6,10 +6,12 @@
 
 #include "permission-db.h"
 
+#include <errno.h>
 #include <fcntl.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <unistd.h>
 
 #include <gvdb/gvdb-builder.h>
 #include <gvdb/gvdb-reader.h>
@@ -35,13 +37,71 @@ struct PermissionDb
   /* Map id => GVariant (data, sorted-dict[appid->perms]) */
   GvdbTable  *main_table;
   GHashTable *main_updates;
+  /* Sorted set of all ids, for listing them in pages */
+  GTree      *ids;
 
   /* (reverse) Map app id => [ id ]*/
   GvdbTable  *app_table;
-  GHashTable *app_additions;
-  GHashTable *app_removals;
+  /* Map app id => sorted set of ids, the app table with all updates
+   * applied. Apps without any id are removed. */
+  GHashTable *app_ids;
+
+  /* Secondary indexes, see permission_db_add_index() */
+  GPtrArray  *indexes;
+
+  /* Changes are appended to a log next to the GVDB file, which is only
+   * rewritten (compacted) when the log grows too big or too old */
+  GBytes     *disk_contents;
+  GHashTable *unsaved_ids;
+  gsize       log_size;
+  gint64      log_start_time;
+  gboolean    needs_compaction;
+
+  /* Published immutable view of the db, see permission_db_get_snapshot() */
+  GMutex                snapshot_lock;
+  PermissionDbSnapshot *snapshot;
 };
 
+struct _PermissionDbSnapshot
+{
+  gatomicrefcount ref_count;
+
+  /* Map id => entry, shared between snapshots */
+  GHashTable *base;
+  /* Map id => entry, or NULL for removed ids, applied on top of base */
+  GHashTable *changes;
+
+  /* Computed on first use */
+  char      **ids;
+  char      **apps;
+};
+
+/* Once a snapshot has this many changes, the next one gets a new base */
+#define SNAPSHOT_MAX_CHANGES 256
+
+#define LOG_MAGIC "xdplog01"
+#define LOG_MAGIC_SIZE 8
+#define LOG_HEADER_SIZE (LOG_MAGIC_SIZE + 64)
+#define LOG_RECORD_TYPE "(sm(va{sas}))"
+#define LOG_COMPACT_MIN_SIZE (256 * 1024)
+#define LOG_COMPACT_MAX_AGE (30 * G_TIME_SPAN_MINUTE)
+
+typedef struct
+{
+  guint32 size;
+  guint32 hash;
+} LogRecordHeader;
+
+typedef struct
+{
+  PermissionDbIndexKeyFunc func;
+  gpointer                 user_data;
+  GDestroyNotify           destroy_notify;
+
+  /* Map key => set of ids */
+  GHashTable              *ids_by_key;
+} PermissionDbIndex;
+
 typedef struct
 {
   GObjectClass parent_class;
@@ -72,23 +132,70 @@ sort_strv (const char **strv)
 }
 
 static int
-str_ptr_array_find (GPtrArray  *array,
-                    const char *str)
+id_cmp (gconstpointer a,
+        gconstpointer b,
+        gpointer      user_data)
 {
-  int i;
+  return strcmp (a, b);
+}
 
-  for (i = 0; i < array->len; i++)
-    if (g_strcmp0 (g_ptr_array_index (array, i), str) == 0)
-      return i;
+static GTree *
+id_set_new (void)
+{
+  return g_tree_new_full (id_cmp, NULL, g_free, NULL);
+}
+
+static void
+permission_db_index_free (PermissionDbIndex *db_index)
+{
+  if (db_index->destroy_notify)
+    db_index->destroy_notify (db_index->user_data);
 
-  return -1;
+  g_clear_pointer (&db_index->ids_by_key, g_hash_table_unref);
+  g_free (db_index);
 }
 
-static gboolean
-str_ptr_array_contains (GPtrArray  *array,
-                        const char *str)
+static void
+permission_db_index_add (PermissionDbIndex *db_index,
+                         const char        *id,
+                         PermissionDbEntry *entry)
 {
-  return str_ptr_array_find (array, str) >= 0;
+  g_autofree char *key = NULL;
+  GHashTable *ids;
+
+  key = db_index->func (entry, db_index->user_data);
+  if (key == NULL)
+    return;
+
+  ids = g_hash_table_lookup (db_index->ids_by_key, key);
+  if (ids == NULL)
+    {
+      ids = g_hash_table_new_full (g_str_hash, g_str_equal, g_free, NULL);
+      g_hash_table_insert (db_index->ids_by_key, g_steal_pointer (&key), ids);
+    }
+
+  g_hash_table_add (ids, g_strdup (id));
+}
+
+static void
+permission_db_index_remove (PermissionDbIndex *db_index,
+                            const char        *id,
+                            PermissionDbEntry *entry)
+{
+  g_autofree char *key = NULL;
+  GHashTable *ids;
+
+  key = db_index->func (entry, db_index->user_data);
+  if (key == NULL)
+    return;
+
+  ids = g_hash_table_lookup (db_index->ids_by_key, key);
+  if (ids == NULL)
+    return;
+
+  g_hash_table_remove (ids, id);
+  if (g_hash_table_size (ids) == 0)
+    g_hash_table_remove (db_index->ids_by_key, key);
 }
 
 const char *
@@ -132,8 +239,13 @@ permission_db_finalize (GObject *object)
   g_clear_pointer (&self->main_table, gvdb_table_free);
   g_clear_pointer (&self->app_table, gvdb_table_free);
   g_clear_pointer (&self->main_updates, g_hash_table_unref);
-  g_clear_pointer (&self->app_additions, g_hash_table_unref);
-  g_clear_pointer (&self->app_removals, g_hash_table_unref);
+  g_clear_pointer (&self->ids, g_tree_unref);
+  g_clear_pointer (&self->app_ids, g_hash_table_unref);
+  g_clear_pointer (&self->indexes, g_ptr_array_unref);
+  g_clear_pointer (&self->disk_contents, g_bytes_unref);
+  g_clear_pointer (&self->unsaved_ids, g_hash_table_unref);
+  g_clear_pointer (&self->snapshot, permission_db_snapshot_unref);
+  g_mutex_clear (&self->snapshot_lock);
 
   G_OBJECT_CLASS (permission_db_parent_class)->finalize (object);
 }
@@ -208,12 +320,14 @@ permission_db_init (PermissionDb *self)
   self->main_updates =
     g_hash_table_new_full (g_str_hash, g_str_equal,
                            g_free, (GDestroyNotify) permission_db_entry_unref);
-  self->app_additions =
-    g_hash_table_new_full (g_str_hash, g_str_equal,
-                           g_free, (GDestroyNotify) g_ptr_array_unref);
-  self->app_removals =
+  self->ids = id_set_new ();
+  self->app_ids =
     g_hash_table_new_full (g_str_hash, g_str_equal,
-                           g_free, (GDestroyNotify) g_ptr_array_unref);
+                           g_free, (GDestroyNotify) g_tree_unref);
+  self->indexes =
+    g_ptr_array_new_with_free_func ((GDestroyNotify) permission_db_index_free);
+  self->unsaved_ids = g_hash_table_new_full (g_str_hash, g_str_equal, g_free, NULL);
+  g_mutex_init (&self->snapshot_lock);
 }
 
 static gboolean
@@ -232,6 +346,198 @@ is_on_nfs (const char *path)
   return statfs_buffer.f_type == 0x6969;
 }
 
+static char *
+get_log_path (PermissionDb *self)
+{
+  g_autofree char *dirname = g_path_get_dirname (self->path);
+  g_autofree char *basename = g_path_get_basename (self->path);
+  g_autofree char *log_name = g_strconcat (".", basename, ".log", NULL);
+
+  return g_build_filename (dirname, log_name, NULL);
+}
+
+/* FNV-1a, only used to detect torn or corrupted log records */
+static guint32
+log_record_hash (const guint8 *data,
+                 gsize         size)
+{
+  guint32 hash = 2166136261u;
+
+  for (gsize i = 0; i < size; i++)
+    {
+      hash ^= data[i];
+      hash *= 16777619u;
+    }
+
+  return hash;
+}
+
+static void
+append_log_header (GByteArray *buffer,
+                   GBytes     *disk_contents)
+{
+  g_autofree char *checksum = NULL;
+
+  checksum = g_compute_checksum_for_bytes (G_CHECKSUM_SHA256, disk_contents);
+  g_assert (strlen (checksum) == LOG_HEADER_SIZE - LOG_MAGIC_SIZE);
+
+  g_byte_array_append (buffer, (const guint8 *) LOG_MAGIC, LOG_MAGIC_SIZE);
+  g_byte_array_append (buffer, (const guint8 *) checksum, strlen (checksum));
+}
+
+static void
+append_log_record (GByteArray        *buffer,
+                   const char        *id,
+                   PermissionDbEntry *entry)
+{
+  g_autoptr(GVariant) record = NULL;
+  LogRecordHeader header;
+  gsize offset;
+
+  record = g_variant_ref_sink (g_variant_new ("(s@m(va{sas}))",
+                                              id,
+                                              g_variant_new_maybe (G_VARIANT_TYPE ("(va{sas})"),
+                                                                   (GVariant *) entry)));
+
+  header.size = g_variant_get_size (record);
+
+  offset = buffer->len;
+  g_byte_array_set_size (buffer, offset + sizeof (header) + header.size);
+  g_variant_store (record, buffer->data + offset + sizeof (header));
+
+  header.hash = log_record_hash (buffer->data + offset + sizeof (header), header.size);
+  memcpy (buffer->data + offset, &header, sizeof (header));
+}
+
+static void
+set_entry_internal (PermissionDb      *self,
+                    const char        *id,
+                    PermissionDbEntry *entry);
+static void
+publish_snapshot (PermissionDb      *self,
+                  const char        *id,
+                  PermissionDbEntry *entry);
+
+/* Loads the ids and the reverse app => [ id ] map of the GVDB content, so
+ * listing doesn't need to merge them with the updates on every call */
+static void
+load_ids (PermissionDb *self)
+{
+  g_autofree char **main_ids = NULL;
+  g_autofree char **apps = NULL;
+
+  main_ids = gvdb_table_get_names (self->main_table, NULL);
+  for (size_t i = 0; main_ids[i] != NULL; i++)
+    g_tree_insert (self->ids, main_ids[i], NULL);
+
+  apps = gvdb_table_get_names (self->app_table, NULL);
+  for (size_t i = 0; apps[i] != NULL; i++)
+    {
+      g_autofree char *app = apps[i];
+      g_autoptr(GVariant) ids_v = NULL;
+      g_autofree const char **ids = NULL;
+      GTree *app_ids;
+
+      ids_v = gvdb_table_get_value (self->app_table, app);
+      if (ids_v == NULL)
+        continue;
+
+      ids = g_variant_get_strv (ids_v, NULL);
+      if (ids[0] == NULL)
+        continue;
+
+      app_ids = id_set_new ();
+      for (size_t j = 0; ids[j] != NULL; j++)
+        g_tree_insert (app_ids, g_strdup (ids[j]), NULL);
+
+      g_hash_table_insert (self->app_ids, g_steal_pointer (&app), app_ids);
+    }
+}
+
+/* Applies the records of the log on top of the loaded GVDB content. The log
+ * is ignored if it was written for some other GVDB content, which happens
+ * if we crashed after compacting but before removing the old log. */
+static void
+replay_log (PermissionDb *self)
+{
+  g_autofree char *log_path = get_log_path (self);
+  g_autofree char *contents = NULL;
+  g_autofree char *checksum = NULL;
+  g_autoptr(GError) error = NULL;
+  gsize size;
+  gsize offset;
+
+  if (!g_file_get_contents (log_path, &contents, &size, &error))
+    {
+      if (!g_error_matches (error, G_FILE_ERROR, G_FILE_ERROR_NOENT))
+        {
+          g_warning ("Failed to read db log %s: %s", log_path, error->message);
+          self->needs_compaction = TRUE;
+        }
+      return;
+    }
+
+  if (self->disk_contents == NULL)
+    return;
+
+  checksum = g_compute_checksum_for_bytes (G_CHECKSUM_SHA256, self->disk_contents);
+
+  if (size < LOG_HEADER_SIZE ||
+      memcmp (contents, LOG_MAGIC, LOG_MAGIC_SIZE) != 0 ||
+      memcmp (contents + LOG_MAGIC_SIZE, checksum, LOG_HEADER_SIZE - LOG_MAGIC_SIZE) != 0)
+    {
+      g_debug ("Ignoring stale db log %s", log_path);
+      return;
+    }
+
+  offset = LOG_HEADER_SIZE;
+  while (offset < size)
+    {
+      g_autoptr(GBytes) record_bytes = NULL;
+      g_autoptr(GVariant) record = NULL;
+      g_autoptr(GVariant) maybe_entry = NULL;
+      g_autoptr(PermissionDbEntry) entry = NULL;
+      LogRecordHeader header;
+      const guint8 *data;
+      const char *id;
+
+      if (size - offset < sizeof (header))
+        break;
+
+      memcpy (&header, contents + offset, sizeof (header));
+      if (header.size > size - offset - sizeof (header))
+        break;
+
+      data = (const guint8 *) contents + offset + sizeof (header);
+      if (log_record_hash (data, header.size) != header.hash)
+        break;
+
+      record_bytes = g_bytes_new (data, header.size);
+      record = g_variant_ref_sink (g_variant_new_from_bytes (G_VARIANT_TYPE (LOG_RECORD_TYPE),
+                                                             record_bytes,
+                                                             FALSE));
+      if (!g_variant_is_normal_form (record))
+        break;
+
+      g_variant_get (record, "(&s@m(va{sas}))", &id, &maybe_entry);
+      entry = (PermissionDbEntry *) g_variant_get_maybe (maybe_entry);
+
+      set_entry_internal (self, id, entry);
+
+      offset += sizeof (header) + header.size;
+    }
+
+  self->log_size = offset;
+  self->log_start_time = g_get_monotonic_time ();
+
+  /* Don't append after a torn record, start over with a fresh GVDB */
+  if (offset < size)
+    {
+      g_warning ("Ignoring corrupt tail of db log %s", log_path);
+      self->needs_compaction = TRUE;
+    }
+}
+
 static gboolean
 initable_init (GInitable    *initable,
                GCancellable *cancellable,
@@ -291,8 +597,14 @@ initable_init (GInitable    *initable,
                        "No app table in db");
           return FALSE;
         }
+
+      self->disk_contents = g_bytes_ref (self->gvdb_contents);
+
+      load_ids (self);
     }
 
+  replay_log (self);
+
   return TRUE;
 }
 
@@ -337,130 +649,98 @@ permission_db_list_ids (PermissionDb *self)
   return g_strv_builder_end (builder);
 }
 
-static gboolean
-app_update_empty (GHashTable *ht, const char *app)
-{
-  GPtrArray *array;
-
-  array = g_hash_table_lookup (ht, app);
-  if (array == NULL)
-    return TRUE;
-
-  return array->len == 0;
-}
-
 /* Transfer: full */
 char **
 permission_db_list_apps (PermissionDb *self)
 {
-  gpointer key, _value;
+  g_autoptr(GStrvBuilder) builder = NULL;
   GHashTableIter iter;
-  g_autoptr(GPtrArray) res = NULL;
-  int i;
+  gpointer app;
 
   g_return_val_if_fail (PERMISSION_IS_DB (self), NULL);
 
-  res = g_ptr_array_new ();
-
-  g_hash_table_iter_init (&iter, self->app_additions);
-  while (g_hash_table_iter_next (&iter, &key, &_value))
-    {
-      GPtrArray *value = _value;
-      if (value->len > 0)
-        g_ptr_array_add (res, g_strdup (key));
-    }
-
-  if (self->app_table)
-    {
-      // TODO: can we use gvdb_table_list here???
-      g_autofree char **apps = gvdb_table_get_names (self->app_table, NULL);
+  builder = g_strv_builder_new ();
 
-      for (i = 0; apps[i] != NULL; i++)
-        {
-          char *app = apps[i];
-          gboolean empty = TRUE;
-          GPtrArray *removals;
-          int j;
+  g_hash_table_iter_init (&iter, self->app_ids);
+  while (g_hash_table_iter_next (&iter, &app, NULL))
+    g_strv_builder_add (builder, app);
 
-          /* Don't use if we already added above */
-          if (app_update_empty (self->app_additions, app))
-            {
-              g_autoptr(GVariant) ids_v = NULL;
-
-              removals = g_hash_table_lookup (self->app_removals, app);
-
-              /* Add unless all items are removed */
-              ids_v = gvdb_table_get_value (self->app_table, app);
-
-              if (ids_v)
-                {
-                  g_autofree const char **ids = g_variant_get_strv (ids_v, NULL);
-
-                  for (j = 0; ids[j] != NULL; j++)
-                    {
-                      if (removals == NULL ||
-                          !str_ptr_array_contains (removals, ids[j]))
-                        {
-                          empty = FALSE;
-                          break;
-                        }
-                    }
-                }
-            }
+  return g_strv_builder_end (builder);
+}
 
-          if (empty)
-            g_free (app);
-          else
-            g_ptr_array_add (res, app);
-        }
-    }
+static gboolean
+add_id_to_builder (gpointer key,
+                   gpointer value,
+                   gpointer user_data)
+{
+  g_strv_builder_add (user_data, key);
 
-  g_ptr_array_add (res, NULL);
-  return (char **) g_ptr_array_steal (res, NULL);
+  return FALSE;
 }
 
-/* Transfer: full */
+/* Transfer: full, sorted */
 char **
 permission_db_list_ids_by_app (PermissionDb  *self,
                                const char *app)
 {
-  g_autoptr(GPtrArray) res = NULL;
-  GPtrArray *additions;
-  GPtrArray *removals;
-  int i;
+  g_autoptr(GStrvBuilder) builder = NULL;
+  GTree *ids;
 
   g_return_val_if_fail (PERMISSION_IS_DB (self), NULL);
 
-  res = g_ptr_array_new ();
+  builder = g_strv_builder_new ();
 
-  additions = g_hash_table_lookup (self->app_additions, app);
-  removals = g_hash_table_lookup (self->app_removals, app);
+  ids = g_hash_table_lookup (self->app_ids, app);
+  if (ids)
+    g_tree_foreach (ids, add_id_to_builder, builder);
 
-  if (additions)
-    {
-      for (i = 0; i < additions->len; i++)
-        g_ptr_array_add (res,
-                         g_strdup (g_ptr_array_index (additions, i)));
-    }
+  return g_strv_builder_end (builder);
+}
 
-  if (self->app_table)
-    {
-      g_autoptr(GVariant) ids_v = gvdb_table_get_value (self->app_table, app);
-      if (ids_v)
-        {
-          g_autofree const char **ids = g_variant_get_strv (ids_v, NULL);
+static char **
+list_id_set_range (GTree      *ids,
+                   const char *after,
+                   guint       limit)
+{
+  g_autoptr(GStrvBuilder) builder = g_strv_builder_new ();
+  GTreeNode *node = NULL;
 
-          for (i = 0; ids[i] != NULL; i++)
-            {
-              if (removals == NULL ||
-                  !str_ptr_array_contains (removals, ids[i]))
-                g_ptr_array_add (res, g_strdup (ids[i]));
-            }
-        }
-    }
+  if (ids != NULL)
+    node = after != NULL ? g_tree_upper_bound (ids, after) : g_tree_node_first (ids);
 
-  g_ptr_array_add (res, NULL);
-  return (char **) g_ptr_array_steal (res, NULL);
+  for (guint n = 0; node != NULL && n < limit; node = g_tree_node_next (node), n++)
+    g_strv_builder_add (builder, g_tree_node_key (node));
+
+  return g_strv_builder_end (builder);
+}
+
+/* Lists at most limit ids, in order, starting with the first one sorting
+ * after after, or with the first id if after is NULL. To get the next
+ * page, pass the last id of the previous one as after.
+ *
+ * Transfer: full */
+char **
+permission_db_list_ids_range (PermissionDb *self,
+                              const char   *after,
+                              guint         limit)
+{
+  g_return_val_if_fail (PERMISSION_IS_DB (self), NULL);
+
+  return list_id_set_range (self->ids, after, limit);
+}
+
+/* Like permission_db_list_ids_range(), for the ids of one app.
+ *
+ * Transfer: full */
+char **
+permission_db_list_ids_by_app_range (PermissionDb *self,
+                                     const char   *app,
+                                     const char   *after,
+                                     guint         limit)
+{
+  g_return_val_if_fail (PERMISSION_IS_DB (self), NULL);
+
+  return list_id_set_range (g_hash_table_lookup (self->app_ids, app), after, limit);
 }
 
 /* Transfer: full */
@@ -518,37 +798,92 @@ permission_db_filter_ids (PermissionDb           *self,
   return g_strv_builder_end (builder);
 }
 
-static void
-add_app_id (PermissionDb  *self,
-            const char *app,
-            const char *id)
+/* Adds a secondary index mapping the key returned by func for each
+ * entry to the ids of the entries having that key. The index is kept
+ * up to date by permission_db_set_entry(), so lookups by key don't
+ * need to scan the whole table. Returns an index handle to pass to
+ * permission_db_lookup_index(). */
+guint
+permission_db_add_index (PermissionDb             *self,
+                         PermissionDbIndexKeyFunc  func,
+                         gpointer                  user_data,
+                         GDestroyNotify            destroy_notify)
 {
-  GPtrArray *additions;
-  GPtrArray *removals;
-  int i;
+  g_auto(GStrv) ids = NULL;
+  PermissionDbIndex *db_index;
 
-  additions = g_hash_table_lookup (self->app_additions, app);
-  removals = g_hash_table_lookup (self->app_removals, app);
+  g_return_val_if_fail (PERMISSION_IS_DB (self), 0);
+  g_return_val_if_fail (func != NULL, 0);
 
-  if (removals)
+  db_index = g_new0 (PermissionDbIndex, 1);
+  db_index->func = func;
+  db_index->user_data = user_data;
+  db_index->destroy_notify = destroy_notify;
+  db_index->ids_by_key =
+    g_hash_table_new_full (g_str_hash, g_str_equal,
+                           g_free, (GDestroyNotify) g_hash_table_unref);
+
+  ids = permission_db_list_ids (self);
+  for (size_t i = 0; ids[i] != NULL; i++)
     {
-      i = str_ptr_array_find (removals, id);
-      if (i >= 0)
-        g_ptr_array_remove_index_fast (removals, i);
+      g_autoptr(PermissionDbEntry) entry = permission_db_lookup (self, ids[i]);
+
+      if (entry != NULL)
+        permission_db_index_add (db_index, ids[i], entry);
     }
 
-  if (additions)
+  g_ptr_array_add (self->indexes, db_index);
+
+  return self->indexes->len - 1;
+}
+
+/* Transfer: full */
+char **
+permission_db_lookup_index (PermissionDb *self,
+                            guint         index_id,
+                            const char   *key)
+{
+  g_autoptr(GStrvBuilder) builder = NULL;
+  PermissionDbIndex *db_index;
+  GHashTable *ids;
+
+  g_return_val_if_fail (PERMISSION_IS_DB (self), NULL);
+  g_return_val_if_fail (index_id < self->indexes->len, NULL);
+  g_return_val_if_fail (key != NULL, NULL);
+
+  builder = g_strv_builder_new ();
+
+  db_index = g_ptr_array_index (self->indexes, index_id);
+  ids = g_hash_table_lookup (db_index->ids_by_key, key);
+  if (ids)
     {
-      if (!str_ptr_array_contains (additions, id))
-        g_ptr_array_add (additions, g_strdup (id));
+      GHashTableIter iter;
+      gpointer id;
+
+      g_hash_table_iter_init (&iter, ids);
+      while (g_hash_table_iter_next (&iter, &id, NULL))
+        g_strv_builder_add (builder, id);
     }
-  else
+
+  return g_strv_builder_end (builder);
+}
+
+static void
+add_app_id (PermissionDb  *self,
+            const char *app,
+            const char *id)
+{
+  GTree *ids;
+
+  ids = g_hash_table_lookup (self->app_ids, app);
+  if (ids == NULL)
     {
-      additions = g_ptr_array_new_with_free_func (g_free);
-      g_ptr_array_add (additions, g_strdup (id));
-      g_hash_table_insert (self->app_additions,
-                           g_strdup (app), additions);
+      ids = id_set_new ();
+      g_hash_table_insert (self->app_ids, g_strdup (app), ids);
     }
+
+  if (g_tree_lookup_node (ids, id) == NULL)
+    g_tree_insert (ids, g_strdup (id), NULL);
 }
 
 static void
@@ -556,32 +891,15 @@ remove_app_id (PermissionDb  *self,
                const char *app,
                const char *id)
 {
-  GPtrArray *additions;
-  GPtrArray *removals;
-  int i;
+  GTree *ids;
 
-  additions = g_hash_table_lookup (self->app_additions, app);
-  removals = g_hash_table_lookup (self->app_removals, app);
-
-  if (additions)
-    {
-      i = str_ptr_array_find (additions, id);
-      if (i >= 0)
-        g_ptr_array_remove_index_fast (additions, i);
-    }
+  ids = g_hash_table_lookup (self->app_ids, app);
+  if (ids == NULL)
+    return;
 
-  if (removals)
-    {
-      if (!str_ptr_array_contains (removals, id))
-        g_ptr_array_add (removals, g_strdup (id));
-    }
-  else
-    {
-      removals = g_ptr_array_new_with_free_func (g_free);
-      g_ptr_array_add (removals, g_strdup (id));
-      g_hash_table_insert (self->app_removals,
-                           g_strdup (app), removals);
-    }
+  g_tree_remove (ids, id);
+  if (g_tree_nnodes (ids) == 0)
+    g_hash_table_remove (self->app_ids, app);
 }
 
 gboolean
@@ -592,11 +910,10 @@ permission_db_is_dirty (PermissionDb *self)
   return self->dirty;
 }
 
-/* add, replace, or NULL entry to remove */
-void
-permission_db_set_entry (PermissionDb      *self,
-                         const char     *id,
-                         PermissionDbEntry *entry)
+static void
+set_entry_internal (PermissionDb      *self,
+                    const char        *id,
+                    PermissionDbEntry *entry)
 {
   g_autoptr(PermissionDbEntry) old_entry = NULL;
   g_autofree const char **old = NULL;
@@ -605,17 +922,27 @@ permission_db_set_entry (PermissionDb      *self,
   const char **a, **b;
   int ia, ib;
 
-  g_return_if_fail (PERMISSION_IS_DB (self));
-  g_return_if_fail (id != NULL);
-
-  self->dirty = TRUE;
-
   old_entry = permission_db_lookup (self, id);
 
   g_hash_table_insert (self->main_updates,
                        g_strdup (id),
                        permission_db_entry_ref (entry));
 
+  if (entry == NULL)
+    g_tree_remove (self->ids, id);
+  else if (g_tree_lookup_node (self->ids, id) == NULL)
+    g_tree_insert (self->ids, g_strdup (id), NULL);
+
+  for (guint i = 0; i < self->indexes->len; i++)
+    {
+      PermissionDbIndex *db_index = g_ptr_array_index (self->indexes, i);
+
+      if (old_entry)
+        permission_db_index_remove (db_index, id, old_entry);
+      if (entry)
+        permission_db_index_add (db_index, id, entry);
+    }
+
   a = empty;
   b = empty;
 
@@ -675,6 +1002,271 @@ permission_db_set_entry (PermissionDb      *self,
     }
 }
 
+/* add, replace, or NULL entry to remove */
+void
+permission_db_set_entry (PermissionDb      *self,
+                         const char     *id,
+                         PermissionDbEntry *entry)
+{
+  g_return_if_fail (PERMISSION_IS_DB (self));
+  g_return_if_fail (id != NULL);
+
+  self->dirty = TRUE;
+  g_hash_table_add (self->unsaved_ids, g_strdup (id));
+
+  set_entry_internal (self, id, entry);
+
+  if (self->snapshot)
+    publish_snapshot (self, id, entry);
+}
+
+static GHashTable *
+new_entry_table (void)
+{
+  return g_hash_table_new_full (g_str_hash, g_str_equal,
+                                g_free, (GDestroyNotify) permission_db_entry_unref);
+}
+
+static GHashTable *
+copy_entry_table (GHashTable *table)
+{
+  GHashTable *copy = new_entry_table ();
+  GHashTableIter iter;
+  gpointer key, value;
+
+  g_hash_table_iter_init (&iter, table);
+  while (g_hash_table_iter_next (&iter, &key, &value))
+    g_hash_table_insert (copy, g_strdup (key), permission_db_entry_ref (value));
+
+  return copy;
+}
+
+static PermissionDbSnapshot *
+permission_db_snapshot_new (GHashTable *base,
+                            GHashTable *changes)
+{
+  PermissionDbSnapshot *snapshot = g_new0 (PermissionDbSnapshot, 1);
+
+  g_atomic_ref_count_init (&snapshot->ref_count);
+  snapshot->base = base;
+  snapshot->changes = changes;
+
+  return snapshot;
+}
+
+/* Called with the same locking as permission_db_set_entry(), so there is
+ * only one thread replacing the snapshot at a time */
+static void
+publish_snapshot (PermissionDb      *self,
+                  const char        *id,
+                  PermissionDbEntry *entry)
+{
+  PermissionDbSnapshot *old = self->snapshot;
+  PermissionDbSnapshot *new;
+  GHashTable *base;
+  GHashTable *changes;
+
+  if (g_hash_table_size (old->changes) >= SNAPSHOT_MAX_CHANGES)
+    {
+      GHashTableIter iter;
+      gpointer key, value;
+
+      base = copy_entry_table (old->base);
+
+      g_hash_table_iter_init (&iter, old->changes);
+      while (g_hash_table_iter_next (&iter, &key, &value))
+        {
+          if (value != NULL)
+            g_hash_table_insert (base, g_strdup (key), permission_db_entry_ref (value));
+          else
+            g_hash_table_remove (base, key);
+        }
+
+      changes = new_entry_table ();
+    }
+  else
+    {
+      base = g_hash_table_ref (old->base);
+      changes = copy_entry_table (old->changes);
+    }
+
+  g_hash_table_insert (changes, g_strdup (id), permission_db_entry_ref (entry));
+
+  new = permission_db_snapshot_new (base, changes);
+
+  g_mutex_lock (&self->snapshot_lock);
+  self->snapshot = new;
+  g_mutex_unlock (&self->snapshot_lock);
+
+  permission_db_snapshot_unref (old);
+}
+
+/* Makes permission_db_set_entry() publish an immutable snapshot of the db
+ * after each change, which can then be read from other threads without
+ * holding whatever lock protects the db itself. */
+void
+permission_db_enable_snapshots (PermissionDb *self)
+{
+  g_auto(GStrv) ids = NULL;
+  GHashTable *base;
+
+  g_return_if_fail (PERMISSION_IS_DB (self));
+
+  if (self->snapshot)
+    return;
+
+  base = new_entry_table ();
+
+  ids = permission_db_list_ids (self);
+  for (size_t i = 0; ids[i] != NULL; i++)
+    {
+      PermissionDbEntry *entry = permission_db_lookup (self, ids[i]);
+
+      if (entry != NULL)
+        g_hash_table_insert (base, g_strdup (ids[i]), entry);
+    }
+
+  self->snapshot = permission_db_snapshot_new (base, new_entry_table ());
+}
+
+/* Transfer: full. Can be called from any thread, never waits for writers. */
+PermissionDbSnapshot *
+permission_db_get_snapshot (PermissionDb *self)
+{
+  PermissionDbSnapshot *snapshot;
+
+  g_return_val_if_fail (PERMISSION_IS_DB (self), NULL);
+
+  g_mutex_lock (&self->snapshot_lock);
+  snapshot = self->snapshot ? permission_db_snapshot_ref (self->snapshot) : NULL;
+  g_mutex_unlock (&self->snapshot_lock);
+
+  return snapshot;
+}
+
+PermissionDbSnapshot *
+permission_db_snapshot_ref (PermissionDbSnapshot *snapshot)
+{
+  g_atomic_ref_count_inc (&snapshot->ref_count);
+  return snapshot;
+}
+
+void
+permission_db_snapshot_unref (PermissionDbSnapshot *snapshot)
+{
+  if (!g_atomic_ref_count_dec (&snapshot->ref_count))
+    return;
+
+  g_clear_pointer (&snapshot->base, g_hash_table_unref);
+  g_clear_pointer (&snapshot->changes, g_hash_table_unref);
+  g_clear_pointer (&snapshot->ids, g_strfreev);
+  g_clear_pointer (&snapshot->apps, g_strfreev);
+  g_free (snapshot);
+}
+
+/* Transfer: full */
+PermissionDbEntry *
+permission_db_snapshot_lookup (PermissionDbSnapshot *snapshot,
+                               const char           *id)
+{
+  gpointer value;
+
+  g_return_val_if_fail (id != NULL, NULL);
+
+  if (!g_hash_table_lookup_extended (snapshot->changes, id, NULL, &value))
+    value = g_hash_table_lookup (snapshot->base, id);
+
+  return permission_db_entry_ref (value);
+}
+
+static char **
+snapshot_collect_ids (PermissionDbSnapshot *snapshot)
+{
+  g_autoptr(GStrvBuilder) builder = g_strv_builder_new ();
+  GHashTableIter iter;
+  gpointer key, value;
+
+  g_hash_table_iter_init (&iter, snapshot->base);
+  while (g_hash_table_iter_next (&iter, &key, NULL))
+    {
+      if (!g_hash_table_contains (snapshot->changes, key))
+        g_strv_builder_add (builder, key);
+    }
+
+  g_hash_table_iter_init (&iter, snapshot->changes);
+  while (g_hash_table_iter_next (&iter, &key, &value))
+    {
+      if (value != NULL)
+        g_strv_builder_add (builder, key);
+    }
+
+  return g_strv_builder_end (builder);
+}
+
+static char **
+snapshot_collect_apps (PermissionDbSnapshot *snapshot)
+{
+  g_autoptr(GHashTable) apps = g_hash_table_new (g_str_hash, g_str_equal);
+  g_autoptr(GStrvBuilder) builder = g_strv_builder_new ();
+  g_auto(GStrv) ids = permission_db_snapshot_list_ids (snapshot);
+  GHashTableIter iter;
+  gpointer app;
+
+  for (size_t i = 0; ids[i] != NULL; i++)
+    {
+      g_autoptr(PermissionDbEntry) entry = permission_db_snapshot_lookup (snapshot, ids[i]);
+      g_autofree const char **entry_apps = permission_db_entry_list_apps (entry);
+
+      /* The strings are owned by the entries, which the snapshot keeps alive */
+      for (size_t j = 0; entry_apps[j] != NULL; j++)
+        g_hash_table_add (apps, (char *) entry_apps[j]);
+    }
+
+  g_hash_table_iter_init (&iter, apps);
+  while (g_hash_table_iter_next (&iter, &app, NULL))
+    g_strv_builder_add (builder, app);
+
+  return g_strv_builder_end (builder);
+}
+
+/* Transfer: full */
+char **
+permission_db_snapshot_list_ids (PermissionDbSnapshot *snapshot)
+{
+  char **ids = g_atomic_pointer_get (&snapshot->ids);
+
+  if (ids == NULL)
+    {
+      ids = snapshot_collect_ids (snapshot);
+      if (!g_atomic_pointer_compare_and_exchange (&snapshot->ids, NULL, ids))
+        {
+          g_strfreev (ids);
+          ids = g_atomic_pointer_get (&snapshot->ids);
+        }
+    }
+
+  return g_strdupv (ids);
+}
+
+/* Transfer: full */
+char **
+permission_db_snapshot_list_apps (PermissionDbSnapshot *snapshot)
+{
+  char **apps = g_atomic_pointer_get (&snapshot->apps);
+
+  if (apps == NULL)
+    {
+      apps = snapshot_collect_apps (snapshot);
+      if (!g_atomic_pointer_compare_and_exchange (&snapshot->apps, NULL, apps))
+        {
+          g_strfreev (apps);
+          apps = g_atomic_pointer_get (&snapshot->apps);
+        }
+    }
+
+  return g_strdupv (apps);
+}
+
 void
 permission_db_update (PermissionDb *self)
 {
@@ -710,14 +1302,12 @@ permission_db_update (PermissionDb *self)
   apps = permission_db_list_apps (self);
   for (i = 0; apps[i] != 0; i++)
     {
+      /* On-disk arrays are sorted, as list_ids_by_app() returns sorted ids */
       g_auto(GStrv) app_ids = permission_db_list_ids_by_app (self, apps[i]);
       GVariantBuilder builder;
       GvdbItem *item;
       int j;
 
-      /* May as well ensure that on-disk arrays are sorted, even if we don't use it yet */
-      sort_strv ((const char **) app_ids);
-
       /* We should never list an app that has empty id lists */
       g_assert (app_ids[0] != NULL);
 
@@ -841,6 +1431,223 @@ permission_db_save_content_finish (PermissionDb    *self,
   return g_task_propagate_boolean (G_TASK (res), error);
 }
 
+typedef struct
+{
+  char   *log_path;
+  GBytes *data;
+  gboolean truncate;
+} AppendLogData;
+
+static void
+append_log_data_free (AppendLogData *data)
+{
+  g_free (data->log_path);
+  g_bytes_unref (data->data);
+  g_free (data);
+}
+
+static void
+append_log_thread (GTask        *task,
+                   gpointer      source_object,
+                   gpointer      task_data,
+                   GCancellable *cancellable)
+{
+  AppendLogData *data = task_data;
+  g_autofd int fd = -1;
+  const guint8 *buf;
+  gsize len;
+  int flags;
+
+  flags = O_WRONLY | O_CREAT | O_APPEND | O_CLOEXEC;
+  if (data->truncate)
+    flags |= O_TRUNC;
+
+  fd = open (data->log_path, flags, 0644);
+  if (fd < 0)
+    {
+      int errsv = errno;
+      g_task_return_new_error (task, G_IO_ERROR, g_io_error_from_errno (errsv),
+                               "Failed to open %s: %s", data->log_path, g_strerror (errsv));
+      return;
+    }
+
+  buf = g_bytes_get_data (data->data, &len);
+  while (len > 0)
+    {
+      ssize_t res = write (fd, buf, len);
+
+      if (res < 0)
+        {
+          int errsv = errno;
+
+          if (errsv == EINTR)
+            continue;
+
+          g_task_return_new_error (task, G_IO_ERROR, g_io_error_from_errno (errsv),
+                                   "Failed to write %s: %s", data->log_path, g_strerror (errsv));
+          return;
+        }
+
+      buf += res;
+      len -= res;
+    }
+
+  if (fdatasync (fd) != 0)
+    {
+      int errsv = errno;
+      g_task_return_new_error (task, G_IO_ERROR, g_io_error_from_errno (errsv),
+                               "Failed to sync %s: %s", data->log_path, g_strerror (errsv));
+      return;
+    }
+
+  g_task_return_boolean (task, TRUE);
+}
+
+static void
+append_log_done (GObject      *source_object,
+                 GAsyncResult *res,
+                 gpointer      user_data)
+{
+  PermissionDb *self = PERMISSION_DB (source_object);
+  g_autoptr(GTask) task = user_data;
+  g_autoptr(GError) error = NULL;
+
+  if (!g_task_propagate_boolean (G_TASK (res), &error))
+    {
+      /* The log may end in a partial record now, rewrite everything next time */
+      self->needs_compaction = TRUE;
+      g_task_return_error (task, g_steal_pointer (&error));
+      return;
+    }
+
+  g_task_return_boolean (task, TRUE);
+}
+
+static void
+compact_done (GObject      *source_object,
+              GAsyncResult *res,
+              gpointer      user_data)
+{
+  PermissionDb *self = PERMISSION_DB (source_object);
+  g_autoptr(GTask) task = user_data;
+  g_autoptr(GError) error = NULL;
+  g_autofree char *log_path = NULL;
+
+  if (!permission_db_save_content_finish (self, res, &error))
+    {
+      self->needs_compaction = TRUE;
+      g_task_return_error (task, g_steal_pointer (&error));
+      return;
+    }
+
+  /* A leftover log doesn't match the new content and will be ignored, so
+   * failing to remove it is harmless */
+  log_path = get_log_path (self);
+  if (unlink (log_path) != 0 && errno != ENOENT)
+    g_debug ("Failed to remove db log %s: %s", log_path, g_strerror (errno));
+
+  g_clear_pointer (&self->disk_contents, g_bytes_unref);
+  self->disk_contents = g_bytes_ref (g_task_get_task_data (G_TASK (res)));
+  self->log_size = 0;
+  self->needs_compaction = FALSE;
+
+  g_task_return_boolean (task, TRUE);
+}
+
+static gboolean
+should_compact (PermissionDb *self)
+{
+  if (self->needs_compaction || self->disk_contents == NULL)
+    return TRUE;
+
+  if (self->log_size == 0)
+    return FALSE;
+
+  if (self->log_size > MAX (LOG_COMPACT_MIN_SIZE, g_bytes_get_size (self->disk_contents)))
+    return TRUE;
+
+  return g_get_monotonic_time () - self->log_start_time > LOG_COMPACT_MAX_AGE;
+}
+
+/* Persists all changes since the last save. Usually this only appends the
+ * changed entries to the log, but when the log is too big or too old a
+ * fresh GVDB file is written instead and the log is removed. Only one save
+ * may be in flight at a time. */
+void
+permission_db_save_changes_async (PermissionDb        *self,
+                                  GCancellable        *cancellable,
+                                  GAsyncReadyCallback  callback,
+                                  gpointer             user_data)
+{
+  g_autoptr(GTask) task = NULL;
+  g_autoptr(GTask) append_task = NULL;
+  g_autoptr(GByteArray) buffer = NULL;
+  AppendLogData *data;
+  GHashTableIter iter;
+  gpointer id;
+
+  g_return_if_fail (PERMISSION_IS_DB (self));
+
+  task = g_task_new (self, cancellable, callback, user_data);
+  g_task_set_source_tag (task, permission_db_save_changes_async);
+
+  if (self->path == NULL)
+    {
+      g_task_return_new_error (task, G_FILE_ERROR, G_FILE_ERROR_INVAL,
+                               "No path set");
+      return;
+    }
+
+  if (should_compact (self))
+    {
+      g_hash_table_remove_all (self->unsaved_ids);
+      permission_db_update (self);
+      permission_db_save_content_async (self, cancellable,
+                                        compact_done,
+                                        g_steal_pointer (&task));
+      return;
+    }
+
+  buffer = g_byte_array_new ();
+
+  if (self->log_size == 0)
+    {
+      append_log_header (buffer, self->disk_contents);
+      self->log_start_time = g_get_monotonic_time ();
+    }
+
+  g_hash_table_iter_init (&iter, self->unsaved_ids);
+  while (g_hash_table_iter_next (&iter, &id, NULL))
+    {
+      g_autoptr(PermissionDbEntry) entry = permission_db_lookup (self, id);
+
+      append_log_record (buffer, id, entry);
+    }
+
+  g_hash_table_remove_all (self->unsaved_ids);
+  self->dirty = FALSE;
+
+  data = g_new0 (AppendLogData, 1);
+  data->log_path = get_log_path (self);
+  data->truncate = self->log_size == 0;
+  data->data = g_byte_array_free_to_bytes (g_steal_pointer (&buffer));
+
+  self->log_size += g_bytes_get_size (data->data);
+
+  append_task = g_task_new (self, cancellable, append_log_done, g_steal_pointer (&task));
+  g_task_set_source_tag (append_task, permission_db_save_changes_async);
+  g_task_set_task_data (append_task, data, (GDestroyNotify) append_log_data_free);
+  g_task_run_in_thread (append_task, append_log_thread);
+}
+
+gboolean
+permission_db_save_changes_finish (PermissionDb  *self,
+                                   GAsyncResult  *res,
+                                   GError       **error)
+{
+  return g_task_propagate_boolean (G_TASK (res), error);
+}
+
 
 GString *
 permission_db_print_string (PermissionDb *self,
@@ -12,6 +12,7 @@ G_BEGIN_DECLS
 
 typedef struct PermissionDb       PermissionDb;
 typedef struct _PermissionDbEntry PermissionDbEntry;
+typedef struct _PermissionDbSnapshot PermissionDbSnapshot;
 
 #define PERMISSION_TYPE_DB (permission_db_get_type ())
 #define PERMISSION_DB(obj) (G_TYPE_CHECK_INSTANCE_CAST ((obj), PERMISSION_TYPE_DB, PermissionDb))
@@ -25,6 +26,10 @@ GType permission_db_get_type (void);
 typedef gboolean (*PermissionDbLookupFunc) (PermissionDbEntry *entry,
                                             gpointer           user_data);
 
+/* Returns the index key for entry (transfer full), or NULL to not index it */
+typedef char *   (*PermissionDbIndexKeyFunc) (PermissionDbEntry *entry,
+                                              gpointer           user_data);
+
 PermissionDb *     permission_db_new (const char *path,
                                       gboolean    fail_if_not_found,
                                       GError    **error);
@@ -32,11 +37,25 @@ char **        permission_db_list_ids (PermissionDb *self);
 char **        permission_db_list_apps (PermissionDb *self);
 char **        permission_db_list_ids_by_app (PermissionDb  *self,
                                               const char *app);
+char **        permission_db_list_ids_range (PermissionDb *self,
+                                             const char   *after,
+                                             guint         limit);
+char **        permission_db_list_ids_by_app_range (PermissionDb *self,
+                                                    const char   *app,
+                                                    const char   *after,
+                                                    guint         limit);
 char **        permission_db_filter_ids (PermissionDb           *self,
                                          PermissionDbLookupFunc  func,
                                          gpointer                user_data);
 PermissionDbEntry *permission_db_lookup (PermissionDb  *self,
                                    const char *id);
+guint          permission_db_add_index (PermissionDb             *self,
+                                        PermissionDbIndexKeyFunc  func,
+                                        gpointer                  user_data,
+                                        GDestroyNotify            destroy_notify);
+char **        permission_db_lookup_index (PermissionDb *self,
+                                           guint         index_id,
+                                           const char   *key);
 GString *      permission_db_print_string (PermissionDb *self,
                                            GString   *string);
 char *         permission_db_print (PermissionDb *self);
@@ -57,9 +76,25 @@ void           permission_db_save_content_async (PermissionDb          *self,
 gboolean       permission_db_save_content_finish (PermissionDb    *self,
                                                   GAsyncResult *res,
                                                   GError      **error);
+void           permission_db_save_changes_async (PermissionDb        *self,
+                                                 GCancellable        *cancellable,
+                                                 GAsyncReadyCallback  callback,
+                                                 gpointer             user_data);
+gboolean       permission_db_save_changes_finish (PermissionDb  *self,
+                                                  GAsyncResult  *res,
+                                                  GError       **error);
 void           permission_db_set_path (PermissionDb  *self,
                                        const char *path);
 
+void           permission_db_enable_snapshots (PermissionDb *self);
+PermissionDbSnapshot *permission_db_get_snapshot (PermissionDb *self);
+
+PermissionDbSnapshot *permission_db_snapshot_ref (PermissionDbSnapshot *snapshot);
+void           permission_db_snapshot_unref (PermissionDbSnapshot *snapshot);
+PermissionDbEntry *permission_db_snapshot_lookup (PermissionDbSnapshot *snapshot,
+                                                  const char           *id);
+char **        permission_db_snapshot_list_ids (PermissionDbSnapshot *snapshot);
+char **        permission_db_snapshot_list_apps (PermissionDbSnapshot *snapshot);
 
 PermissionDbEntry  *permission_db_entry_ref (PermissionDbEntry *entry);
 void            permission_db_entry_unref (PermissionDbEntry *entry);
@@ -87,5 +122,6 @@ PermissionDbEntry  *permission_db_entry_remove_app_permissions (PermissionDbEntr
 
 G_DEFINE_AUTOPTR_CLEANUP_FUNC (PermissionDb, g_object_unref)
 G_DEFINE_AUTOPTR_CLEANUP_FUNC (PermissionDbEntry, permission_db_entry_unref)
+G_DEFINE_AUTOPTR_CLEANUP_FUNC (PermissionDbSnapshot, permission_db_snapshot_unref)
 
 G_END_DECLS
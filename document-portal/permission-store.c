@@ -41,11 +41,15 @@ on_name_lost (GDBusConnection *connection,
 static gboolean opt_verbose;
 static gboolean opt_replace;
 static gboolean opt_version;
+static int opt_write_delay = 20;
+static int opt_max_write_delay = 200;
 
 static GOptionEntry entries[] = {
   { "verbose", 'v', 0, G_OPTION_ARG_NONE, &opt_verbose, "Print debug information", NULL },
   { "replace", 'r', 0, G_OPTION_ARG_NONE, &opt_replace, "Replace", NULL },
   { "version", 0, 0, G_OPTION_ARG_NONE, &opt_version, "Print version and exit", NULL },
+  { "write-delay", 0, 0, G_OPTION_ARG_INT, &opt_write_delay, "Milliseconds to wait for more changes before writing (default: 20)", "MS" },
+  { "max-write-delay", 0, 0, G_OPTION_ARG_INT, &opt_max_write_delay, "Maximum milliseconds to delay a write (default: 200)", "MS" },
   { NULL }
 };
 
@@ -119,6 +123,14 @@ main (int    argc,
   if (opt_verbose)
     g_log_set_handler (G_LOG_DOMAIN, G_LOG_LEVEL_DEBUG, message_handler, NULL);
 
+  if (opt_write_delay < 0 || opt_max_write_delay < 0)
+    {
+      g_printerr ("Write delays must not be negative\n");
+      return 1;
+    }
+
+  xdg_permission_store_set_write_delay (opt_write_delay, opt_max_write_delay);
+
   g_set_prgname (argv[0]);
 
   owner_id = g_bus_own_name (G_BUS_TYPE_SESSION,
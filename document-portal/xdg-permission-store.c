@@ -15,6 +15,14 @@
 #include "xdp-utils.h"
 
 GHashTable *tables = NULL;
+static XdgPermissionStore *permission_store = NULL;
+
+/* Writes are delayed by write_delay_ms after the last one arrived, so that
+ * bursts of writes end up in a single writeout, but never by more than
+ * max_write_delay_ms after the first one */
+static guint write_delay_ms = 20;
+static guint max_write_delay_ms = 200;
+static guint64 writes_avoided = 0;
 
 typedef struct
 {
@@ -23,13 +31,16 @@ typedef struct
   GList     *outstanding_writes;
   GList     *current_writes;
   gboolean   writing;
+  gint64     first_outstanding_time;
+  guint      writeout_timeout_id;
 } Table;
 
-static void start_writeout (Table *table);
+static void schedule_writeout (Table *table);
 
 static void
 table_free (Table *table)
 {
+  g_clear_handle_id (&table->writeout_timeout_id, g_source_remove);
   g_free (table->name);
   g_object_unref (table->db);
   g_free (table);
@@ -83,7 +94,7 @@ writeout_done (GObject      *source_object,
   g_autoptr(GError) error = NULL;
   gboolean ok;
 
-  ok = permission_db_save_content_finish (table->db, res, &error);
+  ok = permission_db_save_changes_finish (table->db, res, &error);
 
   for (l = table->current_writes; l != NULL; l = l->next)
     {
@@ -102,29 +113,73 @@ writeout_done (GObject      *source_object,
   table->writing = FALSE;
 
   if (table->outstanding_writes != NULL)
-    start_writeout (table);
+    schedule_writeout (table);
 }
 
 static void
 start_writeout (Table *table)
 {
+  guint n_writes;
+
   g_assert (table->current_writes == NULL);
   table->current_writes = g_steal_pointer (&table->outstanding_writes);
+  table->first_outstanding_time = 0;
   table->writing = TRUE;
 
-  permission_db_update (table->db);
+  n_writes = g_list_length (table->current_writes);
+  writes_avoided += n_writes - 1;
+  if (permission_store)
+    xdg_permission_store_set_writes_avoided (permission_store, writes_avoided);
+
+  g_debug ("Writing out %u changes to table %s (%" G_GUINT64_FORMAT " writes avoided so far)",
+           n_writes, table->name, writes_avoided);
+
+  permission_db_save_changes_async (table->db, NULL, writeout_done, table);
+}
+
+static gboolean
+writeout_timeout_cb (gpointer user_data)
+{
+  Table *table = user_data;
+
+  table->writeout_timeout_id = 0;
+  start_writeout (table);
+
+  return G_SOURCE_REMOVE;
+}
+
+static void
+schedule_writeout (Table *table)
+{
+  gint64 now = g_get_monotonic_time ();
+  gint64 deadline;
+  gint64 delay;
+
+  g_clear_handle_id (&table->writeout_timeout_id, g_source_remove);
+
+  deadline = table->first_outstanding_time + max_write_delay_ms * G_TIME_SPAN_MILLISECOND;
+  delay = MIN (now + write_delay_ms * G_TIME_SPAN_MILLISECOND, deadline) - now;
 
-  permission_db_save_content_async (table->db, NULL, writeout_done, table);
+  if (delay <= 0)
+    start_writeout (table);
+  else
+    table->writeout_timeout_id = g_timeout_add (delay / G_TIME_SPAN_MILLISECOND,
+                                                writeout_timeout_cb,
+                                                table);
 }
 
 static void
 ensure_writeout (Table                 *table,
                  GDBusMethodInvocation *invocation)
 {
+  if (table->outstanding_writes == NULL)
+    table->first_outstanding_time = g_get_monotonic_time ();
+
   table->outstanding_writes = g_list_prepend (table->outstanding_writes, invocation);
 
+  /* Whatever arrives during a writeout is scheduled once it's done */
   if (!table->writing)
-    start_writeout (table);
+    schedule_writeout (table);
 }
 
 static gboolean
@@ -147,6 +202,36 @@ handle_list (XdgPermissionStore     *object,
   return TRUE;
 }
 
+static gboolean
+handle_list_paged (XdgPermissionStore     *object,
+                   GDBusMethodInvocation  *invocation,
+                   const gchar            *table_name,
+                   const gchar            *after,
+                   guint                   limit)
+{
+  Table *table;
+
+  g_auto(GStrv) ids = NULL;
+
+  if (limit == 0)
+    {
+      g_dbus_method_invocation_return_error (invocation,
+                                             XDG_DESKTOP_PORTAL_ERROR, XDG_DESKTOP_PORTAL_ERROR_INVALID_ARGUMENT,
+                                             "Limit must not be 0");
+      return TRUE;
+    }
+
+  table = lookup_table (table_name, invocation);
+  if (table == NULL)
+    return TRUE;
+
+  ids = permission_db_list_ids_range (table->db, after[0] != '\0' ? after : NULL, limit);
+
+  xdg_permission_store_complete_list_paged (object, invocation, (const char * const *) ids);
+
+  return TRUE;
+}
+
 static GVariant *
 get_app_permissions (PermissionDbEntry *entry)
 {
@@ -398,6 +483,50 @@ handle_set (XdgPermissionStore     *object,
   return TRUE;
 }
 
+/* Returns the entry @id of @table, or a new empty one if @create is set.
+ * Returns NULL after returning an error to @invocation otherwise. */
+static PermissionDbEntry *
+lookup_entry_for_update (Table                 *table,
+                         const char            *id,
+                         gboolean               create,
+                         GDBusMethodInvocation *invocation)
+{
+  PermissionDbEntry *entry;
+
+  entry = permission_db_lookup (table->db, id);
+  if (entry == NULL)
+    {
+      if (create)
+        {
+          entry = permission_db_entry_new (NULL);
+        }
+      else
+        {
+          g_dbus_method_invocation_return_error (invocation,
+                                                 XDG_DESKTOP_PORTAL_ERROR, XDG_DESKTOP_PORTAL_ERROR_NOT_FOUND,
+                                                 "Id %s not found", id);
+          return NULL;
+        }
+    }
+
+  return entry;
+}
+
+/* Stores @new_entry as @id, and replies to @invocation once it is written */
+static void
+update_entry (XdgPermissionStore    *object,
+              GDBusMethodInvocation *invocation,
+              Table                 *table,
+              const char            *table_name,
+              const char            *id,
+              PermissionDbEntry     *new_entry)
+{
+  permission_db_set_entry (table->db, id, new_entry);
+  emit_changed (object, table_name, id, new_entry);
+
+  ensure_writeout (table, invocation);
+}
+
 static gboolean
 handle_set_permission (XdgPermissionStore     *object,
                        GDBusMethodInvocation  *invocation,
@@ -416,27 +545,55 @@ handle_set_permission (XdgPermissionStore     *object,
   if (table == NULL)
     return TRUE;
 
-  entry = permission_db_lookup (table->db, id);
+  entry = lookup_entry_for_update (table, id, create, invocation);
   if (entry == NULL)
-    {
-      if (create)
-        {
-          entry = permission_db_entry_new (NULL);
-        }
-      else
-        {
-          g_dbus_method_invocation_return_error (invocation,
-                                                 XDG_DESKTOP_PORTAL_ERROR, XDG_DESKTOP_PORTAL_ERROR_NOT_FOUND,
-                                                 "Id %s not found", id);
-          return TRUE;
-        }
-    }
+    return TRUE;
 
   new_entry = permission_db_entry_set_app_permissions (entry, app, (const char **) permissions);
-  permission_db_set_entry (table->db, id, new_entry);
-  emit_changed (object, table_name, id, new_entry);
+  update_entry (object, invocation, table, table_name, id, new_entry);
 
-  ensure_writeout (table, invocation);
+  return TRUE;
+}
+
+static gboolean
+handle_set_permissions (XdgPermissionStore     *object,
+                        GDBusMethodInvocation  *invocation,
+                        const gchar            *table_name,
+                        gboolean                create,
+                        const gchar            *id,
+                        GVariant               *app_permissions)
+{
+  Table *table;
+  GVariantIter iter;
+  GVariant *child;
+
+  g_autoptr(PermissionDbEntry) new_entry = NULL;
+
+  table = lookup_table (table_name, invocation);
+  if (table == NULL)
+    return TRUE;
+
+  new_entry = lookup_entry_for_update (table, id, create, invocation);
+  if (new_entry == NULL)
+    return TRUE;
+
+  g_variant_iter_init (&iter, app_permissions);
+  while ((child = g_variant_iter_next_value (&iter)))
+    {
+      g_autoptr(PermissionDbEntry) old_entry = NULL;
+      const char *child_app_id;
+      g_autofree const char **permissions;
+
+      g_variant_get (child, "{&s^a&s}", &child_app_id, &permissions);
+
+      old_entry = new_entry;
+      new_entry = permission_db_entry_set_app_permissions (new_entry, child_app_id, (const char **) permissions);
+
+      g_variant_unref (child);
+    }
+
+  /* A single change and writeout for all the apps */
+  update_entry (object, invocation, table, table_name, id, new_entry);
 
   return TRUE;
 }
@@ -481,14 +638,19 @@ handle_set_value (XdgPermissionStore     *object,
       new_entry = permission_db_entry_modify_data (entry, data_child);
     }
 
-  permission_db_set_entry (table->db, id, new_entry);
-  emit_changed (object, table_name, id, new_entry);
-
-  ensure_writeout (table, invocation);
+  update_entry (object, invocation, table, table_name, id, new_entry);
 
   return TRUE;
 }
 
+void
+xdg_permission_store_set_write_delay (guint delay_ms,
+                                      guint max_delay_ms)
+{
+  write_delay_ms = delay_ms;
+  max_write_delay_ms = MAX (delay_ms, max_delay_ms);
+}
+
 void
 xdg_permission_store_start (GDBusConnection *connection)
 {
@@ -502,12 +664,16 @@ xdg_permission_store_start (GDBusConnection *connection)
 
   store = xdg_permission_store_skeleton_new ();
 
-  xdg_permission_store_set_version (XDG_PERMISSION_STORE (store), 2);
+  xdg_permission_store_set_version (XDG_PERMISSION_STORE (store), 4);
+  xdg_permission_store_set_writes_avoided (XDG_PERMISSION_STORE (store), writes_avoided);
+  permission_store = XDG_PERMISSION_STORE (store);
 
   g_signal_connect (store, "handle-list", G_CALLBACK (handle_list), NULL);
+  g_signal_connect (store, "handle-list-paged", G_CALLBACK (handle_list_paged), NULL);
   g_signal_connect (store, "handle-lookup", G_CALLBACK (handle_lookup), NULL);
   g_signal_connect (store, "handle-set", G_CALLBACK (handle_set), NULL);
   g_signal_connect (store, "handle-set-permission", G_CALLBACK (handle_set_permission), NULL);
+  g_signal_connect (store, "handle-set-permissions", G_CALLBACK (handle_set_permissions), NULL);
   g_signal_connect (store, "handle-set-value", G_CALLBACK (handle_set_value), NULL);
   g_signal_connect (store, "handle-delete", G_CALLBACK (handle_delete), NULL);
   g_signal_connect (store, "handle-delete-permission", G_CALLBACK (handle_delete_permission), NULL);
@@ -6,4 +6,7 @@
 
 #include <gio/gio.h>
 
+void xdg_permission_store_set_write_delay (guint delay_ms,
+                                           guint max_delay_ms);
+
 void xdg_permission_store_start (GDBusConnection *connection);
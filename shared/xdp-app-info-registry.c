@@ -8,11 +8,24 @@
 
 #include "xdp-app-info.h"
 
+/* An identification of a sender in progress. Concurrent first calls from
+ * the same peer wait for it instead of identifying the peer again. */
+typedef struct
+{
+  int ref_count; /* protected by app_infos_mutex */
+  GCond cond;
+  gboolean done;
+  gboolean deleted; /* the peer went away, don't cache the result */
+  XdpAppInfo *app_info;
+  GError *error;
+} XdpAppInfoResolution;
+
 struct _XdpAppInfoRegistry
 {
   GObject parent_instance;
 
   GHashTable *app_infos; /* unique dbus name -> app info */
+  GHashTable *resolutions; /* unique dbus name -> XdpAppInfoResolution */
   GMutex app_infos_mutex;
 };
 
@@ -20,6 +33,30 @@ G_DEFINE_FINAL_TYPE (XdpAppInfoRegistry,
                      xdp_app_info_registry,
                      G_TYPE_OBJECT);
 
+static XdpAppInfoResolution *
+xdp_app_info_resolution_new (void)
+{
+  XdpAppInfoResolution *resolution = g_new0 (XdpAppInfoResolution, 1);
+
+  resolution->ref_count = 1;
+  g_cond_init (&resolution->cond);
+
+  return resolution;
+}
+
+/* Must be called with app_infos_mutex held */
+static void
+xdp_app_info_resolution_unref (XdpAppInfoResolution *resolution)
+{
+  if (--resolution->ref_count > 0)
+    return;
+
+  g_cond_clear (&resolution->cond);
+  g_clear_object (&resolution->app_info);
+  g_clear_error (&resolution->error);
+  g_free (resolution);
+}
+
 static void
 xdp_app_info_registry_dispose (GObject *object)
 {
@@ -29,6 +66,7 @@ xdp_app_info_registry_dispose (GObject *object)
     {
       g_mutex_clear (&registry->app_infos_mutex);
       g_clear_pointer (&registry->app_infos, g_hash_table_unref);
+      g_clear_pointer (&registry->resolutions, g_hash_table_unref);
     }
 
   G_OBJECT_CLASS (xdp_app_info_registry_parent_class)->dispose (object);
@@ -55,6 +93,9 @@ xdp_app_info_registry_new (void)
   registry->app_infos = g_hash_table_new_full (g_str_hash, g_str_equal,
                                                g_free,
                                                g_object_unref);
+  registry->resolutions = g_hash_table_new_full (g_str_hash, g_str_equal,
+                                                 g_free,
+                                                 (GDestroyNotify) xdp_app_info_resolution_unref);
   g_mutex_init (&registry->app_infos_mutex);
 
   return registry;
@@ -84,14 +125,12 @@ xdp_app_info_registry_has_sender (XdpAppInfoRegistry *registry,
   return g_hash_table_contains (registry->app_infos, sender);
 }
 
-void
-xdp_app_info_registry_insert (XdpAppInfoRegistry *registry,
-                              XdpAppInfo         *app_info)
+static void
+xdp_app_info_registry_insert_locked (XdpAppInfoRegistry *registry,
+                                     XdpAppInfo         *app_info)
 {
   const char *sender = xdp_app_info_get_sender (app_info);
 
-  G_MUTEX_AUTO_LOCK (&registry->app_infos_mutex, locker);
-
   g_debug ("Adding XdpAppInfo: %s app '%s' for %s",
            xdp_app_info_get_engine_display_name (app_info),
            xdp_app_info_get_id (app_info),
@@ -102,14 +141,28 @@ xdp_app_info_registry_insert (XdpAppInfoRegistry *registry,
                        g_object_ref (app_info));
 }
 
+void
+xdp_app_info_registry_insert (XdpAppInfoRegistry *registry,
+                              XdpAppInfo         *app_info)
+{
+  G_MUTEX_AUTO_LOCK (&registry->app_infos_mutex, locker);
+
+  xdp_app_info_registry_insert_locked (registry, app_info);
+}
+
 void
 xdp_app_info_registry_delete (XdpAppInfoRegistry *registry,
                               const char         *sender)
 {
+  XdpAppInfoResolution *resolution;
   XdpAppInfo *app_info = NULL;
 
   G_MUTEX_AUTO_LOCK (&registry->app_infos_mutex, locker);
 
+  resolution = g_hash_table_lookup (registry->resolutions, sender);
+  if (resolution)
+    resolution->deleted = TRUE;
+
   app_info = g_hash_table_lookup (registry->app_infos, sender);
   if (!app_info)
     return;
@@ -129,10 +182,16 @@ xdp_app_info_registry_ensure_for_invocation_sync (XdpAppInfoRegistry     *regist
                                                   GError                **error)
 {
   g_autoptr(XdpAppInfo) app_info = NULL;
+  g_autoptr(GError) local_error = NULL;
+  g_autoptr(GMutexLocker) locker = NULL;
+  XdpAppInfoResolution *resolution;
   const char *sender;
 
   sender = g_dbus_method_invocation_get_sender (invocation);
-  app_info = xdp_app_info_registry_lookup_sender (registry, sender);
+
+  locker = g_mutex_locker_new (&registry->app_infos_mutex);
+
+  app_info = g_hash_table_lookup (registry->app_infos, sender);
   if (app_info)
     {
       g_debug ("Found XdpAppInfo in cache: %s app '%s' for %s",
@@ -140,16 +199,58 @@ xdp_app_info_registry_ensure_for_invocation_sync (XdpAppInfoRegistry     *regist
                xdp_app_info_get_id (app_info),
                sender);
 
+      return g_object_ref (app_info);
+    }
+
+  resolution = g_hash_table_lookup (registry->resolutions, sender);
+  if (resolution)
+    {
+      g_debug ("Waiting for XdpAppInfo of %s", sender);
+
+      resolution->ref_count++;
+      while (!resolution->done)
+        g_cond_wait (&resolution->cond, &registry->app_infos_mutex);
+
+      if (resolution->app_info)
+        app_info = g_object_ref (resolution->app_info);
+      else
+        g_propagate_error (error, g_error_copy (resolution->error));
+
+      xdp_app_info_resolution_unref (resolution);
+
       return g_steal_pointer (&app_info);
     }
 
+  resolution = xdp_app_info_resolution_new ();
+  resolution->ref_count++;
+  g_hash_table_insert (registry->resolutions, g_strdup (sender), resolution);
+
+  /* Identifying the peer blocks on D-Bus and the filesystem, don't hold
+   * the lock meanwhile */
+  g_clear_pointer (&locker, g_mutex_locker_free);
+
   app_info = xdp_app_info_new_for_invocation_sync (invocation,
                                                    cancellable,
-                                                   error);
-  if (!app_info)
-    return NULL;
+                                                   &local_error);
+
+  locker = g_mutex_locker_new (&registry->app_infos_mutex);
 
-  xdp_app_info_registry_insert (registry, app_info);
+  if (app_info && !resolution->deleted)
+    xdp_app_info_registry_insert_locked (registry, app_info);
+
+  resolution->done = TRUE;
+  resolution->app_info = app_info ? g_object_ref (app_info) : NULL;
+  resolution->error = local_error ? g_error_copy (local_error) : NULL;
+  g_cond_broadcast (&resolution->cond);
+
+  g_hash_table_remove (registry->resolutions, sender);
+  xdp_app_info_resolution_unref (resolution);
+
+  if (!app_info)
+    {
+      g_propagate_error (error, g_steal_pointer (&local_error));
+      return NULL;
+    }
 
   return g_steal_pointer (&app_info);
 }
@@ -543,6 +543,54 @@ xdp_app_info_get_pidns (XdpAppInfo  *app_info,
   return TRUE;
 }
 
+/* Maps @pids from the pid namespace of the app to ours, in place */
+gboolean
+xdp_app_info_map_pids (XdpAppInfo  *app_info,
+                       pid_t       *pids,
+                       guint        n_pids,
+                       GError     **error)
+{
+  XdpAppInfoPrivate *priv = xdp_app_info_get_instance_private (app_info);
+  g_autofree pid_t *unmapped = NULL;
+  guint n_unmapped = 0;
+  pid_t outside;
+  pid_t inside;
+  ino_t pidns_id;
+
+  if (!xdp_app_info_get_pidns (app_info, &pidns_id, error))
+    return FALSE;
+
+  if (pidns_id == 0)
+    return TRUE;
+
+  /* Apps usually pass their own pid, which the pidfd of the caller maps
+   * without scanning /proc */
+  if (priv->pidfd < 0 ||
+      !xdp_pidfd_get_nspid (priv->pidfd, &outside, &inside, NULL))
+    return xdp_map_pids (pidns_id, pids, n_pids, error);
+
+  unmapped = g_new0 (pid_t, n_pids);
+  for (guint i = 0; i < n_pids; i++)
+    {
+      if (pids[i] != inside)
+        unmapped[n_unmapped++] = pids[i];
+    }
+
+  if (n_unmapped > 0 && !xdp_map_pids (pidns_id, unmapped, n_unmapped, error))
+    return FALSE;
+
+  n_unmapped = 0;
+  for (guint i = 0; i < n_pids; i++)
+    {
+      if (pids[i] == inside)
+        pids[i] = outside;
+      else
+        pids[i] = unmapped[n_unmapped++];
+    }
+
+  return TRUE;
+}
+
 static char *
 remap_path (XdpAppInfo *app_info,
             const char *path)
@@ -59,6 +59,11 @@ gboolean xdp_app_info_get_pidns (XdpAppInfo  *app_info,
                                  ino_t       *pidns_id_out,
                                  GError     **error);
 
+gboolean xdp_app_info_map_pids (XdpAppInfo  *app_info,
+                                pid_t       *pids,
+                                guint        n_pids,
+                                GError     **error);
+
 char * xdp_app_info_get_path_for_fd (XdpAppInfo   *app_info,
                                      int           fd,
                                      int           require_st_mode,
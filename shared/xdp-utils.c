@@ -19,6 +19,7 @@
 #include <sys/random.h>
 
 #include "xdp-types.h"
+#include "xdp-validator-worker.h"
 
 #if HAVE_PIDFD_OPEN
 #include <sys/pidfd.h>
@@ -676,10 +677,191 @@ xdp_has_path_prefix (const char *str,
     }
 }
 
-#define VALIDATOR_INPUT_FD 3
+#define VALIDATOR_IDLE_TIMEOUT_S 60
 #define ICON_VALIDATOR_GROUP "Icon Validator"
 #define SOUND_VALIDATOR_GROUP "Sound Validator"
 
+/* Workers keyed on the validator and whether it is sandboxed, so changing
+ * the validator configuration never reuses a process of another one. They
+ * are never freed, callers keep using them without holding the lock. */
+static GHashTable *validator_workers = NULL;
+G_LOCK_DEFINE_STATIC (validator_workers);
+
+static XdpValidatorWorker *
+get_validator_worker (const char *validator,
+                      gboolean    sandbox)
+{
+  g_autofree char *key = NULL;
+  XdpValidatorWorker *worker;
+
+  key = g_strdup_printf ("%s:%s", sandbox ? "sandboxed" : "insecure", validator);
+
+  G_LOCK (validator_workers);
+  if (validator_workers == NULL)
+    validator_workers = g_hash_table_new_full (g_str_hash, g_str_equal,
+                                               g_free,
+                                               (GDestroyNotify) xdp_validator_worker_free);
+
+  worker = g_hash_table_lookup (validator_workers, key);
+  if (worker == NULL)
+    {
+      worker = xdp_validator_worker_new (validator, sandbox, VALIDATOR_IDLE_TIMEOUT_S);
+      g_hash_table_insert (validator_workers, g_steal_pointer (&key), worker);
+    }
+  G_UNLOCK (validator_workers);
+
+  return worker;
+}
+
+/* Verdicts of the validators, keyed on the validator, whether it is
+ * sandboxed, the ruleset and the digest of the sealed contents. Sealed fds
+ * can't change, so a hit can skip the validator entirely. */
+#define VALIDATION_CACHE_SIZE 256
+
+typedef struct
+{
+  char *key;
+  gboolean valid;
+  char *format;
+  char *size;
+  GList link;
+} ValidationCacheEntry;
+
+static GHashTable *validation_cache = NULL; /* key -> ValidationCacheEntry */
+static GQueue validation_cache_lru = G_QUEUE_INIT; /* most recent first */
+static guint validation_cache_hits = 0;
+static guint validation_cache_misses = 0;
+G_LOCK_DEFINE_STATIC (validation_cache);
+
+static void
+validation_cache_entry_free (ValidationCacheEntry *entry)
+{
+  g_free (entry->key);
+  g_free (entry->format);
+  g_free (entry->size);
+  g_free (entry);
+}
+
+static char *
+validation_cache_key (XdpSealedFd *sealed_fd,
+                      const char  *validator,
+                      gboolean     sandbox,
+                      const char  *ruleset)
+{
+  g_autoptr(GBytes) bytes = NULL;
+  g_autoptr(GError) error = NULL;
+  g_autofree char *digest = NULL;
+
+  bytes = xdp_sealed_fd_get_bytes (sealed_fd, &error);
+  if (bytes == NULL)
+    {
+      g_debug ("Not caching validation: %s", error->message);
+      return NULL;
+    }
+
+  digest = g_compute_checksum_for_bytes (G_CHECKSUM_SHA256, bytes);
+
+  return g_strdup_printf ("%s:%s:%s:%s", validator,
+                          sandbox ? "sandboxed" : "insecure",
+                          ruleset, digest);
+}
+
+static gboolean
+validation_cache_lookup (const char  *key,
+                         gboolean    *out_valid,
+                         char       **out_format,
+                         char       **out_size)
+{
+  ValidationCacheEntry *entry = NULL;
+
+  G_LOCK (validation_cache);
+
+  if (validation_cache != NULL)
+    entry = g_hash_table_lookup (validation_cache, key);
+
+  if (entry == NULL)
+    {
+      validation_cache_misses++;
+      G_UNLOCK (validation_cache);
+      return FALSE;
+    }
+
+  validation_cache_hits++;
+  g_queue_unlink (&validation_cache_lru, &entry->link);
+  g_queue_push_head_link (&validation_cache_lru, &entry->link);
+
+  g_debug ("Validation cache hit for %s (%u hits, %u misses)",
+           key, validation_cache_hits, validation_cache_misses);
+
+  *out_valid = entry->valid;
+  if (out_format)
+    *out_format = g_strdup (entry->format);
+  if (out_size)
+    *out_size = g_strdup (entry->size);
+
+  G_UNLOCK (validation_cache);
+
+  return TRUE;
+}
+
+static void
+validation_cache_insert (const char *key,
+                         gboolean    valid,
+                         const char *format,
+                         const char *size)
+{
+  ValidationCacheEntry *entry;
+
+  if (key == NULL)
+    return;
+
+  G_LOCK (validation_cache);
+
+  if (validation_cache == NULL)
+    validation_cache = g_hash_table_new_full (g_str_hash, g_str_equal, NULL,
+                                              (GDestroyNotify) validation_cache_entry_free);
+
+  entry = g_hash_table_lookup (validation_cache, key);
+  if (entry != NULL)
+    {
+      /* Validated concurrently, the verdict is the same */
+      G_UNLOCK (validation_cache);
+      return;
+    }
+
+  entry = g_new0 (ValidationCacheEntry, 1);
+  entry->key = g_strdup (key);
+  entry->valid = valid;
+  entry->format = g_strdup (format);
+  entry->size = g_strdup (size);
+  entry->link.data = entry;
+
+  g_queue_push_head_link (&validation_cache_lru, &entry->link);
+  g_hash_table_insert (validation_cache, entry->key, entry);
+
+  while (validation_cache_lru.length > VALIDATION_CACHE_SIZE)
+    {
+      GList *oldest = g_queue_pop_tail_link (&validation_cache_lru);
+      ValidationCacheEntry *evicted = oldest->data;
+
+      g_hash_table_remove (validation_cache, evicted->key);
+    }
+
+  G_UNLOCK (validation_cache);
+}
+
+void
+xdp_validation_cache_get_stats (guint *out_hits,
+                                guint *out_misses)
+{
+  G_LOCK (validation_cache);
+  if (out_hits)
+    *out_hits = validation_cache_hits;
+  if (out_misses)
+    *out_misses = validation_cache_misses;
+  G_UNLOCK (validation_cache);
+}
+
 static const char *
 icon_type_to_string (XdpIconType icon_type)
 {
@@ -705,14 +887,23 @@ xdp_validate_icon (XdpSealedFd  *icon,
   g_autofree char *format = NULL;
   g_autoptr(GError) error = NULL;
   const char *icon_validator = LIBEXECDIR "/xdg-desktop-portal-validate-icon";
-  const char *args[7];
+  XdpValidatorWorker *worker;
   int size;
-  size_t i;
+  g_autofree char *size_str = NULL;
   g_autofree char *output = NULL;
+  g_autofree char *cache_key = NULL;
   g_autoptr(GKeyFile) key_file = NULL;
+  gboolean sandbox;
+  gboolean valid;
 
   if (g_getenv ("XDP_VALIDATE_ICON"))
     icon_validator = g_getenv ("XDP_VALIDATE_ICON");
+  sandbox = g_getenv ("XDP_VALIDATE_ICON_INSECURE") == NULL;
+
+  cache_key = validation_cache_key (icon, icon_validator, sandbox,
+                                    icon_type_to_string (icon_type));
+  if (cache_key && validation_cache_lookup (cache_key, &valid, out_format, out_size))
+    return valid;
 
   if (!g_file_test (icon_validator, G_FILE_TEST_EXISTS))
     {
@@ -720,23 +911,16 @@ xdp_validate_icon (XdpSealedFd  *icon,
       return FALSE;
     }
 
-  i = 0;
-  args[i++] = icon_validator;
-
-  if (g_getenv ("XDP_VALIDATE_ICON_INSECURE") == NULL)
-    args[i++] = "--sandbox";
-
-  args[i++] = "--fd";
-  args[i++] = G_STRINGIFY (VALIDATOR_INPUT_FD);
-  args[i++] = "--ruleset";
-  args[i++] = icon_type_to_string (icon_type);
-  g_assert (i < G_N_ELEMENTS (args));
-  args[i++] = NULL;
-
-  output = xdp_spawn_full (args, xdp_sealed_fd_dup_fd (icon), VALIDATOR_INPUT_FD, &error);
+  worker = get_validator_worker (icon_validator, sandbox);
+  output = xdp_validator_worker_validate (worker,
+                                          xdp_sealed_fd_get_fd (icon),
+                                          icon_type_to_string (icon_type),
+                                          &error);
   if (!output)
     {
       g_warning ("Icon validation: Rejecting icon because validator failed: %s", error->message);
+      if (g_error_matches (error, G_IO_ERROR, G_IO_ERROR_INVALID_DATA))
+        validation_cache_insert (cache_key, FALSE, NULL, NULL);
       return FALSE;
     }
 
@@ -757,10 +941,13 @@ xdp_validate_icon (XdpSealedFd  *icon,
       return FALSE;
     }
 
+  size_str = g_strdup_printf ("%d", size);
+  validation_cache_insert (cache_key, TRUE, format, size_str);
+
   if (out_format)
     *out_format = g_steal_pointer (&format);
   if (out_size)
-    *out_size = g_strdup_printf ("%d", size);
+    *out_size = g_steal_pointer (&size_str);
 
   return TRUE;
 }
@@ -768,15 +955,22 @@ xdp_validate_icon (XdpSealedFd  *icon,
 gboolean
 xdp_validate_sound (XdpSealedFd *sound)
 {
-  const char *args[5];
   g_autoptr(GError) error = NULL;
   g_autoptr(GKeyFile) key_file = NULL;
   g_autofree char *output = NULL;
   const char *sound_validator = LIBEXECDIR "/xdg-desktop-portal-validate-sound";
-  gsize i;
+  XdpValidatorWorker *worker;
+  g_autofree char *cache_key = NULL;
+  gboolean sandbox;
+  gboolean valid;
 
   if (g_getenv ("XDP_VALIDATE_SOUND"))
     sound_validator = g_getenv ("XDP_VALIDATE_SOUND");
+  sandbox = g_getenv ("XDP_VALIDATE_SOUND_INSECURE") == NULL;
+
+  cache_key = validation_cache_key (sound, sound_validator, sandbox, "sound");
+  if (cache_key && validation_cache_lookup (cache_key, &valid, NULL, NULL))
+    return valid;
 
   if (!g_file_test (sound_validator, G_FILE_TEST_EXISTS))
     {
@@ -784,21 +978,13 @@ xdp_validate_sound (XdpSealedFd *sound)
       return FALSE;
     }
 
-  i = 0;
-  args[i++] = sound_validator;
-
-  if (g_getenv ("XDP_VALIDATE_SOUND_INSECURE") == NULL)
-    args[i++] = "--sandbox";
-
-  args[i++] = "--fd";
-  args[i++] = G_STRINGIFY (VALIDATOR_INPUT_FD);
-  g_assert (i < G_N_ELEMENTS (args));
-  args[i++] = NULL;
-
-  output = xdp_spawn_full (args, xdp_sealed_fd_dup_fd (sound), VALIDATOR_INPUT_FD, &error);
+  worker = get_validator_worker (sound_validator, sandbox);
+  output = xdp_validator_worker_validate (worker, xdp_sealed_fd_get_fd (sound), "", &error);
   if (!output)
     {
       g_warning ("Sound validation: Rejecting sound because validator failed: %s", error->message);
+      if (g_error_matches (error, G_IO_ERROR, G_IO_ERROR_INVALID_DATA))
+        validation_cache_insert (cache_key, FALSE, NULL, NULL);
       return FALSE;
     }
 
@@ -809,6 +995,8 @@ xdp_validate_sound (XdpSealedFd *sound)
       return FALSE;
     }
 
+  validation_cache_insert (cache_key, TRUE, NULL, NULL);
+
   return TRUE;
 }
 
@@ -912,22 +1100,24 @@ parse_status_field_nspid (const char *val,
   return parse_pid (val, pid);
 }
 
-static pid_t
-pidfd_to_pid (int         fdinfo,
-              const int   pidfd,
-              GError    **error)
+static gboolean
+parse_pidfd_fdinfo (int         fdinfo,
+                    const int   pidfd,
+                    pid_t      *pid_out,
+                    pid_t      *nspid_out,
+                    GError    **error)
 {
   g_autofree char *name = NULL;
   g_autofree char *key = NULL;
   g_autofree char *val = NULL;
-  gboolean found = FALSE;
+  gboolean have_pid = pid_out == NULL;
+  gboolean have_nspid = nspid_out == NULL;
   FILE *f = NULL;
   size_t keylen = 0;
   size_t vallen = 0;
   ssize_t n;
   int fd;
   int r = 0;
-  pid_t pid = -1;
 
   name = g_strdup_printf ("%d", pidfd);
 
@@ -961,13 +1151,19 @@ pidfd_to_pid (int         fdinfo,
 
     g_strstrip (key);
 
-    if (!strncmp (key, "Pid", 3))
+    if (!have_pid && !strncmp (key, "Pid", 3))
       {
-        r = parse_status_field_pid (val, &pid);
-        found = r > -1;
+        r = parse_status_field_pid (val, pid_out);
+        have_pid = r > -1;
+      }
+    else if (!have_nspid && !strncmp (key, "NSpid", strlen ("NSpid")))
+      {
+        g_strstrip (val);
+        r = parse_status_field_nspid (val, nspid_out);
+        have_nspid = r > -1;
       }
 
-  } while (r == 0 && !found);
+  } while (r == 0 && (!have_pid || !have_nspid));
 
   fclose (f);
 
@@ -976,12 +1172,33 @@ pidfd_to_pid (int         fdinfo,
       g_set_error (error, G_IO_ERROR, G_IO_ERROR_FAILED,
                    "Could not parse fdinfo::%s: %s",
                    key, g_strerror (-r));
+      return FALSE;
     }
-  else if (!found)
+  else if (!have_pid)
     {
       g_set_error_literal (error, G_IO_ERROR, G_IO_ERROR_FAILED,
                            "Could not parse fdinfo: Pid field missing");
+      return FALSE;
     }
+  else if (!have_nspid)
+    {
+      g_set_error_literal (error, G_IO_ERROR, G_IO_ERROR_FAILED,
+                           "Could not parse fdinfo: NSpid field missing");
+      return FALSE;
+    }
+
+  return TRUE;
+}
+
+static pid_t
+pidfd_to_pid (int         fdinfo,
+              const int   pidfd,
+              GError    **error)
+{
+  pid_t pid = -1;
+
+  if (!parse_pidfd_fdinfo (fdinfo, pidfd, &pid, NULL, error))
+    return -1;
 
   return pid;
 }
@@ -1029,6 +1246,25 @@ xdp_pidfds_to_pids (const int  *pidfds,
   return i == count;
 }
 
+gboolean
+xdp_pidfd_get_nspid (int      pidfd,
+                     pid_t   *pid,
+                     pid_t   *nspid,
+                     GError **error)
+{
+  g_autofd int fdinfo = -1;
+
+  g_return_val_if_fail (pidfd >= 0, FALSE);
+  g_return_val_if_fail (pid != NULL, FALSE);
+  g_return_val_if_fail (nspid != NULL, FALSE);
+
+  fdinfo = open_fdinfo_dir (error);
+  if (fdinfo == -1)
+    return FALSE;
+
+  return parse_pidfd_fdinfo (fdinfo, pidfd, pid, nspid, error);
+}
+
 gboolean
 xdp_pidfd_get_pidns (int      pidfd,
                      ino_t   *ns,
@@ -1196,6 +1432,214 @@ parse_status_file (int    pid_dirfd,
   return 0;
 }
 
+static int
+parse_stat_start_time (int      pid_dirfd,
+                       guint64 *start_time)
+{
+  g_autofd int fd = -1;
+  char buf[4096];
+  char *end;
+  char *p;
+  guint64 v;
+  ssize_t n;
+
+  fd = openat (pid_dirfd, "stat", O_RDONLY | O_CLOEXEC | O_NOCTTY);
+  if (fd == -1)
+    return -errno;
+
+  n = read (fd, buf, sizeof (buf) - 1);
+  if (n < 0)
+    return -errno;
+
+  buf[n] = '\0';
+
+  /* The command name in field 2 may contain spaces and parentheses */
+  p = strrchr (buf, ')');
+  if (p == NULL)
+    return -ENXIO;
+
+  /* The start time is field 22 */
+  for (int field = 2; field < 22; field++)
+    {
+      p = strchr (p + 1, ' ');
+      if (p == NULL)
+        return -ENXIO;
+    }
+
+  errno = 0;
+  v = g_ascii_strtoull (p + 1, &end, 10);
+  if (end == p + 1)
+    return -ENXIO;
+  else if (errno != 0)
+    return -errno;
+
+  *start_time = v;
+
+  return 0;
+}
+
+/* A short-lived cache of (pidns, scanned directory, pid inside of it) -> pid
+ * outside of it. The directory tells the pids of /proc apart from the
+ * thread ids of /proc/PID/task. Entries are validated against the start
+ * time of the process on every use, so a recycled pid can't be mapped to
+ * another process. */
+#define PID_CACHE_SIZE 128
+#define PID_CACHE_TTL_US (30 * G_USEC_PER_SEC)
+
+typedef struct
+{
+  ino_t pidns;
+  ino_t proc_ino;
+  pid_t inside;
+} PidCacheKey;
+
+typedef struct
+{
+  PidCacheKey key;
+  pid_t outside;
+  guint64 start_time;
+  gint64 expires_at;
+} PidCacheEntry;
+
+static GHashTable *pid_cache = NULL; /* PidCacheKey -> PidCacheEntry */
+G_LOCK_DEFINE_STATIC (pid_cache);
+
+static guint
+pid_cache_key_hash (gconstpointer data)
+{
+  const PidCacheKey *key = data;
+
+  return ((guint) key->pidns * 31 + (guint) key->proc_ino) * 31 + (guint) key->inside;
+}
+
+static gboolean
+pid_cache_key_equal (gconstpointer a,
+                     gconstpointer b)
+{
+  const PidCacheKey *key_a = a;
+  const PidCacheKey *key_b = b;
+
+  return key_a->pidns == key_b->pidns &&
+         key_a->proc_ino == key_b->proc_ino &&
+         key_a->inside == key_b->inside;
+}
+
+static gboolean
+pid_cache_entry_expired (gpointer key,
+                         gpointer value,
+                         gpointer user_data)
+{
+  PidCacheEntry *entry = value;
+  gint64 *now = user_data;
+
+  return entry->expires_at <= *now;
+}
+
+static void
+pid_cache_insert (ino_t   pidns,
+                  ino_t   proc_ino,
+                  pid_t   inside,
+                  pid_t   outside,
+                  guint64 start_time)
+{
+  PidCacheEntry *entry;
+  gint64 now = g_get_monotonic_time ();
+
+  G_LOCK (pid_cache);
+
+  if (pid_cache == NULL)
+    pid_cache = g_hash_table_new_full (pid_cache_key_hash,
+                                       pid_cache_key_equal,
+                                       NULL, g_free);
+
+  if (g_hash_table_size (pid_cache) >= PID_CACHE_SIZE)
+    g_hash_table_foreach_remove (pid_cache, pid_cache_entry_expired, &now);
+
+  if (g_hash_table_size (pid_cache) >= PID_CACHE_SIZE)
+    g_hash_table_remove_all (pid_cache);
+
+  entry = g_new0 (PidCacheEntry, 1);
+  entry->key.pidns = pidns;
+  entry->key.proc_ino = proc_ino;
+  entry->key.inside = inside;
+  entry->outside = outside;
+  entry->start_time = start_time;
+  entry->expires_at = now + PID_CACHE_TTL_US;
+  g_hash_table_replace (pid_cache, &entry->key, entry);
+
+  G_UNLOCK (pid_cache);
+}
+
+static void
+pid_cache_remove (ino_t pidns,
+                  ino_t proc_ino,
+                  pid_t inside)
+{
+  PidCacheKey key = { pidns, proc_ino, inside };
+
+  G_LOCK (pid_cache);
+
+  if (pid_cache != NULL)
+    g_hash_table_remove (pid_cache, &key);
+
+  G_UNLOCK (pid_cache);
+}
+
+static gboolean
+pid_cache_lookup (int    proc_fd,
+                  ino_t  proc_ino,
+                  ino_t  pidns,
+                  pid_t  inside,
+                  uid_t  target_uid,
+                  pid_t *outside_out)
+{
+  PidCacheKey key = { pidns, proc_ino, inside };
+  g_autofd int pid_dirfd = -1;
+  PidCacheEntry *cached = NULL;
+  PidCacheEntry entry;
+  char name[32];
+  guint64 start_time;
+  pid_t pid;
+  uid_t uid;
+  ino_t ns;
+
+  G_LOCK (pid_cache);
+
+  if (pid_cache != NULL)
+    cached = g_hash_table_lookup (pid_cache, &key);
+
+  if (cached == NULL || cached->expires_at <= g_get_monotonic_time ())
+    {
+      G_UNLOCK (pid_cache);
+      return FALSE;
+    }
+
+  entry = *cached;
+
+  G_UNLOCK (pid_cache);
+
+  /* Make sure this is still the same process, in the same pidns */
+  g_snprintf (name, sizeof (name), "%d", entry.outside);
+  pid_dirfd = openat (proc_fd, name,
+                      O_RDONLY | O_NONBLOCK | O_DIRECTORY | O_CLOEXEC | O_NOCTTY);
+
+  if (pid_dirfd == -1 ||
+      parse_stat_start_time (pid_dirfd, &start_time) < 0 ||
+      start_time != entry.start_time ||
+      !xdp_pid_dirfd_get_pidns (pid_dirfd, &ns, NULL) ||
+      ns != pidns ||
+      parse_status_file (pid_dirfd, &pid, &uid) < 0 ||
+      pid != inside ||
+      uid != target_uid)
+    {
+      pid_cache_remove (pidns, proc_ino, inside);
+      return FALSE;
+    }
+
+  *outside_out = entry.outside;
+  return TRUE;
+}
+
 static inline gboolean
 find_pid (pid_t *pids,
           guint  n_pids,
@@ -1214,6 +1658,29 @@ find_pid (pid_t *pids,
   return FALSE;
 }
 
+static guint
+set_mapped_pid (pid_t *pids,
+                pid_t *res,
+                guint  n_pids,
+                guint  idx,
+                pid_t  outside)
+{
+  guint count = 0;
+
+  /* this handles the first occurrence, already identified by find_pid,
+   * as well as duplicate entries */
+  for (guint i = idx; i < n_pids; i++)
+    {
+      if (pids[i] == pids[idx])
+        {
+          res[i] = outside;
+          count++;
+        }
+    }
+
+  return count;
+}
+
 gboolean
 xdp_map_pids_full (DIR     *proc,
                    ino_t    pidns,
@@ -1224,17 +1691,34 @@ xdp_map_pids_full (DIR     *proc,
 {
   pid_t *res = NULL;
   struct dirent *de;
+  struct stat proc_st;
+  gboolean use_cache;
   guint count = 0;
 
   res = g_alloca (sizeof (pid_t) * n_pids);
   memset (res, 0, sizeof (pid_t) * n_pids);
 
-  while ((de = readdir (proc)) != NULL)
+  use_cache = fstat (dirfd (proc), &proc_st) == 0;
+
+  for (guint i = 0; use_cache && i < n_pids; i++)
+    {
+      pid_t outside;
+
+      if (res[i] != 0)
+        continue;
+
+      if (pid_cache_lookup (dirfd (proc), proc_st.st_ino, pidns, pids[i],
+                            target_uid, &outside))
+        count += set_mapped_pid (pids, res, n_pids, i, outside);
+    }
+
+  while (count < n_pids && (de = readdir (proc)) != NULL)
     {
       g_autofd int pid_dirfd = -1;
       pid_t outside = 0;
       pid_t inside = 0;
       uid_t uid = 0;
+      guint64 start_time;
       guint idx;
       ino_t ns = 0;
       int r;
@@ -1242,6 +1726,10 @@ xdp_map_pids_full (DIR     *proc,
       if (de->d_type != DT_DIR)
         continue;
 
+      r = parse_pid (de->d_name, &outside);
+      if (r < 0)
+        continue;
+
       pid_dirfd = openat (dirfd (proc), de->d_name,
                           O_RDONLY | O_NONBLOCK | O_DIRECTORY | O_CLOEXEC | O_NOCTTY);
       if (pid_dirfd == -1)
@@ -1253,15 +1741,11 @@ xdp_map_pids_full (DIR     *proc,
       if (pidns != ns)
         continue;
 
-      r = parse_pid (de->d_name, &outside);
-      if (r < 0)
-        continue;
-
       r = parse_status_file (pid_dirfd, &inside, &uid);
       if (r < 0)
         continue;
 
-      if (!find_pid (pids, n_pids, inside, &idx))
+      if (!find_pid (pids, n_pids, inside, &idx) || res[idx] != 0)
         continue;
 
       /* We got a match, let's make sure the real uids match as well */
@@ -1272,16 +1756,10 @@ xdp_map_pids_full (DIR     *proc,
           return FALSE;
         }
 
-      /* this handles the first occurrence, already identified by find_pid,
-       * as well as duplicate entries */
-      for (guint i = idx; i < n_pids; i++)
-        {
-          if (pids[i] == inside)
-            {
-              res[idx] = outside;
-              count++;
-            }
-        }
+      count += set_mapped_pid (pids, res, n_pids, idx, outside);
+
+      if (use_cache && parse_stat_start_time (pid_dirfd, &start_time) == 0)
+        pid_cache_insert (pidns, proc_st.st_ino, inside, outside, start_time);
     }
 
   if (count != n_pids)
@@ -35,6 +35,9 @@ gboolean xdp_validate_icon (XdpSealedFd  *icon,
 
 gboolean xdp_validate_sound (XdpSealedFd *sound);
 
+void xdp_validation_cache_get_stats (guint *out_hits,
+                                     guint *out_misses);
+
 typedef void (*XdpPeerDisconnectCallback) (const char *name,
                                            gpointer    user_data);
 
@@ -145,6 +148,11 @@ gboolean xdp_pidfds_to_pids (const int  *pidfds,
                              gint        count,
                              GError    **error);
 
+gboolean xdp_pidfd_get_nspid (int      pidfd,
+                              pid_t   *pid,
+                              pid_t   *nspid,
+                              GError **error);
+
 gboolean xdp_pidfd_get_pidns (int      pidfd,
                               ino_t   *ns,
                               GError **error);
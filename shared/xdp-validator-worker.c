@@ -0,0 +1,366 @@
+/* SPDX-License-Identifier: LGPL-2.1-or-later
+ * SPDX-FileCopyrightText: Copyright © the xdg-desktop-portal contributors
+ */
+
+#include "config.h"
+
+#include "xdp-validator-worker.h"
+
+#include <errno.h>
+#include <poll.h>
+#include <string.h>
+#include <sys/socket.h>
+#include <unistd.h>
+
+#include <gio/gio.h>
+
+/* A long-lived icon or sound validator process. Spawning the validator
+ * (and its bwrap sandbox) for every icon is expensive, so a worker keeps
+ * one around and sends it sealed fds over a SOCK_SEQPACKET socket:
+ *
+ *  request: the ruleset name, with the fd attached as SCM_RIGHTS
+ *  reply: '0' followed by the validator key file, or '1' if invalid
+ *
+ * The process is restarted if it dies, stopped when idle, and recycled
+ * after a number of requests to bound the lifetime of a sandbox that has
+ * seen untrusted input.
+ */
+
+#define VALIDATOR_SOCKET_FD 3
+#define VALIDATOR_TIMEOUT_MS (30 * 1000)
+#define VALIDATOR_MAX_REQUESTS 100
+#define VALIDATOR_MAX_REPLY_SIZE 4096
+
+struct _XdpValidatorWorker
+{
+  GMutex lock;
+
+  char *validator;
+  gboolean sandbox;
+  guint idle_timeout_s;
+
+  /* Protected by lock */
+  GSubprocess *subprocess;
+  int socket_fd;
+  guint n_requests;
+  gint64 last_used;
+  GSource *idle_source;
+};
+
+XdpValidatorWorker *
+xdp_validator_worker_new (const char *validator,
+                          gboolean    sandbox,
+                          guint       idle_timeout_s)
+{
+  XdpValidatorWorker *worker = g_new0 (XdpValidatorWorker, 1);
+
+  g_mutex_init (&worker->lock);
+  worker->validator = g_strdup (validator);
+  worker->sandbox = sandbox;
+  worker->idle_timeout_s = idle_timeout_s;
+  worker->socket_fd = -1;
+
+  return worker;
+}
+
+static void
+validator_worker_stop (XdpValidatorWorker *worker,
+                       gboolean            force)
+{
+  if (worker->subprocess == NULL)
+    return;
+
+  g_debug ("Stopping %s worker", worker->validator);
+
+  /* Closing the socket makes the validator exit on its own */
+  g_clear_fd (&worker->socket_fd, NULL);
+  if (force)
+    g_subprocess_force_exit (worker->subprocess);
+  g_clear_object (&worker->subprocess);
+  worker->n_requests = 0;
+}
+
+void
+xdp_validator_worker_free (XdpValidatorWorker *worker)
+{
+  g_mutex_lock (&worker->lock);
+  validator_worker_stop (worker, FALSE);
+  if (worker->idle_source)
+    {
+      g_source_destroy (worker->idle_source);
+      g_clear_pointer (&worker->idle_source, g_source_unref);
+    }
+  g_mutex_unlock (&worker->lock);
+
+  g_mutex_clear (&worker->lock);
+  g_free (worker->validator);
+  g_free (worker);
+}
+
+static gboolean
+idle_timeout_cb (gpointer user_data)
+{
+  XdpValidatorWorker *worker = user_data;
+  gint64 idle_s;
+
+  /* Busy validating, which can take a while, so check again later */
+  if (!g_mutex_trylock (&worker->lock))
+    return G_SOURCE_CONTINUE;
+
+  idle_s = (g_get_monotonic_time () - worker->last_used) / G_USEC_PER_SEC;
+  if (worker->subprocess != NULL && idle_s < worker->idle_timeout_s)
+    {
+      g_mutex_unlock (&worker->lock);
+      return G_SOURCE_CONTINUE;
+    }
+
+  validator_worker_stop (worker, FALSE);
+  g_clear_pointer (&worker->idle_source, g_source_unref);
+
+  g_mutex_unlock (&worker->lock);
+
+  return G_SOURCE_REMOVE;
+}
+
+static gboolean
+validator_worker_start (XdpValidatorWorker  *worker,
+                        GError             **error)
+{
+  g_autoptr(GSubprocessLauncher) launcher = NULL;
+  g_autoptr(GPtrArray) args = NULL;
+  g_autofd int parent_fd = -1;
+  int fds[2];
+
+  if (socketpair (AF_UNIX, SOCK_SEQPACKET | SOCK_CLOEXEC, 0, fds) < 0)
+    {
+      int errsv = errno;
+      g_set_error (error, G_IO_ERROR, g_io_error_from_errno (errsv),
+                   "Failed to create validator socket: %s", g_strerror (errsv));
+      return FALSE;
+    }
+  parent_fd = fds[0];
+
+  launcher = g_subprocess_launcher_new (G_SUBPROCESS_FLAGS_NONE);
+  g_subprocess_launcher_take_fd (launcher, fds[1], VALIDATOR_SOCKET_FD);
+
+  args = g_ptr_array_new ();
+  g_ptr_array_add (args, worker->validator);
+  if (worker->sandbox)
+    g_ptr_array_add (args, (char *) "--sandbox");
+  g_ptr_array_add (args, (char *) "--socket");
+  g_ptr_array_add (args, (char *) G_STRINGIFY (VALIDATOR_SOCKET_FD));
+  g_ptr_array_add (args, NULL);
+
+  g_debug ("Starting %s worker", worker->validator);
+
+  worker->subprocess =
+    g_subprocess_launcher_spawnv (launcher, (const char * const *) args->pdata, error);
+  if (worker->subprocess == NULL)
+    return FALSE;
+
+  worker->socket_fd = g_steal_fd (&parent_fd);
+  worker->n_requests = 0;
+
+  if (worker->idle_timeout_s > 0 && worker->idle_source == NULL)
+    {
+      worker->idle_source = g_timeout_source_new_seconds (worker->idle_timeout_s);
+      g_source_set_callback (worker->idle_source, idle_timeout_cb, worker, NULL);
+      g_source_attach (worker->idle_source, NULL);
+    }
+
+  return TRUE;
+}
+
+/* Returns FALSE if the worker failed to reply, in which case it must be
+ * stopped. A rejected input is a successful request with *out_output
+ * set to NULL. */
+static gboolean
+validator_worker_request (XdpValidatorWorker  *worker,
+                          int                  fd,
+                          const char          *ruleset,
+                          char               **out_output,
+                          GError             **error)
+{
+  union {
+    struct cmsghdr hdr;
+    char buf[CMSG_SPACE (sizeof (int))];
+  } control = { 0, };
+  struct iovec iov = { (char *) ruleset, strlen (ruleset) + 1 };
+  struct msghdr msg = {
+    .msg_iov = &iov,
+    .msg_iovlen = 1,
+    .msg_control = &control,
+    .msg_controllen = sizeof (control),
+  };
+  struct cmsghdr *cmsg;
+  struct pollfd pfd = { worker->socket_fd, POLLIN, 0 };
+  char reply[VALIDATOR_MAX_REPLY_SIZE + 1];
+  ssize_t res;
+
+  cmsg = CMSG_FIRSTHDR (&msg);
+  cmsg->cmsg_level = SOL_SOCKET;
+  cmsg->cmsg_type = SCM_RIGHTS;
+  cmsg->cmsg_len = CMSG_LEN (sizeof (int));
+  memcpy (CMSG_DATA (cmsg), &fd, sizeof (int));
+
+  do
+    res = sendmsg (worker->socket_fd, &msg, MSG_NOSIGNAL);
+  while (res < 0 && errno == EINTR);
+
+  if (res < 0)
+    {
+      int errsv = errno;
+      g_set_error (error, G_IO_ERROR, g_io_error_from_errno (errsv),
+                   "Failed to send to validator: %s", g_strerror (errsv));
+      return FALSE;
+    }
+
+  do
+    res = poll (&pfd, 1, VALIDATOR_TIMEOUT_MS);
+  while (res < 0 && errno == EINTR);
+
+  if (res == 0)
+    {
+      g_set_error_literal (error, G_IO_ERROR, G_IO_ERROR_TIMED_OUT,
+                           "Validator timed out");
+      return FALSE;
+    }
+
+  do
+    res = recv (worker->socket_fd, reply, sizeof (reply) - 1, MSG_DONTWAIT);
+  while (res < 0 && errno == EINTR);
+
+  if (res < 0)
+    {
+      int errsv = errno;
+      g_set_error (error, G_IO_ERROR, g_io_error_from_errno (errsv),
+                   "Failed to receive from validator: %s", g_strerror (errsv));
+      return FALSE;
+    }
+
+  if (res == 0)
+    {
+      g_set_error_literal (error, G_IO_ERROR, G_IO_ERROR_BROKEN_PIPE,
+                           "Validator exited");
+      return FALSE;
+    }
+
+  reply[res] = 0;
+
+  if (reply[0] == '0')
+    *out_output = g_strdup (reply + 1);
+  else
+    *out_output = NULL;
+
+  return TRUE;
+}
+
+/* Validates @fd with a validator process of its own, for when the
+ * worker is busy with another request */
+static char *
+validator_validate_once (XdpValidatorWorker  *worker,
+                         int                  fd,
+                         const char          *ruleset,
+                         GError             **error)
+{
+  XdpValidatorWorker once = {
+    .validator = worker->validator,
+    .sandbox = worker->sandbox,
+    .socket_fd = -1,
+  };
+  g_autofree char *output = NULL;
+  gboolean ok;
+
+  if (!validator_worker_start (&once, error))
+    return NULL;
+
+  ok = validator_worker_request (&once, fd, ruleset, &output, error);
+  validator_worker_stop (&once, !ok);
+
+  if (!ok)
+    return NULL;
+
+  if (output == NULL)
+    {
+      g_set_error_literal (error, G_IO_ERROR, G_IO_ERROR_INVALID_DATA,
+                           "Rejected by validator");
+      return NULL;
+    }
+
+  return g_steal_pointer (&output);
+}
+
+/* Must be called with the worker lock held */
+static char *
+validator_worker_validate_locked (XdpValidatorWorker  *worker,
+                                  int                  fd,
+                                  const char          *ruleset,
+                                  GError             **error)
+{
+  for (int attempt = 0; ; attempt++)
+    {
+      g_autoptr(GError) local_error = NULL;
+      g_autofree char *output = NULL;
+
+      if (worker->n_requests >= VALIDATOR_MAX_REQUESTS)
+        validator_worker_stop (worker, FALSE);
+
+      if (worker->subprocess == NULL &&
+          !validator_worker_start (worker, error))
+        return NULL;
+
+      worker->n_requests++;
+      worker->last_used = g_get_monotonic_time ();
+
+      if (validator_worker_request (worker, fd, ruleset, &output, &local_error))
+        {
+          if (output == NULL)
+            {
+              g_set_error_literal (error, G_IO_ERROR, G_IO_ERROR_INVALID_DATA,
+                                   "Rejected by validator");
+              return NULL;
+            }
+
+          return g_steal_pointer (&output);
+        }
+
+      g_debug ("%s worker failed: %s", worker->validator, local_error->message);
+      validator_worker_stop (worker, TRUE);
+
+      /* The worker may have died or been stopped while idle, so try a
+       * fresh one once. If that fails too, the input is likely the cause. */
+      if (attempt > 0 ||
+          g_error_matches (local_error, G_IO_ERROR, G_IO_ERROR_TIMED_OUT))
+        {
+          g_propagate_error (error, g_steal_pointer (&local_error));
+          return NULL;
+        }
+    }
+}
+
+/* Validates @fd and returns the validator output, or NULL with @error set
+ * if the input was rejected or the validator failed.
+ *
+ * The worker handles one request at a time. Concurrent requests don't
+ * wait for it, as a slow input could hold it for the whole timeout, but
+ * spawn a validator of their own. */
+char *
+xdp_validator_worker_validate (XdpValidatorWorker  *worker,
+                               int                  fd,
+                               const char          *ruleset,
+                               GError             **error)
+{
+  char *output;
+
+  if (!g_mutex_trylock (&worker->lock))
+    {
+      g_debug ("%s worker busy, spawning a one-shot validator", worker->validator);
+      return validator_validate_once (worker, fd, ruleset, error);
+    }
+
+  output = validator_worker_validate_locked (worker, fd, ruleset, error);
+
+  g_mutex_unlock (&worker->lock);
+
+  return output;
+}
@@ -0,0 +1,22 @@
+/* SPDX-License-Identifier: LGPL-2.1-or-later
+ * SPDX-FileCopyrightText: Copyright © the xdg-desktop-portal contributors
+ */
+
+#pragma once
+
+#include <glib.h>
+
+typedef struct _XdpValidatorWorker XdpValidatorWorker;
+
+XdpValidatorWorker * xdp_validator_worker_new (const char *validator,
+                                               gboolean    sandbox,
+                                               guint       idle_timeout_s);
+
+void xdp_validator_worker_free (XdpValidatorWorker *worker);
+
+char * xdp_validator_worker_validate (XdpValidatorWorker  *worker,
+                                      int                  fd,
+                                      const char          *ruleset,
+                                      GError             **error);
+
+G_DEFINE_AUTOPTR_CLEANUP_FUNC (XdpValidatorWorker, xdp_validator_worker_free)
@@ -0,0 +1,129 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# SPDX-FileCopyrightText: Copyright © the xdg-desktop-portal contributors
+#
+# This file is formatted with Python Black
+# mypy: disable-error-code="misc"
+
+# A stand-in for the document portal which answers slowly and keeps track of
+# how many calls are in flight at the same time.
+
+from tests.templates.xdp_utils import init_logger
+
+import dbus.service
+import os
+from dbusmock import MOCK_IFACE
+from gi.repository import GLib
+from dataclasses import dataclass
+
+
+BUS_NAME = "org.freedesktop.portal.Documents"
+MAIN_OBJ = "/org/freedesktop/portal/documents"
+SYSTEM_BUS = False
+MAIN_IFACE = "org.freedesktop.portal.Documents"
+VERSION = 5
+
+
+logger = init_logger(__name__)
+
+
+@dataclass
+class DocumentsParameters:
+    delay: int
+    mountpoint: str
+    in_flight: int
+    max_in_flight: int
+    n_documents: int
+
+
+def load(mock, parameters={}):
+    logger.debug(f"Loading parameters: {parameters}")
+
+    assert not hasattr(mock, "documents_params")
+    mock.documents_params = DocumentsParameters(
+        delay=parameters.get("delay", 0),
+        mountpoint=parameters.get("mountpoint", "/nonexistent/doc"),
+        in_flight=0,
+        max_in_flight=0,
+        n_documents=0,
+    )
+
+    mock.AddProperties(
+        MAIN_IFACE,
+        dbus.Dictionary(
+            {
+                "version": dbus.UInt32(parameters.get("version", VERSION)),
+            }
+        ),
+    )
+
+
+def reply(params, cb_success, *args):
+    params.in_flight += 1
+    params.max_in_flight = max(params.max_in_flight, params.in_flight)
+
+    def cb_delayed():
+        params.in_flight -= 1
+        cb_success(*args)
+        return GLib.SOURCE_REMOVE
+
+    GLib.timeout_add(params.delay, cb_delayed)
+
+
+@dbus.service.method(
+    MAIN_IFACE,
+    in_signature="",
+    out_signature="ay",
+)
+def GetMountPoint(self):
+    logger.debug("GetMountPoint()")
+    params = self.documents_params
+
+    return dbus.ByteArray(params.mountpoint.encode() + b"\0")
+
+
+@dbus.service.method(
+    MAIN_IFACE,
+    in_signature="ahusas",
+    out_signature="asa{sv}",
+    async_callbacks=("cb_success", "cb_error"),
+)
+def AddFull(self, o_path_fds, flags, app_id, permissions, cb_success, cb_error):
+    logger.debug(f"AddFull({len(o_path_fds)} fds, {flags}, {app_id}, {permissions})")
+    params = self.documents_params
+
+    for fd in o_path_fds:
+        os.close(fd.take())
+    params.n_documents += len(o_path_fds)
+
+    # An empty document ID means the app can access the file directly
+    doc_ids = dbus.Array([""] * len(o_path_fds), signature="s")
+    reply(params, cb_success, doc_ids, dbus.Dictionary({}, signature="sv"))
+
+
+@dbus.service.method(
+    MAIN_IFACE,
+    in_signature="hayusas",
+    out_signature="sa{sv}",
+    async_callbacks=("cb_success", "cb_error"),
+)
+def AddNamedFull(
+    self, o_path_fd, filename, flags, app_id, permissions, cb_success, cb_error
+):
+    logger.debug(f"AddNamedFull({filename}, {flags}, {app_id}, {permissions})")
+    params = self.documents_params
+
+    os.close(o_path_fd.take())
+    params.n_documents += 1
+
+    reply(params, cb_success, "", dbus.Dictionary({}, signature="sv"))
+
+
+@dbus.service.method(
+    MOCK_IFACE,
+    in_signature="",
+    out_signature="uu",
+)
+def GetStats(self):
+    params = self.documents_params
+
+    return (dbus.UInt32(params.max_in_flight), dbus.UInt32(params.n_documents))
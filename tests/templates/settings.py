@@ -8,6 +8,7 @@ from tests.templates.xdp_utils import init_logger
 
 import dbus.service
 from dbusmock import MOCK_IFACE
+from gi.repository import GLib
 from dataclasses import dataclass
 
 
@@ -24,6 +25,7 @@ logger = init_logger(__name__)
 @dataclass
 class SettingsParameters:
     settings: dict
+    delay: int
 
 
 def load(mock, parameters={}):
@@ -32,6 +34,7 @@ def load(mock, parameters={}):
     assert not hasattr(mock, "settings_params")
     mock.settings_params = SettingsParameters(
         settings=parameters.get("settings", {}),
+        delay=parameters.get("delay", 0),
     )
 
     mock.AddProperties(
@@ -44,17 +47,33 @@ def load(mock, parameters={}):
     )
 
 
+def reply(params, cb_success, *args):
+    if params.delay == 0:
+        cb_success(*args)
+        return
+
+    def cb_delayed():
+        cb_success(*args)
+        return GLib.SOURCE_REMOVE
+
+    logger.debug(f"scheduling delay of {params.delay}")
+    GLib.timeout_add(params.delay, cb_delayed)
+
+
 @dbus.service.method(
     MAIN_IFACE,
     in_signature="as",
     out_signature="a{sa{sv}}",
+    async_callbacks=("cb_success", "cb_error"),
 )
-def ReadAll(self, namespaces):
+def ReadAll(self, namespaces, cb_success, cb_error):
     logger.debug(f"ReadAll({namespaces})")
-    settings = self.settings_params.settings
+    params = self.settings_params
+    settings = params.settings
 
     if len(namespaces) == 0 or (len(namespaces) == 1 and namespaces[0] == ""):
-        return settings
+        reply(params, cb_success, settings)
+        return
 
     def find_matching(namespace):
         if len(namespace) >= 3 and namespace[-2:] == ".*":
@@ -74,19 +93,26 @@ def ReadAll(self, namespaces):
     for ns in namespaces:
         result |= find_matching(ns)
 
-    return result
+    reply(params, cb_success, result)
 
 
 @dbus.service.method(
     MAIN_IFACE,
     in_signature="ss",
     out_signature="v",
+    async_callbacks=("cb_success", "cb_error"),
 )
-def Read(self, namespace, key):
+def Read(self, namespace, key, cb_success, cb_error):
     logger.debug(f"Read({namespace}, {key})")
-    settings = self.settings_params.settings
+    params = self.settings_params
+
+    try:
+        value = params.settings[namespace][key]
+    except KeyError as e:
+        cb_error(e)
+        return
 
-    return settings[namespace][key]
+    reply(params, cb_success, value)
 
 
 @dbus.service.method(
@@ -0,0 +1,150 @@
+/* SPDX-License-Identifier: LGPL-2.1-or-later
+ * SPDX-FileCopyrightText: Copyright © the xdg-desktop-portal contributors
+ */
+
+#include "config.h"
+
+#include <glib.h>
+#include <glib/gstdio.h>
+#include <libglnx.h>
+
+#include "flatpak-instance.h"
+
+static char *runtime_dir = NULL;
+
+static void
+add_instance (const char *id,
+              const char *app_id,
+              int         pid)
+{
+  g_autoptr(GError) error = NULL;
+  g_autofree char *dir = NULL;
+  g_autofree char *info_path = NULL;
+  g_autofree char *info = NULL;
+  g_autofree char *pid_path = NULL;
+  g_autofree char *pid_contents = NULL;
+
+  dir = g_build_filename (runtime_dir, ".flatpak", id, NULL);
+  g_assert_cmpint (g_mkdir_with_parents (dir, 0700), ==, 0);
+
+  info_path = g_build_filename (dir, "info", NULL);
+  info = g_strdup_printf ("[Application]\nname=%s\nruntime=runtime/org.example.Platform/x86_64/1\n\n"
+                          "[Instance]\ninstance-id=%s\narch=x86_64\nbranch=stable\n",
+                          app_id, id);
+  g_file_set_contents (info_path, info, -1, &error);
+  g_assert_no_error (error);
+
+  pid_path = g_build_filename (dir, "pid", NULL);
+  pid_contents = g_strdup_printf ("%d", pid);
+  g_file_set_contents (pid_path, pid_contents, -1, &error);
+  g_assert_no_error (error);
+}
+
+static void
+set_child_pid (const char *id,
+               int         child_pid)
+{
+  g_autoptr(GError) error = NULL;
+  g_autofree char *path = NULL;
+  g_autofree char *contents = NULL;
+
+  path = g_build_filename (runtime_dir, ".flatpak", id, "bwrapinfo.json", NULL);
+  contents = g_strdup_printf ("{ \"child-pid\": %d }", child_pid);
+  g_file_set_contents (path, contents, -1, &error);
+  g_assert_no_error (error);
+}
+
+static void
+remove_instance (const char *id)
+{
+  g_autoptr(GError) error = NULL;
+  g_autofree char *dir = NULL;
+
+  dir = g_build_filename (runtime_dir, ".flatpak", id, NULL);
+  glnx_shutil_rm_rf_at (AT_FDCWD, dir, NULL, &error);
+  g_assert_no_error (error);
+}
+
+static FlatpakInstance *
+find_instance (GPtrArray  *instances,
+               const char *id)
+{
+  for (size_t i = 0; i < instances->len; i++)
+    {
+      FlatpakInstance *instance = g_ptr_array_index (instances, i);
+
+      if (g_strcmp0 (flatpak_instance_get_id (instance), id) == 0)
+        return instance;
+    }
+
+  return NULL;
+}
+
+static void
+test_get_all (void)
+{
+  g_autoptr(GPtrArray) instances1 = NULL;
+  g_autoptr(GPtrArray) instances2 = NULL;
+  g_autoptr(GPtrArray) instances3 = NULL;
+  g_autoptr(GPtrArray) instances4 = NULL;
+  FlatpakInstance *instance;
+
+  /* No instance has been started yet */
+  instances1 = flatpak_instance_get_all ();
+  g_assert_cmpuint (instances1->len, ==, 0);
+
+  add_instance ("1", "org.example.App1", 1001);
+  add_instance ("2", "org.example.App2", 1002);
+
+  instances2 = flatpak_instance_get_all ();
+  g_assert_cmpuint (instances2->len, ==, 2);
+
+  instance = find_instance (instances2, "1");
+  g_assert_nonnull (instance);
+  g_assert_cmpstr (flatpak_instance_get_app (instance), ==, "org.example.App1");
+  g_assert_cmpstr (flatpak_instance_get_arch (instance), ==, "x86_64");
+  g_assert_cmpint (flatpak_instance_get_pid (instance), ==, 1001);
+  g_assert_cmpint (flatpak_instance_get_child_pid (instance), ==, 0);
+
+  /* Changes to an instance are picked up, unchanged instances are kept */
+  set_child_pid ("1", 2001);
+  add_instance ("3", "org.example.App3", 1003);
+
+  instances3 = flatpak_instance_get_all ();
+  g_assert_cmpuint (instances3->len, ==, 3);
+  g_assert_true (find_instance (instances3, "2") == find_instance (instances2, "2"));
+  g_assert_false (find_instance (instances3, "1") == find_instance (instances2, "1"));
+  g_assert_cmpint (flatpak_instance_get_child_pid (find_instance (instances3, "1")), ==, 2001);
+  g_assert_cmpstr (flatpak_instance_get_app (find_instance (instances3, "3")), ==, "org.example.App3");
+
+  remove_instance ("2");
+
+  instances4 = flatpak_instance_get_all ();
+  g_assert_cmpuint (instances4->len, ==, 2);
+  g_assert_null (find_instance (instances4, "2"));
+  g_assert_true (find_instance (instances4, "1") == find_instance (instances3, "1"));
+  g_assert_true (find_instance (instances4, "3") == find_instance (instances3, "3"));
+}
+
+int
+main (int argc, char **argv)
+{
+  g_autoptr(GError) error = NULL;
+  int res;
+
+  /* Must be set before anything looks up the runtime dir */
+  runtime_dir = g_dir_make_tmp ("test-flatpak-instance-XXXXXX", &error);
+  g_assert_no_error (error);
+  g_setenv ("XDG_RUNTIME_DIR", runtime_dir, TRUE);
+
+  g_test_init (&argc, &argv, NULL);
+
+  g_test_add_func ("/flatpak-instance/get-all", test_get_all);
+
+  res = g_test_run ();
+
+  glnx_shutil_rm_rf_at (AT_FDCWD, runtime_dir, NULL, NULL);
+  g_free (runtime_dir);
+
+  return res;
+}
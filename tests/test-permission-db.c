@@ -351,6 +351,570 @@ test_modify (void)
   }
 }
 
+static void
+save_changes_cb (GObject      *source_object,
+                 GAsyncResult *res,
+                 gpointer      user_data)
+{
+  gboolean *done = user_data;
+  GError *error = NULL;
+
+  permission_db_save_changes_finish (PERMISSION_DB (source_object), res, &error);
+  g_assert_no_error (error);
+
+  *done = TRUE;
+}
+
+static void
+save_changes (PermissionDb *db)
+{
+  gboolean done = FALSE;
+
+  permission_db_save_changes_async (db, NULL, save_changes_cb, &done);
+  while (!done)
+    g_main_context_iteration (NULL, TRUE);
+}
+
+static void
+test_log (void)
+{
+  g_autoptr(PermissionDb) db = NULL;
+  g_autofree char *dir = NULL;
+  g_autofree char *path = NULL;
+  g_autofree char *log_path = NULL;
+  g_autofree char *gvdb_contents = NULL;
+  gsize gvdb_size;
+  GError *error = NULL;
+
+  dir = g_dir_make_tmp ("test-permission-db-XXXXXX", &error);
+  g_assert_no_error (error);
+  path = g_build_filename (dir, "table", NULL);
+  log_path = g_build_filename (dir, ".table.log", NULL);
+
+  db = create_test_db (FALSE);
+  permission_db_set_path (db, path);
+
+  /* There is no GVDB file yet, so the first save writes one */
+  save_changes (db);
+  g_assert_true (g_file_test (path, G_FILE_TEST_EXISTS));
+  g_assert_false (g_file_test (log_path, G_FILE_TEST_EXISTS));
+  g_assert_true (g_file_get_contents (path, &gvdb_contents, &gvdb_size, &error));
+  g_assert_no_error (error);
+
+  /* Later changes only go to the log */
+  {
+    g_autoptr(PermissionDbEntry) entry1 = NULL;
+    g_autoptr(PermissionDbEntry) entry2 = NULL;
+    g_autoptr(PermissionDb) db2 = NULL;
+    g_autofree char *contents = NULL;
+    gsize size;
+    g_autofree char *dump1 = NULL;
+    g_autofree char *dump2 = NULL;
+    const char *permissions[] = { "read", NULL };
+
+    entry1 = permission_db_entry_new (g_variant_new_string ("gazonk-data"));
+    entry2 = permission_db_entry_set_app_permissions (entry1, "org.test.eapp", permissions);
+    permission_db_set_entry (db, "gazonk", entry2);
+
+    save_changes (db);
+    g_assert_false (permission_db_is_dirty (db));
+    g_assert_true (g_file_test (log_path, G_FILE_TEST_EXISTS));
+    g_assert_true (g_file_get_contents (path, &contents, &size, &error));
+    g_assert_no_error (error);
+    g_assert_cmpmem (contents, size, gvdb_contents, gvdb_size);
+
+    db2 = permission_db_new (path, TRUE, &error);
+    g_assert_no_error (error);
+
+    dump1 = permission_db_print (db);
+    dump2 = permission_db_print (db2);
+    g_assert_cmpstr (dump1, ==, dump2);
+  }
+
+  /* Removals are logged too */
+  {
+    g_autoptr(PermissionDb) db2 = NULL;
+    g_autoptr(PermissionDbEntry) entry = NULL;
+
+    permission_db_set_entry (db, "gazonk", NULL);
+    permission_db_set_entry (db, "bar", NULL);
+    save_changes (db);
+
+    db2 = permission_db_new (path, TRUE, &error);
+    g_assert_no_error (error);
+
+    entry = permission_db_lookup (db2, "gazonk");
+    g_assert_null (entry);
+    entry = permission_db_lookup (db2, "bar");
+    g_assert_null (entry);
+    entry = permission_db_lookup (db2, "foo");
+    g_assert_nonnull (entry);
+  }
+
+  unlink (log_path);
+  unlink (path);
+  rmdir (dir);
+}
+
+static char *
+data_index_key_func (PermissionDbEntry *entry,
+                     gpointer           user_data)
+{
+  g_autoptr(GVariant) data = permission_db_entry_get_data (entry);
+
+  return g_variant_dup_string (data, NULL);
+}
+
+static void
+test_index (void)
+{
+  g_autoptr(PermissionDb) db = NULL;
+  guint index_id;
+
+  db = create_test_db (TRUE);
+
+  /* Existing entries are indexed when the index is added */
+  index_id = permission_db_add_index (db, data_index_key_func, NULL, NULL);
+
+  {
+    g_auto(GStrv) ids = permission_db_lookup_index (db, index_id, "foo-data");
+    g_assert_cmpint (g_strv_length (ids), ==, 1);
+    g_assert_cmpstr (ids[0], ==, "foo");
+  }
+
+  {
+    g_auto(GStrv) ids = permission_db_lookup_index (db, index_id, "gazonk-data");
+    g_assert_nonnull (ids);
+    g_assert_cmpint (g_strv_length (ids), ==, 0);
+  }
+
+  /* Add entries sharing a key */
+  {
+    g_autoptr(PermissionDbEntry) entry = NULL;
+    g_auto(GStrv) ids = NULL;
+
+    entry = permission_db_entry_new (g_variant_new_string ("gazonk-data"));
+    permission_db_set_entry (db, "gazonk", entry);
+    permission_db_set_entry (db, "gazonk2", entry);
+
+    ids = permission_db_lookup_index (db, index_id, "gazonk-data");
+    g_assert_cmpint (g_strv_length (ids), ==, 2);
+    g_assert (g_strv_contains ((const char **) ids, "gazonk"));
+    g_assert (g_strv_contains ((const char **) ids, "gazonk2"));
+  }
+
+  /* Change the key of an entry */
+  {
+    g_autoptr(PermissionDbEntry) entry1 = NULL;
+    g_autoptr(PermissionDbEntry) entry2 = NULL;
+    g_auto(GStrv) foo_ids = NULL;
+    g_auto(GStrv) bar_ids = NULL;
+
+    entry1 = permission_db_lookup (db, "foo");
+    entry2 = permission_db_entry_modify_data (entry1, g_variant_new_string ("bar-data"));
+    permission_db_set_entry (db, "foo", entry2);
+
+    foo_ids = permission_db_lookup_index (db, index_id, "foo-data");
+    g_assert_cmpint (g_strv_length (foo_ids), ==, 0);
+
+    bar_ids = permission_db_lookup_index (db, index_id, "bar-data");
+    g_assert_cmpint (g_strv_length (bar_ids), ==, 2);
+    g_assert (g_strv_contains ((const char **) bar_ids, "foo"));
+    g_assert (g_strv_contains ((const char **) bar_ids, "bar"));
+  }
+
+  /* Remove entries */
+  {
+    g_auto(GStrv) ids = NULL;
+
+    permission_db_set_entry (db, "gazonk", NULL);
+    permission_db_set_entry (db, "bar", NULL);
+    permission_db_update (db);
+
+    ids = permission_db_lookup_index (db, index_id, "gazonk-data");
+    g_assert_cmpint (g_strv_length (ids), ==, 1);
+    g_assert_cmpstr (ids[0], ==, "gazonk2");
+
+    g_clear_pointer (&ids, g_strfreev);
+    ids = permission_db_lookup_index (db, index_id, "bar-data");
+    g_assert_cmpint (g_strv_length (ids), ==, 1);
+    g_assert_cmpstr (ids[0], ==, "foo");
+  }
+}
+
+static void
+test_index_perf (void)
+{
+  const guint sizes[] = { 1000, 10000, 100000 };
+  const guint n_lookups = 1000;
+
+  if (!g_test_perf ())
+    {
+      g_test_skip ("Only run in perf mode");
+      return;
+    }
+
+  for (size_t i = 0; i < G_N_ELEMENTS (sizes); i++)
+    {
+      g_autoptr(PermissionDb) db = NULL;
+      g_autoptr(GError) error = NULL;
+      guint index_id;
+      double elapsed;
+
+      db = permission_db_new (NULL, FALSE, &error);
+      g_assert_no_error (error);
+
+      index_id = permission_db_add_index (db, data_index_key_func, NULL, NULL);
+
+      for (guint j = 0; j < sizes[i]; j++)
+        {
+          g_autoptr(PermissionDbEntry) entry = NULL;
+          g_autofree char *id = g_strdup_printf ("id%u", j);
+          g_autofree char *data = g_strdup_printf ("/home/user/file%u", j);
+
+          entry = permission_db_entry_new (g_variant_new_string (data));
+          permission_db_set_entry (db, id, entry);
+        }
+
+      g_test_timer_start ();
+
+      for (guint j = 0; j < n_lookups; j++)
+        {
+          g_autofree char *data = g_strdup_printf ("/home/user/file%u",
+                                                   g_test_rand_int_range (0, sizes[i]));
+          g_auto(GStrv) ids = permission_db_lookup_index (db, index_id, data);
+
+          g_assert_cmpint (g_strv_length (ids), ==, 1);
+        }
+
+      elapsed = g_test_timer_elapsed ();
+      g_test_minimized_result (elapsed / n_lookups * G_USEC_PER_SEC,
+                               "indexed lookup with %u entries: %.3f us",
+                               sizes[i], elapsed / n_lookups * G_USEC_PER_SEC);
+    }
+}
+
+static void
+assert_ids_by_app (PermissionDb *db,
+                   const char   *app,
+                   const char  **expected)
+{
+  g_auto(GStrv) ids = permission_db_list_ids_by_app (db, app);
+
+  g_assert_true (g_strv_equal ((const char * const *) ids, expected));
+}
+
+static void
+test_list_ids_by_app (void)
+{
+  g_autoptr(PermissionDb) db = NULL;
+  g_autoptr(PermissionDb) db2 = NULL;
+  GError *error = NULL;
+  char tmpfile[] = "/tmp/test-permission-db-XXXXXX";
+  const char *permissions[] = { "read", NULL };
+  const char *no_permissions[] = { NULL };
+  const char *new_ids[] = { "a", "bar", "foo", "z", NULL };
+  const char *dapp_ids[] = { "bar", NULL };
+  const char *empty[] = { NULL };
+  int fd;
+
+  db = create_test_db (TRUE);
+
+  /* Listed in order, whatever the order the ids were added in */
+  {
+    g_autoptr(PermissionDbEntry) entry1 = NULL;
+    g_autoptr(PermissionDbEntry) entry2 = NULL;
+
+    entry1 = permission_db_entry_new (g_variant_new_string ("z-data"));
+    entry2 = permission_db_entry_set_app_permissions (entry1, "org.test.app", permissions);
+    permission_db_set_entry (db, "z", entry2);
+    permission_db_set_entry (db, "a", entry2);
+  }
+
+  assert_ids_by_app (db, "org.test.app", new_ids);
+  assert_ids_by_app (db, "org.test.dapp", dapp_ids);
+  assert_ids_by_app (db, "org.test.noapp", empty);
+
+  /* Apps without any id left are not listed anymore */
+  {
+    g_autoptr(PermissionDbEntry) entry1 = NULL;
+    g_autoptr(PermissionDbEntry) entry2 = NULL;
+    g_auto(GStrv) apps = NULL;
+
+    entry1 = permission_db_lookup (db, "bar");
+    entry2 = permission_db_entry_set_app_permissions (entry1, "org.test.dapp", no_permissions);
+    permission_db_set_entry (db, "bar", entry2);
+
+    assert_ids_by_app (db, "org.test.dapp", empty);
+
+    apps = permission_db_list_apps (db);
+    g_assert_cmpint (g_strv_length (apps), ==, 3);
+    g_assert_false (g_strv_contains ((const char **) apps, "org.test.dapp"));
+  }
+
+  /* The same after loading the db again */
+  permission_db_update (db);
+
+  fd = g_mkstemp (tmpfile);
+  close (fd);
+
+  permission_db_set_path (db, tmpfile);
+  permission_db_save_content (db, &error);
+  g_assert_no_error (error);
+
+  db2 = permission_db_new (tmpfile, TRUE, &error);
+  g_assert_no_error (error);
+
+  assert_ids_by_app (db2, "org.test.app", new_ids);
+  assert_ids_by_app (db2, "org.test.dapp", empty);
+
+  {
+    g_auto(GStrv) apps = permission_db_list_apps (db2);
+
+    g_assert_cmpint (g_strv_length (apps), ==, 3);
+  }
+
+  {
+    const char *app_ids[] = { "foo", "z", NULL };
+
+    permission_db_set_entry (db2, "a", NULL);
+    permission_db_set_entry (db2, "bar", NULL);
+
+    assert_ids_by_app (db2, "org.test.app", app_ids);
+  }
+
+  unlink (tmpfile);
+}
+
+static void
+test_list_ids_range (void)
+{
+  g_autoptr(PermissionDb) db = NULL;
+  g_autoptr(PermissionDbEntry) entry1 = NULL;
+  g_autoptr(PermissionDbEntry) entry2 = NULL;
+  const char *permissions[] = { "read", NULL };
+  const char *page1[] = { "bar", "baz", NULL };
+  const char *page2[] = { "foo", NULL };
+  const char *app_page1[] = { "bar", NULL };
+  const char *app_page2[] = { "baz", "foo", NULL };
+  const char *empty[] = { NULL };
+
+  db = create_test_db (TRUE);
+
+  entry1 = permission_db_entry_new (g_variant_new_string ("baz-data"));
+  entry2 = permission_db_entry_set_app_permissions (entry1, "org.test.app", permissions);
+  permission_db_set_entry (db, "baz", entry2);
+
+  {
+    g_auto(GStrv) ids1 = permission_db_list_ids_range (db, NULL, 2);
+    g_auto(GStrv) ids2 = permission_db_list_ids_range (db, "baz", 2);
+    g_auto(GStrv) ids3 = permission_db_list_ids_range (db, "foo", 2);
+    g_auto(GStrv) ids4 = permission_db_list_ids_range (db, "bb", 1);
+
+    g_assert_true (g_strv_equal ((const char * const *) ids1, page1));
+    g_assert_true (g_strv_equal ((const char * const *) ids2, page2));
+    g_assert_true (g_strv_equal ((const char * const *) ids3, empty));
+    g_assert_true (g_strv_equal ((const char * const *) ids4, page2));
+  }
+
+  {
+    g_auto(GStrv) ids1 = permission_db_list_ids_by_app_range (db, "org.test.app", NULL, 1);
+    g_auto(GStrv) ids2 = permission_db_list_ids_by_app_range (db, "org.test.app", "bar", 5);
+    g_auto(GStrv) ids3 = permission_db_list_ids_by_app_range (db, "org.test.noapp", NULL, 5);
+
+    g_assert_true (g_strv_equal ((const char * const *) ids1, app_page1));
+    g_assert_true (g_strv_equal ((const char * const *) ids2, app_page2));
+    g_assert_true (g_strv_equal ((const char * const *) ids3, empty));
+  }
+
+  /* Removed ids are not listed anymore */
+  permission_db_set_entry (db, "baz", NULL);
+
+  {
+    g_auto(GStrv) ids = permission_db_list_ids_range (db, "bar", 5);
+
+    g_assert_true (g_strv_equal ((const char * const *) ids, page2));
+  }
+}
+
+static void
+test_snapshot (void)
+{
+  g_autoptr(PermissionDb) db = NULL;
+  g_autoptr(PermissionDbSnapshot) snapshot1 = NULL;
+  g_autoptr(PermissionDbSnapshot) snapshot2 = NULL;
+  g_autoptr(PermissionDbSnapshot) snapshot3 = NULL;
+
+  db = create_test_db (TRUE);
+
+  g_assert_null (permission_db_get_snapshot (db));
+
+  permission_db_enable_snapshots (db);
+  snapshot1 = permission_db_get_snapshot (db);
+  g_assert_nonnull (snapshot1);
+
+  {
+    g_autoptr(PermissionDbEntry) entry = NULL;
+    g_autoptr(PermissionDbEntry) new_entry = NULL;
+    const char *permissions[] = { "read", NULL };
+
+    permission_db_set_entry (db, "bar", NULL);
+
+    entry = permission_db_entry_new (g_variant_new_string ("gazonk-data"));
+    new_entry = permission_db_entry_set_app_permissions (entry, "org.test.eapp", permissions);
+    permission_db_set_entry (db, "gazonk", new_entry);
+  }
+
+  snapshot2 = permission_db_get_snapshot (db);
+
+  /* Older snapshots are not affected by changes */
+  {
+    g_autoptr(PermissionDbEntry) entry = NULL;
+    g_auto(GStrv) ids = NULL;
+    g_auto(GStrv) apps = NULL;
+
+    entry = permission_db_snapshot_lookup (snapshot1, "bar");
+    g_assert_nonnull (entry);
+    g_clear_pointer (&entry, permission_db_entry_unref);
+    entry = permission_db_snapshot_lookup (snapshot1, "gazonk");
+    g_assert_null (entry);
+
+    ids = permission_db_snapshot_list_ids (snapshot1);
+    g_assert_cmpint (g_strv_length (ids), ==, 2);
+    g_assert (g_strv_contains ((const char **) ids, "foo"));
+    g_assert (g_strv_contains ((const char **) ids, "bar"));
+
+    apps = permission_db_snapshot_list_apps (snapshot1);
+    g_assert_cmpint (g_strv_length (apps), ==, 4);
+    g_assert (g_strv_contains ((const char **) apps, "org.test.dapp"));
+  }
+
+  {
+    g_autoptr(PermissionDbEntry) entry = NULL;
+    g_auto(GStrv) ids = NULL;
+    g_auto(GStrv) apps = NULL;
+
+    entry = permission_db_snapshot_lookup (snapshot2, "bar");
+    g_assert_null (entry);
+    entry = permission_db_snapshot_lookup (snapshot2, "gazonk");
+    g_assert_nonnull (entry);
+
+    ids = permission_db_snapshot_list_ids (snapshot2);
+    g_assert_cmpint (g_strv_length (ids), ==, 2);
+    g_assert (g_strv_contains ((const char **) ids, "foo"));
+    g_assert (g_strv_contains ((const char **) ids, "gazonk"));
+
+    apps = permission_db_snapshot_list_apps (snapshot2);
+    g_assert_cmpint (g_strv_length (apps), ==, 4);
+    g_assert (g_strv_contains ((const char **) apps, "org.test.app"));
+    g_assert (g_strv_contains ((const char **) apps, "org.test.bapp"));
+    g_assert (g_strv_contains ((const char **) apps, "org.test.capp"));
+    g_assert (g_strv_contains ((const char **) apps, "org.test.eapp"));
+  }
+
+  /* Enough changes to make a new base */
+  for (guint i = 0; i < 1000; i++)
+    {
+      g_autoptr(PermissionDbEntry) entry = NULL;
+      g_autofree char *id = g_strdup_printf ("id%u", i % 300);
+
+      entry = permission_db_entry_new (g_variant_new_uint32 (i));
+      permission_db_set_entry (db, id, entry);
+    }
+
+  snapshot3 = permission_db_get_snapshot (db);
+
+  {
+    g_auto(GStrv) ids = permission_db_snapshot_list_ids (snapshot3);
+    g_autoptr(PermissionDbEntry) entry = NULL;
+    g_autoptr(GVariant) data = NULL;
+
+    g_assert_cmpint (g_strv_length (ids), ==, 302);
+
+    entry = permission_db_snapshot_lookup (snapshot3, "id42");
+    data = permission_db_entry_get_data (entry);
+    g_assert_cmpuint (g_variant_get_uint32 (data), ==, 942);
+  }
+}
+
+typedef struct
+{
+  PermissionDb *db;
+  guint         n_ids;
+  guint         n_lookups;
+} SnapshotPerfData;
+
+static gpointer
+snapshot_lookup_thread (gpointer user_data)
+{
+  SnapshotPerfData *data = user_data;
+
+  for (guint i = 0; i < data->n_lookups; i++)
+    {
+      g_autoptr(PermissionDbSnapshot) snapshot = permission_db_get_snapshot (data->db);
+      g_autoptr(PermissionDbEntry) entry = NULL;
+      char id[32];
+
+      g_snprintf (id, sizeof (id), "id%u", i % data->n_ids);
+      entry = permission_db_snapshot_lookup (snapshot, id);
+      g_assert_nonnull (entry);
+    }
+
+  return NULL;
+}
+
+static void
+test_snapshot_perf (void)
+{
+  g_autoptr(PermissionDb) db = NULL;
+  g_autoptr(GError) error = NULL;
+  SnapshotPerfData data;
+  const guint n_threads[] = { 1, 2, 4, 8 };
+
+  if (!g_test_perf ())
+    {
+      g_test_skip ("Only run in perf mode");
+      return;
+    }
+
+  db = permission_db_new (NULL, FALSE, &error);
+  g_assert_no_error (error);
+
+  permission_db_enable_snapshots (db);
+
+  data.db = db;
+  data.n_ids = 10000;
+  data.n_lookups = 1000000;
+
+  for (guint i = 0; i < data.n_ids; i++)
+    {
+      g_autoptr(PermissionDbEntry) entry = NULL;
+      g_autofree char *id = g_strdup_printf ("id%u", i);
+
+      entry = permission_db_entry_new (g_variant_new_uint32 (i));
+      permission_db_set_entry (db, id, entry);
+    }
+
+  for (size_t i = 0; i < G_N_ELEMENTS (n_threads); i++)
+    {
+      g_autoptr(GPtrArray) threads = g_ptr_array_new ();
+      double elapsed;
+
+      g_test_timer_start ();
+
+      for (guint j = 0; j < n_threads[i]; j++)
+        g_ptr_array_add (threads, g_thread_new ("lookup", snapshot_lookup_thread, &data));
+
+      for (guint j = 0; j < threads->len; j++)
+        g_thread_join (g_ptr_array_index (threads, j));
+
+      elapsed = g_test_timer_elapsed ();
+      g_test_maximized_result (n_threads[i] * data.n_lookups / elapsed,
+                               "%u threads: %.0f lookups/s",
+                               n_threads[i], n_threads[i] * data.n_lookups / elapsed);
+    }
+}
+
 int
 main (int argc, char **argv)
 {
@@ -359,6 +923,13 @@ main (int argc, char **argv)
   g_test_add_func ("/db/open", test_db_open);
   g_test_add_func ("/db/serialize", test_serialize);
   g_test_add_func ("/db/modify", test_modify);
+  g_test_add_func ("/db/log", test_log);
+  g_test_add_func ("/db/index", test_index);
+  g_test_add_func ("/db/index-perf", test_index_perf);
+  g_test_add_func ("/db/list-ids-by-app", test_list_ids_by_app);
+  g_test_add_func ("/db/list-ids-range", test_list_ids_range);
+  g_test_add_func ("/db/snapshot", test_snapshot);
+  g_test_add_func ("/db/snapshot-perf", test_snapshot_perf);
 
   return g_test_run ();
 }
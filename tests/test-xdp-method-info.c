@@ -4,6 +4,8 @@
 
 #include "config.h"
 
+#include <string.h>
+
 #include <glib.h>
 
 #include "xdp-method-info.h"
@@ -64,10 +66,102 @@ test_method_info_find (void)
 
 }
 
+static void
+test_method_info_sorted (void)
+{
+  unsigned int count = xdp_method_info_get_count ();
+  unsigned int n_interfaces = xdp_method_info_get_interface_count ();
+  const XdpMethodInfo *method_info = xdp_method_info_get_all ();
+  const XdpMethodInfoInterface *interfaces = xdp_method_info_get_interfaces ();
+  unsigned int n_methods = 0;
+
+  for (unsigned int i = 0; i < n_interfaces; i++)
+    {
+      if (i > 0)
+        g_assert_cmpint (strcmp (interfaces[i - 1].interface, interfaces[i].interface), <, 0);
+
+      g_assert_cmpuint (interfaces[i].first_method, ==, n_methods);
+      n_methods += interfaces[i].n_methods;
+    }
+  g_assert_cmpuint (n_methods, ==, count);
+
+  /* Every method can be found, and carries the id of its interface */
+  for (unsigned int i = 0; i < count; i++)
+    {
+      const XdpMethodInfo *mi = &method_info[i];
+
+      g_assert_cmpstr (interfaces[mi->interface_id].interface, ==, mi->interface);
+      g_assert_true (xdp_method_info_find (mi->interface, mi->method) == mi);
+    }
+}
+
+/* The lookup before the table was sorted, for comparison */
+static const XdpMethodInfo *
+linear_method_info_find (const char *interface,
+                         const char *method)
+{
+  const XdpMethodInfo *mi = xdp_method_info_get_all ();
+
+  while (mi->interface != NULL)
+    {
+      if (g_strcmp0 (interface, mi->interface) == 0 &&
+          g_strcmp0 (method, mi->method) == 0)
+        return mi;
+      mi++;
+    }
+
+  return NULL;
+}
+
+static void
+test_method_info_find_perf (void)
+{
+  unsigned int count = xdp_method_info_get_count ();
+  const XdpMethodInfo *method_info = xdp_method_info_get_all ();
+  const unsigned int n_lookups = 1000000;
+  double elapsed;
+
+  if (!g_test_perf ())
+    {
+      g_test_skip ("Only run in perf mode");
+      return;
+    }
+
+  g_test_timer_start ();
+
+  for (unsigned int i = 0; i < n_lookups; i++)
+    {
+      const XdpMethodInfo *mi = &method_info[i % count];
+
+      g_assert_true (linear_method_info_find (mi->interface, mi->method) == mi);
+    }
+
+  elapsed = g_test_timer_elapsed ();
+  g_test_minimized_result (elapsed / n_lookups * G_USEC_PER_SEC * 1000,
+                           "linear scan of %u methods: %.1f ns",
+                           count, elapsed / n_lookups * G_USEC_PER_SEC * 1000);
+
+  g_test_timer_start ();
+
+  for (unsigned int i = 0; i < n_lookups; i++)
+    {
+      const XdpMethodInfo *mi = &method_info[i % count];
+
+      g_assert_true (xdp_method_info_find (mi->interface, mi->method) == mi);
+    }
+
+  elapsed = g_test_timer_elapsed ();
+  g_test_minimized_result (elapsed / n_lookups * G_USEC_PER_SEC * 1000,
+                           "bisection of %u methods: %.1f ns",
+                           count, elapsed / n_lookups * G_USEC_PER_SEC * 1000);
+}
+
 int main (int argc, char **argv)
 {
   g_test_init (&argc, &argv, NULL);
   g_test_add_func ("/method-info/all", test_method_info_all);
   g_test_add_func ("/method-info/find", test_method_info_find);
+  g_test_add_func ("/method-info/sorted", test_method_info_sorted);
+  g_test_add_func ("/method-info/find-perf", test_method_info_find_perf);
   return g_test_run ();
 }
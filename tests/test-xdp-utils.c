@@ -4,12 +4,19 @@
 
 #include "config.h"
 
+#include <dirent.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
 #include <glib.h>
+#include <glib/gstdio.h>
 
 #include "xdp-app-info-host-private.h"
 #include "xdp-app-info-private.h"
 #include "xdp-app-info-snap-private.h"
 #include "xdp-utils.h"
+#include "xdp-validator-worker.h"
 
 #define snap_parse_cgroup _xdp_app_info_snap_parse_cgroup_file
 #define host_parse_app_id _xdp_app_info_host_parse_app_id_from_unit_name
@@ -194,6 +201,484 @@ test_app_id_via_systemd_unit (void)
 }
 #endif /* HAVE_LIBSYSTEMD */
 
+/* A 16x16 red PNG */
+static const char test_icon_png[] =
+  "\x89\x50\x4e\x47\x0d\x0a\x1a\x0a\x00\x00\x00\x0d\x49\x48\x44\x52"
+  "\x00\x00\x00\x10\x00\x00\x00\x10\x08\x02\x00\x00\x00\x90\x91\x68"
+  "\x36\x00\x00\x00\x16\x49\x44\x41\x54\x78\xda\x63\xf8\xcf\xc0\x40"
+  "\x12\x62\x18\xd5\x30\xaa\x61\xf8\x6a\x00\x00\x90\xf9\xff\x01\xf2"
+  "\xee\xe8\x57\x00\x00\x00\x00\x49\x45\x4e\x44\xae\x42\x60\x82";
+
+static XdpSealedFd *
+sealed_fd_new_from_data (const char *data,
+                         gsize       size)
+{
+  g_autoptr(GBytes) bytes = g_bytes_new_static (data, size);
+  g_autoptr(GError) error = NULL;
+  XdpSealedFd *sealed_fd;
+
+  sealed_fd = xdp_sealed_fd_new_from_bytes (bytes, &error);
+  g_assert_no_error (error);
+
+  return sealed_fd;
+}
+
+static void
+test_validator_worker (void)
+{
+  g_autoptr(XdpValidatorWorker) worker = NULL;
+  g_autoptr(XdpSealedFd) icon = NULL;
+  g_autoptr(XdpSealedFd) not_icon = NULL;
+  const char *validator;
+
+  validator = g_getenv ("XDP_VALIDATE_ICON");
+  if (validator == NULL)
+    {
+      g_test_skip ("XDP_VALIDATE_ICON not set");
+      return;
+    }
+
+  worker = xdp_validator_worker_new (validator, FALSE, 0);
+  icon = sealed_fd_new_from_data (test_icon_png, sizeof (test_icon_png) - 1);
+  not_icon = sealed_fd_new_from_data ("not an icon", 11);
+
+  /* The same worker handles a series of valid and invalid inputs */
+  for (int i = 0; i < 3; i++)
+    {
+      g_autoptr(GError) error = NULL;
+      g_autofree char *output = NULL;
+
+      output = xdp_validator_worker_validate (worker,
+                                              xdp_sealed_fd_get_fd (icon),
+                                              "notification",
+                                              &error);
+      g_assert_no_error (error);
+      g_assert_nonnull (strstr (output, "format=png"));
+      g_assert_nonnull (strstr (output, "width=16"));
+      g_clear_pointer (&output, g_free);
+
+      output = xdp_validator_worker_validate (worker,
+                                              xdp_sealed_fd_get_fd (not_icon),
+                                              "notification",
+                                              &error);
+      g_assert_error (error, G_IO_ERROR, G_IO_ERROR_INVALID_DATA);
+      g_assert_null (output);
+      g_clear_error (&error);
+
+      output = xdp_validator_worker_validate (worker,
+                                              xdp_sealed_fd_get_fd (icon),
+                                              "no-such-ruleset",
+                                              &error);
+      g_assert_error (error, G_IO_ERROR, G_IO_ERROR_INVALID_DATA);
+      g_assert_null (output);
+    }
+}
+
+static gpointer
+validate_icon_thread (gpointer user_data)
+{
+  XdpValidatorWorker *worker = user_data;
+  g_autoptr(XdpSealedFd) icon = NULL;
+  g_autoptr(GError) error = NULL;
+  g_autofree char *output = NULL;
+
+  icon = sealed_fd_new_from_data (test_icon_png, sizeof (test_icon_png) - 1);
+
+  for (int i = 0; i < 5; i++)
+    {
+      output = xdp_validator_worker_validate (worker,
+                                              xdp_sealed_fd_get_fd (icon),
+                                              "notification",
+                                              &error);
+      g_assert_no_error (error);
+      g_assert_nonnull (strstr (output, "format=png"));
+      g_clear_pointer (&output, g_free);
+    }
+
+  return NULL;
+}
+
+static void
+test_validator_worker_concurrent (void)
+{
+  g_autoptr(XdpValidatorWorker) worker = NULL;
+  GThread *threads[4];
+  const char *validator;
+
+  validator = g_getenv ("XDP_VALIDATE_ICON");
+  if (validator == NULL)
+    {
+      g_test_skip ("XDP_VALIDATE_ICON not set");
+      return;
+    }
+
+  worker = xdp_validator_worker_new (validator, FALSE, 0);
+
+  /* Requests arriving while the worker is busy get a validator of their own */
+  for (size_t i = 0; i < G_N_ELEMENTS (threads); i++)
+    threads[i] = g_thread_new ("validate", validate_icon_thread, worker);
+
+  for (size_t i = 0; i < G_N_ELEMENTS (threads); i++)
+    g_thread_join (threads[i]);
+}
+
+static void
+test_validation_cache (void)
+{
+  g_autoptr(XdpSealedFd) icon = NULL;
+  g_autoptr(XdpSealedFd) same_icon = NULL;
+  g_autoptr(XdpSealedFd) not_icon = NULL;
+  guint hits, misses, prev_hits, prev_misses;
+
+  if (g_getenv ("XDP_VALIDATE_ICON") == NULL)
+    {
+      g_test_skip ("XDP_VALIDATE_ICON not set");
+      return;
+    }
+
+  icon = sealed_fd_new_from_data (test_icon_png, sizeof (test_icon_png) - 1);
+  same_icon = sealed_fd_new_from_data (test_icon_png, sizeof (test_icon_png) - 1);
+  not_icon = sealed_fd_new_from_data ("not an icon either", 18);
+
+  xdp_validation_cache_get_stats (&prev_hits, &prev_misses);
+
+  for (int i = 0; i < 2; i++)
+    {
+      g_autofree char *format = NULL;
+      g_autofree char *size = NULL;
+
+      g_assert_true (xdp_validate_icon (i == 0 ? icon : same_icon,
+                                        XDP_ICON_TYPE_DESKTOP,
+                                        &format, &size));
+      g_assert_cmpstr (format, ==, "png");
+      g_assert_cmpstr (size, ==, "16");
+
+      /* Only the first rejection runs the validator and warns */
+      if (i == 0)
+        g_test_expect_message (G_LOG_DOMAIN, G_LOG_LEVEL_WARNING,
+                               "Icon validation: Rejecting icon*");
+      g_assert_false (xdp_validate_icon (not_icon, XDP_ICON_TYPE_DESKTOP,
+                                         NULL, NULL));
+      g_test_assert_expected_messages ();
+    }
+
+  /* Same contents in a different fd hit the cache, the ruleset is part
+   * of the key */
+  xdp_validation_cache_get_stats (&hits, &misses);
+  g_assert_cmpuint (hits - prev_hits, ==, 2);
+  g_assert_cmpuint (misses - prev_misses, ==, 2);
+
+  g_assert_true (xdp_validate_icon (icon, XDP_ICON_TYPE_NOTIFICATION, NULL, NULL));
+  xdp_validation_cache_get_stats (&hits, &misses);
+  g_assert_cmpuint (misses - prev_misses, ==, 3);
+}
+
+static void
+test_validator_worker_perf (void)
+{
+  g_autoptr(XdpValidatorWorker) worker = NULL;
+  g_autoptr(XdpSealedFd) icon = NULL;
+  const guint n_validations = 50;
+  const char *validator;
+  const char *args[7];
+  gboolean sandbox;
+  double elapsed;
+  size_t i = 0;
+
+  if (!g_test_perf ())
+    {
+      g_test_skip ("Only run in perf mode");
+      return;
+    }
+
+  validator = g_getenv ("XDP_VALIDATE_ICON");
+  if (validator == NULL)
+    {
+      g_test_skip ("XDP_VALIDATE_ICON not set");
+      return;
+    }
+
+  sandbox = g_getenv ("XDP_VALIDATE_ICON_INSECURE") == NULL;
+  icon = sealed_fd_new_from_data (test_icon_png, sizeof (test_icon_png) - 1);
+
+  args[i++] = validator;
+  if (sandbox)
+    args[i++] = "--sandbox";
+  args[i++] = "--fd";
+  args[i++] = "3";
+  args[i++] = "--ruleset";
+  args[i++] = "notification";
+  args[i++] = NULL;
+
+  g_test_timer_start ();
+
+  for (guint j = 0; j < n_validations; j++)
+    {
+      g_autoptr(GError) error = NULL;
+      g_autofree char *output = NULL;
+
+      output = xdp_spawn_full (args, xdp_sealed_fd_dup_fd (icon), 3, &error);
+      g_assert_no_error (error);
+    }
+
+  elapsed = g_test_timer_elapsed ();
+  g_test_minimized_result (elapsed / n_validations * 1000,
+                           "spawn per validation: %.3f ms",
+                           elapsed / n_validations * 1000);
+
+  worker = xdp_validator_worker_new (validator, sandbox, 0);
+
+  g_test_timer_start ();
+
+  for (guint j = 0; j < n_validations; j++)
+    {
+      g_autoptr(GError) error = NULL;
+      g_autofree char *output = NULL;
+
+      output = xdp_validator_worker_validate (worker,
+                                              xdp_sealed_fd_get_fd (icon),
+                                              "notification",
+                                              &error);
+      g_assert_no_error (error);
+    }
+
+  elapsed = g_test_timer_elapsed ();
+  g_test_minimized_result (elapsed / n_validations * 1000,
+                           "persistent worker (including startup): %.3f ms",
+                           elapsed / n_validations * 1000);
+}
+
+static void
+rm_rf (const char *path)
+{
+  g_autoptr(GDir) dir = NULL;
+  const char *name;
+
+  dir = g_dir_open (path, 0, NULL);
+  while (dir && (name = g_dir_read_name (dir)) != NULL)
+    {
+      g_autofree char *child = g_build_filename (path, name, NULL);
+
+      if (g_file_test (child, G_FILE_TEST_IS_DIR) &&
+          !g_file_test (child, G_FILE_TEST_IS_SYMLINK))
+        rm_rf (child);
+      else
+        g_unlink (child);
+    }
+
+  g_rmdir (path);
+}
+
+static void
+fake_proc_add (const char *proc_dir,
+               pid_t       outside,
+               pid_t       inside,
+               uid_t       uid,
+               guint64     start_time,
+               gboolean    sandboxed)
+{
+  g_autoptr(GError) error = NULL;
+  g_autofree char *pid_dir = NULL;
+  g_autofree char *ns_dir = NULL;
+  g_autofree char *ns_link = NULL;
+  g_autofree char *status_path = NULL;
+  g_autofree char *status = NULL;
+  g_autofree char *stat_path = NULL;
+  g_autofree char *stat_contents = NULL;
+  int r;
+
+  pid_dir = g_strdup_printf ("%s/%d", proc_dir, outside);
+  ns_dir = g_build_filename (pid_dir, "ns", NULL);
+  g_assert_cmpint (g_mkdir_with_parents (ns_dir, 0700), ==, 0);
+
+  /* The pidns is identified by the inode of ns/pid */
+  ns_link = g_build_filename (ns_dir, "pid", NULL);
+  g_unlink (ns_link);
+  r = symlink (sandboxed ? "../../ns-sandbox" : "../../ns-host", ns_link);
+  g_assert_cmpint (r, ==, 0);
+
+  status_path = g_build_filename (pid_dir, "status", NULL);
+  if (sandboxed)
+    status = g_strdup_printf ("Name:\tfake\nUid:\t%u\t%u\t%u\t%u\nNSpid:\t%d\t%d\n",
+                              uid, uid, uid, uid, outside, inside);
+  else
+    status = g_strdup_printf ("Name:\tfake\nUid:\t%u\t%u\t%u\t%u\nNSpid:\t%d\n",
+                              uid, uid, uid, uid, outside);
+  g_file_set_contents (status_path, status, -1, &error);
+  g_assert_no_error (error);
+
+  /* The command name may contain spaces and parentheses */
+  stat_path = g_build_filename (pid_dir, "stat", NULL);
+  stat_contents = g_strdup_printf ("%d (fake (proc)) S 1 1 1 0 -1 0 0 0 0 0 0 0 0 0 20 0 1 0 %"
+                                   G_GUINT64_FORMAT " 0 0\n",
+                                   outside, start_time);
+  g_file_set_contents (stat_path, stat_contents, -1, &error);
+  g_assert_no_error (error);
+}
+
+/* A fake /proc with @n_procs processes, of which every tenth is in the
+ * sandbox pidns, with pid (outside - 1000) / 10 + 1 in it */
+static char *
+fake_proc_new (guint  n_procs,
+               ino_t *pidns_out)
+{
+  g_autoptr(GError) error = NULL;
+  g_autofree char *proc_dir = NULL;
+  g_autofree char *ns_sandbox = NULL;
+  g_autofree char *ns_host = NULL;
+  struct stat st;
+
+  proc_dir = g_dir_make_tmp ("test-xdp-utils-proc-XXXXXX", &error);
+  g_assert_no_error (error);
+
+  ns_sandbox = g_build_filename (proc_dir, "ns-sandbox", NULL);
+  ns_host = g_build_filename (proc_dir, "ns-host", NULL);
+  g_file_set_contents (ns_sandbox, "", -1, &error);
+  g_assert_no_error (error);
+  g_file_set_contents (ns_host, "", -1, &error);
+  g_assert_no_error (error);
+
+  g_assert_cmpint (stat (ns_sandbox, &st), ==, 0);
+  *pidns_out = st.st_ino;
+
+  for (guint i = 0; i < n_procs; i++)
+    fake_proc_add (proc_dir, 1000 + i, i / 10 + 1, getuid (), 100 + i, i % 10 == 0);
+
+  return g_steal_pointer (&proc_dir);
+}
+
+static gboolean
+map_pids_in (const char  *proc_dir,
+             ino_t        pidns,
+             pid_t       *pids,
+             guint        n_pids,
+             uid_t        uid,
+             GError     **error)
+{
+  DIR *proc;
+  gboolean ok;
+
+  proc = opendir (proc_dir);
+  g_assert_nonnull (proc);
+
+  ok = xdp_map_pids_full (proc, pidns, pids, n_pids, uid, error);
+  closedir (proc);
+
+  return ok;
+}
+
+static void
+test_map_pids (void)
+{
+  g_autofree char *proc_dir = NULL;
+  ino_t pidns;
+
+  proc_dir = fake_proc_new (100, &pidns);
+
+  /* Cold, and then from the cache */
+  for (guint i = 0; i < 2; i++)
+    {
+      g_autoptr(GError) error = NULL;
+      pid_t pids[] = { 3, 1, 3 };
+
+      g_assert_true (map_pids_in (proc_dir, pidns, pids, G_N_ELEMENTS (pids),
+                                  getuid (), &error));
+      g_assert_no_error (error);
+      g_assert_cmpint (pids[0], ==, 1020);
+      g_assert_cmpint (pids[1], ==, 1000);
+      g_assert_cmpint (pids[2], ==, 1020);
+    }
+
+  /* Pids outside of the sandbox can't be mapped */
+  {
+    g_autoptr(GError) error = NULL;
+    pid_t pids[] = { 1, 42 };
+
+    g_assert_false (map_pids_in (proc_dir, pidns, pids, G_N_ELEMENTS (pids),
+                                 getuid (), &error));
+    g_assert_error (error, G_IO_ERROR, G_IO_ERROR_NOT_FOUND);
+  }
+
+  /* Neither can pids of other users, even if they are cached */
+  {
+    g_autoptr(GError) error = NULL;
+    pid_t pids[] = { 1 };
+
+    g_assert_false (map_pids_in (proc_dir, pidns, pids, G_N_ELEMENTS (pids),
+                                 getuid () + 1, &error));
+    g_assert_error (error, G_IO_ERROR, G_IO_ERROR_PERMISSION_DENIED);
+  }
+
+  /* A recycled pid is not mapped to the cached process */
+  {
+    g_autoptr(GError) error = NULL;
+    pid_t pids[] = { 3 };
+
+    fake_proc_add (proc_dir, 1020, 7, getuid (), 5000, TRUE);
+    fake_proc_add (proc_dir, 1099, 3, getuid (), 5001, TRUE);
+
+    g_assert_true (map_pids_in (proc_dir, pidns, pids, G_N_ELEMENTS (pids),
+                                getuid (), &error));
+    g_assert_no_error (error);
+    g_assert_cmpint (pids[0], ==, 1099);
+  }
+
+  rm_rf (proc_dir);
+}
+
+static void
+test_map_pids_perf (void)
+{
+  g_autofree char *proc_dir = NULL;
+  const guint n_procs = 5000;
+  const guint n_maps = 100;
+  double elapsed;
+  ino_t pidns;
+
+  if (!g_test_perf ())
+    {
+      g_test_skip ("Only run in perf mode");
+      return;
+    }
+
+  proc_dir = fake_proc_new (n_procs, &pidns);
+
+  g_test_timer_start ();
+
+  for (guint i = 0; i < n_maps; i++)
+    {
+      g_autoptr(GError) error = NULL;
+      /* A different, uncached pid every time */
+      pid_t pids[] = { n_procs / 10 - i };
+
+      g_assert_true (map_pids_in (proc_dir, pidns, pids, 1, getuid (), &error));
+      g_assert_no_error (error);
+    }
+
+  elapsed = g_test_timer_elapsed ();
+  g_test_minimized_result (elapsed / n_maps * 1000,
+                           "scan of %u processes per map: %.3f ms",
+                           n_procs, elapsed / n_maps * 1000);
+
+  g_test_timer_start ();
+
+  for (guint i = 0; i < n_maps; i++)
+    {
+      g_autoptr(GError) error = NULL;
+      pid_t pids[] = { n_procs / 10 - i };
+
+      g_assert_true (map_pids_in (proc_dir, pidns, pids, 1, getuid (), &error));
+      g_assert_no_error (error);
+    }
+
+  elapsed = g_test_timer_elapsed ();
+  g_test_minimized_result (elapsed / n_maps * 1000,
+                           "cached map: %.3f ms",
+                           elapsed / n_maps * 1000);
+
+  rm_rf (proc_dir);
+}
+
 int main (int argc, char **argv)
 {
   g_test_init (&argc, &argv, NULL);
@@ -202,6 +687,12 @@ int main (int argc, char **argv)
   g_test_add_func ("/parse-cgroup/systemd", test_parse_cgroup_systemd);
   g_test_add_func ("/parse-cgroup/not-snap", test_parse_cgroup_not_snap);
   g_test_add_func ("/alternate-doc-path", test_alternate_doc_path);
+  g_test_add_func ("/validator-worker", test_validator_worker);
+  g_test_add_func ("/validator-worker-concurrent", test_validator_worker_concurrent);
+  g_test_add_func ("/validator-worker-perf", test_validator_worker_perf);
+  g_test_add_func ("/validation-cache", test_validation_cache);
+  g_test_add_func ("/map-pids", test_map_pids);
+  g_test_add_func ("/map-pids-perf", test_map_pids_perf);
 #if HAVE_LIBSYSTEMD
   g_test_add_func ("/app-id-via-systemd-unit", test_app_id_via_systemd_unit);
 #endif
@@ -0,0 +1,89 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# SPDX-FileCopyrightText: Copyright © the xdg-desktop-portal contributors
+#
+# This file is formatted with Python Black
+
+import tests.xdp_utils as xdp
+
+from gi.repository import GLib, Gio
+
+import pytest
+import time
+
+
+logger = xdp.init_logger("app_info")
+
+
+def new_peer() -> Gio.DBusConnection:
+    address = Gio.dbus_address_get_for_bus_sync(Gio.BusType.SESSION, None)
+    return Gio.DBusConnection.new_for_address_sync(
+        address,
+        Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT
+        | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION,
+        None,
+        None,
+    )
+
+
+def call_concurrently(connections, calls_per_connection):
+    """
+    Calls NetworkMonitor.GetAvailable from all connections at the same time
+    and waits for all replies. Returns the number of successful replies.
+    """
+    loop = GLib.MainLoop()
+    pending = len(connections) * calls_per_connection
+    replies = []
+
+    def reply_cb(connection, result):
+        nonlocal pending
+        replies.append(connection.call_finish(result))
+        pending -= 1
+        if pending == 0:
+            loop.quit()
+
+    for connection in connections:
+        for _ in range(calls_per_connection):
+            connection.call(
+                "org.freedesktop.portal.Desktop",
+                "/org/freedesktop/portal/desktop",
+                "org.freedesktop.portal.NetworkMonitor",
+                "GetAvailable",
+                None,
+                GLib.VariantType("(b)"),
+                Gio.DBusCallFlags.NONE,
+                xdp.DBUS_TIMEOUT,
+                None,
+                reply_cb,
+            )
+
+    loop.run()
+    return len(replies)
+
+
+class TestAppInfo:
+    def test_concurrent_first_calls(self, portals, dbus_con):
+        # Many calls from one new peer share its identification
+        connection = new_peer()
+        assert call_concurrently([connection], 20) == 20
+
+        # And many new peers at once each get identified
+        connections = [new_peer() for _ in range(10)]
+        assert call_concurrently(connections, 2) == 20
+
+    @pytest.mark.skipif(
+        not xdp.run_benchmarks(), reason="Set XDP_TEST_BENCHMARK to run benchmarks"
+    )
+    @pytest.mark.parametrize("n_peers", [1, 10, 50])
+    @pytest.mark.parametrize("calls_per_peer", [1, 5])
+    def test_first_call_benchmark(self, portals, dbus_con, n_peers, calls_per_peer):
+        connections = [new_peer() for _ in range(n_peers)]
+
+        start = time.monotonic()
+        n_replies = call_concurrently(connections, calls_per_peer)
+        elapsed = time.monotonic() - start
+
+        assert n_replies == n_peers * calls_per_peer
+        logger.info(
+            f"{n_peers} new peers, {calls_per_peer} first calls each: "
+            f"{elapsed * 1000:.1f} ms"
+        )
@@ -135,3 +135,34 @@ class TestCamera:
         # Check the impl portal was called with the right args
         method_calls = mock_intf.GetMethodCalls("AccessDialog")
         assert len(method_calls) == 0
+
+    def test_access_permission_changed(self, portals, dbus_con, xdp_app_info):
+        app_id = xdp_app_info.app_id
+        camera_intf = xdp.get_portal_iface(dbus_con, "Camera")
+        mock_intf = xdp.get_mock_iface(dbus_con)
+
+        # The permission is unset, the dialog stores the user's choice
+        request = xdp.Request(dbus_con, camera_intf)
+        response = request.call("AccessCamera", options={})
+        assert response
+        assert response.response == 0
+        assert len(mock_intf.GetMethodCalls("AccessDialog")) == 1
+
+        request = xdp.Request(dbus_con, camera_intf)
+        response = request.call("AccessCamera", options={})
+        assert response
+        assert response.response == 0
+        assert len(mock_intf.GetMethodCalls("AccessDialog")) == 1
+
+        # Changes made by others in the permission store are picked up, once
+        # the portal got the Changed signal of the store
+        self.set_permissions(dbus_con, app_id, ["no"])
+
+        def access_denied():
+            request = xdp.Request(dbus_con, camera_intf)
+            response = request.call("AccessCamera", options={})
+            assert response
+            return response.response == 1
+
+        xdp.wait_for(access_denied)
+        assert len(mock_intf.GetMethodCalls("AccessDialog")) == 1
@@ -0,0 +1,160 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# SPDX-FileCopyrightText: Copyright © the xdg-desktop-portal contributors
+#
+# This file is formatted with Python Black
+
+import tests.xdp_utils as xdp
+import tests.xdp_doc_utils as xdp_doc
+
+import pytest
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+logger = xdp.init_logger("throughput")
+
+CHUNK_SIZE = 1024 * 1024
+FILE_SIZE = 64 * CHUNK_SIZE
+PARALLEL_FILES = 8
+
+
+if not xdp.run_benchmarks():
+    pytest.skip("Set XDP_TEST_BENCHMARK to run benchmarks", allow_module_level=True)
+
+try:
+    xdp.ensure_fuse_supported()
+except xdp.FuseNotSupportedException as e:
+    pytest.skip(f"No fuse support: {e}", allow_module_level=True)
+
+
+@pytest.fixture
+def xdp_app_info() -> xdp.AppInfo:
+    return xdp.AppInfoHost(app_id="")
+
+
+@pytest.fixture(
+    params=[
+        {},
+        {
+            "XDG_DOCUMENT_PORTAL_FUSE_CLONE_FD": "1",
+            "XDG_DOCUMENT_PORTAL_FUSE_MAX_IDLE_THREADS": "32",
+            "XDG_DOCUMENT_PORTAL_FUSE_MAX_BACKGROUND": "64",
+            "XDG_DOCUMENT_PORTAL_FUSE_CONGESTION_THRESHOLD": "48",
+            "XDG_DOCUMENT_PORTAL_FUSE_MAX_WRITE": f"{CHUNK_SIZE}",
+            "XDG_DOCUMENT_PORTAL_FUSE_MAX_READ": f"{CHUNK_SIZE}",
+        },
+        {
+            "XDG_DOCUMENT_PORTAL_FUSE_SPLICE": "0",
+        },
+        {
+            "XDG_DOCUMENT_PORTAL_FUSE_PASSTHROUGH": "0",
+        },
+    ],
+    ids=["default", "tuned", "no-splice", "no-passthrough"],
+)
+def xdp_overwrite_env(request) -> dict[str, str]:
+    return request.param
+
+
+def export_docs(documents_intf, count):
+    mountpoint = xdp_doc.get_mountpoint(documents_intf)
+    doc_paths = []
+
+    for i in range(count):
+        file_path = Path(os.environ["TMPDIR"]) / f"throughput{i}"
+        xdp_doc.write_bytes_atomic(file_path, b"")
+        doc_id = xdp_doc.export_file(documents_intf, file_path)
+        doc_paths.append(mountpoint / doc_id / file_path.name)
+
+    return doc_paths
+
+
+def write_file(path, size):
+    chunk = os.urandom(CHUNK_SIZE)
+    fd = os.open(path, os.O_WRONLY | os.O_TRUNC)
+    try:
+        written = 0
+        while written < size:
+            written += os.write(fd, chunk)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return written
+
+
+def read_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        total = 0
+        while True:
+            data = os.read(fd, CHUNK_SIZE)
+            if not data:
+                break
+            total += len(data)
+    finally:
+        os.close(fd)
+    return total
+
+
+def copy_file(src_path, dst_path):
+    src_fd = os.open(src_path, os.O_RDONLY)
+    dst_fd = os.open(dst_path, os.O_WRONLY | os.O_TRUNC)
+    try:
+        total = 0
+        while True:
+            res = os.copy_file_range(src_fd, dst_fd, FILE_SIZE)
+            if res == 0:
+                break
+            total += res
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+    return total
+
+
+def measure(name, func, *args):
+    start = time.monotonic()
+    size = func(*args)
+    elapsed = time.monotonic() - start
+    logger.info(
+        f"{name}: {size / CHUNK_SIZE:.0f} MiB in {elapsed:.3f}s, "
+        f"{size / CHUNK_SIZE / elapsed:.1f} MiB/s"
+    )
+    return size
+
+
+def parallel(func, paths, *args):
+    with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+        return sum(executor.map(lambda path: func(path, *args), paths))
+
+
+class TestDocumentThroughput:
+    def test_sequential(self, xdg_document_portal, dbus_con):
+        documents_intf = xdp.get_document_portal_iface(dbus_con)
+        (doc_path,) = export_docs(documents_intf, 1)
+
+        written = measure("sequential write", write_file, doc_path, FILE_SIZE)
+        assert written == FILE_SIZE
+        read = measure("sequential read", read_file, doc_path)
+        assert read == FILE_SIZE
+
+    def test_parallel(self, xdg_document_portal, dbus_con):
+        documents_intf = xdp.get_document_portal_iface(dbus_con)
+        doc_paths = export_docs(documents_intf, PARALLEL_FILES)
+        total_size = FILE_SIZE * PARALLEL_FILES
+
+        written = measure("parallel write", parallel, write_file, doc_paths, FILE_SIZE)
+        assert written == total_size
+        read = measure("parallel read", parallel, read_file, doc_paths)
+        assert read == total_size
+
+    def test_copy_file_range(self, xdg_document_portal, dbus_con):
+        documents_intf = xdp.get_document_portal_iface(dbus_con)
+        src_path, dst_path = export_docs(documents_intf, 2)
+
+        write_file(src_path, FILE_SIZE)
+        copied = measure("copy_file_range", copy_file, src_path, dst_path)
+        assert copied == FILE_SIZE
+        assert read_file(dst_path) == FILE_SIZE
@@ -10,6 +10,7 @@ import pytest
 import dbus
 from pathlib import Path
 import os
+import stat
 
 
 @pytest.fixture
@@ -32,7 +33,7 @@ class TestDocuments:
             "org.freedesktop.portal.Documents",
             "version",
         )
-        assert int(portal_version) == 5
+        assert int(portal_version) == 6
 
     def test_mount_point(self, xdg_document_portal, dbus_con):
         documents_intf = xdp.get_document_portal_iface(dbus_con)
@@ -194,6 +195,131 @@ class TestDocuments:
             with pytest.raises(PermissionError):
                 other_app_path.write_bytes(b"new-content")
 
+    def test_list_app_docs(self, xdg_document_portal, dbus_con):
+        documents_intf = xdp.get_document_portal_iface(dbus_con)
+        mountpoint = xdp_doc.get_mountpoint(documents_intf)
+
+        file_paths = []
+        for i in range(20):
+            file_path = Path(os.environ["TMPDIR"]) / f"list-doc{i}"
+            xdp_doc.write_bytes_atomic(file_path, b"x" * i)
+            file_paths.append(file_path)
+
+        doc_ids, _ = xdp_doc.export_files(
+            documents_intf, file_paths, ["read"], app_id="org.list.App"
+        )
+
+        app_path = mountpoint / "by-app" / "org.list.App"
+        entries = {entry.name: entry for entry in os.scandir(app_path)}
+        assert set(doc_ids) <= set(entries.keys())
+
+        for i, doc_id in enumerate(doc_ids):
+            assert entries[doc_id].is_dir()
+            doc_entries = list(os.scandir(app_path / doc_id))
+            assert [entry.name for entry in doc_entries] == [f"list-doc{i}"]
+            assert doc_entries[0].stat().st_size == i
+
+        documents_intf.RevokePermissions(doc_ids[0], "org.list.App", ["read"])
+
+        names = os.listdir(app_path)
+        assert doc_ids[0] not in names
+        assert doc_ids[1] in names
+
+    def test_list_app_docs_large(self, xdg_document_portal, dbus_con):
+        documents_intf = xdp.get_document_portal_iface(dbus_con)
+        mountpoint = xdp_doc.get_mountpoint(documents_intf)
+
+        # Enough entries to need several READDIR and READDIRPLUS calls
+        doc_ids = []
+        for batch in range(4):
+            file_paths = []
+            for i in range(100):
+                file_path = Path(os.environ["TMPDIR"]) / f"large-doc{batch}-{i}"
+                xdp_doc.write_bytes_atomic(file_path, b"content")
+                file_paths.append(file_path)
+
+            ids, _ = xdp_doc.export_files(
+                documents_intf, file_paths, ["read"], app_id="org.large.App"
+            )
+            doc_ids += ids
+
+        app_path = mountpoint / "by-app" / "org.large.App"
+
+        names = os.listdir(app_path)
+        assert len(names) == len(set(names))
+        assert set(names) == set(doc_ids)
+
+        # Looking up the entries makes the kernel keep using READDIRPLUS
+        entries = []
+        for entry in os.scandir(app_path):
+            assert entry.stat().st_mode & stat.S_IFDIR
+            entries.append(entry.name)
+        assert len(entries) == len(set(entries))
+        assert set(entries) == set(doc_ids)
+
+    def test_list_paged(self, xdg_document_portal, dbus_con):
+        documents_intf = xdp.get_document_portal_iface(dbus_con)
+
+        file_paths = []
+        for i in range(25):
+            file_path = Path(os.environ["TMPDIR"]) / f"paged-doc{i}"
+            xdp_doc.write_bytes_atomic(file_path, b"content")
+            file_paths.append(file_path)
+
+        doc_ids, _ = xdp_doc.export_files(
+            documents_intf, file_paths, ["read"], app_id="org.paged.App"
+        )
+
+        pages = []
+        after = ""
+        while True:
+            page = documents_intf.ListPaged(
+                "org.paged.App", after, dbus.UInt32(10), byte_arrays=True
+            )
+            pages.append(page)
+            if len(page) < 10:
+                break
+            after = max(page.keys())
+
+        assert [len(page) for page in pages] == [10, 10, 5]
+
+        docs = {}
+        for page in pages:
+            assert not set(docs.keys()) & set(page.keys())
+            docs.update(page)
+
+        assert set(docs.keys()) == set(doc_ids)
+        for doc_id, file_path in zip(doc_ids, file_paths):
+            assert xdp_doc.path_from_null_term_bytes(docs[doc_id]) == file_path
+
+    def test_copy_file_range(self, xdg_document_portal, dbus_con):
+        documents_intf = xdp.get_document_portal_iface(dbus_con)
+        mountpoint = xdp_doc.get_mountpoint(documents_intf)
+
+        content = os.urandom(3 * 1024 * 1024 + 17)
+        src_path = Path(os.environ["TMPDIR"]) / "copy-src"
+        dst_path = Path(os.environ["TMPDIR"]) / "copy-dst"
+        xdp_doc.write_bytes_atomic(src_path, content)
+        xdp_doc.write_bytes_atomic(dst_path, b"")
+
+        src_id = xdp_doc.export_file(documents_intf, src_path)
+        dst_id = xdp_doc.export_file(documents_intf, dst_path)
+
+        src_fd = os.open(mountpoint / src_id / src_path.name, os.O_RDONLY)
+        dst_fd = os.open(mountpoint / dst_id / dst_path.name, os.O_WRONLY)
+        try:
+            copied = 0
+            while copied < len(content):
+                res = os.copy_file_range(src_fd, dst_fd, len(content) - copied)
+                assert res > 0
+                copied += res
+        finally:
+            os.close(src_fd)
+            os.close(dst_fd)
+
+        assert (mountpoint / dst_id / dst_path.name).read_bytes() == content
+        assert dst_path.read_bytes() == content
+
     def test_add_named(self, xdg_document_portal, dbus_con):
         documents_intf = xdp.get_document_portal_iface(dbus_con)
         mountpoint = xdp_doc.get_mountpoint(documents_intf)
@@ -305,6 +431,30 @@ class TestDocuments:
         doc_host_path = xdp_doc.path_from_null_term_bytes(host_paths[doc_id])
         assert doc_host_path == file_path
 
+    def test_get_host_paths_many(self, xdg_document_portal, dbus_con):
+        documents_intf = xdp.get_document_portal_iface(dbus_con)
+
+        file_paths = {}
+        for i in range(10):
+            file_path = Path(os.environ["TMPDIR"]) / f"host-path-{i}"
+            xdp_doc.write_bytes_atomic(file_path, b"content")
+            doc_id = xdp_doc.export_file(documents_intf, file_path)
+            file_paths[doc_id] = file_path
+
+        deleted_doc_id = list(file_paths.keys())[0]
+        documents_intf.Delete(deleted_doc_id)
+        del file_paths[deleted_doc_id]
+
+        # Unknown and deleted documents are left out of the result
+        host_paths = documents_intf.GetHostPaths(
+            [deleted_doc_id, "nonexistent"] + list(file_paths.keys()),
+            byte_arrays=True,
+        )
+        assert len(host_paths) == len(file_paths)
+        for doc_id, file_path in file_paths.items():
+            doc_host_path = xdp_doc.path_from_null_term_bytes(host_paths[doc_id])
+            assert doc_host_path == file_path
+
     def test_host_paths_xattr(self, xdg_document_portal, dbus_con):
         documents_intf = xdp.get_document_portal_iface(dbus_con)
         mountpoint = xdp_doc.get_mountpoint(documents_intf)
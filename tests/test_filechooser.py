@@ -6,6 +6,7 @@
 import tests.xdp_utils as xdp
 
 import dbus
+import dbusmock
 import pytest
 import os
 from pathlib import Path
@@ -622,3 +623,94 @@ class TestFilechooser:
         # Check the impl portal was not called
         method_calls = mock_intf.GetMethodCalls("FileChooser")
         assert len(method_calls) == 0
+
+
+MANY_FILES_URIS = []
+
+
+class TestFilechooserManyFiles:
+    @pytest.fixture
+    def required_templates(self):
+        MANY_FILES_URIS.clear()
+
+        # More files than can be registered in a single call
+        for i in range(300):
+            test_file = Path(os.environ["XDG_DATA_HOME"]) / f"many{i}.txt"
+            test_file.write_text(f"many{i}")
+            MANY_FILES_URIS.append(f"file://{test_file.absolute().as_posix()}")
+
+        return {
+            "filechooser": {
+                "results": dbus.Dictionary({"uris": MANY_FILES_URIS}, signature="sv"),
+            },
+            "lockdown": {},
+        }
+
+    def test_open_file_many(
+        self, xdg_document_portal, portals, dbus_con, xdp_app_info
+    ):
+        filechooser_intf = xdp.get_portal_iface(dbus_con, "FileChooser")
+
+        request = xdp.Request(dbus_con, filechooser_intf)
+        response = request.call(
+            "OpenFile",
+            parent_window="",
+            title="Test",
+            options={"multiple": True},
+        )
+
+        assert response
+        assert response.response == 0
+        assert len(response.results["uris"]) == len(MANY_FILES_URIS)
+        assert xdp.uris_same_files(MANY_FILES_URIS, response.results["uris"])
+
+
+class TestFilechooserSlowDocuments:
+    @pytest.fixture
+    def xdp_app_info(self):
+        # Only sandboxed apps get their files registered
+        return xdp.AppInfoFlatpak()
+
+    @pytest.fixture
+    def required_templates(self, required_templates):
+        return {
+            **required_templates,
+            "documents": {"delay": 500},
+        }
+
+    def test_open_file_concurrent(self, portals, dbus_con, xdp_app_info):
+        filechooser_intf = xdp.get_portal_iface(dbus_con, "FileChooser")
+        documents_mock_intf = dbus.Interface(
+            dbus_con.get_object(
+                "org.freedesktop.portal.Documents",
+                "/org/freedesktop/portal/documents",
+            ),
+            dbusmock.MOCK_IFACE,
+        )
+        n_requests = 40
+        errors = []
+
+        requests = [xdp.Request(dbus_con, filechooser_intf) for _ in range(n_requests)]
+        for request in requests:
+            filechooser_intf.OpenFile(
+                "",
+                "Test",
+                {"handle_token": request.handle_token, "multiple": True},
+                reply_handler=lambda handle: None,
+                error_handler=errors.append,
+            )
+
+        xdp.wait_for(lambda: errors or all(request.response for request in requests))
+        assert not errors
+
+        for request in requests:
+            assert request.response.response == 0
+            assert xdp.uris_same_files(
+                FILECHOOSER_RESULTS["uris"], request.response.results["uris"]
+            )
+
+        # Every request was answered, but the document portal never had more
+        # than a bounded number of calls in flight
+        max_in_flight, n_documents = documents_mock_intf.GetStats()
+        assert n_documents == n_requests * len(FILECHOOSER_RESULTS["uris"])
+        assert 1 < max_in_flight <= 16
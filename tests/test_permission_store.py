@@ -41,6 +41,12 @@ class PermissionStore(xdp.GDBusIface):
             GLib.Variant("(sbssas)", (table, create, id, app, perm)),
         )
 
+    def SetPermissions(self, table, create, id, app_perms):
+        return self._call(
+            "SetPermissions",
+            GLib.Variant("(sbsa{sas})", (table, create, id, app_perms)),
+        )
+
     def SetPermissionAsync(self, table, create, id, app, perm, user_cb):
         self._call_async(
             "SetPermission",
@@ -74,6 +80,18 @@ class PermissionStore(xdp.GDBusIface):
             GLib.Variant("(sss)", (table, id, app)),
         )
 
+    def List(self, table):
+        return self._call(
+            "List",
+            GLib.Variant("(s)", (table,)),
+        )
+
+    def ListPaged(self, table, after, limit):
+        return self._call(
+            "ListPaged",
+            GLib.Variant("(ssu)", (table, after, limit)),
+        )
+
 
 class TestPermissionStore:
     def test_version(self, portals, dbus_con):
@@ -90,7 +108,7 @@ class TestPermissionStore:
             "org.freedesktop.impl.portal.PermissionStore",
             "version",
         )
-        assert int(portal_version) == 2
+        assert int(portal_version) == 4
 
     def test_delete_race(self, portals, dbus_con):
         permission_store_intf = PermissionStore()
@@ -137,6 +155,88 @@ class TestPermissionStore:
         perms_out = result.unpack()[0]
         assert perms_out == {}
 
+    def test_write_burst(self, portals, dbus_con):
+        permission_store_intf = PermissionStore()
+        finished_count = 0
+        n_writes = 50
+
+        table = "TEST"
+        id = "test-burst"
+        perms = ["one"]
+
+        def cb(_):
+            nonlocal finished_count
+
+            finished_count += 1
+
+        for i in range(n_writes):
+            permission_store_intf.SetPermissionAsync(
+                table, True, id, f"org.example.App{i}", perms, cb
+            )
+
+        xdp.wait_for(lambda: finished_count >= n_writes)
+
+        result, _ = permission_store_intf.Lookup(table, id)
+        perms_out = result.unpack()[0]
+        assert perms_out == {f"org.example.App{i}": perms for i in range(n_writes)}
+
+        # The burst was written out in fewer writes than calls
+        permission_store = dbus_con.get_object(
+            "org.freedesktop.impl.portal.PermissionStore",
+            "/org/freedesktop/impl/portal/PermissionStore",
+        )
+        properties_intf = dbus.Interface(
+            permission_store,
+            "org.freedesktop.DBus.Properties",
+        )
+        writes_avoided = properties_intf.Get(
+            "org.freedesktop.impl.portal.PermissionStore",
+            "WritesAvoided",
+        )
+        assert int(writes_avoided) > 0
+
+    def test_set_permissions(self, portals, dbus_con):
+        permission_store_intf = PermissionStore()
+        changed_count = 0
+
+        table = "TEST"
+        id = "test-batch"
+        app_perms = {f"org.example.App{i}": ["yes"] for i in range(10)}
+
+        try:
+            permission_store_intf.SetPermissions(table, False, id, app_perms)
+            assert False, "This statement should not be reached"
+        except GLib.GError as e:
+            assert "org.freedesktop.portal.Error.NotFound" in e.message
+
+        permission_store_intf.SetPermission(
+            table, True, id, "org.example.Other", ["no"]
+        )
+
+        def cb_changed(results):
+            nonlocal changed_count
+
+            cb_table, cb_id, deleted, _, cb_perms = results.unpack()
+
+            assert cb_table == table
+            assert cb_id == id
+            assert not deleted
+            assert cb_perms == {"org.example.Other": ["no"], **app_perms}
+
+            changed_count += 1
+
+        cs = permission_store_intf.connect_to_signal("Changed", cb_changed)
+        permission_store_intf.SetPermissions(table, False, id, app_perms)
+        xdp.wait_for(lambda: changed_count >= 1)
+        cs.disconnect()
+
+        # All apps were written at once
+        assert changed_count == 1
+
+        result, _ = permission_store_intf.Lookup(table, id)
+        perms_out = result.unpack()[0]
+        assert perms_out == {"org.example.Other": ["no"], **app_perms}
+
     def test_change(self, portals, dbus_con):
         permission_store_intf = PermissionStore()
         changed_count = 0
@@ -297,3 +397,36 @@ class TestPermissionStore:
         result, _ = permission_store_intf.GetPermission(table, id, "no-such-app")
         permissions = result.unpack()[0]
         assert permissions == []
+
+    def test_list_paged(self, portals, dbus_con):
+        permission_store_intf = PermissionStore()
+
+        table = "list-paged"
+        ids = [f"test-list-{i:02}" for i in range(25)]
+
+        for id in reversed(ids):
+            permission_store_intf.SetPermission(
+                table, True, id, "org.example.App", ["yes"]
+            )
+
+        pages = []
+        after = ""
+        while True:
+            result, _ = permission_store_intf.ListPaged(table, after, 10)
+            page = result.unpack()[0]
+            pages.append(page)
+            if len(page) < 10:
+                break
+            after = page[-1]
+
+        assert [len(page) for page in pages] == [10, 10, 5]
+        assert sum(pages, []) == ids
+
+        result, _ = permission_store_intf.List(table)
+        assert sorted(result.unpack()[0]) == ids
+
+        try:
+            permission_store_intf.ListPaged(table, "", 0)
+            assert False, "This statement should not be reached"
+        except GLib.GError as e:
+            assert "org.freedesktop.portal.Error.InvalidArgument" in e.message
@@ -7,6 +7,7 @@ import tests.xdp_utils as xdp
 
 import dbus
 import pytest
+import time
 
 
 SETTINGS_DATA_TEST1 = {
@@ -218,6 +219,23 @@ org.freedesktop.impl.portal.Settings=test1;*;
     yield files
 
 
+def portal_config_nocache():
+    # test1 without caching, merged with test2
+    files = PORTAL_CONFIG_FILES.copy()
+    del files["test1.portal"]
+    files["test_nocache.portal"] = b"""
+[portal]
+DBusName=org.freedesktop.impl.portal.Test1
+Interfaces=org.freedesktop.impl.portal.Settings;
+SettingsCache=false
+"""
+    files["test-portals.conf"] = b"""
+[preferred]
+default=test_nocache;test2;
+"""
+    yield files
+
+
 @pytest.fixture
 def xdg_desktop_portal_dir_default_files():
     return next(portal_config_good())
@@ -337,3 +355,108 @@ class TestSettings:
         mock_intf.SetSetting(ns, key, new_value)
 
         xdp.wait_for(lambda: changed_count == 1)
+
+    @pytest.mark.parametrize(
+        "required_templates",
+        (
+            {
+                "settings:org.freedesktop.impl.portal.Test1": {
+                    "settings": SETTINGS_DATA_TEST1,
+                    "delay": 1500,
+                },
+                "settings:org.freedesktop.impl.portal.Test2": {
+                    "settings": SETTINGS_DATA_TEST2,
+                    "delay": 1500,
+                },
+            },
+        ),
+    )
+    def test_read_concurrent(self, portals, dbus_con):
+        settings_intf = xdp.get_portal_iface(dbus_con, "Settings")
+
+        # Test2 is the only one that has the key, but Test1 still has
+        # priority and must be waited for
+        start = time.monotonic()
+        value = settings_intf.ReadOne("org.freedesktop.appearance", "contrast")
+        assert value == SETTINGS_DATA["org.freedesktop.appearance"]["contrast"]
+        assert time.monotonic() - start < 2.5
+
+        # Both backends are queried at the same time, so the total is
+        # about one backend delay rather than the sum of them
+        start = time.monotonic()
+        value = settings_intf.ReadAll([])
+        assert value == SETTINGS_DATA
+        assert time.monotonic() - start < 2.5
+
+    def test_cache(self, portals, dbus_con):
+        settings_intf = xdp.get_portal_iface(dbus_con, "Settings")
+        mock_intf = xdp.get_mock_iface(dbus_con, "org.freedesktop.impl.portal.Test1")
+
+        ns = "org.freedesktop.appearance"
+        key = "color-scheme"
+
+        for _ in range(3):
+            value = settings_intf.ReadAll([ns])
+            assert value[ns] == SETTINGS_DATA[ns]
+
+            value = settings_intf.ReadOne(ns, key)
+            assert value == SETTINGS_DATA[ns][key]
+
+            with pytest.raises(dbus.exceptions.DBusException) as excinfo:
+                settings_intf.ReadOne(ns, "does-not-exist")
+            assert (
+                excinfo.value.get_dbus_name() == "org.freedesktop.portal.Error.NotFound"
+            )
+
+        # Everything after the first ReadAll() is answered from the cache
+        assert len(mock_intf.GetMethodCalls("ReadAll")) == 1
+        assert len(mock_intf.GetMethodCalls("Read")) == 0
+
+        # Globs are only answered from the cache once all namespaces are known
+        settings_intf.ReadAll(["org.*"])
+        assert len(mock_intf.GetMethodCalls("ReadAll")) == 2
+        settings_intf.ReadAll([])
+        assert len(mock_intf.GetMethodCalls("ReadAll")) == 3
+        value = settings_intf.ReadAll(["org.*"])
+        assert value == SETTINGS_DATA
+        assert len(mock_intf.GetMethodCalls("ReadAll")) == 3
+
+        # Changes are applied to the cache
+        changed_count = 0
+
+        def cb_settings_changed(changed_ns, changed_key, changed_value):
+            nonlocal changed_count
+            changed_count += 1
+
+        settings_intf.connect_to_signal("SettingChanged", cb_settings_changed)
+        mock_intf.SetSetting(ns, key, dbus.UInt32(2))
+        mock_intf.SetSetting("org.example.new", "foo", "baz")
+        xdp.wait_for(lambda: changed_count == 2)
+
+        value = settings_intf.ReadOne(ns, key)
+        assert value == 2
+        value = settings_intf.ReadOne("org.example.new", "foo")
+        assert value == "baz"
+        assert len(mock_intf.GetMethodCalls("ReadAll")) == 3
+        assert len(mock_intf.GetMethodCalls("Read")) == 0
+
+    @pytest.mark.parametrize(
+        "xdg_desktop_portal_dir_default_files",
+        portal_config_nocache(),
+    )
+    def test_cache_disabled(self, portals, dbus_con):
+        settings_intf = xdp.get_portal_iface(dbus_con, "Settings")
+        mock_intf = xdp.get_mock_iface(dbus_con, "org.freedesktop.impl.portal.Test1")
+
+        ns = "org.freedesktop.appearance"
+        key = "color-scheme"
+
+        for _ in range(3):
+            value = settings_intf.ReadAll([])
+            assert value == SETTINGS_DATA
+
+            value = settings_intf.ReadOne(ns, key)
+            assert value == SETTINGS_DATA[ns][key]
+
+        assert len(mock_intf.GetMethodCalls("ReadAll")) == 3
+        assert len(mock_intf.GetMethodCalls("Read")) == 3
@@ -65,6 +65,10 @@ def run_long_tests() -> bool:
     return os.environ.get("XDP_TEST_RUN_LONG") is not None
 
 
+def run_benchmarks() -> bool:
+    return os.environ.get("XDP_TEST_BENCHMARK") is not None
+
+
 def is_valgrind() -> bool:
     return os.getenv("XDP_TEST_VALGRIND") is not None
 